@@ -16,6 +16,8 @@
 """Recurrent Interface Network (RIN), but here it is named Tape."""
 
 import einops
+
+import utils
 from architectures.convnet_blocks import DepthwiseConvBlock
 from architectures.transformers import add_vis_pos_emb
 from architectures.transformers import get_shape
@@ -238,13 +240,14 @@ class TapeDenoiser(tf.keras.layers.Layer):  # pylint: disable=missing-docstring
                 cond = tf.expand_dims(cond, 1)
         return t, cond
 
-    def initialize_tape(self, x, time_emb, cond, tape_prev, offset=0):
+    def initialize_tape(self, x, time_emb, cond, tape_prev, offset=0,
+                        tape_pos_emb=None):
         tape_r = None
         if not self._time_on_latent and time_emb is not None:
             tape_r = time_emb
         if not self._cond_on_latent and cond is not None:
             tape_r = cond if tape_r is None else tf.concat([tape_r, cond], 1)
-        tape = self._x_to_tape(x, offset)  # (bsz, n, d)
+        tape = self._x_to_tape(x, offset, tape_pos_emb)  # (bsz, n, d)
 
         if self._self_cond in ['tape', 'latent+tape'] and tape_prev is not None:
             tape += self.tape_prev_ln(self.tape_prev_proj(tape_prev))
@@ -252,11 +255,11 @@ class TapeDenoiser(tf.keras.layers.Layer):  # pylint: disable=missing-docstring
             tape, tape_r = tf.concat([tape, tape_r], 1), None
         return tape, tape_r
 
-    def initialize_latent(self, batch_size, time_emb, cond, latent_prev):
-        latent = self.latent_pos_emb[tf.newaxis, ...]
-        if self._latent_pos_encoding in ['sin_cos_plus_learned']:
-            latent += self.latent_pos_emb_res[tf.newaxis, ...]
-        latent = tf.tile(latent, [batch_size, 1, 1])
+    def initialize_latent(self, batch_size, time_emb, cond, latent_prev,
+                          latent_pos_emb=None):
+        if latent_pos_emb is None:
+            latent_pos_emb = self.get_latent_pos_emb()
+        latent = tf.tile(latent_pos_emb, [batch_size, 1, 1])
         if self._time_on_latent and time_emb is not None:
             latent = tf.concat([latent, time_emb], 1)
         if self._cond_on_latent and cond is not None:
@@ -265,7 +268,33 @@ class TapeDenoiser(tf.keras.layers.Layer):  # pylint: disable=missing-docstring
             latent += self.latent_prev_ln(self.latent_prev_proj(latent_prev))
         return latent
 
-    def _x_to_tape(self, x, offset):
+    def get_latent_pos_emb(self):
+        latent_pos_emb = self.latent_pos_emb[tf.newaxis, ...]
+        if self._latent_pos_encoding in ['sin_cos_plus_learned']:
+            latent_pos_emb += self.latent_pos_emb_res[tf.newaxis, ...]
+        return latent_pos_emb
+
+    def get_tape_pos_emb(self):
+        tape_pos_emb = self.tape_pos_emb[tf.newaxis, ...]
+        if self._tape_pos_encoding in ['sin_cos_plus_learned']:
+            tape_pos_emb += self.tape_pos_emb_res[tf.newaxis, ...]
+        return tape_pos_emb
+
+    def get_step_cache(self, cond, training=False):
+        """Inputs of call that do not change across the steps of a generate call.
+
+        Only for inference: the returned dict is passed to call as step_cache in
+        every denoising step so that only the time embedding, the tape of x and
+        the self-cond projections of the previous latent and tape are computed
+        per step. The projected cond has the batch size of cond.
+        """
+        with tf.name_scope(self.name):  # same variable names as when built in call
+            _, cond = self.initialize_cond(None, cond, training)
+        return dict(latent_pos_emb=self.get_latent_pos_emb(),
+                    tape_pos_emb=self.get_tape_pos_emb(),
+                    cond=cond)
+
+    def _x_to_tape(self, x, offset, tape_pos_emb=None):
         raise NotImplementedError
     def _merge_tape(self, tape_writable, tape_readonly):
         tape_merged = tape_writable if tape_readonly is None else (
@@ -300,8 +329,12 @@ class TapeDenoiser(tf.keras.layers.Layer):  # pylint: disable=missing-docstring
         tape_shape = [self._tape_slots, self._tape_dim]
         return latent_shape, tape_shape
 
-    def call(self, x, t, cond, training):
-        """x[0] in (bsz, h, w, c), t in (bsz, m), cond in (bsz, s, d)."""
+    def call(self, x, t, cond, training, step_cache=None):
+        """x[0] in (bsz, h, w, c), t in (bsz, m), cond in (bsz, s, d).
+
+        With step_cache from get_step_cache, cond is ignored and the projected
+        cond of the cache, repeated to the batch size of x, is used instead.
+        """
         if isinstance(x, tuple) or isinstance(x, list):
             x, latent_prev, tape_prev = x
             bsz = tf.shape(x)[0]
@@ -309,9 +342,20 @@ class TapeDenoiser(tf.keras.layers.Layer):  # pylint: disable=missing-docstring
             bsz = tf.shape(x)[0]
             latent_prev = tf.zeros([bsz] + self.hidden_shapes[0])
             tape_prev = tf.zeros([bsz] + self.hidden_shapes[1])
-        time_emb, cond = self.initialize_cond(t, cond, training)
-        tape, tape_r = self.initialize_tape(x, time_emb, cond, tape_prev)
-        latent = self.initialize_latent(bsz, time_emb, cond, latent_prev)
+        if step_cache is None:
+            step_cache = {}
+            time_emb, cond = self.initialize_cond(t, cond, training)
+        else:
+            time_emb, _ = self.initialize_cond(t, None, training)
+            cond = step_cache['cond']
+            if cond is not None:
+                cond = utils.repeat_to_batch(cond, bsz)
+        tape, tape_r = self.initialize_tape(
+            x, time_emb, cond, tape_prev,
+            tape_pos_emb=step_cache.get('tape_pos_emb'))
+        latent = self.initialize_latent(
+            bsz, time_emb, cond, latent_prev,
+            latent_pos_emb=step_cache.get('latent_pos_emb'))
         latent, tape = self.compute(latent, tape, tape_r, training)
         x = self.readout_tape(tape)
         return x, latent, tape[:, :self._tape_slots]
@@ -366,11 +410,10 @@ class TokenTapeDenoiser(TapeDenoiser):  # pylint: disable=missing-docstring
 
         self.stem = tf.keras.layers.Dense(tape_dim, name='stem')
 
-    def _x_to_tape(self, x, offset=0):
+    def _x_to_tape(self, x, offset=0, tape_pos_emb=None):
         tokens = self.stem(x)
-        tape_pos_emb = self.tape_pos_emb[tf.newaxis, ...]
-        if self._tape_pos_encoding in ['sin_cos_plus_learned']:
-            tape_pos_emb += self.tape_pos_emb_res[tf.newaxis, ...]
+        if tape_pos_emb is None:
+            tape_pos_emb = self.get_tape_pos_emb()
         tokens = self.stem_ln(tokens) + tape_pos_emb
         return tokens
 
@@ -426,13 +469,12 @@ class ImageTapeDenoiser(TapeDenoiser):  # pylint: disable=missing-docstring
             filters=tape_dim, kernel_size=patch_size, strides=patch_size,
             padding='VALID', use_bias=True, name='stem')
 
-    def _x_to_tape(self, x, offset=0):
+    def _x_to_tape(self, x, offset=0, tape_pos_emb=None):
         tokens = self.stem(x)
         bsz, h, w, d = get_shape(tokens)
         tokens = tf.reshape(tokens, [bsz, h * w, d])
-        tape_pos_emb = self.tape_pos_emb[tf.newaxis, ...]
-        if self._tape_pos_encoding in ['sin_cos_plus_learned']:
-            tape_pos_emb += self.tape_pos_emb_res[tf.newaxis, ...]
+        if tape_pos_emb is None:
+            tape_pos_emb = self.get_tape_pos_emb()
         tokens = self.stem_ln(tokens) + tape_pos_emb
         return tokens
 
@@ -536,14 +578,13 @@ class VideoTapeDenoiser(TapeDenoiser):  # pylint: disable=missing-docstring
         else:
             raise ValueError(f'Unknown tape_pos_encoding {tape_pos_encoding}')
 
-    def _x_to_tape(self, x, offset=0):
+    def _x_to_tape(self, x, offset=0, tape_pos_emb=None):
         tokens = self.stem(x)
         bsz, t, h, w, d = get_shape(tokens)
         tokens = tf.reshape(tokens, [bsz, t * h * w, d])
-        pos_emb = self.tape_pos_emb[tf.newaxis, ...]
-        if self._tape_pos_encoding in ['sin_cos_plus_learned']:
-            pos_emb += self.tape_pos_emb_res[tf.newaxis, ...]
-        tokens = self.stem_ln(tokens) + pos_emb[:, offset:offset + tokens.shape[1]]
+        if tape_pos_emb is None:
+            tape_pos_emb = self.get_tape_pos_emb()
+        tokens = self.stem_ln(tokens) + tape_pos_emb[:, offset:offset + tokens.shape[1]]
         return tokens
 
     def readout_tape(self, tape):
@@ -558,8 +599,29 @@ class VideoTapeDenoiser(TapeDenoiser):  # pylint: disable=missing-docstring
         if out.shape[1] > out_len: out = out[:, :out_len]  # odd-len conv padding
         return out
 
-    def call(self, x, t, cond, training):
-        """x[0] in (bsz, t, h, w, c), t in (bsz, m), cond in (bsz, t_c, h, w, c)."""
+    def get_step_cache(self, cond, training=False):
+        """Same as TapeDenoiser.get_step_cache but with the tape of the cond frames.
+
+        The cond frames go through the stem once per generate call instead of
+        once per step; their tape has the batch size of cond.
+        """
+        tape_pos_emb = self.get_tape_pos_emb()
+        n_time_x = -(-(self._seq_len - self._seq_cond) // self._seq_stride)
+        cond_offset = n_time_x * self._n_rows * self._n_cols
+        with tf.name_scope(self.name):
+            tape_cond, _ = self.initialize_tape(cond, None, None, None,
+                                                offset=cond_offset,
+                                                tape_pos_emb=tape_pos_emb)
+        return dict(latent_pos_emb=self.get_latent_pos_emb(),
+                    tape_pos_emb=tape_pos_emb,
+                    tape_cond=tape_cond)
+
+    def call(self, x, t, cond, training, step_cache=None):
+        """x[0] in (bsz, t, h, w, c), t in (bsz, m), cond in (bsz, t_c, h, w, c).
+
+        With step_cache from get_step_cache, the cached tape of the cond frames,
+        repeated to the batch size of x, is used instead of the one of cond.
+        """
         if isinstance(x, tuple) or isinstance(x, list):
             x, latent_prev, tape_prev = x
             bsz = tf.shape(x)[0]
@@ -567,13 +629,22 @@ class VideoTapeDenoiser(TapeDenoiser):  # pylint: disable=missing-docstring
             bsz = tf.shape(x)[0]
             latent_prev = tf.zeros([bsz] + self.hidden_shapes[0])
             tape_prev = tf.zeros([bsz] + self.hidden_shapes[1])
+        if step_cache is None:
+            step_cache = {}
         time_emb, _ = self.initialize_cond(t, None, training)
-        tape, tape_r = self.initialize_tape(x, time_emb, None, tape_prev)
+        tape, tape_r = self.initialize_tape(
+            x, time_emb, None, tape_prev,
+            tape_pos_emb=step_cache.get('tape_pos_emb'))
         cond_offset = tape.shape[1]
-        tape_cond, _ = self.initialize_tape(cond, None, None, None,
-                                            offset=cond_offset)
+        if 'tape_cond' in step_cache:
+            tape_cond = utils.repeat_to_batch(step_cache['tape_cond'], bsz)
+        else:
+            tape_cond, _ = self.initialize_tape(cond, None, None, None,
+                                                offset=cond_offset)
         tape = tf.concat([tape, tape_cond], axis=1)
-        latent = self.initialize_latent(bsz, time_emb, cond, latent_prev)
+        latent = self.initialize_latent(
+            bsz, time_emb, cond, latent_prev,
+            latent_pos_emb=step_cache.get('latent_pos_emb'))
         latent, tape = self.compute(latent, tape, tape_r, training)
         # tape = tape[:, :cond_offset]
         x = self.readout_tape(tape)
@@ -15,6 +15,7 @@
 # ==============================================================================
 """Transformer."""
 
+import contextlib
 import math
 import re
 import einops
@@ -389,6 +390,106 @@ def merge_masks(mask1, mask2):
         tf.concat([bottom_left, mask2], 3)], 2)
 
 
+def get_segment_mask(q_segment_ids, k_segment_ids, dtype=tf.float32):
+    """Get mask restricting attention to keys in the same segment as each query.
+
+    Args:
+      q_segment_ids: `int` tensor of shape [bsz, q_len] with -1 for empty positions.
+      k_segment_ids: `int` tensor of shape [bsz, k_len].
+      dtype: tf data type for the return tensor.
+
+    Returns:
+      tensor of shape [bsz, 1, q_len, k_len] with ones for locations that can be
+      attended to.
+    """
+    same_segment = tf.logical_and(
+        tf.equal(q_segment_ids[:, :, tf.newaxis], k_segment_ids[:, tf.newaxis, :]),
+        q_segment_ids[:, :, tf.newaxis] >= 0)
+    return tf.cast(same_segment[:, tf.newaxis], dtype)
+
+
+def get_packed_ar_mask(segment_ids, dtype=tf.float32):
+    """Get block-diagonal causal mask for several sequences packed into each row.
+
+    Args:
+      segment_ids: `int` tensor of shape [bsz, seq_len] with the index of the
+        sequence each token belongs to and -1 for empty positions.
+      dtype: tf data type for the return tensor.
+
+    Returns:
+      tensor of shape [bsz, 1, seq_len, seq_len] with ones for locations that
+      can be attended to.
+    """
+    seq_len = get_shape(segment_ids)[1]
+    return (1. - get_ar_mask(seq_len, dtype)) * get_segment_mask(segment_ids, segment_ids, dtype)
+
+
+"""stack of [seed, number of masks sampled from it] of the enclosing replay_dropout contexts"""
+_replay_seeds = []
+
+
+def new_replay_seed():
+    return tf.random.uniform([2], maxval=tf.int32.max, dtype=tf.int32)
+
+
+@contextlib.contextmanager
+def replay_dropout(seed):
+    """Samples the dropout and drop path masks of the layers called in this context from `seed`.
+
+    The n-th mask is sampled with stateless ops from `seed` folded with n so that calling the same layers again
+    in the same order with the same seed samples the same masks.
+    """
+    _replay_seeds.append([seed, 0])
+    try:
+        yield
+    finally:
+        _replay_seeds.pop()
+
+
+def next_replay_seed():
+    """stateless seed for the next mask or None outside of replay_dropout"""
+    if not _replay_seeds:
+        return None
+    state = _replay_seeds[-1]
+    seed = tf.random.experimental.stateless_fold_in(state[0], state[1])
+    state[1] += 1
+    return seed
+
+
+def check_recompute_grad(layer):
+    """Recomputed layers must sample all their masks through replay_dropout or their gradients would not match
+    the forward pass."""
+    for sublayer in layer.submodules:
+        if isinstance(sublayer, tf.keras.layers.Dropout) and not isinstance(sublayer, Dropout):
+            assert sublayer.rate == 0, (
+                f'recompute_grad cannot replay the masks of {sublayer.name} in {layer.name} so its rate must be 0 '
+                f'but got {sublayer.rate}')
+
+
+def recompute_layer(layer, *args, **kwargs):
+    """Calls `layer` on `args` with its activations recomputed in the backward pass.
+
+    Only the tensors in `args` are differentiated w.r.t. while `kwargs` are closed
+    over so non-tensor arguments like `training` or `None` caches can go there.
+    The first call is made normally so the layer variables get created outside of
+    `tf.recompute_grad`.
+
+    Both the forward pass and its recomputation run in replay_dropout with the same
+    seed so that they sample the same dropout and drop path masks.
+    """
+    if not layer.built:
+        outputs = layer(*args, **kwargs)
+        check_recompute_grad(layer)
+        return outputs
+    seed = new_replay_seed()
+
+    def _call(*args_):
+        with replay_dropout(seed):
+            return layer(*args_, **kwargs)
+
+    return tf.recompute_grad(_call)(*args)
+
+
 def top_logits(logits: tf.Tensor,
                k: int = 0,
                p: float = 1.0,
@@ -473,12 +574,34 @@ class DropPath(tf.keras.layers.Layer):
         keep_rate = 1. - self._drop_rate
         xshape = tf.shape(x)
         drop_mask_shape = [xshape[0]] + [1] * (len(xshape) - 1)
-        drop_mask = keep_rate + tf.random.uniform(drop_mask_shape, dtype=x.dtype)
+        seed = next_replay_seed()
+        if seed is None:
+            drop_mask = keep_rate + tf.random.uniform(drop_mask_shape, dtype=x.dtype)
+        else:
+            drop_mask = keep_rate + tf.random.stateless_uniform(drop_mask_shape, seed, dtype=x.dtype)
         drop_mask = tf.math.divide(tf.floor(drop_mask), keep_rate)
 
         return x * drop_mask
 
 
+class Dropout(tf.keras.layers.Dropout):
+    """Dropout that samples its mask from the seed of the enclosing replay_dropout if there is one."""
+
+    def call(self, inputs, training=None):
+        if not training or self.rate == 0 or not _replay_seeds:
+            return super(Dropout, self).call(inputs, training)
+        return tf.nn.experimental.stateless_dropout(
+            inputs, self.rate, next_replay_seed(), noise_shape=self._get_noise_shape(inputs))
+
+
+class MultiHeadAttention(tf.keras.layers.MultiHeadAttention):
+    """MultiHeadAttention whose attention dropout can be replayed with replay_dropout."""
+
+    def _build_attention(self, rank):
+        super(MultiHeadAttention, self)._build_attention(rank)
+        self._dropout_layer = Dropout(rate=self._dropout, dtype=self._dtype_policy)
+
+
 class FeedForwardLayer(tf.keras.layers.Layer):  # pylint: disable=missing-docstring
     """
     two-layer MLP
@@ -500,7 +623,7 @@ class FeedForwardLayer(tf.keras.layers.Layer):  # pylint: disable=missing-docstr
         """
         self.dense1 = tf.keras.layers.Dense(
             dim_mlp, activation=tf.nn.gelu, name='dense1')
-        self.dropout = tf.keras.layers.Dropout(drop_units)
+        self.dropout = Dropout(drop_units)
         self.dense2 = tf.keras.layers.Dense(dim_att, name='dense2')
         if use_ln:
             self.ln = tf.keras.layers.LayerNormalization(
@@ -659,7 +782,7 @@ class TransformerDecoderLayer(tf.keras.layers.Layer):  # pylint: disable=missing
                 center=ln_scale_shift,
                 scale=ln_scale_shift,
                 name='self_mha/ln')
-            self.self_mha = tf.keras.layers.MultiHeadAttention(
+            self.self_mha = MultiHeadAttention(
                 num_heads, dim // num_heads, dropout=drop_att, name='self_mha')
         if cross_attention:
             self.cross_ln = tf.keras.layers.LayerNormalization(
@@ -676,7 +799,7 @@ class TransformerDecoderLayer(tf.keras.layers.Layer):  # pylint: disable=missing
             else:
                 self.enc_ln = lambda x: x
             dim_x_att = dim if dim_x_att is None else dim_x_att
-            self.cross_mha = tf.keras.layers.MultiHeadAttention(
+            self.cross_mha = MultiHeadAttention(
                 num_heads, dim_x_att // num_heads, dropout=drop_att, name='cross_mha')
         if use_mlp:
             self.mlp = MLP(1, dim, mlp_ratio, drop_path, drop_units,
@@ -684,14 +807,19 @@ class TransformerDecoderLayer(tf.keras.layers.Layer):  # pylint: disable=missing
                            name='mlp')
         self.dropp = DropPath(drop_path)
 
-    def call(self, x, enc, cache, mask_self, mask_cross, training):
-        """x in (bsz, seq, d), enc in (bsz, seq', d)."""
+    def call(self, x, enc, cache, mask_self, mask_cross, training, mask_cache=None):
+        """x in (bsz, seq, d), enc in (bsz, seq', d), mask_cache in (1, 1, 1, c_size)."""
         x_for_cache = []
         if self.self_attention:
             x_for_cache = x_ln = kv_ln = self.self_ln(x)
             if cache is not None:  # Augment kv_ln with cache in (bsz, c_size, d).
                 q_size, k_size = tf.shape(x)[1], tf.shape(cache)[1]
-                mask_self = tf.concat([tf.ones([1, 1, q_size, k_size]), mask_self], -1)
+                """all cache entries are attended to unless mask_cache marks some of them as not yet filled"""
+                if mask_cache is None:
+                    mask_cache = tf.ones([1, 1, q_size, k_size])
+                else:
+                    mask_cache = tf.broadcast_to(mask_cache, [1, 1, q_size, k_size])
+                mask_self = tf.concat([mask_cache, mask_self], -1)
                 kv_ln = tf.concat([cache, x_ln], axis=1)
             """kv_ln = x_ln if cache is None (which is the case during training)"""
             x_res = self.self_mha(x_ln, kv_ln, kv_ln, mask_self, training=training)
@@ -723,9 +851,11 @@ class TransformerDecoder(tf.keras.layers.Layer):  # pylint: disable=missing-docs
                  use_enc_ln=False,
                  use_ffn_ln=False,
                  ln_scale_shift=True,
+                 recompute_grad=False,
                  **kwargs):
         super(TransformerDecoder, self).__init__(**kwargs)
         self.num_layers = num_layers
+        self.recompute_grad = recompute_grad
         self.dec_layers = [
             TransformerDecoderLayer(  # pylint: disable=g-complex-comprehension
                 dim,
@@ -745,13 +875,19 @@ class TransformerDecoder(tf.keras.layers.Layer):  # pylint: disable=missing-docs
             for i in range(num_layers)
         ]
 
-    def call(self, x, enc, caches, mask_self, mask_cross, training):
-        """x in (bsz, seq, d), enc in (bsz, seq', d)."""
+    def call(self, x, enc, caches, mask_self, mask_cross, training, mask_cache=None, num_layers=None):
+        """x in (bsz, seq, d), enc in (bsz, seq', d); only the first num_layers layers are run if provided."""
         presents = []
-        for i in range(self.num_layers):
+        for i in range(self.num_layers if num_layers is None else num_layers):
             cache = None if caches is None else caches[i]
-            x, x_for_cache = self.dec_layers[i](
-                x, enc, cache, mask_self, mask_cross, training)
+            if self.recompute_grad and training and cache is None:
+                """trade compute for memory by keeping only the layer inputs for the backward pass"""
+                x, x_for_cache = recompute_layer(
+                    self.dec_layers[i], x, enc, cache=None, mask_self=mask_self,
+                    mask_cross=mask_cross, training=training)
+            else:
+                x, x_for_cache = self.dec_layers[i](
+                    x, enc, cache, mask_self, mask_cross, training, mask_cache=mask_cache)
             presents.append(x_for_cache)
 
         return x, tf.stack(presents)
@@ -802,7 +938,7 @@ class VisionTransformer(tf.keras.layers.Layer):  # pylint: disable=missing-docst
         bsz, h, w, dim = get_shape(tokens)
         tokens = self.stem_ln(tf.reshape(tokens, [bsz, h * w, dim]))
 
-        tokens = tokens + tf.expand_dims(self.vis_pos_emb, 0)
+        tokens = tokens + tf.cast(tf.expand_dims(self.vis_pos_emb, 0), tokens.dtype)
         if self.use_cls_token:
             cls_token = tf.tile(tf.expand_dims(self.cls_token_emb, 0), [bsz, 1, 1])
             tokens = tf.concat([cls_token, tokens], 1)
@@ -877,7 +1013,7 @@ class ResNetTransformer(tf.keras.layers.Layer):  # pylint: disable=missing-docst
         tokens = self.stem_ln(self.stem_projection(self.dropout(tokens, training)))
 
         tokens_vis_pos_emb = tf.expand_dims(self.vis_pos_emb, 0)
-        tokens = tokens + tokens_vis_pos_emb
+        tokens = tokens + tf.cast(tokens_vis_pos_emb, tokens.dtype)
 
         if self.use_cls_token:
             cls_token = tf.tile(tf.expand_dims(self.cls_token_emb, 0), [bsz, 1, 1])
@@ -907,6 +1043,9 @@ class AutoregressiveDecoder(tf.keras.layers.Layer):  # pylint: disable=missing-d
                  shared_embedding=True,
                  output_bias=True,
                  cross_attention=True,
+                 recompute_grad=False,
+                 draft_layers=0,
+                 draft_len=4,
                  **kwargs):
         super(AutoregressiveDecoder, self).__init__(**kwargs)
         self.defer_vocab = defer_vocab
@@ -915,6 +1054,13 @@ class AutoregressiveDecoder(tf.keras.layers.Layer):  # pylint: disable=missing-d
         self.max_seq_len = max_seq_len
         self.num_layers = num_layers
         self.dim = dim
+        """
+        greedy inference uses speculative decoding with the first draft_layers layers as the draft model
+        if draft_layers > 0
+        """
+        assert draft_layers < num_layers, "draft_layers must be less than num_layers"
+        self.draft_layers = draft_layers
+        self.draft_len = draft_len
         self.shared_embedding = shared_embedding
         self.output_bias = output_bias
         if self.defer_seq:
@@ -946,7 +1092,9 @@ class AutoregressiveDecoder(tf.keras.layers.Layer):  # pylint: disable=missing-d
         self.decoder = TransformerDecoder(
             num_layers, dim, mlp_ratio, num_heads,
             drop_path, drop_units, drop_att,
-            cross_attention=cross_attention, name='transformer_decoder')
+            cross_attention=cross_attention,
+            recompute_grad=recompute_grad,
+            name='transformer_decoder')
         self.output_ln = tf.keras.layers.LayerNormalization(
             epsilon=1e-6, name='ouput_ln')
 
@@ -955,7 +1103,8 @@ class AutoregressiveDecoder(tf.keras.layers.Layer):  # pylint: disable=missing-d
             seq_pos_emb = self.seq_pos_emb_deferred
         else:
             seq_pos_emb = self.seq_pos_emb
-        return seq_pos_emb
+        """sin_cos encodings are float32 constants that need to match the compute dtype under mixed precision"""
+        return tf.cast(seq_pos_emb, self.compute_dtype)
 
     def get_token_emb(self):
         if self.defer_vocab:
@@ -975,26 +1124,42 @@ class AutoregressiveDecoder(tf.keras.layers.Layer):  # pylint: disable=missing-d
 
         return inp_embedding, outp_embedding, outp_bias
 
-    def call(self, tokens, encoded, training):
+    def call(self, tokens, encoded, training, packing=None):
+        """
+        packing: optional dict with the segment_ids and positions of several sequences packed into each row of
+        tokens and the enc_segment_ids of the encoded images they belong to, as returned by
+        model_utils.get_packing; each sequence then only attends to itself and its own image
+        """
         _, seqlen = get_shape(tokens)
         seq_pos_emb_ = self.get_seq_pos_emb()
-        seq_pos_emb = tf.expand_dims(seq_pos_emb_[:seqlen], 0)
+        if packing is None:
+            seq_pos_emb = tf.expand_dims(seq_pos_emb_[:seqlen], 0)
+        else:
+            """positions restart at the beginning of each packed sequence"""
+            seq_pos_emb = tf.gather(seq_pos_emb_, packing['positions'])
 
         inp_embedding, outp_embedding, outp_bias = self.get_token_emb()
 
         token_emb = tf.gather(inp_embedding, tokens) + seq_pos_emb
-        """mask for self attention"""
-        mask_self = 1. - get_ar_mask(seqlen, token_emb.dtype)
         """
+        mask for self attention
+
         caches = None
         ignoring the cache returned from decoder
         
         mask_cross = None
         no masking for cross attention
         """
+        if packing is None:
+            mask_self = 1. - get_ar_mask(seqlen, token_emb.dtype)
+            mask_cross = None
+        else:
+            mask_self = get_packed_ar_mask(packing['segment_ids'], token_emb.dtype)
+            mask_cross = get_segment_mask(packing['segment_ids'], packing['enc_segment_ids'], token_emb.dtype)
+
         outputs, _ = self.decoder(
             token_emb, encoded, caches=None,
-            mask_self=mask_self, mask_cross=None,
+            mask_self=mask_self, mask_cross=mask_cross,
             training=training)
         outputs = self.output_ln(outputs)
         logits = tf.matmul(outputs, outp_embedding, transpose_b=True)
@@ -1005,14 +1170,39 @@ class AutoregressiveDecoder(tf.keras.layers.Layer):  # pylint: disable=missing-d
     def infer(self, prompt, encoded, max_seq_len=None,
               temperature=1.0, top_k=1, top_p=1.0,
               sampling_callback=None, training=False):
+        if self.draft_layers and sampling_callback is None and isinstance(top_k, int) and top_k == 1:
+            sampled_tokens, sampled_logits, _ = self.infer_speculative(
+                prompt, encoded, max_seq_len, training=training)
+            return sampled_tokens, sampled_logits
+
         bsz, prompt_len = get_shape(prompt)
         seq_len = self.max_seq_len if max_seq_len is None else max_seq_len
 
+        """
+        caches[:step] has a data-dependent shape that XLA cannot compile so, inside a jit_compile function, 
+        the decoder attends to the whole fixed-size cache instead with the entries that are yet to be 
+        filled masked out
+        """
+        static_cache = tf.__internal__.get_enclosing_xla_context() is not None
+        if static_cache:
+            assert isinstance(prompt_len, int) and isinstance(seq_len, int), \
+                "prompt_len and seq_len must be static for XLA compilation"
+
         seq_pos_emb_ = self.get_seq_pos_emb()
         seq_pos_emb = tf.expand_dims(seq_pos_emb_, 0)
 
         inp_embedding, outp_embedding, outp_bias = self.get_token_emb()
 
+        """
+        infer is not called through __call__ so the variables are not autocast under mixed precision;
+        caches and logits are kept in the compute dtype which halves their memory with bfloat16
+        """
+        compute_dtype = self.compute_dtype
+        inp_embedding = tf.cast(inp_embedding, compute_dtype)
+        outp_embedding = tf.cast(outp_embedding, compute_dtype)
+        if self.output_bias:
+            outp_bias = tf.cast(outp_bias, compute_dtype)
+
         # Each step reads caches[:step] and tokens[step:next_step] and updates
         # tokens[next_step], logits[next_step] and caches[step:next_step].
         # On the first step, step=0, next_step=prompt_len. On subsequent steps
@@ -1033,14 +1223,21 @@ class AutoregressiveDecoder(tf.keras.layers.Layer):  # pylint: disable=missing-d
                 """
                 mask_self = 1. - get_ar_mask(prompt_len, token_emb.dtype)
                 caches_in = None
+                mask_cache = None
             else:
                 token_emb = tf.gather(inp_embedding, tf.transpose(tokens[step]))
                 token_emb = token_emb + seq_pos_emb[:, step]  # (bsz, d)
                 token_emb = tf.expand_dims(token_emb, 1)  # (bsz, 1, d)
                 mask_self = tf.ones([1, 1, 1, 1])
-                caches_in = tf.transpose(caches[:step], [1, 2, 0, 3])
+                if static_cache:
+                    caches_in = tf.transpose(caches, [1, 2, 0, 3])
+                    mask_cache = tf.cast(tf.range(seq_len - 1) < step, tf.float32)
+                    mask_cache = tf.reshape(mask_cache, [1, 1, 1, seq_len - 1])
+                else:
+                    caches_in = tf.transpose(caches[:step], [1, 2, 0, 3])
+                    mask_cache = None
             outputs, caches_out = self.decoder(
-                token_emb, encoded, caches_in, mask_self, None, training=training)
+                token_emb, encoded, caches_in, mask_self, None, training=training, mask_cache=mask_cache)
             outputs = self.output_ln(outputs)
             next_logits = tf.matmul(  # only take the last for sampling next token.
                 outputs, outp_embedding, transpose_b=True)[:, -1]
@@ -1048,11 +1245,13 @@ class AutoregressiveDecoder(tf.keras.layers.Layer):  # pylint: disable=missing-d
                 next_logits = tf.nn.bias_add(next_logits, outp_bias)
 
             # Scale and truncate logits and sample next token.
+            """sampling always happens in float32"""
+            next_logits_f32 = tf.cast(next_logits, tf.float32)
             if sampling_callback:
                 next_token = sampling_callback(
-                    next_logits, step, temperature, top_k, top_p)
+                    next_logits_f32, step, temperature, top_k, top_p)
             else:
-                sampling_logits = next_logits / tf.cast(temperature, tf.float32)
+                sampling_logits = next_logits_f32 / tf.cast(temperature, tf.float32)
                 sampling_logits = top_logits(sampling_logits, k=top_k, p=top_p)
                 next_token = tf.random.categorical(
                     sampling_logits, num_samples=1, dtype=tf.int32)[:, 0]
@@ -1093,9 +1292,9 @@ class AutoregressiveDecoder(tf.keras.layers.Layer):  # pylint: disable=missing-d
             del logits
             return tf.less(step, seq_len - 1)
 
-        caches_var = tf.zeros([seq_len - 1, self.num_layers, bsz, self.dim])
+        caches_var = tf.zeros([seq_len - 1, self.num_layers, bsz, self.dim], dtype=compute_dtype)
         tokens_var = tf.zeros([seq_len, bsz], dtype=tf.int64)
-        logits_var = tf.zeros([seq_len, bsz, self.vocab_size], dtype=tf.float32)
+        logits_var = tf.zeros([seq_len, bsz, self.vocab_size], dtype=compute_dtype)
         indices = tf.expand_dims(tf.range(prompt_len), -1)
         """
         equivalent to:
@@ -1124,8 +1323,171 @@ class AutoregressiveDecoder(tf.keras.layers.Layer):  # pylint: disable=missing-d
 
         sampled_tokens = tf.transpose(tokens_var[prompt_len:], [1, 0])
         sampled_logits = tf.transpose(logits_var[prompt_len:], [1, 0, 2])
+        sampled_logits = tf.cast(sampled_logits, tf.float32)
         return sampled_tokens, sampled_logits
 
+    def infer_speculative(self, prompt, encoded, max_seq_len=None, training=False):
+        """Greedy decoding with the first draft_layers layers of the decoder as the draft model.
+
+        Each step, the draft proposes draft_len tokens one at a time and the full decoder then
+        processes the current token along with all the proposals in a single pass over the cached
+        prefix. The longest prefix of the proposals matching the greedy predictions of the full
+        decoder is accepted along with the prediction that follows it so the output is the same as
+        that of greedy decoding with infer while the full decoder runs once per accepted block
+        instead of once per token.
+
+        The draft shares the embeddings, the output layer and the caches of its layers with the
+        full decoder so there is no separate draft model to train or to keep in sync.
+
+        Args:
+          prompt: `int` tensor of shape (bsz, prompt_len).
+          encoded: `float` tensor of shape (bsz, seq', d).
+          max_seq_len: `int` of max generated sequence length (including prompt).
+          training: `bool` indicator.
+
+        Returns:
+          sampled_tokens: `int` tensor of shape (bsz, seq_len - prompt_len).
+          sampled_logits: `float` tensor of shape (bsz, seq_len - prompt_len, vocab_size).
+          stats: dict with the number of passes of the full decoder and the number of accepted
+            draft tokens, both summed over the sequence and shared by the whole batch.
+        """
+        bsz, prompt_len = get_shape(prompt)
+        seq_len = self.max_seq_len if max_seq_len is None else max_seq_len
+        draft_len = self.draft_len
+        n_draft_layers = self.draft_layers
+
+        """
+        the last block of proposals can extend past the end of the sequence so the tokens and caches
+        have room for draft_len extra entries that are discarded at the end
+        """
+        buf_len = seq_len + draft_len
+        cache_len = buf_len - 1
+
+        static_cache = tf.__internal__.get_enclosing_xla_context() is not None
+        if static_cache:
+            assert isinstance(prompt_len, int) and isinstance(seq_len, int), \
+                "prompt_len and seq_len must be static for XLA compilation"
+
+        seq_pos_emb_ = self.get_seq_pos_emb()
+        max_pos = get_shape(seq_pos_emb_)[0]
+
+        inp_embedding, outp_embedding, outp_bias = self.get_token_emb()
+        compute_dtype = self.compute_dtype
+        inp_embedding = tf.cast(inp_embedding, compute_dtype)
+        outp_embedding = tf.cast(outp_embedding, compute_dtype)
+        if self.output_bias:
+            outp_bias = tf.cast(outp_bias, compute_dtype)
+
+        def embed(tokens, positions):
+            """tokens: (n, bsz), positions: (n,)"""
+            """positions past the end only occur for discarded proposals"""
+            positions = tf.minimum(positions, max_pos - 1)
+            token_emb = tf.gather(inp_embedding, tf.transpose(tokens))
+            return token_emb + tf.gather(seq_pos_emb_, positions)[tf.newaxis]  # (bsz, n, d)
+
+        def get_logits(outputs):
+            outputs = self.output_ln(outputs)
+            logits = tf.matmul(outputs, outp_embedding, transpose_b=True)
+            if self.output_bias:
+                logits = tf.nn.bias_add(logits, outp_bias)
+            return logits
+
+        def get_caches_in(caches, step, n_layers):
+            """caches[:step] of the first n_layers layers in the (layers, bsz, seq, d) layout of the decoder"""
+            if static_cache:
+                caches_in = tf.transpose(caches[:, :n_layers], [1, 2, 0, 3])
+                mask_cache = tf.cast(tf.range(cache_len) < step, tf.float32)
+                mask_cache = tf.reshape(mask_cache, [1, 1, 1, cache_len])
+            else:
+                caches_in = tf.transpose(caches[:step, :n_layers], [1, 2, 0, 3])
+                mask_cache = None
+            return caches_in, mask_cache
+
+        def draft(step, caches, tokens):
+            """proposals for tokens[step + 1:step + 1 + draft_len]"""
+            caches_in, mask_cache = get_caches_in(caches, step, n_draft_layers)
+            token = tokens[step]
+            proposals = []
+            for i in range(draft_len):
+                token_emb = embed(token[tf.newaxis], step[tf.newaxis] + i)
+                outputs, caches_out = self.decoder(
+                    token_emb, encoded, caches_in, tf.ones([1, 1, 1, 1]), None, training=training,
+                    mask_cache=mask_cache, num_layers=n_draft_layers)
+                token = tf.argmax(get_logits(outputs)[:, -1], -1)
+                proposals.append(token)
+                """the draft caches of the proposals only live until they are verified"""
+                caches_in = tf.concat([caches_in, caches_out], axis=2)
+                if mask_cache is not None:
+                    mask_cache = tf.concat([mask_cache, tf.ones([1, 1, 1, 1])], -1)
+            return tf.stack(proposals)  # (draft_len, bsz)
+
+        def loop_body(step, caches, tokens, logits, n_passes, n_accepted):
+            proposals = draft(step, caches, tokens)
+
+            """verify the current token and all the proposals with a single pass of the full decoder"""
+            block = tf.concat([tokens[step][tf.newaxis], proposals], 0)  # (draft_len + 1, bsz)
+            block_pos = step + tf.range(draft_len + 1)
+            caches_in, mask_cache = get_caches_in(caches, step, self.num_layers)
+            mask_self = 1. - get_ar_mask(draft_len + 1)
+            outputs, caches_out = self.decoder(
+                embed(block, block_pos), encoded, caches_in, mask_self, None, training=training,
+                mask_cache=mask_cache)
+            block_logits = get_logits(outputs)  # (bsz, draft_len + 1, vocab_size)
+            preds = tf.argmax(block_logits, -1)  # (bsz, draft_len + 1)
+
+            is_match = tf.cast(tf.equal(tf.transpose(proposals), preds[:, :draft_len]), tf.int32)
+            """the batch moves in lockstep so only the proposals accepted for every item are committed"""
+            n_acc = tf.reduce_min(tf.reduce_sum(tf.math.cumprod(is_match, axis=-1), axis=-1))
+
+            """
+            the accepted proposals are the same as the predictions for their positions so all the predictions
+            are written and those after the first rejected proposal get overwritten by the later steps
+            """
+            caches = tf.tensor_scatter_nd_update(
+                caches, block_pos[:, tf.newaxis], tf.transpose(caches_out, [2, 0, 1, 3]))
+            tokens = tf.tensor_scatter_nd_update(
+                tokens, block_pos[:, tf.newaxis] + 1, tf.transpose(preds))
+            logits = tf.tensor_scatter_nd_update(
+                logits, block_pos[:, tf.newaxis] + 1, tf.transpose(block_logits, [1, 0, 2]))
+
+            """proposals accepted past the end of the sequence are discarded and not counted"""
+            n_kept = tf.minimum(n_acc, seq_len - 2 - step)
+            return step + n_acc + 1, caches, tokens, logits, n_passes + 1, n_accepted + n_kept
+
+        def cond(step, caches, tokens, logits, n_passes, n_accepted):
+            del caches, tokens, logits, n_passes, n_accepted
+            return tf.less(step, seq_len - 1)
+
+        caches_var = tf.zeros([cache_len, self.num_layers, bsz, self.dim], dtype=compute_dtype)
+        tokens_var = tf.zeros([buf_len, bsz], dtype=tf.int64)
+        logits_var = tf.zeros([buf_len, bsz, self.vocab_size], dtype=compute_dtype)
+        tokens_var = tf.tensor_scatter_nd_update(
+            tokens_var, tf.expand_dims(tf.range(prompt_len), -1), tf.transpose(prompt, [1, 0]))
+
+        """the prompt is processed together with the causal mask as in infer"""
+        token_emb = embed(tokens_var[:prompt_len], tf.range(prompt_len))
+        outputs, caches_out = self.decoder(
+            token_emb, encoded, None, 1. - get_ar_mask(prompt_len, token_emb.dtype), None, training=training)
+        next_logits = get_logits(outputs)[:, -1]
+        caches_var = tf.tensor_scatter_nd_update(
+            caches_var, tf.expand_dims(tf.range(prompt_len), -1), tf.transpose(caches_out, [2, 0, 1, 3]))
+        tokens_var = tf.tensor_scatter_nd_update(tokens_var, [[prompt_len]], [tf.argmax(next_logits, -1)])
+        logits_var = tf.tensor_scatter_nd_update(logits_var, [[prompt_len]], [next_logits])
+
+        step = tf.constant(prompt_len)
+        n_passes = tf.constant(1)
+        n_accepted = tf.constant(0)
+        if seq_len > prompt_len:
+            step, caches_var, tokens_var, logits_var, n_passes, n_accepted = tf.while_loop(
+                cond=cond, body=loop_body,
+                loop_vars=[step, caches_var, tokens_var, logits_var, n_passes, n_accepted])
+
+        sampled_tokens = tf.transpose(tokens_var[prompt_len:seq_len], [1, 0])
+        sampled_logits = tf.transpose(logits_var[prompt_len:seq_len], [1, 0, 2])
+        sampled_logits = tf.cast(sampled_logits, tf.float32)
+        stats = dict(n_passes=n_passes, n_accepted=n_accepted)
+        return sampled_tokens, sampled_logits, stats
+
 
 class AutoregressiveMHD(tf.keras.layers.Layer):  # pylint: disable=missing-docstring
 
@@ -543,11 +543,38 @@ class TransUNet(tf.keras.layers.Layer):
           name='conv_out')
       self.bits = int2bits(tf.range(2**nbits), nbits, tf.float32)
 
-  def call(self, x, t, cembs, training, return_logits=False):
-    """x in (bsz, h, w, c), t in (bsz,) or (bsz, k), cembs in (bsz, s, d)."""
+  def _conv_in_part(self, x, begin):
+    """conv_in of x that holds the input channels from begin on without bias."""
+    kernel = self.conv_in.kernel[:, :, begin:begin + x.shape[-1]]
+    return tf.nn.conv2d(
+        x, tf.cast(kernel, x.dtype),
+        strides=[self.config.in_strides, self.config.in_strides],
+        padding='SAME')
+
+  def call(self, x, t, cembs, training, return_logits=False, cond_in=None,
+           conv_in_part=None):
+    """x in (bsz, h, w, c), t in (bsz,) or (bsz, k), cembs in (bsz, s, d).
+
+    conv_in is linear so for an input that concats the samples with
+    conditioning channels that stay the same in all denoising steps, the part
+    of the conditioning channels can be computed once:
+      conv_in_part=(begin, in_dim): x holds the input channels from begin on of
+        an in_dim channel input and only their part of conv_in is returned.
+      cond_in: the sum of such parts; x holds only the leading channels.
+    """
     config = self.config
+    if conv_in_part is not None:
+      begin, in_dim = conv_in_part
+      if not self.conv_in.built:
+        self.conv_in(tf.zeros([1, 1, 1, in_dim], x.dtype))
+      return self._conv_in_part(x, begin)
     emb = self.time_emb(t)
-    x = self.group_norm_in(self.conv_in(x))
+    if cond_in is None:
+      x = self.conv_in(x)
+    else:
+      x = self._conv_in_part(x, 0) + tf.cast(
+          self.conv_in.bias, x.dtype) + cond_in
+    x = self.group_norm_in(x)
 
     x_list = [x]
     for i in range(config.n_mlp_blocks):
@@ -8,7 +8,8 @@ from architectures import resnet
 import tensorflow as tf
 
 from architectures.transformers import (MLP, DropPath, get_shape, add_cls_token_emb,
-                                        add_vis_pos_emb, suffix_id, TransformerEncoder)
+                                        add_vis_pos_emb, suffix_id, TransformerEncoder,
+                                        recompute_layer, MultiHeadAttention)
 
 
 class VideoTransformerEncoderLayer(tf.keras.layers.Layer):  # pylint: disable=missing-docstring
@@ -44,7 +45,7 @@ class VideoTransformerEncoderLayer(tf.keras.layers.Layer):  # pylint: disable=mi
                 center=ln_scale_shift,
                 scale=ln_scale_shift,
                 name='mha/ln')
-            self.mha = tf.keras.layers.MultiHeadAttention(
+            self.mha = MultiHeadAttention(
                 num_heads, dim // num_heads, dropout=drop_att, name='mha')
             if use_mlp:
                 self.mlp = MLP(1, dim, mlp_ratio, drop_path, drop_units,
@@ -57,7 +58,7 @@ class VideoTransformerEncoderLayer(tf.keras.layers.Layer):  # pylint: disable=mi
                 scale=ln_scale_shift,
                 name='cross_mha/ln')
             dim_x_att = dim if dim_x_att is None else dim_x_att
-            self.cross_mha = tf.keras.layers.MultiHeadAttention(
+            self.cross_mha = MultiHeadAttention(
                 num_heads, dim_x_att // num_heads,
                 dropout=drop_att, name='cross_mha')
             if use_mlp:
@@ -119,6 +120,7 @@ class VideoTransformerEncoder(tf.keras.layers.Layer):  # pylint: disable=missing
                  self_attention=True,
                  use_ffn_ln=False,
                  ln_scale_shift=True,
+                 recompute_grad=False,
                  **kwargs):
         super(VideoTransformerEncoder, self).__init__(**kwargs)
 
@@ -127,6 +129,7 @@ class VideoTransformerEncoder(tf.keras.layers.Layer):  # pylint: disable=missing
         self.vid_len = vid_len
         self.num_layers = num_layers
         self.late_fusion = late_fusion
+        self.recompute_grad = recompute_grad
         self.enc_layers = [
             VideoTransformerEncoderLayer(
                 dim=dim,
@@ -149,7 +152,10 @@ class VideoTransformerEncoder(tf.keras.layers.Layer):  # pylint: disable=missing
         if ret_list:
             x_list = [x]
         for i in range(self.num_layers):
-            x = self.enc_layers[i](x, mask, training)
+            if self.recompute_grad and training:
+                x = recompute_layer(self.enc_layers[i], x, mask=mask, training=training)
+            else:
+                x = self.enc_layers[i](x, mask, training)
             if ret_list:
                 x_list.append(x)
         return (x, x_list) if ret_list else x
@@ -176,6 +182,7 @@ class VideoResNetTransformer(tf.keras.layers.Layer):  # pylint: disable=missing-
                  pos_encoding='sin_cos',
                  use_cls_token=True,
                  freeze_backbone=0,
+                 recompute_grad=False,
                  **kwargs):
         super(VideoResNetTransformer, self).__init__(**kwargs)
         self.dim = dim
@@ -231,16 +238,20 @@ class VideoResNetTransformer(tf.keras.layers.Layer):  # pylint: disable=missing-
             drop_path=drop_path,
             drop_units=drop_units,
             drop_att=drop_att,
+            recompute_grad=recompute_grad,
             name='transformer_encoder')
         self.output_ln = tf.keras.layers.LayerNormalization(
             epsilon=1e-6, name='ouput_ln')
 
-    def call(self, videos, training):
-        b, t, h, w, c = get_shape(videos)
-
-        videos = utils.flatten_vid(videos)
+    def encode_frames(self, frames, training):
+        """
+        backbone features of each frame which do not depend on the other frames in the video so they can be
+        reused across overlapping windows of a longer video
 
-        hidden_stack, _ = self.resnet(videos, training)
+        frames: (n, h, w, c)
+        returns: (n, n_feat, dim)
+        """
+        hidden_stack, _ = self.resnet(frames, training)
         """last feature layer"""
         tokens = hidden_stack[-1]
 
@@ -248,12 +259,21 @@ class VideoResNetTransformer(tf.keras.layers.Layer):  # pylint: disable=missing-
         n_feat = fh * fw
         tokens = tf.reshape(tokens, [bt, n_feat, fc])
         tokens = self.stem_ln(self.stem_projection(self.dropout(tokens, training)))
+        return tokens
 
-        if self.late_fusion:
-            tokens = utils.unflatten_vid(tokens, self.vid_len)
+    def fuse_frames(self, frame_tokens, training):
+        """
+        frame_tokens: (b, t, n_feat, dim) output of encode_frames for the frames of each video
+        """
+        tokens = frame_tokens
+        b, t, n_feat, fc = get_shape(tokens)
+        bt = b * t
+
+        if not self.late_fusion:
+            tokens = utils.flatten_vid(tokens)
 
         tokens_vis_pos_emb = tf.expand_dims(self.vis_pos_emb, 0)
-        tokens = tokens + tokens_vis_pos_emb
+        tokens = tokens + tf.cast(tokens_vis_pos_emb, tokens.dtype)
 
         if self.use_cls_token:
             cls_token = tf.tile(tf.expand_dims(self.cls_token_emb, 0), [bt, 1, 1])
@@ -274,6 +294,11 @@ class VideoResNetTransformer(tf.keras.layers.Layer):  # pylint: disable=missing-
 
         return x
 
+    def call(self, videos, training):
+        frame_tokens = self.encode_frames(utils.flatten_vid(videos), training)
+        frame_tokens = utils.unflatten_vid(frame_tokens, self.vid_len)
+        return self.fuse_frames(frame_tokens, training)
+
 
 class VideoSwinTransformer(tf.keras.layers.Layer):  # pylint: disable=missing-docstring
 
@@ -416,7 +441,7 @@ class VideoSwinTransformer(tf.keras.layers.Layer):  # pylint: disable=missing-do
         tokens = self.stem_ln(tokens)
 
         tokens_vis_pos_emb = tf.expand_dims(self.vis_pos_emb, 0)
-        tokens = tokens + tokens_vis_pos_emb
+        tokens = tokens + tf.cast(tokens_vis_pos_emb, tokens.dtype)
 
         if self.use_cls_token:
             cls_token = tf.tile(tf.expand_dims(self.cls_token_emb, 0), [bsz, 1, 1])
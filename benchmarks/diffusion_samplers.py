@@ -0,0 +1,117 @@
+"""
+Quality vs number of steps of the diffusion samplers supported by diffusion_utils.Scheduler.generate
+on a tiny synthetic setup that runs on CPU
+
+the data is a 2-D mixture of Gaussians for which the optimal denoiser E[x0 | xt] has a closed form so no training
+is needed; the denoiser output is converted to the requested pred_type before it is passed to the sampler
+
+the error of the deterministic samplers is measured against the samples of the probability flow ODE solved with
+many DDIM steps from the same initial noise while the stochastic ddpm samplers are compared through the squared
+distance between the means and covariances of their samples and those of the data
+
+usage:
+python3 benchmarks/diffusion_samplers.py --schedule=cosine --pred_type=eps --steps=5,10,20,50
+"""
+
+import os
+import sys
+import time
+
+sys.path.append(os.getcwd())
+
+os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
+
+from absl import app
+from absl import flags
+
+import numpy as np
+import tensorflow as tf
+
+from models import diffusion_utils
+
+flags.DEFINE_string('schedule', 'cosine', 'time schedule as in model.train_schedule / model.infer_schedule')
+flags.DEFINE_enum('pred_type', 'eps', ['eps', 'x', 'v'], 'type of denoiser output')
+flags.DEFINE_list('samplers', ['ddim', 'heun', 'dpm++2m', 'dpm++3m', 'ddpm'], 'samplers to compare')
+flags.DEFINE_list('steps', ['5', '10', '20', '50'], 'numbers of network evaluations')
+flags.DEFINE_integer('ref_steps', 2000, 'number of DDIM steps for the reference ODE solution')
+flags.DEFINE_integer('n_samples', 4000, 'number of samples')
+flags.DEFINE_float('b_scale', 1.0, 'scale of the data as in model.b_scale')
+FLAGS = flags.FLAGS
+
+"""mixture of well separated Gaussians of different sizes"""
+MEANS = np.array([[-0.6, -0.6], [0.6, -0.3], [0., 0.7]], dtype=np.float32)
+STDS = np.array([0.05, 0.15, 0.1], dtype=np.float32)
+WEIGHTS = np.array([0.3, 0.5, 0.2], dtype=np.float32)
+
+
+def get_transition_f():
+    means = tf.constant(MEANS) * FLAGS.b_scale
+    variances = tf.constant(STDS ** 2) * FLAGS.b_scale ** 2
+    log_weights = tf.math.log(tf.constant(WEIGHTS))
+
+    def transition_f(x, gamma, training):
+        del training
+        alpha, sigma2 = tf.sqrt(gamma), 1. - gamma  # (bsz, 1)
+        var_t = alpha ** 2 * variances + sigma2  # (bsz, k)
+        diff = x[:, tf.newaxis, :] - alpha[:, :, tf.newaxis] * means  # (bsz, k, 2)
+        log_p = log_weights - tf.reduce_sum(diff ** 2, -1) / (2 * var_t) - tf.math.log(var_t)
+        post = tf.nn.softmax(log_p, -1)
+        x0_k = means + (alpha * variances / var_t)[..., tf.newaxis] * diff
+        x0 = tf.reduce_sum(post[..., tf.newaxis] * x0_k, 1)
+        if FLAGS.pred_type == 'x':
+            return x0
+        eps = diffusion_utils.get_eps_from_x0(x, gamma, x0)
+        if FLAGS.pred_type == 'eps':
+            return eps
+        return (tf.sqrt(gamma) * x - x0) / tf.sqrt(1. - gamma)
+
+    return transition_f
+
+
+def sample(scheduler, transition_f, sampler_name, iterations):
+    tf.random.set_seed(0)
+    return scheduler.generate(
+        transition_f, iterations, [FLAGS.n_samples, 2], pred_type=FLAGS.pred_type,
+        schedule=FLAGS.schedule, sampler_name=sampler_name).numpy()
+
+
+def moments_error(samples):
+    """squared distance of the first two moments of the samples from those of the data"""
+    rng = np.random.default_rng(0)
+    ids = rng.choice(len(WEIGHTS), size=100000, p=WEIGHTS)
+    data = (MEANS[ids] + STDS[ids, None] * rng.standard_normal((len(ids), 2))) * FLAGS.b_scale
+    mean_err = np.sum((samples.mean(0) - data.mean(0)) ** 2)
+    cov_err = np.sum((np.cov(samples.T) - np.cov(data.T)) ** 2)
+    return mean_err + cov_err
+
+
+def main(_):
+    scheduler = diffusion_utils.Scheduler(FLAGS.schedule)
+    transition_f = get_transition_f()
+
+    ref = sample(scheduler, transition_f, 'ddim', FLAGS.ref_steps)
+    print(f'schedule: {FLAGS.schedule} pred_type: {FLAGS.pred_type} n_samples: {FLAGS.n_samples} '
+          f'reference: ddim with {FLAGS.ref_steps} steps (moments error: {moments_error(ref):.2e})')
+    print('error: RMSE from the reference ODE samples for deterministic samplers, '
+          'moments error for ddpm')
+
+    header = f'{"sampler":>10s}' + ''.join(f'{f"NFE={s}":>16s}' for s in FLAGS.steps)
+    print(header)
+    for sampler_name in FLAGS.samplers:
+        row = f'{sampler_name:>10s}'
+        for nfe in map(int, FLAGS.steps):
+            """heun evaluates the denoiser twice per iteration except in the last one"""
+            iterations = (nfe + 1) // 2 if sampler_name == 'heun' else nfe
+            start_t = time.time()
+            samples = sample(scheduler, transition_f, sampler_name, iterations)
+            elapsed = time.time() - start_t
+            if sampler_name.startswith('ddpm'):
+                error = moments_error(samples)
+            else:
+                error = np.sqrt(np.mean(np.sum((samples - ref) ** 2, -1)))
+            row += f'{error:>9.2e} ({elapsed:4.1f}s)'
+        print(row)
+
+
+if __name__ == '__main__':
+    app.run(main)
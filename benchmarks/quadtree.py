@@ -0,0 +1,68 @@
+"""
+Per-mask latency of building the quadtree representation of a segmentation mask with the per-node Python loop
+(dense2quad_loop) and the vectorized block min/max pyramid (dense2quad), plus the quad2dense decoder
+
+usage:
+python3 benchmarks/quadtree.py --size=512 --num_levels=6
+"""
+
+import os
+import sys
+import time
+
+sys.path.append(os.getcwd())
+
+from absl import app
+from absl import flags
+
+import numpy as np
+
+from tasks import quadtree
+
+flags.DEFINE_integer('size', 512, 'height and width of the mask')
+flags.DEFINE_integer('num_levels', 6, 'number of quadtree levels')
+flags.DEFINE_integer('num_objects', 8, 'number of random rectangles drawn on the mask')
+flags.DEFINE_integer('n_masks', 5, 'number of timed masks')
+flags.DEFINE_bool('return_255', False, 'set the nodes below uniform nodes to 255')
+FLAGS = flags.FLAGS
+
+
+def random_mask(rng):
+    mask = np.zeros((FLAGS.size, FLAGS.size), dtype=np.uint8)
+    for obj_id in range(1, FLAGS.num_objects + 1):
+        y0, x0 = rng.integers(0, FLAGS.size, 2)
+        h, w = rng.integers(1, FLAGS.size // 2, 2)
+        mask[y0:y0 + h, x0:x0 + w] = obj_id
+    return mask
+
+
+def time_fn(fn, masks):
+    start_t = time.time()
+    outputs = [fn(mask) for mask in masks]
+    ms_per_mask = (time.time() - start_t) / len(masks) * 1000
+    return ms_per_mask, outputs
+
+
+def main(_):
+    rng = np.random.default_rng(0)
+    masks = [random_mask(rng) for _ in range(FLAGS.n_masks)]
+
+    loop_ms, loop_quads = time_fn(
+        lambda mask: quadtree.dense2quad_loop(mask, FLAGS.num_levels, FLAGS.return_255), masks)
+    vec_ms, vec_quads = time_fn(
+        lambda mask: quadtree.dense2quad(mask, FLAGS.num_levels, FLAGS.return_255), masks)
+    dec_ms, dense_maps = time_fn(quadtree.quad2dense, vec_quads)
+
+    for loop_quad, vec_quad, mask, dense_map in zip(loop_quads, vec_quads, masks, dense_maps):
+        for level in loop_quad:
+            assert np.array_equal(loop_quad[level], vec_quad[level]), f'mismatch at level {level}'
+        assert np.array_equal(dense_map, mask), 'quad2dense does not recover the mask'
+
+    print(f'size: {FLAGS.size} num_levels: {FLAGS.num_levels} return_255: {FLAGS.return_255}')
+    print(f'dense2quad_loop: {loop_ms:.2f} ms/mask')
+    print(f'dense2quad: {vec_ms:.3f} ms/mask ({loop_ms / vec_ms:.0f}x)')
+    print(f'quad2dense: {dec_ms:.3f} ms/mask')
+
+
+if __name__ == '__main__':
+    app.run(main)
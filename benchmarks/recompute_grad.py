@@ -0,0 +1,90 @@
+"""
+Peak memory and step time of AutoregressiveDecoder and VideoTransformerEncoder training steps
+with and without activation recomputation (model.recompute_grad) on CPU
+
+usage:
+python3 benchmarks/recompute_grad.py --max_seq_len=1024 --vid_len=4
+"""
+
+import os
+import sys
+import time
+
+sys.path.append(os.getcwd())
+
+os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
+
+from absl import app
+from absl import flags
+
+import tensorflow as tf
+
+from architectures.transformers import AutoregressiveDecoder
+from architectures.video_transformers import VideoTransformerEncoder
+
+flags.DEFINE_integer('batch_size', 2, 'batch size')
+flags.DEFINE_integer('max_seq_len', 512, 'decoder sequence length')
+flags.DEFINE_integer('vocab_size', 2000, 'decoder vocabulary size')
+flags.DEFINE_integer('num_layers', 4, 'number of decoder and encoder layers')
+flags.DEFINE_integer('dim', 256, 'attention dim')
+flags.DEFINE_integer('vid_len', 2, 'number of frames for the video encoder')
+flags.DEFINE_integer('n_feat', 400, 'number of encoded feature tokens per frame')
+flags.DEFINE_integer('n_steps', 5, 'number of timed steps')
+FLAGS = flags.FLAGS
+
+
+def build(recompute_grad):
+    encoder = VideoTransformerEncoder(
+        num_layers=FLAGS.num_layers, dim=FLAGS.dim, mlp_ratio=4, num_heads=8,
+        vid_len=FLAGS.vid_len, late_fusion=0, drop_path=0., drop_units=0.,
+        recompute_grad=recompute_grad, name='encoder')
+    decoder = AutoregressiveDecoder(
+        defer_vocab=0, defer_seq=0, vocab_size=FLAGS.vocab_size, max_seq_len=FLAGS.max_seq_len,
+        num_layers=FLAGS.num_layers, dim=FLAGS.dim, mlp_ratio=4, num_heads=8,
+        drop_path=0., drop_units=0., recompute_grad=recompute_grad, name='decoder')
+    optimizer = tf.keras.optimizers.SGD(1e-3)
+
+    @tf.function
+    def train_step(videos, seq):
+        with tf.GradientTape() as tape:
+            encoded = encoder(videos, None, training=True)
+            logits = decoder(seq, encoded, training=True)
+            loss = tf.reduce_mean(tf.nn.sparse_softmax_cross_entropy_with_logits(seq, logits))
+            trainable_variables = encoder.trainable_variables + decoder.trainable_variables
+            grads = tape.gradient(loss, trainable_variables)
+        optimizer.apply_gradients(zip(grads, trainable_variables))
+        return loss
+
+    return train_step
+
+
+def run(recompute_grad):
+    tf.random.set_seed(0)
+    train_step = build(recompute_grad)
+    videos = tf.random.normal([FLAGS.batch_size, FLAGS.vid_len, FLAGS.n_feat, FLAGS.dim])
+    seq = tf.random.uniform([FLAGS.batch_size, FLAGS.max_seq_len], maxval=FLAGS.vocab_size, dtype=tf.int64)
+
+    """the first two calls create the variables and trace the recomputed graph"""
+    for _ in range(2):
+        train_step(videos, seq).numpy()
+
+    tf.config.experimental.reset_memory_stats('CPU:0')
+    start_t = time.time()
+    for _ in range(FLAGS.n_steps):
+        train_step(videos, seq).numpy()
+    step_time = (time.time() - start_t) / FLAGS.n_steps
+    peak_mem = tf.config.experimental.get_memory_info('CPU:0')['peak'] / 1e6
+
+    return step_time, peak_mem
+
+
+def main(_):
+    print(f'batch_size: {FLAGS.batch_size} max_seq_len: {FLAGS.max_seq_len} '
+          f'vid_len: {FLAGS.vid_len} num_layers: {FLAGS.num_layers} dim: {FLAGS.dim}')
+    for recompute_grad in [0, 1]:
+        step_time, peak_mem = run(recompute_grad)
+        print(f'recompute_grad={recompute_grad}: step_time: {step_time * 1000:.1f} ms peak_mem: {peak_mem:.1f} MB')
+
+
+if __name__ == '__main__':
+    app.run(main)
@@ -0,0 +1,91 @@
+"""
+Throughput of the bit diffusion model when generating many samples in small requests with one
+Scheduler.generate call per request and with the rolling sampler that keeps a fixed-size pool of samples at
+different iterations and refills the finished slots with fresh noise, on CPU with an untrained tape denoiser
+
+usage:
+python3 benchmarks/rolling_sampler.py --num_samples=64 --request_size=4 --pool_sizes=16,32,64 --iterations=20
+"""
+
+import os
+import sys
+import time
+
+sys.path.append(os.getcwd())
+
+os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
+
+from absl import app
+from absl import flags
+
+import tensorflow as tf
+
+from configs import config_diffusion_base
+from models import image_discrete_diffusion_model
+
+flags.DEFINE_integer('num_samples', 64, 'total number of samples')
+flags.DEFINE_integer('request_size', 4, 'number of samples per generate call')
+flags.DEFINE_list('pool_sizes', ['16', '32', '64'], 'pool sizes of the rolling sampler')
+flags.DEFINE_integer('iterations', 20, 'number of iterations per sample')
+flags.DEFINE_string('sampler_name', 'ddim', 'sampler')
+flags.DEFINE_integer('image_size', 16, 'image size')
+FLAGS = flags.FLAGS
+
+
+def build_model():
+    cfg = config_diffusion_base.get_config('cifar10,tape')
+    cfg.dataset.image_size = FLAGS.image_size
+    cfg.model.name = 'image_discrete_diffusion_model'
+    cfg.model.pred_type = 'x'
+    cfg.model.update(dict(
+        num_layers='2,2', latent_slots=32, latent_dim=128, tape_dim=64, patch_size=2,
+        latent_num_heads=4, rw_num_heads=1))
+    return image_discrete_diffusion_model.Model(cfg)
+
+
+def run_generate(model):
+    @tf.function
+    def sample(num_samples):
+        return model.sample(num_samples=num_samples, iterations=FLAGS.iterations, method=FLAGS.sampler_name)
+
+    sample(FLAGS.request_size).numpy()  # trace
+    start_t = time.time()
+    for _ in range(0, FLAGS.num_samples, FLAGS.request_size):
+        sample(FLAGS.request_size).numpy()
+    return FLAGS.num_samples / (time.time() - start_t)
+
+
+def run_rolling(model, pool_size):
+    sampler = model.get_rolling_sampler(pool_size, FLAGS.iterations, FLAGS.sampler_name)
+    for _ in sampler.run(1):  # trace
+        pass
+    start_t = time.time()
+    for _ in range(0, FLAGS.num_samples, FLAGS.request_size):
+        sampler.submit(FLAGS.request_size)
+    n_samples, n_ticks = 0, 0
+    while n_samples < FLAGS.num_samples:
+        outputs = sampler.tick()
+        n_ticks += 1
+        if outputs is not None:
+            n_samples += int(image_discrete_diffusion_model.bit2rgb(
+                outputs[0], model.config.b_type).shape[0])
+    return n_samples / (time.time() - start_t), n_ticks
+
+
+def main(_):
+    tf.random.set_seed(0)
+    model = build_model()
+    print(f'num_samples: {FLAGS.num_samples} request_size: {FLAGS.request_size} iterations: {FLAGS.iterations} '
+          f'sampler: {FLAGS.sampler_name} image_size: {FLAGS.image_size}')
+    samples_per_sec = run_generate(model)
+    print(f'generate per request: {samples_per_sec:.2f} samples/sec '
+          f'({FLAGS.num_samples // FLAGS.request_size * FLAGS.iterations} denoiser calls '
+          f'of batch {FLAGS.request_size})')
+    for pool_size in FLAGS.pool_sizes:
+        samples_per_sec, n_ticks = run_rolling(model, int(pool_size))
+        print(f'rolling pool of {pool_size}: {samples_per_sec:.2f} samples/sec '
+              f'({n_ticks} denoiser calls of batch {pool_size})')
+
+
+if __name__ == '__main__':
+    app.run(main)
@@ -0,0 +1,141 @@
+"""
+Acceptance rate and speedup of greedy speculative decoding (model.draft_layers) over greedy decoding
+of RLE sequences with the decoder of the IPSC semantic and video segmentation configs
+
+the decoder is randomly initialized unless a checkpoint of the corresponding model is provided with --ckpt;
+random decoders almost never agree with their early layers so --tail_scale can be used to scale down the residual
+branches of the layers after the draft to emulate a trained decoder where they do
+
+usage:
+python3 benchmarks/speculative_decoding.py --cfg=seg --draft_layers=2 --draft_len=4
+python3 benchmarks/speculative_decoding.py --cfg=video_seg --ckpt=log/<model_dir>/ckpt-<step>
+"""
+
+import os
+import sys
+import time
+
+sys.path.append(os.getcwd())
+
+os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
+
+from absl import app
+from absl import flags
+
+import numpy as np
+import tensorflow as tf
+
+from architectures.transformers import AutoregressiveDecoder
+
+flags.DEFINE_enum('cfg', 'seg', ['seg', 'video_seg'], 'config providing the decoder architecture')
+flags.DEFINE_string('ckpt', '', 'optional checkpoint of a model trained with cfg to restore the decoder from')
+flags.DEFINE_integer('draft_layers', 2, 'number of decoder layers used as the draft model')
+flags.DEFINE_integer('draft_len', 4, 'number of tokens proposed by the draft per pass of the full decoder')
+flags.DEFINE_integer('batch_size', 1, 'batch size')
+flags.DEFINE_integer('n_enc', 400, 'number of encoded tokens the decoder attends to')
+flags.DEFINE_integer('max_seq_len', 0, 'generated sequence length including the prompt; 0 uses the config value')
+flags.DEFINE_float('tail_scale', 1.0, 'scale of the weights of the layers after the draft for random decoders')
+flags.DEFINE_integer('n_runs', 3, 'number of timed runs')
+FLAGS = flags.FLAGS
+
+
+def get_model_config():
+    if FLAGS.cfg == 'seg':
+        from configs import config_seg as config_lib
+    else:
+        from configs import config_video_seg as config_lib
+    return config_lib.get_config().model
+
+
+def build(model_cfg, max_seq_len):
+    decoder = AutoregressiveDecoder(
+        defer_vocab=model_cfg.defer_vocab,
+        defer_seq=model_cfg.defer_seq,
+        vocab_size=model_cfg.vocab_size,
+        max_seq_len=model_cfg.max_seq_len,
+        num_layers=model_cfg.num_decoder_layers,
+        dim=model_cfg.dim_att_dec,
+        mlp_ratio=model_cfg.dim_mlp_dec // model_cfg.dim_att_dec,
+        num_heads=model_cfg.num_heads_dec,
+        drop_path=0., drop_units=0., drop_att=0.,
+        pos_encoding=model_cfg.pos_encoding_dec,
+        shared_embedding=model_cfg.shared_decoder_embedding,
+        output_bias=model_cfg.decoder_output_bias,
+        draft_layers=FLAGS.draft_layers,
+        draft_len=FLAGS.draft_len,
+        name='ar_decoder')
+
+    prompt = tf.ones([FLAGS.batch_size, 1], dtype=tf.int64)
+    encoded = tf.random.normal([FLAGS.batch_size, FLAGS.n_enc, model_cfg.dim_att_dec])
+    decoder(prompt, encoded, training=False)
+
+    if FLAGS.ckpt:
+        """the decoder is saved as model.decoder by the training checkpoints"""
+        checkpoint = tf.train.Checkpoint(model=tf.train.Checkpoint(decoder=decoder))
+        checkpoint.restore(FLAGS.ckpt).expect_partial()
+        print(f'restored decoder from {FLAGS.ckpt}')
+    elif FLAGS.tail_scale != 1.0:
+        for layer in decoder.decoder.dec_layers[FLAGS.draft_layers:]:
+            for var in layer.variables:
+                var.assign(var * FLAGS.tail_scale)
+
+    @tf.function
+    def greedy_fn(prompt, encoded):
+        draft_layers = decoder.draft_layers
+        decoder.draft_layers = 0
+        tokens, _ = decoder.infer(prompt, encoded, max_seq_len, top_k=1)
+        decoder.draft_layers = draft_layers
+        return tokens
+
+    @tf.function
+    def speculative_fn(prompt, encoded):
+        tokens, _, stats = decoder.infer_speculative(prompt, encoded, max_seq_len)
+        return tokens, stats
+
+    return greedy_fn, speculative_fn, prompt, encoded
+
+
+def timed(fn, *args):
+    """the first call traces the function"""
+    fn(*args)
+    times = []
+    for _ in range(FLAGS.n_runs):
+        start_t = time.time()
+        outputs = tf.nest.map_structure(lambda x: x.numpy(), fn(*args))
+        times.append(time.time() - start_t)
+    return outputs, np.median(times)
+
+
+def main(_):
+    tf.random.set_seed(0)
+
+    model_cfg = get_model_config()
+    max_seq_len = FLAGS.max_seq_len if FLAGS.max_seq_len > 0 else model_cfg.max_seq_len
+    assert FLAGS.draft_layers < model_cfg.num_decoder_layers, \
+        f'draft_layers must be less than num_decoder_layers: {model_cfg.num_decoder_layers}'
+
+    print(f'cfg: {FLAGS.cfg} max_seq_len: {max_seq_len} vocab_size: {model_cfg.vocab_size} '
+          f'num_layers: {model_cfg.num_decoder_layers} dim: {model_cfg.dim_att_dec} '
+          f'draft_layers: {FLAGS.draft_layers} draft_len: {FLAGS.draft_len}')
+
+    greedy_fn, speculative_fn, prompt, encoded = build(model_cfg, max_seq_len)
+
+    greedy_tokens, greedy_time = timed(greedy_fn, prompt, encoded)
+    (spec_tokens, stats), spec_time = timed(speculative_fn, prompt, encoded)
+
+    """speculative decoding must not change the output of greedy decoding"""
+    np.testing.assert_array_equal(spec_tokens, greedy_tokens)
+
+    n_gen = max_seq_len - prompt.shape[1]
+    n_passes, n_accepted = int(stats['n_passes']), int(stats['n_accepted'])
+    """the first pass over the prompt has no proposals"""
+    acceptance_rate = n_accepted / max((n_passes - 1) * FLAGS.draft_len, 1)
+
+    print(f'greedy: {greedy_time * 1000:.1f} ms ({n_gen} passes of the full decoder)')
+    print(f'speculative: {spec_time * 1000:.1f} ms ({n_passes} passes of the full decoder)')
+    print(f'acceptance rate: {acceptance_rate:.3f} tokens per pass: {n_gen / n_passes:.2f} '
+          f'speedup: {greedy_time / spec_time:.2f}x')
+
+
+if __name__ == '__main__':
+    app.run(main)
@@ -0,0 +1,109 @@
+"""
+Per-step latency of the tape denoiser at inference with and without the step cache of
+TapeDenoiser.get_step_cache for several numbers of latent slots on CPU
+
+without the cache, every denoising step projects the conditioning and adds up the position embeddings
+and the video denoiser also runs its stem on the conditioning frames; with the cache these are computed
+once per generate call and each step only computes the time embedding, the tape of the noisy samples,
+the self-cond projections and the read / process / write blocks
+
+usage:
+python3 benchmarks/tape_cache.py --arch=video --latent_slots=32,64,128,256
+"""
+
+import os
+import sys
+import time
+
+sys.path.append(os.getcwd())
+
+os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
+
+from absl import app
+from absl import flags
+
+import numpy as np
+import tensorflow as tf
+
+from architectures.tape import ImageTapeDenoiser
+from architectures.tape import VideoTapeDenoiser
+
+flags.DEFINE_enum('arch', 'video', ['image', 'video'], 'tape denoiser for images with class labels or '
+                                                       'for video prediction with conditioning frames')
+flags.DEFINE_list('latent_slots', ['32', '64', '128', '256'], 'numbers of latent slots to compare')
+flags.DEFINE_integer('batch_size', 8, 'batch size')
+flags.DEFINE_integer('image_size', 32, 'image size')
+flags.DEFINE_integer('patch_size', 4, 'patch size')
+flags.DEFINE_integer('seq_len', 8, 'number of frames for video')
+flags.DEFINE_integer('seq_cond', 4, 'number of conditioning frames for video')
+flags.DEFINE_integer('num_classes', 1000, 'number of classes for images')
+flags.DEFINE_string('num_layers', '2,2', 'number of latent layers per read / write block')
+flags.DEFINE_integer('latent_dim', 256, 'latent dim')
+flags.DEFINE_integer('tape_dim', 128, 'tape dim')
+flags.DEFINE_integer('n_steps', 50, 'number of timed denoising steps')
+FLAGS = flags.FLAGS
+
+
+def build(latent_slots):
+    kwargs = dict(
+        num_layers=FLAGS.num_layers, latent_slots=latent_slots, latent_dim=FLAGS.latent_dim,
+        latent_mlp_ratio=4, latent_num_heads=4, tape_dim=FLAGS.tape_dim, tape_mlp_ratio=2, rw_num_heads=1,
+        image_height=FLAGS.image_size, image_width=FLAGS.image_size, image_channels=3,
+        patch_size=FLAGS.patch_size, latent_pos_encoding='sin_cos_plus_learned',
+        tape_pos_encoding='sin_cos_plus_learned', drop_units=0., self_cond='latent', name='denoiser')
+    bsz, size = FLAGS.batch_size, FLAGS.image_size
+    if FLAGS.arch == 'image':
+        denoiser = ImageTapeDenoiser(**kwargs)
+        x = tf.random.normal([bsz, size, size, 3])
+        cond = tf.one_hot(tf.range(bsz) % FLAGS.num_classes, FLAGS.num_classes)
+    else:
+        denoiser = VideoTapeDenoiser(**kwargs, seq_len=FLAGS.seq_len, seq_stride=1, seq_cond=FLAGS.seq_cond)
+        x = tf.random.normal([bsz, FLAGS.seq_len - FLAGS.seq_cond, size, size, 3])
+        cond = tf.random.normal([bsz, FLAGS.seq_cond, size, size, 3])
+    hidden = tuple(tf.zeros([bsz] + shape) for shape in denoiser.hidden_shapes)
+    return denoiser, (x, *hidden), cond
+
+
+def time_steps(step_fn, x, t):
+    step_fn(x, t)[0].numpy()  # trace
+    latencies = []
+    for _ in range(FLAGS.n_steps):
+        start_t = time.time()
+        step_fn(x, t)[0].numpy()
+        latencies.append(time.time() - start_t)
+    return np.median(latencies) * 1000
+
+
+def run(latent_slots):
+    tf.random.set_seed(0)
+    denoiser, x, cond = build(latent_slots)
+    t = tf.random.uniform([FLAGS.batch_size])
+
+    @tf.function
+    def step(x, t):
+        return denoiser(x, t, cond, training=False)
+
+    step_cache = denoiser.get_step_cache(cond)
+
+    @tf.function
+    def cached_step(x, t):
+        return denoiser(x, t, None, training=False, step_cache=step_cache)
+
+    outputs, outputs_cached = step(x, t), cached_step(x, t)
+    max_diff = max(float(tf.reduce_max(tf.abs(a - b))) for a, b in zip(outputs, outputs_cached))
+    return time_steps(step, x, t), time_steps(cached_step, x, t), max_diff
+
+
+def main(_):
+    print(f'arch: {FLAGS.arch} batch_size: {FLAGS.batch_size} image_size: {FLAGS.image_size} '
+          f'patch_size: {FLAGS.patch_size} num_layers: {FLAGS.num_layers} latent_dim: {FLAGS.latent_dim} '
+          f'tape_dim: {FLAGS.tape_dim}')
+    print(f'{"latent_slots":>12} {"step (ms)":>10} {"cached (ms)":>12} {"speedup":>8} {"max diff":>9}')
+    for latent_slots in FLAGS.latent_slots:
+        step_ms, cached_ms, max_diff = run(int(latent_slots))
+        print(f'{latent_slots:>12} {step_ms:>10.2f} {cached_ms:>12.2f} {step_ms / cached_ms:>8.2f} '
+              f'{max_diff:>9.1e}')
+
+
+if __name__ == '__main__':
+    app.run(main)
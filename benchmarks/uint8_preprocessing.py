@@ -0,0 +1,105 @@
+"""
+Throughput of the tf.data preprocessing of video segmentation clips when the decoded frames are converted to
+float before the transforms and when they are kept as uint8 through the geometric transforms and converted
+to float by the last transform, on synthetic jpeg frames on CPU
+
+the transforms are the resize_video of the video segmentation task followed by the scale jitter, crop, flip and
+padding of the video detection task
+
+usage:
+python3 benchmarks/uint8_preprocessing.py --length=8 --frame_size=720,960 --image_size=640,640
+"""
+
+import os
+import sys
+import time
+
+sys.path.append(os.getcwd())
+
+os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
+
+from absl import app
+from absl import flags
+
+import ml_collections
+import numpy as np
+import tensorflow as tf
+
+from configs import transform_configs
+from data import decode_utils
+from data import transforms
+from data import video_transforms  # registers the video transforms
+
+flags.DEFINE_integer('length', 8, 'number of frames per clip')
+flags.DEFINE_list('frame_size', ['720', '960'], 'height and width of the decoded frames')
+flags.DEFINE_list('image_size', ['640', '640'], 'height and width of the preprocessed frames')
+flags.DEFINE_integer('n_clips', 64, 'number of distinct clips')
+flags.DEFINE_integer('n_epochs', 3, 'number of timed passes over the clips')
+flags.DEFINE_integer('num_parallel_calls', 1, 'parallel calls of the dataset map')
+FLAGS = flags.FLAGS
+
+D = lambda **kwargs: ml_collections.ConfigDict(kwargs)
+
+
+def get_transforms(image_size, uint8_images):
+    transforms_ = transform_configs.get_video_segmentation_train_transforms(
+        image_size, max_seq_len=512, rle_from_mask=True)
+    transforms_ += [
+        D(name='scale_jitter_video', inputs=['video'], length=FLAGS.length, target_size=image_size,
+          min_scale=0.3, max_scale=2.0),
+        D(name='fixed_size_crop_video', inputs=['video'], target_size=image_size),
+        D(name='random_horizontal_flip_video', inputs=['video'], length=FLAGS.length),
+        D(name='pad_video_to_max_size', inputs=['video'], length=FLAGS.length, target_size=image_size),
+    ]
+    if uint8_images:
+        transforms_.append(D(name='convert_image_dtype_float32', inputs=['video']))
+    return [transforms.TransformRegistry.lookup(t.name)(t) for t in transforms_]
+
+
+def get_encoded_clips():
+    height, width = [int(x) for x in FLAGS.frame_size]
+    """smooth random frames so that jpeg decoding does not dominate"""
+    frames = tf.image.resize(tf.random.uniform([FLAGS.length, height // 8, width // 8, 3]), [height, width])
+    frames = tf.image.convert_image_dtype(frames, tf.uint8)
+    encoded = tf.stack([tf.io.encode_jpeg(frame) for frame in frames])
+    return tf.tile(encoded[tf.newaxis], [FLAGS.n_clips, 1])
+
+
+def run(uint8_images):
+    image_size = [int(x) for x in FLAGS.image_size]
+    transforms_ = get_transforms(image_size, uint8_images)
+    dtype = tf.uint8 if uint8_images else tf.float32
+
+    def preprocess(encoded):
+        frames = [decode_utils.decode_image(dict(frame=encoded[i]), 'frame', dtype=dtype)
+                  for i in range(FLAGS.length)]
+        example = dict(video=tf.stack(frames))
+        for t in transforms_:
+            example = t.process_example(example)
+        return example['video']
+
+    dataset = tf.data.Dataset.from_tensor_slices(get_encoded_clips()).map(
+        preprocess, num_parallel_calls=FLAGS.num_parallel_calls)
+    for video in dataset.take(2):  # warm up
+        assert video.dtype == tf.float32, video.dtype
+    start_t = time.time()
+    n_clips = 0
+    for _ in range(FLAGS.n_epochs):
+        for _ in dataset:
+            n_clips += 1
+    return n_clips / (time.time() - start_t)
+
+
+def main(_):
+    tf.random.set_seed(0)
+    print(f'length: {FLAGS.length} frame_size: {FLAGS.frame_size} image_size: {FLAGS.image_size} '
+          f'num_parallel_calls: {FLAGS.num_parallel_calls}')
+    clips_per_sec = {}
+    for uint8_images in [False, True]:
+        clips_per_sec[uint8_images] = run(uint8_images)
+        print(f'{"uint8" if uint8_images else "float"}: {clips_per_sec[uint8_images]:.2f} clips/sec')
+    print(f'speedup: {clips_per_sec[True] / clips_per_sec[False]:.2f}')
+
+
+if __name__ == '__main__':
+    app.run(main)
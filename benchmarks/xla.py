@@ -0,0 +1,112 @@
+"""
+Compile time and steady-state steps/sec of the VideoTransformerEncoder + AutoregressiveDecoder
+training step and the AutoregressiveDecoder.infer decoding step with and without XLA (jit_compile) on CPU
+
+usage:
+python3 benchmarks/xla.py --max_seq_len=256 --vid_len=2
+"""
+
+import os
+import sys
+import time
+
+sys.path.append(os.getcwd())
+
+os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
+
+from absl import app
+from absl import flags
+
+import tensorflow as tf
+
+from architectures.transformers import AutoregressiveDecoder
+from architectures.video_transformers import VideoTransformerEncoder
+
+flags.DEFINE_integer('batch_size', 2, 'batch size')
+flags.DEFINE_integer('max_seq_len', 256, 'decoder sequence length for training')
+flags.DEFINE_integer('infer_seq_len', 101, 'generated sequence length including the prompt for inference')
+flags.DEFINE_integer('vocab_size', 2000, 'decoder vocabulary size')
+flags.DEFINE_integer('num_layers', 2, 'number of decoder and encoder layers')
+flags.DEFINE_integer('dim', 256, 'attention dim')
+flags.DEFINE_integer('vid_len', 2, 'number of frames for the video encoder')
+flags.DEFINE_integer('n_feat', 100, 'number of encoded feature tokens per frame')
+flags.DEFINE_integer('n_steps', 10, 'number of timed steps')
+FLAGS = flags.FLAGS
+
+
+def build(jit_compile):
+    encoder = VideoTransformerEncoder(
+        num_layers=FLAGS.num_layers, dim=FLAGS.dim, mlp_ratio=4, num_heads=8,
+        vid_len=FLAGS.vid_len, late_fusion=0, drop_path=0., drop_units=0., name='encoder')
+    decoder = AutoregressiveDecoder(
+        defer_vocab=0, defer_seq=0, vocab_size=FLAGS.vocab_size, max_seq_len=FLAGS.max_seq_len,
+        num_layers=FLAGS.num_layers, dim=FLAGS.dim, mlp_ratio=4, num_heads=8,
+        drop_path=0., drop_units=0., name='decoder')
+    optimizer = tf.keras.optimizers.SGD(1e-3)
+
+    """same split as Trainer: only the forward and backward passes are compiled"""
+    @tf.function(jit_compile=jit_compile)
+    def loss_and_gradients(videos, seq):
+        with tf.GradientTape() as tape:
+            encoded = encoder(videos, None, training=True)
+            logits = decoder(seq, encoded, training=True)
+            loss = tf.reduce_mean(tf.nn.sparse_softmax_cross_entropy_with_logits(seq, logits))
+            trainable_variables = encoder.trainable_variables + decoder.trainable_variables
+            grads = tape.gradient(loss, trainable_variables)
+        return loss, grads
+
+    @tf.function
+    def train_step(videos, seq):
+        loss, grads = loss_and_gradients(videos, seq)
+        optimizer.apply_gradients(zip(grads, encoder.trainable_variables + decoder.trainable_variables))
+        return loss
+
+    @tf.function(jit_compile=jit_compile)
+    def infer_step(videos, prompt):
+        encoded = encoder(videos, None, training=False)
+        tokens, logits = decoder.infer(prompt, encoded, FLAGS.infer_seq_len)
+        return tokens
+
+    return train_step, infer_step
+
+
+def time_fn(fn, *args):
+    start_t = time.time()
+    fn(*args).numpy()
+    first_time = time.time() - start_t
+
+    start_t = time.time()
+    for _ in range(FLAGS.n_steps):
+        fn(*args).numpy()
+    steps_per_sec = FLAGS.n_steps / (time.time() - start_t)
+
+    return first_time, steps_per_sec
+
+
+def run(jit_compile):
+    tf.random.set_seed(0)
+    train_step, infer_step = build(jit_compile)
+    videos = tf.random.normal([FLAGS.batch_size, FLAGS.vid_len, FLAGS.n_feat, FLAGS.dim])
+    seq = tf.random.uniform([FLAGS.batch_size, FLAGS.max_seq_len], maxval=FLAGS.vocab_size, dtype=tf.int64)
+    prompt = tf.ones([FLAGS.batch_size, 1], dtype=tf.int64)
+
+    train_compile_time, train_steps_per_sec = time_fn(train_step, videos, seq)
+    infer_compile_time, infer_steps_per_sec = time_fn(infer_step, videos, prompt)
+
+    return train_compile_time, train_steps_per_sec, infer_compile_time, infer_steps_per_sec
+
+
+def main(_):
+    print(f'batch_size: {FLAGS.batch_size} max_seq_len: {FLAGS.max_seq_len} infer_seq_len: {FLAGS.infer_seq_len} '
+          f'vid_len: {FLAGS.vid_len} num_layers: {FLAGS.num_layers} dim: {FLAGS.dim}')
+    for jit_compile in [0, 1]:
+        train_compile_time, train_steps_per_sec, infer_compile_time, infer_steps_per_sec = run(jit_compile)
+        print(f'jit_compile={jit_compile}:\n'
+              f'\ttrain: first step (trace + compile): {train_compile_time:.2f} s '
+              f'steps/sec: {train_steps_per_sec:.2f}\n'
+              f'\tinfer: first step (trace + compile): {infer_compile_time:.2f} s '
+              f'steps/sec: {infer_steps_per_sec:.2f}')
+
+
+if __name__ == '__main__':
+    app.run(main)
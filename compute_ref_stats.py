@@ -0,0 +1,99 @@
+"""
+computes the FID / FVD reference statistics of the real data of the eval split of a generation config once
+and saves them in eval.ref_stats_dir, keyed by dataset, split, image size, resize method and antialiasing,
+so that the evaluator of the task loads them instead of running the real data through the classifier in
+every eval step
+
+usage:
+python3 compute_ref_stats.py --config=configs/config_diffusion_base.py:cifar10,tape \
+    --config.eval.ref_stats_dir=fid_stats
+
+with eval.fvd_clip_len > 0, the FVD stats of the real videos are computed on the same clips as in the eval
+so that long videos are streamed through the frame cache of metrics/video_clips.py:
+python3 compute_ref_stats.py --config=configs/config_diffusion_base.py:ucf101,tape \
+    --config.task.name=video_generation --config.dataset.seq_len=64 \
+    --config.eval.ref_stats_dir=fvd_stats --config.eval.fvd_clip_len=16 --config.eval.fvd_clip_stride=8
+"""
+
+import os
+import sys
+import time
+
+from absl import app
+from absl import flags
+from ml_collections.config_flags import config_flags
+
+sys.path.append(os.getcwd())
+
+os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
+import tensorflow as tf
+
+config_flags.DEFINE_config_file('config', '', 'config file of the generation task', lock_config=False)
+flags.DEFINE_integer('batch_size', 0, 'batch size; eval.batch_size is used if 0')
+flags.DEFINE_integer('max_batches', 0, 'number of batches to process; the whole split is used if 0')
+flags.DEFINE_bool('overwrite', False, 'recompute the stats even if they already exist')
+FLAGS = flags.FLAGS
+
+
+def main(unused_argv):
+    from data import dataset as dataset_lib
+    from data import datasets  # pylint: disable=unused-import
+    from metrics.activation_stats import ActivationStats
+    from tasks import task as task_lib
+
+    cfg = FLAGS.config
+    assert cfg.eval.get('ref_stats_dir', ''), 'eval.ref_stats_dir must be provided'
+    if 'debug' not in cfg:
+        cfg.debug = 0
+
+    task = task_lib.TaskRegistry.lookup(cfg.task.name)(cfg)
+    evaluator = task._tfgan_evaluator  # pylint: disable=protected-access
+    if evaluator.has_ref_stats and not FLAGS.overwrite:
+        print(f'reference stats already exist: {evaluator.ref_stats_path}')
+        return
+
+    ds = dataset_lib.DatasetRegistry.lookup(cfg.dataset.name)(cfg)
+    input_fn = ds.pipeline(
+        process_single_example=task.preprocess_single,
+        global_batch_size=FLAGS.batch_size or cfg.eval.batch_size,
+        training=False,
+        validation=False,
+    )
+    dataset = input_fn(None)
+    clip_len = getattr(evaluator, 'clip_len', 0)
+
+    @tf.function
+    def get_real_stats(examples):
+        _, _, examples = task.preprocess_batched(examples, training=False)
+        data_real = task.get_real_data(examples)
+        assert data_real is not None, 'real data is not available in the dataset'
+        if clip_len > 0:
+            """the clips are cut and preprocessed by update_stats_from_videos"""
+            return data_real
+        data_real = evaluator.preprocess_inputs(data_real, is_n1p1=False)
+        return evaluator.get_inception_stats(data_real)
+
+    """same type of stats as the evaluator accumulates for the real data"""
+    evaluator.ref_stats = None
+    evaluator.reset()
+    ref_stats = evaluator.stats_real
+
+    start_t = time.time()
+    for batch_id, examples in enumerate(dataset):
+        if FLAGS.max_batches and batch_id >= FLAGS.max_batches:
+            break
+        if clip_len > 0:
+            evaluator.update_stats_from_videos(tf.unstack(get_real_stats(examples)), is_real=True)
+        else:
+            logits, pool = get_real_stats(examples)
+            ref_stats.update(logits, pool)
+        if (batch_id + 1) % 100 == 0:
+            print(f'{batch_id + 1} batches, {ref_stats.count} examples: {time.time() - start_t:.1f} s')
+
+    out_path = evaluator.save_ref_stats(ref_stats)
+    print(f'saved reference stats of {ref_stats.count} examples to {out_path} '
+          f'in {time.time() - start_t:.1f} s')
+
+
+if __name__ == '__main__':
+    app.run(main)
@@ -28,6 +28,8 @@ train_eval_config = D(
     save_suffix=[],
     pt=0,
     batch_size=16,
+    # compile the train step (forward, loss and gradients) or the model inference step with XLA
+    jit_compile=0,
 )
 train_config = D(
     check_ckpt=0,
@@ -41,6 +43,14 @@ train_config = D(
     freeze_decoder=0,
     freeze_encoder_decoder=0,
     val_epochs=0,
+    # number of micro-batches of batch_size whose gradients are summed before each optimizer step
+    grad_accum_steps=1,
+    # write checkpoints in a background thread from a host memory copy of the variables
+    async_ckpt=0,
+    # pack up to this many response sequences into each decoder row with block-diagonal attention masks
+    # so that the decoder runs on batch_size / pack_seqs rows; batches whose sequences do not all fit are
+    # decoded with one sequence per row and the fraction of batches that fit is logged as packed_frac
+    pack_seqs=0,
 )
 
 eval_config = D(
@@ -58,6 +68,8 @@ eval_config = D(
     save_mask=1,
     save_vis=0,
     save_csv=1,
+    # also save the columns of each csv file to a npz file with the same name
+    save_npz=0,
     profile=0,
     run_existing=1,
     remote='',
@@ -72,6 +84,22 @@ eval_config = D(
     defer=0.,
     tag='eval',
     checkpoint_dir='',  # checkpoint_dir will be model_dir if not set.
+    # evaluate up to this many pending checkpoints together with one model instance each so that
+    # the eval dataset is decoded and preprocessed only once for all of them
+    multi_ckpt=0,
+    # run inference on a raw video file with a rolling window of dataset.length frames
+    # instead of the eval dataset; see video_stream.py
+    stream=D(
+        video_path='',
+        # number of new frames between consecutive windows
+        stride=1,
+        # stop after this many frames if > 0
+        max_frames=0,
+        # compute the backbone features of each frame only once and reuse them in all the windows containing it;
+        # the backbone batch norm uses batch statistics so the features of each frame then depend on the other
+        # new frames read with it rather than on the other frames in each window
+        reuse_features=1,
+    ),
 )
 
 eval_config.update(train_eval_config)
@@ -85,10 +113,22 @@ base_config = D(
     eager=0,
     dyn_ram=1,
     debug=0,
+    # mixed precision policy: '', 'mixed_bfloat16' or 'mixed_float16' (with dynamic loss scaling)
+    mixed_precision='',
     resnet_replace=[],
     gpu='',
 
-    model= D(mhd=0,),
+    model= D(
+        mhd=0,
+        # recompute decoder / video encoder layer activations in the backward pass to save memory; the dropout,
+        # drop path and attention dropout masks are replayed from a per-call seed so the recomputed pass
+        # matches the forward pass, and layers with any other dropout are rejected
+        recompute_grad=0,
+        # greedy (top_k=1) inference uses speculative decoding with the first draft_layers decoder layers as the
+        # draft model proposing draft_len tokens per pass of the full decoder if draft_layers > 0
+        draft_layers=0,
+        draft_len=4,
+    ),
 
     model_dir='',
     eval_type='',
@@ -109,6 +109,8 @@ def get_config(config_str=None):
             top_k=0,
             top_p=0.4,
             temperature=1.0,
+            # keep only the class logits of each object after inference
+            presliced_logits=0,
             weight=1.0,
             # metric=D(name='coco_object_detection', ),
         ),
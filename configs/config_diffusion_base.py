@@ -77,6 +77,9 @@ def get_config(config_str=None):
           cond_dim=0,
           cond_proj=True,
           cond_decoupled_read=False,
+          # compute the cond projection, the cond frame tape of video and the position
+          # embeddings once per generate call instead of in every denoising step
+          cache_step_inputs=True,
       ),
   })
 
@@ -172,6 +175,7 @@ def get_config(config_str=None):
           normalize_noisy_input=False,
           time_scaling=1000,
           pretrained_ckpt='',
+          # ddim, ddpm, ddpm@small, heun or the multistep dpm++2m / dpm++3m that need far fewer iterations
           sampler_name='ddpm',
           conditional='class',
           self_cond='latent',
@@ -208,6 +212,10 @@ def get_config(config_str=None):
           end_lr_factor=0.0,
           ema_decay=0.9999,
           ema_name_exact_match=True,
+          # number of training steps between EMA updates
+          ema_every_n_steps=1,
+          # use min(ema_decay, (1 + step) / (10 + step)) as the decay early in training
+          ema_warmup=False,
           exclude_from_weight_decay='bias,beta,gamma',
       ),
 
@@ -226,6 +234,13 @@ def get_config(config_str=None):
           checkpoint_dir='',
           batch_size=64,
           steps=100,  # this is an approximation.
+          # dir of the real data FID / FVD stats from compute_ref_stats.py;
+          # real images are not run through the classifier when they exist
+          ref_stats_dir='',
+          # FVD on the clips of fvd_clip_len frames every fvd_clip_stride
+          # (fvd_clip_len if 0) frames of the eval videos if > 0
+          fvd_clip_len=0,
+          fvd_clip_stride=0,
       ),
   )
 
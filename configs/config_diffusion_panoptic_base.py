@@ -148,7 +148,11 @@ def get_config(config_str=None):
           min_pixels=40,
           metric=D(
               name='segmentation_and_tracking_quality',
-              results_dir=''
+              results_dir='',
+              # evaluate videos in parallel processes if > 1
+              num_workers=0,
+              # feed predictions to the metric directly instead of via pngs
+              streaming=0,
           ),
       ),
   }
@@ -193,12 +197,18 @@ def get_config(config_str=None):
           conditional='cat',
           iterations=100,
           iterations_2=100,  # only used in video inference where less iterations can be used for the 2nd frame onwards.
+          # ddim, ddpm, ddpm@small, heun or the multistep dpm++2m / dpm++3m that need far fewer iterations
           sampler='ddim',
           l_tile_factors=1,
           msize=msize,
           mask_weight_p=0.,
           self_cond_rate=0.5,
           self_cond_by_masking=False,
+          # cf guidance strength with image features zeroed for the unconditional denoising
+          guidance=0.,
+          # compute the denoiser input conv on the image features and cond maps once per image
+          # at inference instead of concatenating them with the samples in every step
+          cache_cond_in=True,
 
           # extra architecture
           image_size=image_size,
@@ -230,6 +240,10 @@ def get_config(config_str=None):
           eps=1e-8,
           ema_decay=0.9999,
           ema_name_exact_match=True,
+          # number of training steps between EMA updates
+          ema_every_n_steps=1,
+          # use min(ema_decay, (1 + step) / (10 + step)) as the decay early in training
+          ema_warmup=False,
           learning_rate_schedule='linear',
           learning_rate_scaling='none',
       ),
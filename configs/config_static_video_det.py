@@ -92,6 +92,7 @@ def get_config(config_str=None):
             top_k=0,
             top_p=0.4,
             temperature=1.0,
+            presliced_logits=0,
             weight=1.0,
         ),
     }
@@ -44,10 +44,12 @@ def update_task_config(cfg):
         task_config.train_transforms = transform_configs.get_video_detection_train_transforms(
             cfg.dataset.transforms,
             cfg.dataset.target_size,
-            image_size, length, max_disp, max_instances_per_image)
+            image_size, length, max_disp, max_instances_per_image,
+            cfg.dataset.get('uint8_images', False))
         task_config.eval_transforms = transform_configs.get_video_detection_eval_transforms(
             cfg.dataset.transforms,
-            image_size, length, max_instances_per_image_test)
+            image_size, length, max_instances_per_image_test,
+            cfg.dataset.get('uint8_images', False))
 
 
 def get_config(config_str=None):
@@ -92,6 +94,7 @@ def get_config(config_str=None):
             top_k=0,
             top_p=0.4,
             temperature=1.0,
+            presliced_logits=0,
             weight=1.0,
         ),
     }
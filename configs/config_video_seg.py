@@ -20,6 +20,7 @@ def update_task_config(cfg):
     max_seq_len = cfg.model.max_seq_len
     cfg.task.image_size = image_size
     rle_from_mask = cfg.dataset.rle_from_mask
+    uint8_images = cfg.dataset.get('uint8_images', False)
 
     """"update parameters that depend on image size but inexplicably missing from pretrained config files"""
     assert cfg.task.name == 'video_segmentation', f"invalid task name: {cfg.task.name}"
@@ -28,10 +29,10 @@ def update_task_config(cfg):
         task.image_size = image_size
 
         task.eval_transforms = transform_configs.get_video_segmentation_eval_transforms(
-            image_size, max_seq_len, rle_from_mask)
+            image_size, max_seq_len, rle_from_mask, uint8_images)
 
         task.train_transforms = transform_configs.get_video_segmentation_train_transforms(
-            image_size, max_seq_len, rle_from_mask)
+            image_size, max_seq_len, rle_from_mask, uint8_images)
 
 
 def get_config(config_str=None):
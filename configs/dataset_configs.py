@@ -38,6 +38,8 @@ def get_shared_det_data():
         cache_dataset=True,
 
         target_size=None,
+        # decode frames as uint8 and convert them to float after the geometric transforms
+        uint8_images=False,
 
         train_split='train',
         eval_split='validation',
@@ -147,6 +149,8 @@ def get_shared_seg_data():
         cache_dataset=True,
 
         target_size=None,
+        # decode frames as uint8 and convert them to float after the geometric transforms
+        uint8_images=False,
 
         train_name='',
         eval_name='',
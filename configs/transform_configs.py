@@ -217,6 +217,7 @@ def get_video_detection_train_transforms(
         length: int,
         max_disp: int,
         max_instances_per_image: int,
+        uint8_images: bool = False,
 ):
     # return get_video_detection_eval_transforms(
     #     image_size, length, max_instances_per_image)
@@ -295,6 +296,11 @@ def get_video_detection_train_transforms(
           inputs=instance_feature_names,
           max_instances=max_instances_per_image),
     ]
+    if uint8_images:
+        train_transforms.append(
+            D(name='convert_image_dtype_float32',
+              inputs=['video'])
+        )
     return train_transforms
 
 
@@ -303,10 +309,11 @@ def get_video_detection_eval_transforms(
         image_size: Tuple[int, int],
         length: int,
         max_instances_per_image: int,
+        uint8_images: bool = False,
 ):
     instance_feature_names = ['bbox', 'class_id', 'class_name',
                               'area', 'is_crowd']
-    return [
+    eval_transforms = [
         # D(name='record_original_video_size'),
         D(name='resize_video',
           inputs=['video'],
@@ -322,6 +329,12 @@ def get_video_detection_eval_transforms(
           inputs=instance_feature_names,
           max_instances=max_instances_per_image),
     ]
+    if uint8_images:
+        eval_transforms.append(
+            D(name='convert_image_dtype_float32',
+              inputs=['video'])
+        )
+    return eval_transforms
 
 def get_static_video_detection_train_transforms(
         cfg,
@@ -440,6 +453,7 @@ def get_video_segmentation_train_transforms(
         image_size: Tuple[int, int],
         max_seq_len,
         rle_from_mask,
+        uint8_images=False,
 ):
     train_transforms = [
         D(name='resize_video',
@@ -455,6 +469,11 @@ def get_video_segmentation_train_transforms(
               inputs=['rle', ],
               max_instances=max_seq_len),
         )
+    if uint8_images:
+        train_transforms.append(
+            D(name='convert_image_dtype_float32',
+              inputs=['video', ]),
+        )
     return train_transforms
 
 
@@ -462,6 +481,7 @@ def get_video_segmentation_eval_transforms(
         image_size: Tuple[int, int],
         max_seq_len,
         rle_from_mask,
+        uint8_images=False,
 ):
     train_transforms = [
         D(name='resize_video',
@@ -477,6 +497,11 @@ def get_video_segmentation_eval_transforms(
               inputs=['rle', ],
               max_instances=max_seq_len),
         )
+    if uint8_images:
+        train_transforms.append(
+            D(name='convert_image_dtype_float32',
+              inputs=['video', ]),
+        )
     return train_transforms
 
 
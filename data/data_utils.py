@@ -465,6 +465,41 @@ def reorder_object_instances(features, labels, order):
     return features, labels
 
 
+def resize_image(image, size, method=tf.image.ResizeMethod.BILINEAR,
+                 antialias=False, preserve_aspect_ratio=False):
+    """tf.image.resize that keeps uint8 images in uint8.
+
+    tf.image.resize returns float32 in the [0, 255] range for uint8 inputs
+    except with nearest neighbor, so the result is rounded and cast back.
+    The uint8 image is cast to float32 first since the float32 kernels are
+    faster than the uint8 ones. Float images are resized as usual.
+    """
+    if image.dtype != tf.uint8 or method == tf.image.ResizeMethod.NEAREST_NEIGHBOR:
+        return tf.image.resize(
+            image, size, method=method, antialias=antialias,
+            preserve_aspect_ratio=preserve_aspect_ratio)
+    resized = tf.image.resize(
+        tf.cast(image, tf.float32), size, method=method, antialias=antialias,
+        preserve_aspect_ratio=preserve_aspect_ratio)
+    # rounds half up and clips the overshoot of bicubic / lanczos
+    return tf.saturate_cast(resized + 0.5, tf.uint8)
+
+
+def pad_to_bounding_box_with_value(image, target_height, target_width, value):
+    """Pads image (.., h, w, c) on the bottom and right to the target size with value.
+
+    value is in [0, 1] and is scaled to [0, 255] and rounded for uint8 images.
+    """
+    if image.dtype == tf.uint8:
+        shape = tf.shape(image)
+        paddings = [[0, 0]] * (image.shape.rank - 3) + [
+            [0, target_height - shape[-3]], [0, target_width - shape[-2]], [0, 0]]
+        value = tf.cast(tf.round(value * 255.), tf.uint8)
+        return tf.pad(image, paddings, constant_values=value)
+    return value + tf.image.pad_to_bounding_box(
+        image - value, 0, 0, target_height, target_width)
+
+
 def random_resize(image, min_image_size, max_image_size, max_out_prob=0.,
                   resize_method=tf.image.ResizeMethod.BILINEAR,
                   antialias=False):
@@ -495,7 +530,7 @@ def random_resize(image, min_image_size, max_image_size, max_out_prob=0.,
     else:
         oh = size_longer_side
         ow = tf.cast(size_longer_side * w / h, tf.int32)
-    return tf.image.resize(
+    return resize_image(
         image, (oh, ow), method=resize_method, antialias=antialias)
 
 
@@ -533,7 +568,7 @@ def scale_jitter(image, min_scale, max_scale, target_height, target_width,
         random_scale_size[0] / input_size[0], random_scale_size[1] / input_size[1]
     )
     scaled_size = tf.cast(tf.multiply(input_size, scale), tf.int32)
-    scaled_image = tf.image.resize(
+    scaled_image = resize_image(
         image, tf.cast(scaled_size, tf.int32), method=interp)
     return scaled_image
 
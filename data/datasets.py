@@ -13,9 +13,25 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 # ==============================================================================
-"""All registered datasets."""
+"""All registered datasets.
 
-from data import coco  # pylint: disable=unused-import
-from data import ipsc  # pylint: disable=unused-import
-from data import ipsc_video  # pylint: disable=unused-import
-from data import ipsc_static_video  # pylint: disable=unused-import
+Each dataset module is only imported when its dataset name is looked up.
+"""
+
+from data import dataset as dataset_lib
+
+_DATASET_MODULES = {
+    'coco/2017_object_detection': 'data.coco',
+    'coco/2017_instance_segmentation': 'data.coco',
+    'coco/2017_keypoint_detection': 'data.coco',
+    'coco/2017_captioning': 'data.coco',
+    'ipsc_object_detection': 'data.ipsc',
+    'ipsc_semantic_segmentation': 'data.ipsc',
+    'ipsc_instance_segmentation': 'data.ipsc',
+    'ipsc_video_detection': 'data.ipsc_video',
+    'ipsc_video_segmentation': 'data.ipsc_video',
+    'ipsc_static_video_detection': 'data.ipsc_static_video',
+    'ipsc_static_video_segmentation': 'data.ipsc_static_video',
+}
+for _name, _module in _DATASET_MODULES.items():
+    dataset_lib.DatasetRegistry.register_lazy(_name, _module)
@@ -109,11 +109,15 @@ def get_feature_map_for_captioning():
     }
 
 
-def decode_image(example, key='image/encoded'):
-    """Decodes the image and set its static shape."""
+def decode_image(example, key='image/encoded', dtype=tf.float32):
+    """Decodes the image and set its static shape.
+
+    With dtype uint8 the decoded image is returned as is so that it can go
+    through the geometric transforms before being converted to float.
+    """
     image = tf.io.decode_image(example[key], channels=3)
     image.set_shape([None, None, 3])
-    image = tf.image.convert_image_dtype(image, tf.float32)
+    image = tf.image.convert_image_dtype(image, dtype)
     return image
 
 
@@ -1,5 +1,6 @@
 import os.path
 
+from data import data_utils
 from data import dataset as dataset_lib
 from data import decode_utils
 import utils
@@ -85,11 +86,14 @@ class IPSCVideoDetectionTFRecordDataset(tf_record.TFRecordDataset):
         frames.set_shape([length, None, None, 3])
         # frames.set_shape([None, None, None, 3])
 
-        frames = tf.image.convert_image_dtype(frames, tf.float32)
+        # with uint8_images, frames stay uint8 through the geometric transforms and the last
+        # transform converts them to float
+        if not self.config.get('uint8_images', False):
+            frames = tf.image.convert_image_dtype(frames, tf.float32)
 
         target_size = self.config.target_size
         if target_size is not None:
-            frames = tf.image.resize(
+            frames = data_utils.resize_image(
                 frames, target_size, method='bilinear',
                 antialias=False, preserve_aspect_ratio=False)
         # area = bbox = None
@@ -220,9 +224,10 @@ class IPSCVideoSegmentationTFRecordDataset(tf_record.TFRecordDataset):
         filenames = []
         frame_ids = []
         image_ids = []
+        image_dtype = tf.uint8 if self.config.get('uint8_images', False) else tf.float32
         for _id in range(self.config.length):
             image = decode_utils.decode_image(
-                example, f'video/frame-{_id}/encoded')
+                example, f'video/frame-{_id}/encoded', dtype=image_dtype)
             images.append(image)
 
             filename = example[f'video/frame-{_id}/filename']
@@ -125,7 +125,7 @@ class ResizeImage(Transform):
                     example[k], self.config.target_size, method="nearest",
                     antialias=False, preserve_aspect_ratio=p_ar)
             else:
-                example[k] = tf.image.resize(
+                example[k] = data_utils.resize_image(
                     example[k], self.config.target_size, method=resize_method,
                     antialias=antialias, preserve_aspect_ratio=p_ar)
         return example
@@ -164,7 +164,7 @@ class RandomScale(Transform):
                     example[k], tf.cast(scaled_size, tf.int32),
                     method="nearest", antialias=False)
             else:
-                example[k] = tf.image.resize(
+                example[k] = data_utils.resize_image(
                     example[k], tf.cast(scaled_size, tf.int32),
                     method=resize_method, antialias=antialias)
         return example
@@ -217,7 +217,7 @@ class ScaleJitter(Transform):
                     example[k], tf.cast(scaled_size, tf.int32),
                     method="nearest", antialias=False)
             else:
-                example[k] = tf.image.resize(
+                example[k] = data_utils.resize_image(
                     example[k], tf.cast(scaled_size, tf.int32),
                     method=resize_method, antialias=antialias)
         return example
@@ -392,6 +392,8 @@ class RandomColorJitter(Transform):
         if self.config.get('color_jitter_strength', 0) > 0:
             clip_min, clip_max = self.config.get('clip_by_value', (0., 1.))
             for k in self.config.inputs:
+                if example[k].dtype != tf.float32:  # photometric so uint8 is converted here
+                    example[k] = tf.image.convert_image_dtype(example[k], tf.float32)
                 example[k] = data_utils.random_color_jitter(
                     example[k], strength=self.config.color_jitter_strength,
                     impl='simclrv2')
@@ -550,8 +552,8 @@ class PadImageToMaxSize(Transform):
                 example['unpadded_image_size'] = tf.shape(unpadded_image)[-3:-1]
                 height = tf.shape(unpadded_image)[0]
                 width = tf.shape(unpadded_image)[1]
-            example[k] = backgrnd_val_ + tf.image.pad_to_bounding_box(
-                unpadded_image - backgrnd_val_, 0, 0, target_size[0], target_size[1])
+            example[k] = data_utils.pad_to_bounding_box_with_value(
+                unpadded_image, target_size[0], target_size[1], backgrnd_val_)
 
         # Adjust the coordinate fields.
         object_coordinate_keys = self.config.get('object_coordinate_keys', [])
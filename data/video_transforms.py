@@ -70,7 +70,7 @@ class ResizeVideo(Transform):
 
         for k, resize_method, antialias, p_ar in zip(
                 self.config.inputs, resize_methods, antialias_list, preserve_ar):
-            example[k] = tf.image.resize(
+            example[k] = data_utils.resize_image(
                 example[k],
                 size=self.config.target_size, method=resize_method,
                 antialias=antialias, preserve_aspect_ratio=p_ar)
@@ -110,7 +110,7 @@ class ScaleJitterVideo(Transform):
         for k, resize_method, antialias in zip(self.config.inputs,
                                                resize_methods, antialias_list):
             video = example_out[k]
-            resized_video = tf.image.resize(
+            resized_video = data_utils.resize_image(
                 video, scaled_size,
                 method=resize_method, antialias=antialias)
             example_out[k] = resized_video
@@ -236,12 +236,11 @@ class PadVideoToMaxSize(Transform):
                 height = unpadded_video_size[0]
                 width = unpadded_video_size[1]
 
-            example_out[k] = backgrnd_val_ + tf.image.pad_to_bounding_box(
-                unpadded_video - backgrnd_val_,
-                offset_height=0,
-                offset_width=0,
+            example_out[k] = data_utils.pad_to_bounding_box_with_value(
+                unpadded_video,
                 target_height=target_size[0],
-                target_width=target_size[1]
+                target_width=target_size[1],
+                value=backgrnd_val_,
             )
 
         # example_out['pad_video_to_max_size'] = target_size
@@ -0,0 +1,197 @@
+# coding=utf-8
+# Copyright 2022 The Pix2Seq Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Streaming statistics of classifier activations for FID / FVD and IS."""
+
+import os
+
+import numpy as np
+
+
+def get_ref_stats_filename(stats_name, dataset_name, split, image_size,
+                           resize_method, antialias):
+  """Name of the reference stats file of a dataset split for one metric config."""
+  if isinstance(split, (list, tuple)):
+    split = "+".join(split)
+  key = [stats_name, dataset_name, split, "size_{}".format(image_size),
+         resize_method, "aa" if antialias else "no_aa"]
+  return "_".join(str(k).replace(os.sep, "-") for k in key) + ".npz"
+
+
+def _log_softmax(logits):
+  logits = logits - np.max(logits, axis=-1, keepdims=True)
+  return logits - np.log(np.sum(np.exp(logits), axis=-1, keepdims=True))
+
+
+class StreamingMoments(object):
+  """Running mean and covariance of activations with batched Welford updates.
+
+  Only the count, the mean and the sum of squared deviations from the mean are
+  kept so memory does not grow with the number of samples. Accumulators from
+  different workers can be combined with `merge`.
+  """
+
+  def __init__(self):
+    self.count = 0
+    self.mean = None
+    self.m2 = None
+
+  def _merge_moments(self, count, mean, m2):
+    if not count:
+      return
+    if not self.count:
+      self.count, self.mean, self.m2 = count, mean.copy(), m2.copy()
+      return
+    if mean.shape != self.mean.shape:
+      raise ValueError("activation dimensions do not match: {} vs {}".format(
+          mean.shape, self.mean.shape))
+    total = self.count + count
+    delta = mean - self.mean
+    self.mean += delta * (count / total)
+    self.m2 += m2 + np.outer(delta, delta) * (self.count * count / total)
+    self.count = total
+
+  def update(self, act):
+    """Adds a batch of activations of shape (n, d)."""
+    act = np.asarray(act, dtype=np.float64)
+    if act.ndim != 2:
+      raise ValueError("Expected input to have 2 axes")
+    if not act.shape[0]:
+      return
+    mean = np.mean(act, axis=0)
+    centered = act - mean
+    self._merge_moments(act.shape[0], mean, centered.T.dot(centered))
+
+  def merge(self, other):
+    self._merge_moments(other.count, other.mean, other.m2)
+
+  def to_dict(self, prefix):
+    return {prefix + "count": np.asarray(self.count),
+            prefix + "mean": self.mean, prefix + "m2": self.m2}
+
+  @classmethod
+  def from_dict(cls, arrays, prefix):
+    moments = cls()
+    moments.count = int(arrays[prefix + "count"])
+    moments.mean = np.asarray(arrays[prefix + "mean"], dtype=np.float64)
+    moments.m2 = np.asarray(arrays[prefix + "m2"], dtype=np.float64)
+    return moments
+
+  def mean_and_cov(self):
+    """Same statistics as `fid.get_stats_for_fid` on all the activations."""
+    if self.count < 2:
+      raise ValueError("at least 2 samples are needed for the covariance")
+    return self.mean.copy(), self.m2 / (self.count - 1)
+
+
+class StreamingClassifierScore(object):
+  """Running sums for the Inception score of classifier logits.
+
+  The score is exp(E_x[KL(p(y|x) || p(y))]) and the expectation splits into
+  E_x[sum_y p(y|x) log p(y|x)] - sum_y p(y) log p(y), so only the sum of the
+  negative entropies and the per-class sums of p(y|x) are needed.
+  """
+
+  def __init__(self):
+    self.count = 0
+    self.neg_entropy_sum = 0.
+    self.prob_sum = None
+
+  def update(self, logits):
+    """Adds a batch of logits of shape (n, num_classes)."""
+    logits = np.asarray(logits, dtype=np.float64)
+    if logits.ndim != 2:
+      raise ValueError("Expected input to have 2 axes")
+    log_p = _log_softmax(logits)
+    p = np.exp(log_p)
+    prob_sum = np.sum(p, axis=0)
+    self.count += logits.shape[0]
+    self.neg_entropy_sum += np.sum(p * log_p)
+    self.prob_sum = prob_sum if self.prob_sum is None else self.prob_sum + prob_sum
+
+  def merge(self, other):
+    if not other.count:
+      return
+    self.count += other.count
+    self.neg_entropy_sum += other.neg_entropy_sum
+    self.prob_sum = (other.prob_sum.copy() if self.prob_sum is None
+                     else self.prob_sum + other.prob_sum)
+
+  def to_dict(self, prefix):
+    return {prefix + "count": np.asarray(self.count),
+            prefix + "neg_entropy_sum": np.asarray(self.neg_entropy_sum),
+            prefix + "prob_sum": self.prob_sum}
+
+  @classmethod
+  def from_dict(cls, arrays, prefix):
+    score = cls()
+    score.count = int(arrays[prefix + "count"])
+    score.neg_entropy_sum = float(arrays[prefix + "neg_entropy_sum"])
+    score.prob_sum = np.asarray(arrays[prefix + "prob_sum"], dtype=np.float64)
+    return score
+
+  def score(self):
+    marginal = self.prob_sum / self.count
+    log_marginal = np.log(np.maximum(marginal, np.finfo(np.float64).tiny))
+    mean_kl = self.neg_entropy_sum / self.count - np.sum(marginal * log_marginal)
+    return np.exp(mean_kl)
+
+
+class ActivationStats(object):
+  """Streaming statistics of the logits and pool activations of one side (real or generated).
+
+  Keeps the moments of the pool activations for FID, the Inception score sums
+  of the logits and optionally the moments of the logits as well (FVD).
+  """
+
+  def __init__(self, logits_moments=False):
+    self.pool = StreamingMoments()
+    self.classifier_score = StreamingClassifierScore()
+    self.logits = StreamingMoments() if logits_moments else None
+
+  @property
+  def count(self):
+    return self.pool.count
+
+  def update(self, logits, pool):
+    logits = np.asarray(logits)
+    self.pool.update(pool)
+    self.classifier_score.update(logits)
+    if self.logits is not None:
+      self.logits.update(logits)
+
+  def merge(self, other):
+    self.pool.merge(other.pool)
+    self.classifier_score.merge(other.classifier_score)
+    if self.logits is not None:
+      self.logits.merge(other.logits)
+
+  def save(self, fout):
+    """Writes the stats to a file object as npz."""
+    arrays = self.pool.to_dict("pool_")
+    arrays.update(self.classifier_score.to_dict("is_"))
+    if self.logits is not None:
+      arrays.update(self.logits.to_dict("logits_"))
+    np.savez(fout, **arrays)
+
+  @classmethod
+  def load(cls, fin):
+    arrays = dict(np.load(fin))
+    stats = cls(logits_moments="logits_count" in arrays)
+    stats.pool = StreamingMoments.from_dict(arrays, "pool_")
+    stats.classifier_score = StreamingClassifierScore.from_dict(arrays, "is_")
+    if stats.logits is not None:
+      stats.logits = StreamingMoments.from_dict(arrays, "logits_")
+    return stats
@@ -21,6 +21,8 @@ from absl import logging
 import numpy as np
 import tensorflow as tf
 import tensorflow_gan as tfgan
+from metrics.activation_stats import ActivationStats
+from metrics.activation_stats import get_ref_stats_filename
 
 
 def get_stats_for_fid(act):
@@ -71,12 +73,16 @@ class TFGANMetricEvaluator:
   activations_key: str = "pool_3"
   resize_method: str = "bilinear"
   antialias: bool = False
+  # Reference stats of the real data are loaded from this dir if available so
+  # the real images do not need to go through Inception in each eval step.
+  split: str = ""
+  ref_stats_dir: str = ""
+
+  stats_name = "fid"
 
   def __post_init__(self):
-    self.all_logits_real = []
-    self.all_pool3_real = []
-    self.all_logits_gen = []
-    self.all_pool3_gen = []
+    self.ref_stats = self.load_ref_stats()
+    self.reset()
     self.dataset_stats_mean, self.dataset_stats_cov = self.load_fid_stats()
 
   def load_fid_stats(self, stats_path=None):
@@ -113,6 +119,38 @@ class TFGANMetricEvaluator:
                    stats_real.shape[0])
       return get_stats_for_fid(stats_real)
 
+  @property
+  def ref_stats_path(self):
+    if not self.ref_stats_dir:
+      return None
+    return "{}/{}".format(self.ref_stats_dir, get_ref_stats_filename(
+        self.stats_name, self.dataset_name, self.split, self.image_size,
+        self.resize_method, self.antialias))
+
+  @property
+  def has_ref_stats(self):
+    return self.ref_stats is not None
+
+  def load_ref_stats(self):
+    """Load the real data stats computed by compute_ref_stats.py if available."""
+    path = self.ref_stats_path
+    if path is None or not tf.io.gfile.exists(path):
+      return None
+    with tf.io.gfile.GFile(path, "rb") as fin:
+      ref_stats = ActivationStats.load(fin)
+    logging.info("loaded reference stats of %d examples from %s",
+                 ref_stats.count, path)
+    return ref_stats
+
+  def save_ref_stats(self, stats):
+    path = self.ref_stats_path
+    tf.io.gfile.makedirs(self.ref_stats_dir)
+    with tf.io.gfile.GFile(path, "wb") as fout:
+      stats.save(fout)
+    logging.info("saved reference stats of %d examples to %s",
+                 stats.count, path)
+    return path
+
   def preprocess_inputs(self, inputs, is_n1p1=False):
     """Resize images and shift/clip pixels to [-1, 1]."""
     if isinstance(inputs, list):
@@ -138,35 +176,52 @@ class TFGANMetricEvaluator:
     stats = tfgan.eval.run_inception(inputs)
     return stats["logits"], stats["pool_3"]
 
+  def get_real_and_gen_stats(self, data_real, data_gen, is_n1p1=False):
+    """Logits and pool activations of the real and generated data.
+
+    The real data is skipped if reference stats are available and its
+    activations are returned as empty batches.
+    """
+    if self.has_ref_stats:
+      data_gen = self.preprocess_inputs(data_gen, is_n1p1=is_n1p1)
+      logits_gen, pool3_gen = self.get_inception_stats(data_gen)
+      return (logits_gen[:0], pool3_gen[:0]), (logits_gen, pool3_gen)
+    data_real, data_gen = self.preprocess_inputs(
+        [data_real, data_gen], is_n1p1=is_n1p1)
+    return self.get_inception_stats([data_real, data_gen])
+
   def update_stats(self, logits_real, pool3_real, logits_gen, pool3_gen):
-    self.all_logits_real.append(logits_real)
-    self.all_pool3_real.append(pool3_real)
-    self.all_logits_gen.append(logits_gen)
-    self.all_pool3_gen.append(pool3_gen)
+    if not self.has_ref_stats:
+      self.stats_real.update(logits_real, pool3_real)
+    self.stats_gen.update(logits_gen, pool3_gen)
+
+  def merge(self, other):
+    """Merge the stats accumulated by another evaluator, e.g. on another worker."""
+    if not self.has_ref_stats:
+      self.stats_real.merge(other.stats_real)
+    self.stats_gen.merge(other.stats_gen)
 
   def reset(self):
-    self.all_logits_real.clear()
-    self.all_pool3_real.clear()
-    self.all_logits_gen.clear()
-    self.all_pool3_gen.clear()
+    # Running statistics instead of all the activations so memory stays
+    # constant and the work is spread over the eval steps.
+    self.stats_real = self.ref_stats or ActivationStats()
+    self.stats_gen = ActivationStats()
     return
 
   def compute_fid_score(self):
     """Return a dict of metrics."""
     metrics = {}
     logging.info("Computing Inception score.")
-    all_logits_gen = np.concatenate(self.all_logits_gen, axis=0)
     logging.info("IS number of gen samples: %d, number of classes: %d",
-                 all_logits_gen.shape[0], all_logits_gen.shape[1])
-    is_score = tfgan.eval.classifier_score_from_logits(all_logits_gen)
+                 self.stats_gen.count,
+                 self.stats_gen.classifier_score.prob_sum.shape[0])
+    is_score = self.stats_gen.classifier_score.score()
     metrics.update({"inception_score": is_score})
     logging.info("Computing FID score.")
-    all_stats_real = np.concatenate(self.all_pool3_real, axis=0)
-    all_stats_gen = np.concatenate(self.all_pool3_gen, axis=0)
-    logging.info("FID number of real samples: %d", all_stats_real.shape[0])
-    logging.info("FID number of generated samples: %d", all_stats_gen.shape[0])
-    gen_mean, gen_cov = get_stats_for_fid(all_stats_gen)
-    ref_mean, ref_cov = get_stats_for_fid(all_stats_real)
+    logging.info("FID number of real samples: %d", self.stats_real.count)
+    logging.info("FID number of generated samples: %d", self.stats_gen.count)
+    gen_mean, gen_cov = self.stats_gen.pool.mean_and_cov()
+    ref_mean, ref_cov = self.stats_real.pool.mean_and_cov()
     metrics.update({
         "fid_batch": get_fid_score(gen_mean, gen_cov, ref_mean, ref_cov),
     })
@@ -21,12 +21,12 @@ from functools import partial
 from absl import logging
 from jax.experimental import jax2tf
 import numpy as np
+from metrics.activation_stats import ActivationStats
 from metrics.fid import get_fid_score
-from metrics.fid import get_stats_for_fid
 from metrics.fid import TFGANMetricEvaluator
+from metrics import video_clips
 
 import tensorflow as tf
-import tensorflow_gan as tfgan
 from universal_diffusion.metrics import c3d
 from universal_diffusion.metrics import i3d
 
@@ -37,12 +37,18 @@ class FVDMetricEvaluator(TFGANMetricEvaluator):
   dataset_name: str
   image_size: int = -1
   activations_key: str = 'pool_3'
+  # Frames are resized to frame_size x frame_size for the network if > 0.
+  frame_size: int = -1
+  # FVD is computed on the clips of clip_len frames starting every clip_stride
+  # (clip_len if 0) frames of the videos instead of on the whole videos if > 0.
+  clip_len: int = 0
+  clip_stride: int = 0
+
+  stats_name = 'fvd'
 
   def __post_init__(self):
-    self.all_logits_real = []
-    self.all_pool3_real = []
-    self.all_logits_gen = []
-    self.all_pool3_gen = []
+    self.ref_stats = self.load_ref_stats()
+    self.reset()
     self.dataset_stats_mean, self.dataset_stats_cov = self.load_fid_stats()
 
     if self.dataset_name == 'ucf101':
@@ -68,6 +74,19 @@ class FVDMetricEvaluator(TFGANMetricEvaluator):
       logging.warn('Dataset %s stats not found!', self.dataset_name)
       return None, None
 
+  @property
+  def ref_stats_path(self):
+    path = super().ref_stats_path
+    if path is None or self.clip_len <= 0:
+      return path
+    return '{}_clip_{}_{}.npz'.format(
+        path[:-len('.npz')], self.clip_len, self.clip_stride or self.clip_len)
+
+  def reset(self):
+    self.stats_real = self.ref_stats or ActivationStats(logits_moments=True)
+    self.stats_gen = ActivationStats(logits_moments=True)
+    return
+
   def preprocess_inputs(self, inputs, is_n1p1=False):
     if isinstance(inputs, list):
       all_inputs = tf.concat(inputs, 0)
@@ -77,8 +96,56 @@ class FVDMetricEvaluator(TFGANMetricEvaluator):
       inputs = tf.clip_by_value(inputs, -1.0, 1.0)
       inputs = (inputs + 1.0) / 2.0
     inputs = inputs * 255.0
+    if self.frame_size > 0:
+      inputs = self.resize_frames(inputs)
     return inputs
 
+  def resize_frames(self, frames):
+    """Resizes frames of shape (..., h, w, c) to frame_size."""
+    shape = tf.shape(frames)
+    frames = tf.reshape(frames, tf.concat([[-1], shape[-3:]], 0))
+    frames = tf.image.resize(
+        frames, [self.frame_size, self.frame_size], self.resize_method,
+        antialias=self.antialias)
+    return tf.reshape(frames, tf.concat(
+        [shape[:-3], [self.frame_size, self.frame_size], shape[-1:]], 0))
+
+  def update_stats_from_videos(self, videos, is_real, clip_len=0, stride=0,
+                               batch_size=8, max_clips=0, is_n1p1=False):
+    """Streams the clips of arbitrarily long videos into the stats.
+
+    Clips of clip_len frames are taken every stride frames of each video and
+    each frame is preprocessed once and shared by the overlapping clips so
+    that only a few clips are held in memory regardless of the video length.
+
+    Args:
+      videos: iterable of videos, each a (t, h, w, c) tensor or an iterable of
+        frames or chunks of frames that can be read lazily.
+      is_real: `bool` whether the videos are real or generated.
+      clip_len: `int` number of frames per clip; self.clip_len if 0.
+      stride: `int` number of frames between the starts of consecutive clips;
+        self.clip_stride or clip_len if 0.
+      batch_size: `int` number of clips per network call.
+      max_clips: `int` maximum number of clips per video or 0 for all.
+      is_n1p1: `bool` whether the frames are in [-1, 1] instead of [0, 1].
+
+    Returns:
+      number of clips.
+    """
+    clip_len = clip_len or self.clip_len
+    stride = stride or self.clip_stride or clip_len
+    assert clip_len > 0, 'clip_len must be provided'
+    if is_real and self.has_ref_stats:
+      logging.info('reference stats are used for the real videos.')
+      return 0
+    if not hasattr(self, '_clip_features_fn'):
+      self._clip_features_fn = tf.function(self.get_inception_stats)
+    stats = self.stats_real if is_real else self.stats_gen
+    return video_clips.accumulate_clip_stats(
+        videos, stats, self._clip_features_fn, batch_size,
+        clip_len=clip_len, stride=stride, max_clips=max_clips,
+        preprocess_fn=partial(self.preprocess_inputs, is_n1p1=is_n1p1))
+
   def get_inception_stats(self, inputs):
     if isinstance(inputs, list):
       return [self.get_inception_stats(x) for x in inputs]
@@ -92,23 +159,20 @@ class FVDMetricEvaluator(TFGANMetricEvaluator):
     """Return a dict of metrics."""
     metrics = {}
     logging.info('Computing Inception score.')
-    all_logits_gen = np.concatenate(self.all_logits_gen, axis=0)
-    all_logits_real = np.concatenate(self.all_logits_real, axis=0)
     logging.info('IS number of gen samples: %d, number of classes: %d',
-                 all_logits_gen.shape[0], all_logits_gen.shape[1])
-    is_score = tfgan.eval.classifier_score_from_logits(all_logits_gen)
+                 self.stats_gen.count,
+                 self.stats_gen.classifier_score.prob_sum.shape[0])
+    is_score = self.stats_gen.classifier_score.score()
     metrics.update({'inception_score': is_score})
 
     logging.info('Computing FVD score.')
-    all_stats_real = np.concatenate(self.all_pool3_real, axis=0)
-    all_stats_gen = np.concatenate(self.all_pool3_gen, axis=0)
-    logging.info('FVD number of real samples: %d', all_stats_real.shape[0])
-    logging.info('FVD number of generated samples: %d', all_stats_gen.shape[0])
-    gen_mean, gen_cov = get_stats_for_fid(all_stats_gen)
-    ref_mean, ref_cov = get_stats_for_fid(all_stats_real)
-
-    gen_logits_mean, gen_logits_cov = get_stats_for_fid(all_logits_gen)
-    ref_logits_mean, ref_logits_cov = get_stats_for_fid(all_logits_real)
+    logging.info('FVD number of real samples: %d', self.stats_real.count)
+    logging.info('FVD number of generated samples: %d', self.stats_gen.count)
+    gen_mean, gen_cov = self.stats_gen.pool.mean_and_cov()
+    ref_mean, ref_cov = self.stats_real.pool.mean_and_cov()
+
+    gen_logits_mean, gen_logits_cov = self.stats_gen.logits.mean_and_cov()
+    ref_logits_mean, ref_logits_cov = self.stats_real.logits.mean_and_cov()
 
     metrics.update({
         'fvd_pool_batch': get_fid_score(gen_mean, gen_cov, ref_mean, ref_cov),
@@ -15,4 +15,18 @@
 # ==============================================================================
 import registry
 
-MetricRegistry = registry.Registry()
\ No newline at end of file
+MetricRegistry = registry.Registry()
+
+# Modules that register each metric, only imported when the metric name is
+# looked up.
+_METRIC_MODULES = {
+    'coco_captioning': 'metrics.coco_metrics',
+    'coco_instance_segmentation': 'metrics.coco_metrics',
+    'coco_keypoint_detection': 'metrics.coco_metrics',
+    'coco_object_detection': 'metrics.coco_metrics',
+    'text_sacrebleu': 'metrics.text_metrics',
+    'davis_video_object_segmentation': 'metrics.vos_metrics',
+    'segmentation_and_tracking_quality': 'metrics.vps_metrics',
+}
+for _name, _module in _METRIC_MODULES.items():
+  MetricRegistry.register_lazy(_name, _module)
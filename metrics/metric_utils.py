@@ -13,6 +13,26 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 # ==============================================================================
+from concurrent import futures
+
+
+class BackgroundWriter(object):
+  """Runs file writes on a background thread so they overlap with evaluation."""
+
+  def __init__(self):
+    self._executor = futures.ThreadPoolExecutor(max_workers=1)
+    self._pending = []
+
+  def submit(self, fn, *args, **kwargs):
+    self._pending.append(self._executor.submit(fn, *args, **kwargs))
+
+  def flush(self):
+    """Waits for all the submitted writes and raises the first error if any."""
+    pending, self._pending = self._pending, []
+    for future in pending:
+      future.result()
+
+
 def yxyx_to_xywh(box):
   ymin, xmin, ymax, xmax = box
   w = xmax - xmin
@@ -20,7 +20,9 @@ https://github.com/google-research/deeplab2/blob/main/evaluation/depth_aware_seg
 """
 
 import collections
-from typing import Any, Dict, MutableMapping, Optional, Sequence, Text, Union
+from concurrent import futures
+import multiprocessing
+from typing import Any, Callable, Dict, MutableMapping, Optional, Sequence, Text, Tuple, Union
 
 import warnings
 
@@ -64,6 +66,61 @@ def _update_dict_stats(
         stat_dict[idx] = count * weight
 
 
+def _compute_iou(confusion_per_seq: Sequence[np.ndarray],
+                 include_indices: np.ndarray, confusion_matrix_size: int):
+  """Computes the mean IoU over all sequences and for each sequence."""
+  # Compute IoU scores.
+  # The rows correspond to ground-truth and the columns to predictions.
+  # Remove fp from confusion matrix for the void/ignore class.
+  iou_per_seq = [0] * len(confusion_per_seq)
+  total_confusion = np.zeros(
+      (confusion_matrix_size, confusion_matrix_size), dtype=np.float64)
+  for index, confusion in enumerate(confusion_per_seq):
+    confusion = np.array(confusion, dtype=np.float64)
+    removal_matrix = np.zeros_like(confusion)
+    removal_matrix[include_indices, :] = 1.0
+    confusion *= removal_matrix
+    total_confusion += confusion
+
+    # `intersections` corresponds to true positives.
+    intersections = confusion.diagonal()
+    fps = confusion.sum(axis=0) - intersections
+    fns = confusion.sum(axis=1) - intersections
+    unions = intersections + fps + fns
+
+    num_classes = np.count_nonzero(unions)
+    ious = (intersections.astype(np.double) /
+            np.maximum(unions, 1e-15).astype(np.double))
+    iou_per_seq[index] = np.sum(ious) / num_classes
+
+  # `intersections` corresponds to true positives.
+  intersections = total_confusion.diagonal()
+  fps = total_confusion.sum(axis=0) - intersections
+  fns = total_confusion.sum(axis=1) - intersections
+  unions = intersections + fps + fns
+
+  num_classes = np.count_nonzero(unions)
+  ious = (intersections.astype(np.double) /
+          np.maximum(unions, 1e-15).astype(np.double))
+  iou_mean = np.sum(ious) / num_classes
+  return iou_mean, iou_per_seq
+
+
+def _stq_result(aq_mean, iou_mean, aq_per_seq, iou_per_seq, id_per_seq,
+                length_per_seq) -> Dict[Text, Any]:
+  st_quality = np.sqrt(aq_mean * iou_mean)
+  st_quality_per_seq = np.sqrt(aq_per_seq * iou_per_seq)
+  return {'STQ': st_quality,
+          'AQ': aq_mean,
+          'IoU': float(iou_mean),
+          'STQ_per_seq': st_quality_per_seq,
+          'AQ_per_seq': aq_per_seq,
+          'IoU_per_seq': iou_per_seq,
+          'ID_per_seq': id_per_seq,
+          'Length_per_seq': length_per_seq,
+          }
+
+
 class STQuality(object):
   """Metric class for the Segmentation and Tracking Quality (STQ).
 
@@ -275,7 +332,6 @@ class STQuality(object):
     # Compute association quality (AQ)
     num_tubes_per_seq = [0] * len(self._ground_truth)
     aq_per_seq = [0] * len(self._ground_truth)
-    iou_per_seq = [0] * len(self._ground_truth)
     id_per_seq = [''] * len(self._ground_truth)
 
     for index, sequence_id in enumerate(self._ground_truth):
@@ -302,53 +358,252 @@ class STQuality(object):
     aq_mean = np.sum(aq_per_seq) / np.maximum(np.sum(num_tubes_per_seq), 1e-15)
     aq_per_seq = aq_per_seq / np.maximum(num_tubes_per_seq, 1e-15)
 
-    # Compute IoU scores.
-    # The rows correspond to ground-truth and the columns to predictions.
-    # Remove fp from confusion matrix for the void/ignore class.
-    total_confusion = np.zeros(
-        (self._confusion_matrix_size, self._confusion_matrix_size),
-        dtype=np.float64)
-    for index, confusion in enumerate(
-        self._iou_confusion_matrix_per_sequence.values()):
-      confusion = confusion.numpy()
-      removal_matrix = np.zeros_like(confusion)
-      removal_matrix[self._include_indices, :] = 1.0
-      confusion *= removal_matrix
-      total_confusion += confusion
-
-      # `intersections` corresponds to true positives.
-      intersections = confusion.diagonal()
-      fps = confusion.sum(axis=0) - intersections
-      fns = confusion.sum(axis=1) - intersections
-      unions = intersections + fps + fns
-
-      num_classes = np.count_nonzero(unions)
-      ious = (intersections.astype(np.double) /
-              np.maximum(unions, 1e-15).astype(np.double))
-      iou_per_seq[index] = np.sum(ious) / num_classes
+    iou_mean, iou_per_seq = _compute_iou(
+        [confusion.numpy() for confusion in
+         self._iou_confusion_matrix_per_sequence.values()],
+        self._include_indices, self._confusion_matrix_size)
 
-    # `intersections` corresponds to true positives.
-    intersections = total_confusion.diagonal()
-    fps = total_confusion.sum(axis=0) - intersections
-    fns = total_confusion.sum(axis=1) - intersections
-    unions = intersections + fps + fns
+    return _stq_result(aq_mean, iou_mean, aq_per_seq, iou_per_seq, id_per_seq,
+                       list(self._sequence_length.values()))
 
-    num_classes = np.count_nonzero(unions)
-    ious = (intersections.astype(np.double) /
-            np.maximum(unions, 1e-15).astype(np.double))
-    iou_mean = np.sum(ious) / num_classes
-
-    st_quality = np.sqrt(aq_mean * iou_mean)
-    st_quality_per_seq = np.sqrt(aq_per_seq * iou_per_seq)
-    return {'STQ': st_quality,
-            'AQ': aq_mean,
-            'IoU': float(iou_mean),
-            'STQ_per_seq': st_quality_per_seq,
-            'AQ_per_seq': aq_per_seq,
-            'IoU_per_seq': iou_per_seq,
-            'ID_per_seq': id_per_seq,
-            'Length_per_seq': list(self._sequence_length.values()),
-            }
+  def reset_states(self):
+    """Resets all states that accumulated data."""
+    self._iou_confusion_matrix_per_sequence = collections.OrderedDict()
+    self._predictions = collections.OrderedDict()
+    self._ground_truth = collections.OrderedDict()
+    self._intersections = collections.OrderedDict()
+    self._sequence_length = collections.OrderedDict()
+
+
+def _accumulate_areas(
+    stats: Tuple[np.ndarray, np.ndarray],
+    id_array: np.ndarray,
+    weights: Optional[np.ndarray] = None,
+) -> Tuple[np.ndarray, np.ndarray]:
+  """Adds the (weighted) pixel count of each id to a (sorted ids, areas) pair."""
+  ids, areas = stats
+  if weights is None:
+    weights = np.ones(id_array.size, dtype=np.float64)
+  else:
+    _check_weights(np.unique(weights).tolist())
+  ids, inverse = np.unique(
+      np.concatenate([ids, id_array]), return_inverse=True)
+  areas = np.bincount(inverse, weights=np.concatenate([areas, weights]),
+                      minlength=ids.size)
+  return ids, areas
+
+
+def _empty_areas() -> Tuple[np.ndarray, np.ndarray]:
+  return np.zeros([0], dtype=np.int64), np.zeros([0], dtype=np.float64)
+
+
+class STQualityNumpy(object):
+  """NumPy implementation of `STQuality`.
+
+  The per-sequence areas of the ground-truth, predicted and intersecting
+  segments are held as pairs of sorted int64 id and float64 area arrays and
+  accumulated with `np.unique` and `np.bincount` instead of per-id Python loops
+  over dicts of scalar tensors. `result()` gives the same values as `STQuality`.
+
+  Being free of tensors, instances can be pickled so that sequences can be
+  evaluated in separate processes and merged with `merge_state` (see
+  `evaluate_sequences_in_parallel`).
+  """
+
+  def __init__(self,
+               num_classes: int,
+               things_list: Sequence[int],
+               ignore_label: int,
+               max_instances_per_category: int,
+               offset: int,
+               name='stq'
+               ):
+    """Initialization of the STQ metric.
+
+    Args:
+      num_classes: Number of classes in the dataset as an integer.
+      things_list: A sequence of class ids that belong to `things`.
+      ignore_label: The class id to be ignored in evaluation as an integer.
+      max_instances_per_category: The maximum number of instances for each class
+        as an integer.
+      offset: The maximum number of unique labels as an integer.
+      name: An optional name. (default: 'st_quality')
+    """
+    self._name = name
+    self._num_classes = num_classes
+    self._ignore_label = ignore_label
+    self._things_list = list(things_list)
+    self._max_instances_per_category = max_instances_per_category
+    self._offset = offset
+
+    if ignore_label >= num_classes:
+      self._confusion_matrix_size = num_classes + 1
+      self._include_indices = np.arange(self._num_classes)
+    else:
+      self._confusion_matrix_size = num_classes
+      self._include_indices = np.array(
+          [i for i in range(num_classes) if i != self._ignore_label])
+
+    lower_bound = num_classes * max_instances_per_category
+    if offset < lower_bound:
+      raise ValueError('The provided offset %d is too small. No guarantess '
+                       'about the correctness of the results can be made. '
+                       'Please choose an offset that is higher than num_classes'
+                       ' * max_instances_per_category = %d' % lower_bound)
+    self.reset_states()
+
+  def get_config(self) -> Dict[Text, Any]:
+    """Returns the constructor arguments to create an empty copy of the metric."""
+    return dict(num_classes=self._num_classes,
+                things_list=self._things_list,
+                ignore_label=self._ignore_label,
+                max_instances_per_category=self._max_instances_per_category,
+                offset=self._offset,
+                name=self._name)
+
+  def update_state(self,
+                   y_true: np.ndarray,
+                   y_pred: np.ndarray,
+                   sequence_id: Union[int, str] = 0,
+                   weights: Optional[np.ndarray] = None):
+    """Accumulates the segmentation and tracking quality statistics.
+
+    Args:
+      y_true: The ground-truth panoptic label map for a particular video frame
+        (defined as semantic_map * max_instances_per_category + instance_map).
+      y_pred: The predicted panoptic label map for a particular video frame
+        (defined as semantic_map * max_instances_per_category + instance_map).
+      sequence_id: The optional ID of the sequence the frames belong to. When no
+        sequence is given, all frames are considered to belong to the same
+        sequence (default: 0).
+      weights: The weights for each pixel with the same shape of `y_true`.
+    """
+    y_true = np.asarray(y_true, dtype=np.int64).reshape([-1])
+    y_pred = np.asarray(y_pred, dtype=np.int64).reshape([-1])
+    if weights is not None:
+      weights = np.asarray(weights, dtype=np.float64).reshape([-1])
+    semantic_label = y_true // self._max_instances_per_category
+    semantic_prediction = y_pred // self._max_instances_per_category
+    # Check if the ignore value is outside the range [0, num_classes]. If yes,
+    # map `_ignore_label` to `_num_classes`, so it can be used to create the
+    # confusion matrix.
+    if self._ignore_label > self._num_classes:
+      semantic_label = np.where(semantic_label != self._ignore_label,
+                                semantic_label, self._num_classes)
+      semantic_prediction = np.where(
+          semantic_prediction != self._ignore_label, semantic_prediction,
+          self._num_classes)
+
+    if sequence_id not in self._iou_confusion_matrix_per_sequence:
+      self._iou_confusion_matrix_per_sequence[sequence_id] = np.zeros(
+          (self._confusion_matrix_size, self._confusion_matrix_size),
+          dtype=np.float64)
+      self._predictions[sequence_id] = _empty_areas()
+      self._ground_truth[sequence_id] = _empty_areas()
+      self._intersections[sequence_id] = _empty_areas()
+      self._sequence_length[sequence_id] = 0
+
+    self._iou_confusion_matrix_per_sequence[sequence_id] += np.bincount(
+        semantic_label * self._confusion_matrix_size + semantic_prediction,
+        weights=weights,
+        minlength=self._confusion_matrix_size ** 2).reshape(
+            (self._confusion_matrix_size, self._confusion_matrix_size))
+    self._sequence_length[sequence_id] += 1
+
+    instance_label = y_true % self._max_instances_per_category
+
+    label_mask = np.isin(semantic_label, self._things_list)
+    prediction_mask = np.isin(semantic_prediction, self._things_list)
+
+    # Select the `crowd` region of the current class. This region is encoded
+    # instance id `0`.
+    is_crowd = np.logical_and(instance_label == 0, label_mask)
+    # Select the non-crowd region of the corresponding class as the `crowd`
+    # region is ignored for the tracking term.
+    label_mask = np.logical_and(label_mask, np.logical_not(is_crowd))
+    # Do not punish id assignment for regions that are annotated as `crowd` in
+    # the ground-truth.
+    prediction_mask = np.logical_and(prediction_mask, np.logical_not(is_crowd))
+    non_crowd_intersection = np.logical_and(label_mask, prediction_mask)
+
+    # Compute and update areas of ground-truth, predictions and intersections.
+    self._predictions[sequence_id] = _accumulate_areas(
+        self._predictions[sequence_id], y_pred[prediction_mask],
+        weights[prediction_mask] if weights is not None else None)
+    self._ground_truth[sequence_id] = _accumulate_areas(
+        self._ground_truth[sequence_id], y_true[label_mask],
+        weights[label_mask] if weights is not None else None)
+    intersection_ids = (
+        y_true[non_crowd_intersection] * self._offset +
+        y_pred[non_crowd_intersection])
+    self._intersections[sequence_id] = _accumulate_areas(
+        self._intersections[sequence_id], intersection_ids,
+        weights[non_crowd_intersection] if weights is not None else None)
+
+  def merge_state(self, metrics: Sequence['STQualityNumpy']):
+    """Merges the results of multiple STQualityNumpy metrics.
+
+    Only metrics with unique sequences are supported, like
+    `STQuality.merge_state`.
+
+    Args:
+      metrics: A sequence of STQualityNumpy objects with unique sequences.
+
+    Raises:
+      ValueError: If a sequence is re-used between different metrics, or is
+        already in this metric.
+    """
+    # pylint: disable=protected-access
+    for metric in metrics:
+      for sequence in metric._ground_truth.keys():
+        if sequence in self._ground_truth:
+          raise ValueError('Tried to merge metrics with duplicate sequences.')
+        self._ground_truth[sequence] = metric._ground_truth[sequence]
+        self._predictions[sequence] = metric._predictions[sequence]
+        self._intersections[sequence] = metric._intersections[sequence]
+        self._iou_confusion_matrix_per_sequence[sequence] = (
+            metric._iou_confusion_matrix_per_sequence[sequence])
+        self._sequence_length[sequence] = metric._sequence_length[sequence]
+    # pylint: enable=protected-access
+
+  def result(self) -> Dict[Text, Any]:
+    """Computes the segmentation and tracking quality.
+
+    Returns:
+      The same dictionary as `STQuality.result`.
+    """
+    # Compute association quality (AQ)
+    num_tubes_per_seq = [0] * len(self._ground_truth)
+    aq_per_seq = [0] * len(self._ground_truth)
+    id_per_seq = [''] * len(self._ground_truth)
+
+    for index, sequence_id in enumerate(self._ground_truth):
+      gt_ids, gt_sizes = self._ground_truth[sequence_id]
+      pr_ids, pr_sizes = self._predictions[sequence_id]
+      intersection_ids, tpa = self._intersections[sequence_id]
+      num_tubes_per_seq[index] = gt_ids.size
+      id_per_seq[index] = sequence_id
+
+      # Intersections only come from pixels in both the ground-truth and the
+      # prediction masks so both of their ids are always found.
+      gt_index = np.searchsorted(gt_ids, intersection_ids // self._offset)
+      pr_index = np.searchsorted(pr_ids, intersection_ids % self._offset)
+      fpa = pr_sizes[pr_index] - tpa
+      fna = gt_sizes[gt_index] - tpa
+      inner_sums = np.bincount(
+          gt_index, weights=tpa * (tpa / (tpa + fpa + fna)),
+          minlength=gt_ids.size)
+      aq_per_seq[index] = np.sum(inner_sums / gt_sizes)
+
+    aq_mean = np.sum(aq_per_seq) / np.maximum(np.sum(num_tubes_per_seq), 1e-15)
+    aq_per_seq = aq_per_seq / np.maximum(num_tubes_per_seq, 1e-15)
+
+    iou_mean, iou_per_seq = _compute_iou(
+        list(self._iou_confusion_matrix_per_sequence.values()),
+        self._include_indices, self._confusion_matrix_size)
+
+    return _stq_result(aq_mean, iou_mean, aq_per_seq, iou_per_seq, id_per_seq,
+                       list(self._sequence_length.values()))
 
   def reset_states(self):
     """Resets all states that accumulated data."""
@@ -357,3 +612,40 @@ class STQuality(object):
     self._ground_truth = collections.OrderedDict()
     self._intersections = collections.OrderedDict()
     self._sequence_length = collections.OrderedDict()
+
+
+def _evaluate_sequence(metric_config: Dict[Text, Any],
+                       sequence_fn: Callable[..., None],
+                       sequence_args: Sequence[Any]) -> STQualityNumpy:
+  metric = STQualityNumpy(**metric_config)
+  sequence_fn(metric, *sequence_args)
+  return metric
+
+
+def evaluate_sequences_in_parallel(
+    metric: STQualityNumpy,
+    sequence_fn: Callable[..., None],
+    sequence_args: Sequence[Sequence[Any]],
+    num_workers: int):
+  """Evaluates sequences in a process pool and merges them into `metric`.
+
+  Args:
+    metric: STQualityNumpy that the per-sequence metrics are merged into.
+    sequence_fn: picklable (module-level) function called in the worker as
+      `sequence_fn(sequence_metric, *args)` for each `args` in `sequence_args`
+      which must call `sequence_metric.update_state` for all frames of a single
+      sequence.
+    sequence_args: arguments for `sequence_fn`, one entry per sequence.
+    num_workers: number of worker processes.
+  """
+  metric_config = metric.get_config()
+  # spawn rather than fork since the parent has usually initialized tensorflow.
+  mp_context = multiprocessing.get_context('spawn')
+  with futures.ProcessPoolExecutor(
+      max_workers=num_workers, mp_context=mp_context) as executor:
+    sequence_metrics = list(executor.map(
+        _evaluate_sequence,
+        [metric_config] * len(sequence_args),
+        [sequence_fn] * len(sequence_args),
+        sequence_args))
+  metric.merge_state(sequence_metrics)
@@ -0,0 +1,143 @@
+# coding=utf-8
+# Copyright 2022 The Pix2Seq Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Streaming clips of long videos for FVD."""
+
+import collections
+
+import tensorflow as tf
+
+
+class FrameCache(object):
+  """Preprocessed frames of the last clip_len frames of a video.
+
+  Each frame is preprocessed once when it is added and shared by all the
+  overlapping clips that contain it.
+  """
+
+  def __init__(self, clip_len):
+    self.frames = collections.deque(maxlen=clip_len)
+
+  def __len__(self):
+    return len(self.frames)
+
+  def add(self, frame):
+    self.frames.append(frame)
+
+  def clip(self):
+    return tf.stack(list(self.frames))
+
+
+def iter_chunks(frames, chunk_size):
+  """Chunks of at most chunk_size frames of a video.
+
+  frames is a video tensor of shape (t, h, w, c) or an iterable of frames of
+  shape (h, w, c) or chunks of frames of shape (n, h, w, c).
+  """
+  if tf.is_tensor(frames) or hasattr(frames, 'shape'):
+    frames = tf.convert_to_tensor(frames)
+    for start in range(0, int(frames.shape[0]), chunk_size):
+      yield frames[start:start + chunk_size]
+    return
+  pending, n_pending = [], 0
+  for chunk in frames:
+    chunk = tf.convert_to_tensor(chunk)
+    if chunk.shape.rank == 3:
+      chunk = chunk[tf.newaxis]
+    pending.append(chunk)
+    n_pending += int(chunk.shape[0])
+    while n_pending >= chunk_size:
+      chunk = tf.concat(pending, 0)
+      yield chunk[:chunk_size]
+      pending, n_pending = [chunk[chunk_size:]], n_pending - chunk_size
+  if n_pending:
+    yield tf.concat(pending, 0)
+
+
+def iter_clips(frames, clip_len, stride, preprocess_fn=None, max_clips=0):
+  """Clips of clip_len frames starting every stride frames of a video.
+
+  Args:
+    frames: a video tensor of shape (t, h, w, c) or an iterable of frames or
+      chunks of frames so that arbitrarily long videos can be read lazily.
+    clip_len: `int` number of frames in each clip.
+    stride: `int` number of frames between the starts of consecutive clips.
+    preprocess_fn: applied to each chunk of frames read from the video before
+      they are cached.
+    max_clips: `int` maximum number of clips or 0 for all of them.
+
+  Yields:
+    clips of shape (clip_len, h', w', c'); the trailing frames that do not fill
+      a complete clip are dropped. Only the frames of the current clip and one
+      chunk of clip_len frames are held in memory at a time.
+  """
+  assert clip_len > 0 and stride > 0, (clip_len, stride)
+  cache = FrameCache(clip_len)
+  n_clips = 0
+  frame_id = 0
+  for chunk in iter_chunks(frames, clip_len):
+    chunk_ids = range(frame_id, frame_id + int(chunk.shape[0]))
+    frame_id += len(chunk_ids)
+    # Frames in the gaps between clips when stride > clip_len are never
+    # preprocessed.
+    keep = [i for i, k in enumerate(chunk_ids) if k % stride < clip_len]
+    if not keep:
+      continue
+    if len(keep) < len(chunk_ids):
+      chunk = tf.gather(chunk, keep)
+    if preprocess_fn is not None:
+      chunk = preprocess_fn(chunk)
+    for i, frame in zip(keep, tf.unstack(chunk)):
+      cache.add(frame)
+      clip_start = chunk_ids[i] - clip_len + 1
+      if clip_start >= 0 and clip_start % stride == 0:
+        yield cache.clip()
+        n_clips += 1
+        if max_clips and n_clips >= max_clips:
+          return
+
+
+def iter_clip_batches(videos, batch_size, **clip_kwargs):
+  """Batches of clips from an iterable of videos, see iter_clips."""
+  batch = []
+  for video in videos:
+    for clip in iter_clips(video, **clip_kwargs):
+      batch.append(clip)
+      if len(batch) == batch_size:
+        yield tf.stack(batch)
+        batch = []
+  if batch:
+    yield tf.stack(batch)
+
+
+def accumulate_clip_stats(videos, stats, feature_fn, batch_size, **clip_kwargs):
+  """Adds the features of all the clips of videos to the streaming stats.
+
+  Args:
+    videos: iterable of videos as in iter_clips.
+    stats: `ActivationStats` to update.
+    feature_fn: function from a batch of clips to (logits, pool) features.
+    batch_size: `int` number of clips per feature_fn call.
+    **clip_kwargs: clip_len, stride, preprocess_fn and max_clips of iter_clips.
+
+  Returns:
+    number of clips.
+  """
+  n_clips = 0
+  for clips in iter_clip_batches(videos, batch_size, **clip_kwargs):
+    logits, pool = feature_fn(clips)
+    stats.update(logits, pool)
+    n_clips += int(clips.shape[0])
+  return n_clips
@@ -26,6 +26,7 @@ import pandas as pd
 import PIL
 import utils
 from metrics import metric_registry
+from metrics import metric_utils
 import tensorflow as tf
 
 _PALETTE = [
@@ -51,11 +52,30 @@ class DavisVideoObjectSegmentationMetric():
         task=config.dataset.vos_task,
         gt_set=('train' if config.dataset.eval_split == 'train' else 'val'),
         use_tfds=False)
+    # DAVISEvaluation only reads png files, so in streaming mode the pngs are
+    # encoded on a background writer and written straight to the directory
+    # that is evaluated.
+    self.streaming = config.task.metric.get('streaming', 0)
     self.reset_states()
 
   def reset_states(self):
     self.metric_values = None
     self._local_pred_dir_obj = tempfile.TemporaryDirectory()
+    if self.streaming:
+      self._writer = metric_utils.BackgroundWriter()
+
+  def _pred_dir(self, step):
+    if self.streaming and self.results_dir is not None:
+      return os.path.join(self.results_dir, str(step))
+    return os.path.join(self._local_pred_dir_obj.name, str(step))
+
+  def _write_prediction(self, prediction, filepath):
+    pred_image = PIL.Image.fromarray(prediction, mode='L')
+    pred_image.putpalette(_PALETTE)
+    with io.BytesIO() as out:
+      pred_image.save(out, format='PNG')
+      with tf.io.gfile.GFile(filepath, 'wb') as f:
+        f.write(out.getvalue())
 
   def record_prediction(self, predictions, video_name, frame_ids, step):
     """Records predictions.
@@ -68,22 +88,21 @@ class DavisVideoObjectSegmentationMetric():
       step: int. The checkpoint step, used to name sub-directories.
     """
     predictions = predictions[..., -1]  # Last channel is instance id.
-    subdir = os.path.join(self._local_pred_dir_obj.name, str(step), video_name)
+    subdir = os.path.join(self._pred_dir(step), video_name)
     if not tf.io.gfile.exists(subdir):
       tf.io.gfile.makedirs(subdir)
 
     for frame_id in frame_ids:
       filename = f'{frame_id:05}.png'
       filepath = os.path.join(subdir, filename)
-      pred_image = PIL.Image.fromarray(predictions[frame_id], mode='L')
-      pred_image.putpalette(_PALETTE)
-      with io.BytesIO() as out:
-        pred_image.save(out, format='PNG')
-        with tf.io.gfile.GFile(filepath, 'wb') as f:
-          f.write(out.getvalue())
+      if self.streaming:
+        self._writer.submit(self._write_prediction,
+                            predictions[frame_id].copy(), filepath)
+      else:
+        self._write_prediction(predictions[frame_id], filepath)
     logging.info('Done writing out pngs for %s', video_name)
 
-    if self.results_dir is not None:
+    if self.results_dir is not None and not self.streaming:
       # Copy images to results dir.
       results_dir = os.path.join(self.results_dir, str(step), video_name)
       utils.copy_dir(subdir, results_dir)
@@ -99,7 +118,9 @@ class DavisVideoObjectSegmentationMetric():
     Returns:
       dict from metric name to float value.
     """
-    result_path = os.path.join(self._local_pred_dir_obj.name, str(step))
+    if self.streaming:
+      self._writer.flush()
+    result_path = self._pred_dir(step)
     metrics_res = self.dataset_eval.evaluate(result_path)
     J, F = metrics_res['J'], metrics_res['F']  # pylint: disable=invalid-name
     g_measures = [
@@ -27,6 +27,7 @@ import pandas as pd
 import PIL
 import utils
 from metrics import metric_registry
+from metrics import metric_utils
 from metrics import segmentation_and_tracking_quality as stq
 import seaborn as sns
 from skimage import segmentation
@@ -133,6 +134,73 @@ def _in_list_of_lists(x, list_of_lists):
   return False
 
 
+class _InstanceIdRemapper(object):
+  """Postprocesses the instance ids of a video one frame at a time.
+
+  When new instances appear, they get assigned ids that have not been used in
+  previous frames.
+  """
+
+  def __init__(self, max_instances, num_cond_frames):
+    self.max_instances = max_instances
+    # Keep a map of original instance ids to processed instance ids.
+    self.id_map = np.zeros([max_instances], np.int32)
+    # 'used_ids' is the list of all used ids. 'recent_ids' are ids that
+    # appeared in the conditional frames. Only when an id appears in
+    # previous frames other than the conditional frames, we need to map it
+    # to a new id. Therefore we need to keep a running list of ids that
+    # appear in the conditional frames.
+    self.used_ids = [0]
+    self.recent_ids = collections.deque([[0]] * num_cond_frames,
+                                        num_cond_frames)
+
+  def __call__(self, instance_map):
+    # Update the id map.
+    ids = list(np.unique(instance_map))
+    for i in ids:
+      if self.id_map[i] == 0:
+        # the id hasn't appeared before.
+        self.id_map[i] = i
+        self.used_ids.append(i)
+      elif _in_list_of_lists(i, self.recent_ids):
+        # the id appeared in the conditional frames.
+        pass
+      else:
+        # the id is not in the conditional frames, but has been used.
+        new_id = _get_new_id(self.used_ids + ids, self.max_instances)
+        self.id_map[i] = new_id
+        self.used_ids.append(new_id)
+
+    self.recent_ids.append(ids)
+    # Update the instance map.
+    return self.id_map[instance_map]
+
+
+def _evaluate_video(stq_metric, annotation_dir, result_dir, video_name,
+                    video_id, panoptic_label_divisor, max_instances,
+                    num_cond_frames, postprocess_ins):
+  """Updates `stq_metric` with all frames of a single video."""
+  if postprocess_ins:
+    remap_instance_ids = _InstanceIdRemapper(max_instances, num_cond_frames)
+
+  # Frames are postprocessed in order since the instance ids depend on the
+  # previous frames.
+  for img in sorted(tf.io.gfile.listdir(os.path.join(result_dir, video_name))):
+    pred_file = os.path.join(result_dir, video_name, img)
+    gt_file = os.path.join(annotation_dir, video_name, img)
+    gt = _panoptic_map_from_rgb(gt_file, panoptic_label_divisor)
+
+    if postprocess_ins:
+      semantic_map, instance_map = _semantic_instance_maps_from_rgb(
+          pred_file, panoptic_label_divisor)
+      instance_map = remap_instance_ids(instance_map)
+      pred = _panoptic_map_from_semantic_instance_maps(
+          semantic_map, instance_map, panoptic_label_divisor)
+    else:
+      pred = _panoptic_map_from_rgb(pred_file, panoptic_label_divisor)
+    stq_metric.update_state(gt, pred, video_id)
+
+
 class STQEvaluation(object):
   """Evaluation class for the Segmentation and Tracking Quality (STQ)."""
 
@@ -143,8 +211,10 @@ class STQEvaluation(object):
                ignore_label: int,
                panoptic_label_divisor: int,
                max_instances: int,
-               num_cond_frames: int):
-    self.stq = stq.STQuality(
+               num_cond_frames: int,
+               num_workers: int = 0):
+    """num_workers > 1 evaluates the videos in that many parallel processes."""
+    self.stq = stq.STQualityNumpy(
         num_classes=num_classes,
         things_list=class_has_instances_list,
         ignore_label=ignore_label,
@@ -158,6 +228,8 @@ class STQEvaluation(object):
     }
     self.max_instances = max_instances
     self.num_cond_frames = num_cond_frames
+    self.num_workers = num_workers
+    self._remappers = {}
 
   def evaluate(self, result_dir: str, postprocess_ins: bool = True):
     """Evaluates STQ for a result directory.
@@ -172,60 +244,54 @@ class STQEvaluation(object):
       a dict of metric name to value.
     """
     # Loop through all videos in result dir.
-    for video_name in tf.io.gfile.listdir(result_dir):
-      video_id = self.video_name_to_id_map[video_name]
-
-      if postprocess_ins:
-        # Keep a map of original instance ids to processed instance ids.
-        id_map = np.zeros([self.max_instances], np.int32)
-        # 'used_ids' is the list of all used ids. 'recent_ids' are ids that
-        # appeared in the conditional frames. Only when an id appears in
-        # previous frames other than the conditional frames, we need to map it
-        # to a new id. Therefore we need to keep a running list of ids that
-        # appear in the conditional frames.
-        used_ids = [0]
-        recent_ids = collections.deque([[0]] * self.num_cond_frames,
-                                       self.num_cond_frames)
-
-      for img in tf.io.gfile.listdir(os.path.join(result_dir, video_name)):
-        pred_file = os.path.join(result_dir, video_name, img)
-        gt_file = os.path.join(self.annotation_dir, video_name, img)
-        gt = _panoptic_map_from_rgb(gt_file, self.panoptic_label_divisor)
-
-        if postprocess_ins:
-          semantic_map, instance_map = _semantic_instance_maps_from_rgb(
-              pred_file, self.panoptic_label_divisor)
-
-          # Update the id map.
-          ids = list(np.unique(instance_map))
-          for i in ids:
-            if id_map[i] == 0:
-              # the id hasn't appeared before.
-              id_map[i] = i
-              used_ids.append(i)
-            elif _in_list_of_lists(i, recent_ids):
-              # the id appeared in the conditional frames.
-              pass
-            else:
-              # the id is not in the conditional frames, but has been used.
-              new_id = _get_new_id(used_ids + ids, self.max_instances)
-              id_map[i] = new_id
-              used_ids.append(new_id)
-
-          recent_ids.append(ids)
-          # Update the instance map.
-          instance_map = id_map[instance_map]
-
-          pred = _panoptic_map_from_semantic_instance_maps(
-              semantic_map, instance_map, self.panoptic_label_divisor)
-        else:
-          pred = _panoptic_map_from_rgb(pred_file, self.panoptic_label_divisor)
-        self.stq.update_state(gt, pred, video_id)
+    video_args = [
+        (self.annotation_dir, result_dir, video_name,
+         self.video_name_to_id_map[video_name], self.panoptic_label_divisor,
+         self.max_instances, self.num_cond_frames, postprocess_ins)
+        for video_name in sorted(tf.io.gfile.listdir(result_dir))]
+
+    if self.num_workers > 1:
+      stq.evaluate_sequences_in_parallel(
+          self.stq, _evaluate_video, video_args, self.num_workers)
+    else:
+      for args in video_args:
+        _evaluate_video(self.stq, *args)
+
+    return self.stq.result()
+
+  def update_video_frame(self, video_name: str, frame_id: int,
+                         semantic_map: np.ndarray, instance_map: np.ndarray,
+                         postprocess_ins: bool = True):
+    """Evaluates a predicted frame directly without going through a file.
+
+    Frames of a video must be passed in order since the instance ids are
+    postprocessed online like in `evaluate`.
 
+    Args:
+      video_name: str, name of the video in the annotation dir.
+      frame_id: int, the frame id.
+      semantic_map: int of shape (h, w) with the original class ids.
+      instance_map: int of shape (h, w).
+      postprocess_ins: bool, whether to postprocess instance ids like in
+        `evaluate`.
+    """
+    gt_file = os.path.join(self.annotation_dir, video_name, f'{frame_id:06}.png')
+    gt = _panoptic_map_from_rgb(gt_file, self.panoptic_label_divisor)
+    if postprocess_ins:
+      if video_name not in self._remappers:
+        self._remappers[video_name] = _InstanceIdRemapper(
+            self.max_instances, self.num_cond_frames)
+      instance_map = self._remappers[video_name](instance_map)
+    pred = _panoptic_map_from_semantic_instance_maps(
+        semantic_map, instance_map, self.panoptic_label_divisor)
+    self.stq.update_state(gt, pred, self.video_name_to_id_map[video_name])
+
+  def result(self):
     return self.stq.result()
 
   def reset_states(self):
     self.stq.reset_states()
+    self._remappers = {}
 
 
 @metric_registry.MetricRegistry.register('segmentation_and_tracking_quality')
@@ -246,22 +312,35 @@ class STQMetric(object):
         ignore_label=config.dataset.ignore_label,
         panoptic_label_divisor=config.dataset.panoptic_label_divisor,
         max_instances=config.task.max_instances_per_image,
-        num_cond_frames=len(config.task.proceeding_frames.split(',')))
+        num_cond_frames=len(config.task.proceeding_frames.split(',')),
+        num_workers=config.task.metric.get('num_workers', 0))
+    # Feed predictions straight to the accumulator instead of writing them to
+    # files and reading them back for evaluation.
+    self.streaming = config.task.metric.get('streaming', 0)
     self.reset_states()
 
   def reset_states(self):
     self.metric_values = None
     self.eval.reset_states()
+    if self.streaming:
+      # Files are only written to results_dir, in the background.
+      self._writer = metric_utils.BackgroundWriter()
+      return
     # For saving predictions for metric evaluation.
     self._local_pred_dir_obj = tempfile.TemporaryDirectory()
     # For saving visualization images.
     self._panoptic_local_vis_dir_obj = tempfile.TemporaryDirectory()
 
+  def _to_original_semantic_map(self, semantic_map):
+    # Change semantic ids back to the original class ids, and 0 back to 255
+    # which is to be ignored.
+    return np.where(semantic_map == 0,
+                    self.config.dataset.ignore_label, semantic_map - 1)
+
   def _write_predictions(self, frame_id, semantic_map, instance_map, outdir):
     # When saving output for evaluation, change semantic ids back to the
-    # original class ids, and 0 back to 255 which is to be ignored.
-    semantic_map = np.where(semantic_map == 0,
-                            self.config.dataset.ignore_label, semantic_map - 1)
+    # original class ids.
+    semantic_map = self._to_original_semantic_map(semantic_map)
     output_file = os.path.join(outdir, f'{frame_id:06}.png')
     _panoptic_map_to_rgb(semantic_map, instance_map, output_file)
 
@@ -290,6 +369,11 @@ class STQMetric(object):
       frame_ids: list of int, or 1-d np.array. Frame ids of predictions.
       step: int. The checkpoint step, used to name sub-directories.
     """
+    if self.streaming:
+      self._record_prediction_streaming(predictions, video_name, frame_ids,
+                                        step)
+      return
+
     pred_dir = os.path.join(self._local_pred_dir_obj.name, str(step),
                             video_name)
     if not tf.io.gfile.exists(pred_dir):
@@ -321,6 +405,36 @@ class STQMetric(object):
 
     logging.info('Done writing out pngs for %s', video_name)
 
+  def _record_prediction_streaming(self, predictions, video_name, frame_ids,
+                                   step):
+    """Evaluates predictions directly, writing them out in the background."""
+    if self.results_dir is not None:
+      vis_dir = os.path.join(self.results_dir, str(step), video_name)
+      pred_dir = os.path.join(self.results_dir, 'pred', video_name)
+      for out_dir in [vis_dir, pred_dir]:
+        if not tf.io.gfile.exists(out_dir):
+          tf.io.gfile.makedirs(out_dir)
+
+    for fid, id_maps in zip(frame_ids, predictions):
+      sem_map, ins_map = id_maps[..., 0], id_maps[..., 1]
+
+      # Same maps as those read back from the png files.
+      semantic_map = self._to_original_semantic_map(sem_map).astype(
+          np.uint8).astype(np.int32)
+      self.eval.update_video_frame(video_name, fid, semantic_map,
+                                   ins_map.astype(np.int32))
+
+      if self.results_dir is not None:
+        # Copies since `predictions` may be reused by the caller. The
+        # visualization draws boundaries in place, so it goes last.
+        sem_map, ins_map = sem_map.copy(), ins_map.copy()
+        self._writer.submit(self._write_predictions, fid, sem_map, ins_map,
+                            pred_dir)
+        self._writer.submit(self._write_visualizations, fid, sem_map, ins_map,
+                            vis_dir)
+
+    logging.info('Done evaluating %s', video_name)
+
   def _evaluate(self, step):
     """Evaluates with predictions for all images.
 
@@ -332,8 +446,12 @@ class STQMetric(object):
     Returns:
       dict from metric name to float value.
     """
-    result_path = os.path.join(self._local_pred_dir_obj.name, str(step))
-    stq_metric = self.eval.evaluate(result_path)
+    if self.streaming:
+      self._writer.flush()
+      stq_metric = self.eval.result()
+    else:
+      result_path = os.path.join(self._local_pred_dir_obj.name, str(step))
+      stq_metric = self.eval.evaluate(result_path)
 
     if self.results_dir is not None:
       # Write metrics to result_dir.
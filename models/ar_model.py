@@ -110,6 +110,9 @@ class Model(tf.keras.models.Model):
             pos_encoding=config.pos_encoding_dec,
             shared_embedding=config.shared_decoder_embedding,
             output_bias=config.decoder_output_bias,
+            recompute_grad=config.recompute_grad,
+            draft_layers=config.get('draft_layers', 0),
+            draft_len=config.get('draft_len', 4),
             name='ar_decoder')
 
         if self.freeze_decoder or self.freeze_encoder_decoder:
@@ -143,7 +146,7 @@ class Model(tf.keras.models.Model):
         encoded = self.proj_ln(self.proj(encoded))
         # Add (optional) positional embedding to encoded visual units.
         if config.dec_proj_mode != 'linear':
-            vis_pos_emb = tf.expand_dims(self.vis_pos_emb, 0)
+            vis_pos_emb = tf.cast(tf.expand_dims(self.vis_pos_emb, 0), encoded.dtype)
             if config.use_cls_token:
                 encoded = encoded + tf.concat(
                     [tf.zeros_like(vis_pos_emb[:, :1]), vis_pos_emb], 1)
@@ -156,7 +159,7 @@ class Model(tf.keras.models.Model):
         return encoded
 
     def call(self, images, seq,
-             training=True):  # pytype: disable=signature-mismatch  # overriding-parameter-count-checks
+             training=True, packing=None):  # pytype: disable=signature-mismatch  # overriding-parameter-count-checks
         """Model function call for *training*.
 
         Args:
@@ -164,14 +167,22 @@ class Model(tf.keras.models.Model):
           seq: `int` sequence visible to the model of shape (bsz, seqlen),
             or (bsz, instances, seqlen) if there are multiple sequences per image.
           training: `bool` indicator.
+          packing: optional output of `model_utils.get_packing` for the
+            (bsz * instances) sequences to pack several of them into each
+            decoder row.
 
         Returns:
-          logits for each predicted tokens of (bsz * instances, seqlen, vocab_size).
+          logits for each predicted tokens of (bsz * instances, seqlen, vocab_size)
+            or (n_rows, seqlen, vocab_size) if packing is given.
         """
         with tf.name_scope(''):  # for other functions to have the same name scope.
             encoded = self._encode_images(images, training)
             encoded, seq = self._tile_vis_output(encoded, seq)
-            logits = self.decoder(seq, encoded, training)
+            if packing is not None:
+                seq = model_utils.pack_seqs(seq, packing)
+                encoded, enc_segment_ids = model_utils.pack_encoded(encoded, packing)
+                packing = dict(packing, enc_segment_ids=enc_segment_ids)
+            logits = self.decoder(seq, encoded, training, packing=packing)
 
             if not self.is_inited:
                 model_utils.get_params_counts(self)
@@ -255,6 +266,9 @@ class ARTrainer(model_lib.Trainer):
             'accuracy_notpad': tf.keras.metrics.SparseCategoricalAccuracy(
                 'accuracy_notpad'),
         })
+        if config.train.get('pack_seqs', 0) > 1:
+            """fraction of the batches whose sequences all fit into the packed decoder rows"""
+            self._metrics['packed_frac'] = tf.keras.metrics.Mean('packed_frac')
 
         self._val_metrics.update({
             'loss_notpad': tf.keras.metrics.Mean('loss_notpad'),
@@ -403,12 +417,43 @@ class ARTrainer(model_lib.Trainer):
         token_weights = utils.flatten_batch_dims(token_weights, out_rank=2)
         token_weights = utils.tf_float32(token_weights)
 
+        packing = None
+        pack_seqs = self.config.train.get('pack_seqs', 0)
+        if pack_seqs > 1 and not validation:
+            """
+            several sequences share each decoder row with only their first padding token so that 
+            far fewer of the decoded tokens are padding
+            """
+            bsz, seq_len = utils.shape_as_list(target_seq)
+            n_rows = -(-bsz // pack_seqs)
+            lengths = model_utils.get_seq_lengths(target_seq)
+            packing = model_utils.get_packing(lengths, seq_len, n_rows, pack_seqs)
+            """
+            the packed rows only hold the tokens up to the first padding token so the rest are left out of 
+            the loss whether or not the batch is packed
+            """
+            in_seq = tf.range(seq_len)[tf.newaxis, :] < lengths[:, tf.newaxis]
+            token_weights = tf.where(in_seq, token_weights, tf.zeros_like(token_weights))
+            self._metrics['packed_frac'].update_state(tf.cast(packing['fits'], tf.float32))
+
         is_padding = tf.equal(target_seq, 0)  # padding tokens.
         token_weights_notpad = tf.where(
             is_padding, tf.zeros_like(token_weights), token_weights)
 
         image = examples["image"]
-        logits = self.model(image, input_seq)
+        if packing is not None:
+            """
+            batches whose sequences do not all fit into the packed rows are decoded with one sequence per row 
+            instead of dropping the ones that do not fit; the packed logits are unpacked so that both give 
+            logits of the same shape
+            """
+            logits = tf.cond(
+                packing['fits'],
+                lambda: model_utils.unpack_seqs(self.model(image, input_seq, packing=packing), packing),
+                lambda: self.model(image, input_seq))
+        else:
+            logits = self.model(image, input_seq)
+        logits = tf.cast(logits, tf.float32)
         losses = model_utils.get_loss(
             logits, target_seq, self.config.train.loss_type)
         loss = tf.reduce_sum(losses * token_weights) / (
@@ -419,13 +464,10 @@ class ARTrainer(model_lib.Trainer):
         # update metrics
         y_mask = tf.greater(token_weights_notpad, 0)
         """
-        flatten tokens from all batch samples into a single sequence
-        each sequence might have different length so maintaining a 
-        batch-wise shape is not possible
+        padding tokens are excluded through sample weights rather than boolean_mask so that 
+        all shapes stay static and the loss can be compiled with XLA
         """
-        y_true_unbatched = tf.boolean_mask(target_seq, y_mask)
-        y_pred_logits_unbatched = tf.boolean_mask(logits, y_mask)
-        y_mask = tf.greater(token_weights_notpad, 0)
+        y_weights = tf.cast(y_mask, tf.float32)
         y_correct = model_utils.get_val_metrics(
             target_seq, logits, y_mask)
 
@@ -442,15 +484,17 @@ class ARTrainer(model_lib.Trainer):
         if validation:
             self._val_metrics['loss_notpad'].update_state(loss_notpad)
             self._val_metrics['accuracy_notpad'].update_state(
-                y_true_unbatched,
-                y_pred_logits_unbatched,
+                target_seq,
+                logits,
+                sample_weight=y_weights,
             )
             self._val_metrics['correct_pc'].update_state(y_correct)
         else:
             self._metrics['loss_notpad'].update_state(loss_notpad)
             self._metrics['accuracy_notpad'].update_state(
-                y_true_unbatched,
-                y_pred_logits_unbatched,
+                target_seq,
+                logits,
+                sample_weight=y_weights,
             )
             # if self.config.debug:
             #     from tasks.visualization import vis_utils
@@ -513,6 +557,9 @@ class ModelT(Model):
             pos_encoding=config.pos_encoding_dec,
             shared_embedding=config.shared_decoder_embedding,
             output_bias=config.decoder_output_bias,
+            recompute_grad=config.recompute_grad,
+            draft_layers=config.get('draft_layers', 0),
+            draft_len=config.get('draft_len', 4),
             name='ar_decoder')
 
     def _encode_images(self, images, training):
@@ -16,8 +16,11 @@
 """The diffusion utils."""
 import functools
 import math
+import numpy as np
 import tensorflow as tf
 
+import utils
+
 
 def sqrt(x):
     return tf.math.sqrt(x)
@@ -32,6 +35,10 @@ class Scheduler(object):
             self.generate, sampler_name='ddim')
         self.sample_ddpm = functools.partial(
             self.generate, sampler_name='ddpm')
+        self.sample_dpmpp = functools.partial(
+            self.generate, sampler_name='dpm++2m')
+        self.sample_heun = functools.partial(
+            self.generate, sampler_name='heun')
 
     def get_time_transform(self, schedule_name):
         """Returns time transformation function according to schedule name."""
@@ -131,6 +138,9 @@ class Scheduler(object):
 
         Args:
           transition_f: `callable` function for producing transition variables.
+            With guidance, it is called once per iteration on the conditional and
+            unconditional samples stacked along the batch dim with drop_label set
+            to a (2 * bsz,) mask that is 1 for the unconditional half.
           iterations: `int` number of iterations for generation.
           samples_shape: `tuple` or `list` shape of samples, e.g., (bsz, h, w, 3).
           hidden_shapes: a `list` of shapes of hiddens from denoising network,
@@ -143,11 +153,14 @@ class Scheduler(object):
           self_cond: `str`.
           self_cond_decay: `float` decaying factor between 0 and 1.
           guidance: `float` for cf guidance strength.
-          sampler_name: `str`.
+          sampler_name: `str`, one of 'ddim', 'ddpm', 'ddpm@large', 'ddpm@small',
+            'dpm++2m', 'dpm++3m' (multistep DPM-Solver++ of 2nd / 3rd order) or
+            'heun' (2nd order with two transition_f evaluations per iteration).
 
         Returns:
           Generated samples in samples_shape.
         """
+        check_sampler_name(sampler_name)
         num_samples = samples_shape[0]
         ts = tf.ones([num_samples] + [1] * (len(samples_shape) - 1))
         get_step = lambda t: ts * (  # pylint: disable=g-long-lambda
@@ -165,6 +178,15 @@ class Scheduler(object):
             ctx = SelfCondHiddenContext(
                 self_cond, samples_shape, hidden_shapes, self_cond_decay)
         pred_out = ctx.init_denoise_out(samples_shape)
+
+        predict = functools.partial(
+            predict_with_guidance, transition_f, ctx, pred_type=pred_type,
+            x0_clip_fn=x0_clip_fn, guidance=guidance)
+
+        """data predictions and log-SNRs of the previous two iterations for the multistep solvers"""
+        solver_order = get_solver_order(sampler_name)
+        data_pred_hist = (tf.zeros_like(samples), tf.zeros_like(samples))
+        log_snr_hist = (tf.zeros_like(ts), tf.zeros_like(ts))
         for t in tf.range(iterations):
             t = tf.cast(t, tf.float32)
             time_step = get_step(t)
@@ -174,31 +196,404 @@ class Scheduler(object):
                                 'data_pred': data_pred,
                                 'noise_pred': noise_pred,
                                 'pred_type': pred_type})
-            if guidance == 0:
-                pred_out_nl = 0.
+            pred_out, noise_pred, data_pred = predict(samples, gamma)
+            if sampler_name.startswith('dpm++'):
+                """lower orders for the first iterations until there are enough previous predictions"""
+                order = tf.minimum(t + 1, solver_order)
+                samples = dpm_solver_pp_step(
+                    samples, gamma, gamma_prev,
+                    (data_pred,) + data_pred_hist, (get_log_snr(gamma),) + log_snr_hist, order)
+                data_pred_hist = (data_pred, data_pred_hist[0])
+                log_snr_hist = (get_log_snr(gamma), log_snr_hist[0])
+            elif sampler_name == 'heun':
+                samples_next = self.transition_step(
+                    samples=samples,
+                    data_pred=data_pred,
+                    noise_pred=noise_pred,
+                    gamma_now=gamma,
+                    gamma_prev=gamma_prev,
+                    sampler_name='ddim')
+                if t + 1 < iterations:
+                    """
+                    the correction is skipped in the last iteration since its samples are not used and
+                    gamma_prev can be 1 there
+                    """
+                    _, _, data_pred_next = predict(samples_next, gamma_prev)
+                    samples_next = heun_step(
+                        samples, data_pred, data_pred_next, gamma, gamma_prev)
+                samples = samples_next
             else:
-                pred_out_nl = transition_f(
-                    ctx.contextualized_inputs(samples), gamma, training=False,
-                    drop_label=True)
-                pred_out_nl = pred_out_nl[0] if isinstance(pred_out_nl, tuple) else (
-                    pred_out_nl)
-            pred_out_l = transition_f(
-                ctx.contextualized_inputs(samples), gamma, training=False)
-            pred_out = pred_out_l
-            pred_out_l = pred_out_l[0] if isinstance(pred_out_l, tuple) else (
-                pred_out_l)
-            pred_out_ = pred_out_l * (1 + guidance) - pred_out_nl * guidance
-            x0_eps = get_x0_eps(
-                samples, gamma, pred_out_, pred_type, x0_clip_fn, truncate_noise=True)
-            noise_pred, data_pred = x0_eps['noise_pred'], x0_eps['data_pred']
-            samples = self.transition_step(
+                samples = self.transition_step(
+                    samples=samples,
+                    data_pred=data_pred,
+                    noise_pred=noise_pred,
+                    gamma_now=gamma,
+                    gamma_prev=gamma_prev,
+                    sampler_name=sampler_name)
+        return data_pred
+
+
+def predict_with_guidance(transition_f, ctx, samples, gamma, pred_type,
+                          x0_clip_fn, guidance):
+    """Denoising output along with the data and noise predicted from it for samples at gamma.
+
+    Args:
+      transition_f: `callable` function for producing transition variables as in
+        Scheduler.generate.
+      ctx: self-conditioning context providing the inputs of transition_f.
+      samples: `float` tensor of current samples.
+      gamma: `float` tensor of gamma for the current samples.
+      pred_type: `str`, the output type of `transition_f`.
+      x0_clip_fn: function for clipping the data prediction.
+      guidance: `float` for cf guidance strength.
+
+    Returns:
+      the output of transition_f for the (conditional) samples, the noise
+      prediction and the data prediction.
+    """
+    if guidance == 0:
+        pred_out_nl = 0.
+        pred_out_l = transition_f(
+            ctx.contextualized_inputs(samples), gamma, training=False)
+    else:
+        """
+        a single forward on the conditional and unconditional samples stacked along the batch dim
+        instead of one forward for each
+        """
+        num_samples = tf.shape(samples)[0]
+        inputs = tf.nest.map_structure(
+            lambda x: tf.concat([x, x], 0), ctx.contextualized_inputs(samples))
+        drop_label = tf.concat(
+            [tf.zeros([num_samples]), tf.ones([num_samples])], 0)
+        pred_out_lnl = transition_f(
+            inputs, tf.concat([gamma, gamma], 0), training=False,
+            drop_label=drop_label)
+        pred_out_l = tf.nest.map_structure(
+            lambda x: tf.split(x, 2)[0], pred_out_lnl)
+        pred_out_nl = pred_out_lnl[0] if isinstance(pred_out_lnl, tuple) else (
+            pred_out_lnl)
+        pred_out_nl = tf.split(pred_out_nl, 2)[1]
+    pred_out = pred_out_l
+    pred_out_l = pred_out_l[0] if isinstance(pred_out_l, tuple) else (
+        pred_out_l)
+    pred_out_ = pred_out_l * (1 + guidance) - pred_out_nl * guidance
+    x0_eps = get_x0_eps(
+        samples, gamma, pred_out_, pred_type, x0_clip_fn, truncate_noise=True)
+    return pred_out, x0_eps['noise_pred'], x0_eps['data_pred']
+
+
+class RollingSampler(object):
+    """Sampler with a fixed-size pool of samples at different iterations.
+
+    Every tick advances all the samples in the pool by one iteration with a
+    single batched transition_f call. The samples that finish their last
+    iteration are returned and their slots are refilled with fresh noise for
+    the requests that are still pending, so the batch size of transition_f
+    stays at the pool size however small the requests are. Each slot follows
+    the same trajectory as Scheduler.generate from the same initial noise.
+    """
+
+    def __init__(self,
+                 scheduler,
+                 get_transition_f,
+                 iterations,
+                 samples_shape,
+                 sample_labels=None,
+                 hidden_shapes=None,
+                 pred_type='eps',
+                 schedule=None,
+                 td=0.,
+                 x0_clip='',
+                 self_cond='none',
+                 self_cond_decay=0.,
+                 guidance=0.,
+                 sampler_name='ddim'):
+        """Init function.
+
+        Args:
+          scheduler: `Scheduler` for the time transform and the noise.
+          get_transition_f: `callable` returning the transition_f of
+            Scheduler.generate for a tensor of labels of the pool (or None).
+          iterations: `int` number of iterations for each sample.
+          samples_shape: `tuple` or `list` shape of the pool of samples, e.g.,
+            (pool_size, h, w, 3).
+          sample_labels: `callable` returning labels of shape (pool_size, ...) for
+            the fresh samples or None for unconditional sampling.
+          hidden_shapes, pred_type, schedule, td, x0_clip, self_cond,
+            self_cond_decay, guidance: as in Scheduler.generate.
+          sampler_name: `str`, one of the samplers of Scheduler.generate except
+            'heun' whose two transition_f evaluations per iteration are at
+            different time steps.
+        """
+        check_sampler_name(sampler_name)
+        if sampler_name == 'heun':
+            raise ValueError('heun is not supported by the rolling sampler')
+        self._scheduler = scheduler
+        self._get_transition_f = get_transition_f
+        self._iterations = iterations
+        self._samples_shape = list(samples_shape)
+        self._pool_size = samples_shape[0]
+        self._sample_labels = sample_labels
+        self._pred_type = pred_type
+        self._td = td
+        self._x0_clip_fn = get_x0_clipping_function(x0_clip)
+        self._guidance = guidance
+        self._sampler_name = sampler_name
+        self._solver_order = get_solver_order(sampler_name)
+        self._time_transform = scheduler.time_transform if schedule is None else (
+            scheduler.get_time_transform(schedule))
+        if hidden_shapes is None:
+            self._make_ctx = functools.partial(
+                SelfCondEstimateContext, self_cond, samples_shape, self_cond_decay)
+        else:
+            self._make_ctx = functools.partial(
+                SelfCondHiddenContext, self_cond, samples_shape, hidden_shapes,
+                self_cond_decay)
+
+        self._num_pending = 0
+        self._active = np.zeros([self._pool_size], bool)
+        self._state = None
+        self._advance = tf.function(self._advance_fn)
+        self._refill = tf.function(self._refill_fn)
+
+    @property
+    def num_pending(self):
+        return self._num_pending
+
+    @property
+    def num_active(self):
+        return int(np.sum(self._active))
+
+    def submit(self, num_samples):
+        """Adds a request for num_samples samples."""
+        self._num_pending += num_samples
+
+    def _init_state(self):
+        """State of a pool of fresh samples."""
+        ctx = self._make_ctx()
+        samples = self._scheduler.sample_noise(self._samples_shape)
+        ts = tf.ones([self._pool_size] + [1] * (len(self._samples_shape) - 1))
+        state = {
+            'samples': samples,
+            'step': tf.zeros([self._pool_size], tf.int32),
+            'pred_out': ctx.init_denoise_out(self._samples_shape),
+            'noise_pred': tf.zeros_like(samples),
+            'data_pred': tf.zeros_like(samples),
+            'ctx': ctx.state,
+            'data_pred_hist': (tf.zeros_like(samples), tf.zeros_like(samples)),
+            'log_snr_hist': (tf.zeros_like(ts), tf.zeros_like(ts)),
+        }
+        if self._sample_labels is not None:
+            state['labels'] = self._sample_labels()
+        return state
+
+    def _refill_fn(self, state, refill):
+        """Replaces the state of the slots where refill is True with that of fresh samples."""
+        fresh = self._init_state()
+
+        def select(fresh_v, v):
+            mask = tf.reshape(refill, [-1] + [1] * (v.shape.rank - 1))
+            return tf.where(mask, fresh_v, v)
+
+        return tf.nest.map_structure(select, fresh, state)
+
+    def _advance_fn(self, state):
+        """One iteration for all the samples in the pool."""
+        samples = state['samples']
+        rank = len(self._samples_shape)
+        t = tf.minimum(state['step'], self._iterations - 1)
+        t = tf.reshape(tf.cast(t, tf.float32), [-1] + [1] * (rank - 1))
+        time_step = 1.0 - t / self._iterations
+        time_step_p = tf.maximum(1.0 - (t + 1 + self._td) / self._iterations, 0)
+        gamma = self._time_transform(time_step)
+        gamma_prev = self._time_transform(time_step_p)
+
+        ctx = self._make_ctx()
+        ctx.state = state['ctx']
+        ctx.update_context({'denoise_out': state['pred_out'],
+                            'data_pred': state['data_pred'],
+                            'noise_pred': state['noise_pred'],
+                            'pred_type': self._pred_type})
+        transition_f = self._get_transition_f(state.get('labels'))
+        pred_out, noise_pred, data_pred = predict_with_guidance(
+            transition_f, ctx, samples, gamma, self._pred_type,
+            self._x0_clip_fn, self._guidance)
+        data_pred_hist, log_snr_hist = state['data_pred_hist'], state['log_snr_hist']
+        if self._sampler_name.startswith('dpm++'):
+            order = tf.minimum(t + 1, self._solver_order)
+            samples = dpm_solver_pp_step(
+                samples, gamma, gamma_prev,
+                (data_pred,) + data_pred_hist, (get_log_snr(gamma),) + log_snr_hist, order)
+            data_pred_hist = (data_pred, data_pred_hist[0])
+            log_snr_hist = (get_log_snr(gamma), log_snr_hist[0])
+        else:
+            samples = self._scheduler.transition_step(
                 samples=samples,
                 data_pred=data_pred,
                 noise_pred=noise_pred,
                 gamma_now=gamma,
                 gamma_prev=gamma_prev,
-                sampler_name=sampler_name)
-        return data_pred
+                sampler_name=self._sampler_name)
+        state = dict(state, samples=samples, step=state['step'] + 1,
+                     pred_out=pred_out, noise_pred=noise_pred, data_pred=data_pred,
+                     ctx=ctx.state, data_pred_hist=data_pred_hist,
+                     log_snr_hist=log_snr_hist)
+        return state
+
+    def tick(self):
+        """Fills the free slots from the pending requests and advances the pool.
+
+        Returns:
+          the samples that finished in this tick and their labels (None for
+          unconditional sampling), or None if no sample finished.
+        """
+        free = ~self._active
+        refill = free & (np.cumsum(free) <= self._num_pending)
+        if self._state is None:
+            self._state = self._init_state()
+        elif np.any(refill):
+            self._state = self._refill(self._state, tf.constant(refill))
+        self._num_pending -= int(np.sum(refill))
+        self._active |= refill
+        if not np.any(self._active):
+            return None
+
+        self._state = self._advance(self._state)
+        finished = self._active & (self._state['step'].numpy() >= self._iterations)
+        self._active &= ~finished
+        if not np.any(finished):
+            return None
+        ids = np.nonzero(finished)[0]
+        samples = tf.gather(self._state['data_pred'], ids)
+        labels = self._state.get('labels')
+        return samples, (None if labels is None else tf.gather(labels, ids))
+
+    def run(self, num_samples):
+        """Yields (samples, labels) as they finish until num_samples are generated."""
+        self.submit(num_samples)
+        while self._num_pending or np.any(self._active):
+            outputs = self.tick()
+            if outputs is not None:
+                yield outputs
+
+
+def check_sampler_name(sampler_name):
+    if sampler_name in ['ddim', 'ddpm', 'heun'] or sampler_name.startswith('ddpm@'):
+        return
+    if sampler_name in ['dpm++1m', 'dpm++2m', 'dpm++3m']:
+        return
+    raise ValueError(f'Unknown sampler_name {sampler_name}')
+
+
+def get_solver_order(sampler_name):
+    """Order of the multistep DPM-Solver++ samplers named dpm++<order>m."""
+    if not sampler_name.startswith('dpm++'):
+        return 1
+    return int(sampler_name[len('dpm++')])
+
+
+def get_log_snr(gamma, eps=1e-6):
+    """Half log-SNR, i.e. log(alpha / sigma) for alpha^2 = gamma, sigma^2 = 1 - gamma.
+
+    gamma is clipped to [eps, 1 - eps] to keep it finite at the ends of the
+    schedules.
+    """
+    gamma = tf.clip_by_value(gamma, eps, 1. - eps)
+    return 0.5 * (tf.math.log(gamma) - tf.math.log1p(-gamma))
+
+
+def dpm_solver_pp_step(samples, gamma_now, gamma_prev, data_preds, log_snrs, order):
+    """Multistep DPM-Solver++ transition (Lu et al., 2022) in log-SNR space.
+
+    The data predictions are extrapolated in log-SNR from the current and up to
+    two previous iterations. The 1st order step is the same as DDIM.
+
+    Args:
+      samples: `float` tensor of current samples.
+      gamma_now: `float` tensor of gamma for the current samples.
+      gamma_prev: `float` tensor of gamma to transition to.
+      data_preds: `tuple` of data predictions of the current and the two
+        previous iterations.
+      log_snrs: `tuple` of half log-SNRs of the current and the two previous
+        iterations.
+      order: `float` scalar tensor, 1, 2 or 3; the previous iterations that
+        are not used can have arbitrary values.
+
+    Returns:
+      samples at gamma_prev.
+    """
+    x0, x0_1, x0_2 = data_preds
+    lambda_now, lambda_1, lambda_2 = log_snrs
+    lambda_prev = get_log_snr(gamma_prev)
+    alpha_prev = sqrt(gamma_prev)
+    sigma_ratio = sqrt(tf.clip_by_value(1. - gamma_prev, 0., 1.) / (1. - gamma_now))
+
+    h = lambda_prev - lambda_now
+    h_0, h_1 = lambda_now - lambda_1, lambda_1 - lambda_2
+    r_0, r_1 = h_0 / h, h_1 / h
+    phi_1 = tf.math.expm1(-h)
+    phi_2 = phi_1 / h + 1.
+    phi_3 = phi_2 / h - 0.5
+
+    d1_0 = tf.math.divide_no_nan(x0 - x0_1, r_0)
+    d1_1 = tf.math.divide_no_nan(x0_1 - x0_2, r_1)
+    samples_1 = sigma_ratio * samples - alpha_prev * phi_1 * x0
+    samples_2 = samples_1 - 0.5 * alpha_prev * phi_1 * d1_0
+    d1 = d1_0 + tf.math.divide_no_nan(r_0, r_0 + r_1) * (d1_0 - d1_1)
+    d2 = tf.math.divide_no_nan(d1_0 - d1_1, r_0 + r_1)
+    samples_3 = samples_1 + alpha_prev * phi_2 * d1 - alpha_prev * phi_3 * d2
+
+    samples = tf.where(order >= 3, samples_3, tf.where(order >= 2, samples_2, samples_1))
+    return samples
+
+
+def heun_step(samples, data_pred, data_pred_next, gamma_now, gamma_prev):
+    """Heun's correction of a DDIM transition in log-SNR space.
+
+    DDIM is the 1st order exponential integrator of the probability flow ODE
+    in log-SNR with the data prediction held constant over the step. The
+    correction instead interpolates it linearly between the predictions for
+    the current samples and for the DDIM samples at gamma_prev. Working with
+    the data instead of the noise prediction keeps the step stable for
+    gamma close to 0 where x / alpha blows up.
+
+    Args:
+      samples: `float` tensor of current samples.
+      data_pred: `float` tensor of data predicted for samples.
+      data_pred_next: `float` tensor of data predicted for the DDIM samples.
+      gamma_now: `float` tensor of gamma for the current samples.
+      gamma_prev: `float` tensor of gamma to transition to.
+
+    Returns:
+      samples at gamma_prev.
+    """
+    h = get_log_snr(gamma_prev) - get_log_snr(gamma_now)
+    phi_1 = tf.math.expm1(-h)
+    phi_2 = phi_1 / h + 1.
+    alpha_prev = sqrt(gamma_prev)
+    sigma_ratio = sqrt(tf.clip_by_value(1. - gamma_prev, 0., 1.) / (1. - gamma_now))
+    return (sigma_ratio * samples - alpha_prev * phi_1 * data_pred +
+            alpha_prev * phi_2 * (data_pred_next - data_pred))
+
+
+def drop_labels(labels, drop_label):
+    """Zeros the labels for the unconditional denoising of cf guidance.
+
+    Args:
+      labels: `float` tensor of conditioning labels of shape (bsz, ...).
+      drop_label: python `bool` for dropping the labels of the whole batch or a
+        `float` tensor of shape (n * bsz,) that is 1 for the examples whose labels
+        are dropped where n is the number of copies of the samples in the batch.
+
+    Returns:
+      labels with the dropped ones zeroed out in shape (n * bsz, ...).
+    """
+    if isinstance(drop_label, bool):
+        return labels * 0. if drop_label else labels
+    labels = utils.repeat_to_batch(labels, tf.shape(drop_label)[0])
+    keep = 1. - tf.reshape(
+        drop_label, tf.concat([[-1], tf.ones([tf.rank(labels) - 1], tf.int32)], 0))
+    return labels * keep
 
 
 class SelfCondEstimateContext(object):
@@ -234,6 +629,15 @@ class SelfCondEstimateContext(object):
                                           context['pred_type'])
         self._estimate = ema(self._estimate, estimate, self._momentum)
 
+    @property
+    def state(self):
+        """Self-conditioning variables carried between iterations."""
+        return [self._estimate]
+
+    @state.setter
+    def state(self, state):
+        self._estimate, = state
+
     def contextualized_inputs(self, samples):
         """Instead of using samples as inputs, obtain inputs with self-cond vars."""
         if self._mode == 'none':
@@ -276,6 +680,15 @@ class SelfCondHiddenContext(object):
             vars_update.append(ema(var_old, var_new, self._momentum))
         self._hiddens = vars_update
 
+    @property
+    def state(self):
+        """Self-conditioning variables carried between iterations."""
+        return list(self._hiddens)
+
+    @state.setter
+    def state(self, state):
+        self._hiddens = list(state)
+
     def contextualized_inputs(self, samples):
         """Instead of using samples as inputs, obtain inputs with self-cond vars."""
         return tuple([samples] + self._hiddens)
@@ -24,6 +24,7 @@ from architectures.transformers import FITDenoiser
 from architectures.transunet import TransUNet
 from models import diffusion_utils
 from models import model as model_lib
+from models import model_utils
 import tensorflow as tf
 
 
@@ -119,6 +120,7 @@ class Model(tf.keras.models.Model):
         config = self.config
 
         def cond_denoise(x, gamma, training, drop_label=False):
+            """drop_label is either a bool or a per-example mask as in diffusion_utils.drop_labels"""
             gamma = tf.reshape(gamma, [-1])
             cond = None
             if config.conditional == 'class' or config.conditional == 'text':
@@ -131,19 +133,53 @@ class Model(tf.keras.models.Model):
                         label_shape = [tf.shape(labels)[0], 1, 1]
                     labels_w = tf.random.uniform(label_shape) > cond_dropout
                     labels_w = tf.cast(labels_w, tf.float32)
-                if drop_label:
-                    labels_w = 0.
+                labels_ = diffusion_utils.drop_labels(labels * labels_w, drop_label)
                 if config.arch_name == 'transunet':  # Merge one-hot label with gamma.
-                    gamma = tf.concat([gamma[..., tf.newaxis], labels * labels_w], -1)
+                    gamma = tf.concat([gamma[..., tf.newaxis], labels_], -1)
                 else:
-                    cond = labels * labels_w
+                    cond = labels_
             elif config.conditional != 'none':
                 raise ValueError(f'Unknown conditional {config.conditional}')
             return self.denoise(x, gamma, cond, training)
 
         return cond_denoise
 
-    def denoise(self, x, gamma, cond, training):
+    def get_cached_cond_denoise(self, labels):
+        """Inference only cond_denoise of the tape denoiser with its step cache.
+
+        The cond projection and the position embeddings of the denoiser are
+        computed once per generate call instead of in every step. For cf
+        guidance the projection of the dropped (zero) labels is cached as well
+        and picked per example with drop_label.
+        """
+        config = self.config
+        cond = None
+        if config.conditional == 'class' or config.conditional == 'text':
+            cond = labels
+        elif config.conditional != 'none':
+            raise ValueError(f'Unknown conditional {config.conditional}')
+        step_cache = self.denoiser_ema.get_step_cache(cond)
+        if cond is not None:
+            cond_null = self.denoiser_ema.get_step_cache(cond[:1] * 0.)['cond']
+
+        def cond_denoise(x, gamma, training, drop_label=False):
+            assert not training, 'the step cache is only for inference'
+            gamma = tf.reshape(gamma, [-1])
+            step_cache_ = step_cache
+            if cond is not None and isinstance(drop_label, bool):
+                if drop_label:
+                    step_cache_ = dict(step_cache, cond=cond_null)
+            elif cond is not None:
+                cond_ = utils.repeat_to_batch(
+                    step_cache['cond'], tf.shape(drop_label)[0])
+                keep = 1. - tf.reshape(drop_label, [-1, 1, 1])
+                step_cache_ = dict(
+                    step_cache, cond=cond_ * keep + cond_null * (1. - keep))
+            return self.denoise(x, gamma, None, training, step_cache=step_cache_)
+
+        return cond_denoise
+
+    def denoise(self, x, gamma, cond, training, step_cache=None):
         """gamma should be (bsz, ) or (bsz, d)."""
         assert gamma.shape.rank <= 2
         if not hasattr(self, 'denoise_x_shape'):
@@ -161,7 +197,10 @@ class Model(tf.keras.models.Model):
                     x[0], list(range(1, x[0].shape.ndims)), keepdims=True)
             else:
                 x /= tf.math.reduce_std(x, list(range(1, x.shape.ndims)), keepdims=True)
-        x = denoiser(x, gamma, cond, training=training)
+        if step_cache is None:
+            x = denoiser(x, gamma, cond, training=training)
+        else:
+            x = denoiser(x, gamma, cond, training=training, step_cache=step_cache)
         return x
 
     def sample(self, num_samples=100, iterations=100, method='ddim', **kwargs):
@@ -175,8 +214,12 @@ class Model(tf.keras.models.Model):
             labels = kwargs['labels']
         else:
             labels = None
+        if config.arch_name == 'tape' and config.get('cache_step_inputs', True):
+            cond_denoise = self.get_cached_cond_denoise(labels)
+        else:
+            cond_denoise = self.get_cond_denoise(labels)
         samples = self.scheduler.generate(
-            self.get_cond_denoise(labels),
+            cond_denoise,
             iterations,
             samples_shape,
             hidden_shapes=self.hidden_shapes,
@@ -275,9 +318,6 @@ class Trainer(model_lib.Trainer):
         super().train_step(examples, tasks, strategy)
 
         # EMA udpate
-        oconfig = self.config.optimization
-        ema_decay = oconfig.get('ema_decay', 0.)
-        vars_src = self.model.denoiser.variables
         if not hasattr(self.model, 'ema_initialized'):
             self.model.ema_initialized = True
             if isinstance(self.model.denoise_x_shape, tuple):
@@ -293,13 +333,13 @@ class Trainer(model_lib.Trainer):
                 gamma=tf.zeros(self.model.denoise_gamma_shape),
                 cond=cond,
                 training=False)
-        vars_dst = self.model.denoiser_ema.variables
-        assert len(vars_src) == len(vars_dst), (len(vars_src), len(vars_dst))
-        if oconfig.get('ema_name_exact_match', False):
-            src_vars_dict = dict((var.name, var) for var in vars_src)
-            vars_src = [src_vars_dict[var.name] for var in vars_dst]
-        for var_src, var_dst in zip(vars_src, vars_dst):
-            var_dst.assign(var_dst * ema_decay + var_src * (1. - ema_decay))
+        if not hasattr(self, 'ema'):
+            oconfig = self.config.optimization
+            self.ema = model_utils.build_ema(oconfig)
+            self.ema.pair(self.model.denoiser.variables,
+                          self.model.denoiser_ema.variables,
+                          oconfig.get('ema_name_exact_match', False))
+        self.ema.update(self._optimizer.iterations)
 
 
 @model_lib.ModelRegistry.register('image_token_diffusion_model')
@@ -22,6 +22,7 @@ from architectures.tape import ImageTapeDenoiser
 from architectures.transunet import TransUNet
 from models import diffusion_utils
 from models import model as model_lib
+from models import model_utils
 import tensorflow as tf
 
 
@@ -116,6 +117,7 @@ class Model(tf.keras.models.Model):
   def get_cond_denoise(self, labels, for_loss=False):
     config = self.config
     def cond_denoise(x, gamma, training, drop_label=False):
+      """drop_label is either a bool or a per-example mask as in diffusion_utils.drop_labels"""
       gamma = tf.reshape(gamma, [-1])
       cond = None
       if config.conditional == 'class':
@@ -124,12 +126,11 @@ class Model(tf.keras.models.Model):
         if training and cond_dropout > 0:
           labels_w = tf.random.uniform([tf.shape(labels)[0], 1]) > cond_dropout
           labels_w = tf.cast(labels_w, tf.float32)
-        if drop_label:
-          labels_w = 0.
+        labels_ = diffusion_utils.drop_labels(labels * labels_w, drop_label)
         if config.arch_name == 'transunet':  # Merge one-hot label with gamma.
-          gamma = tf.concat([gamma[..., tf.newaxis], labels * labels_w], -1)
+          gamma = tf.concat([gamma[..., tf.newaxis], labels_], -1)
         else:
-          cond = labels * labels_w
+          cond = labels_
       elif config.conditional != 'none':
         raise ValueError(f'Unknown conditional {config.conditional}')
       return self.denoise(x, gamma, cond, training, for_loss=for_loss)
@@ -194,6 +195,43 @@ class Model(tf.keras.models.Model):
         sampler_name=method)
     return bit2rgb(samples, config.b_type)
 
+  def get_rolling_sampler(self, pool_size, iterations=100, method='ddim'):
+    """RollingSampler over a pool of pool_size analog bit samples.
+
+    Class labels of the fresh samples are drawn uniformly as in sample.
+    """
+    config = self.config
+    sample_labels = None
+    if config.conditional == 'class':
+      sample_labels = lambda: tf.one_hot(tf.random.uniform(  # pylint: disable=g-long-lambda
+          [pool_size], 0, self.num_classes, dtype=tf.int32), self.num_classes)
+    return diffusion_utils.RollingSampler(
+        self.scheduler,
+        self.get_cond_denoise,
+        iterations,
+        [pool_size, self.image_size, self.image_size, self.x_channels],
+        sample_labels=sample_labels,
+        hidden_shapes=self.hidden_shapes,
+        pred_type=config.pred_type,
+        schedule=config.infer_schedule,
+        td=config.td,
+        x0_clip=self.x0_clip,
+        self_cond=config.self_cond,
+        guidance=config.guidance,
+        sampler_name=method)
+
+  def sample_rolling(self, num_samples, pool_size, iterations=100,
+                     method='ddim'):
+    """Yields (images, labels) until num_samples images are generated.
+
+    Unlike sample, the denoiser always runs on a batch of pool_size samples at
+    different iterations so that many samples can be generated efficiently
+    with a small num_samples per request or a large number of iterations.
+    """
+    sampler = self.get_rolling_sampler(pool_size, iterations, method)
+    for samples, labels in sampler.run(num_samples):
+      yield bit2rgb(samples, self.config.b_type), labels
+
   def noise_denoise(self, images, labels, time_step=None, training=True):
     config = self.config
     images = rgb2bit(images, config.b_type, config.b_scale, self.x_channels)
@@ -273,9 +311,6 @@ class Trainer(model_lib.Trainer):
     super().train_step(examples, tasks, strategy)
 
     # EMA udpate
-    oconfig = self.config.optimization
-    ema_decay = oconfig.get('ema_decay', 0.)
-    vars_src = self.model.denoiser.variables
     if not hasattr(self.model, 'ema_initialized'):
       self.model.ema_initialized = True
       if isinstance(self.model.denoise_x_shape, tuple):
@@ -291,13 +326,13 @@ class Trainer(model_lib.Trainer):
           gamma=tf.zeros(self.model.denoise_gamma_shape),
           cond=cond,
           training=False)
-    vars_dst = self.model.denoiser_ema.variables
-    assert len(vars_src) == len(vars_dst), (len(vars_src), len(vars_dst))
-    if oconfig.get('ema_name_exact_match', False):
-      src_vars_dict = dict((var.name, var) for var in vars_src)
-      vars_src = [src_vars_dict[var.name] for var in vars_dst]
-    for var_src, var_dst in zip(vars_src, vars_dst):
-      var_dst.assign(var_dst * ema_decay + var_src * (1. - ema_decay))
+    if not hasattr(self, 'ema'):
+      oconfig = self.config.optimization
+      self.ema = model_utils.build_ema(oconfig)
+      self.ema.pair(self.model.denoiser.variables,
+                    self.model.denoiser_ema.variables,
+                    oconfig.get('ema_name_exact_match', False))
+    self.ema.update(self._optimizer.iterations)
 
 
 class GrayCode:
@@ -506,17 +506,14 @@ class MHDARTrainer(model_lib.Trainer):
         # update metrics
         y_mask = tf.greater(token_weights_notpad, 0)
         """
-        flatten tokens from all batch samples into a single sequence
-        each sequence might have different length so maintaining a 
-        batch-wise shape is not possible
+        padding tokens are excluded through sample weights rather than boolean_mask so that 
+        all shapes stay static and the loss can be compiled with XLA
         """
-        y_true_unbatched = tf.boolean_mask(target_seq, y_mask)
-        y_pred_logits_unbatched = tf.boolean_mask(logits, y_mask)
-        y_mask = tf.greater(token_weights_notpad, 0)
+        y_weights = tf.cast(y_mask, tf.float32)
         y_correct = model_utils.get_val_metrics(
             target_seq, logits, y_mask)
 
-        return loss, loss_notpad, y_correct, y_true_unbatched, y_pred_logits_unbatched
+        return loss, loss_notpad, y_correct, target_seq, y_weights
 
     def compute_loss(self, preprocess_outputs, validation):
         """Compute loss based on model outputs and targets."""
@@ -529,13 +526,13 @@ class MHDARTrainer(model_lib.Trainer):
         image = examples["image"]
         logits_x, logits_y, logits_l, logits_c = self.model(image, input_seq_x, input_seq_y, input_seq_l, input_seq_c)
 
-        loss_x, loss_notpad_x, y_correct_x, y_true_unbatched_x, y_pred_logits_unbatched_x = self.get_loss(
+        loss_x, loss_notpad_x, y_correct_x, y_true_x, y_weights_x = self.get_loss(
             logits_x, target_seq_x, token_weights_x)
-        loss_y, loss_notpad_y, y_correct_y, y_true_unbatched_y, y_pred_logits_unbatched_y = self.get_loss(
+        loss_y, loss_notpad_y, y_correct_y, y_true_y, y_weights_y = self.get_loss(
             logits_y, target_seq_y, token_weights_y)
-        loss_l, loss_notpad_l, y_correct_l, y_true_unbatched_l, y_pred_logits_unbatched_l = self.get_loss(
+        loss_l, loss_notpad_l, y_correct_l, y_true_l, y_weights_l = self.get_loss(
             logits_l, target_seq_l, token_weights_l)
-        loss_c, loss_notpad_c, y_correct_c, y_true_unbatched_c, y_pred_logits_unbatched_c = self.get_loss(
+        loss_c, loss_notpad_c, y_correct_c, y_true_c, y_weights_c = self.get_loss(
             logits_c, target_seq_c, token_weights_c)
 
         loss_weight_x, loss_weight_y, loss_weight_l, loss_weight_c = self.mhd_loss_weights
@@ -570,20 +567,24 @@ class MHDARTrainer(model_lib.Trainer):
         metrics['loss_notpad_c'].update_state(loss_notpad_c)
 
         metrics['accuracy_notpad_x'].update_state(
-            y_true_unbatched_x,
-            y_pred_logits_unbatched_x,
+            y_true_x,
+            logits_x,
+            sample_weight=y_weights_x,
         )
         metrics['accuracy_notpad_y'].update_state(
-            y_true_unbatched_y,
-            y_pred_logits_unbatched_y,
+            y_true_y,
+            logits_y,
+            sample_weight=y_weights_y,
         )
         metrics['accuracy_notpad_l'].update_state(
-            y_true_unbatched_l,
-            y_pred_logits_unbatched_l,
+            y_true_l,
+            logits_l,
+            sample_weight=y_weights_l,
         )
         metrics['accuracy_notpad_c'].update_state(
-            y_true_unbatched_c,
-            y_pred_logits_unbatched_c,
+            y_true_c,
+            logits_c,
+            sample_weight=y_weights_c,
         )
         metrics['correct_pc_x'].update_state(y_correct_x)
         metrics['correct_pc_y'].update_state(y_correct_y)
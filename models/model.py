@@ -16,6 +16,7 @@
 """Abstract model file."""
 
 import abc
+import threading
 from absl import logging
 import ml_collections
 import registry
@@ -26,6 +27,25 @@ import tensorflow as tf
 ModelRegistry = registry.Registry()
 TrainerRegistry = registry.Registry()
 
+"""
+modules that register each model and its trainer, only imported when the model name is looked up
+"""
+_MODEL_MODULES = {
+    'encoder_ar_decoder': 'models.ar_model',
+    'fit_encoder_ar_decoder': 'models.ar_model',
+    'mhd_encoder_ar_decoder': 'models.mhd_ar_model',
+    'video_encoder_ar_decoder': 'models.video_ar_model',
+    'image_ar_decoder': 'models.image_ar_model',
+    'image_diffusion_model': 'models.image_diffusion_model',
+    'image_token_diffusion_model': 'models.image_diffusion_model',
+    'image_discrete_diffusion_model': 'models.image_discrete_diffusion_model',
+    'video_diffusion_model': 'models.video_diffusion_model',
+    'panoptic_diffusion': 'models.panoptic_diffusion',
+}
+for _name, _module in _MODEL_MODULES.items():
+    ModelRegistry.register_lazy(_name, _module)
+    TrainerRegistry.register_lazy(_name, _module)
+
 
 class Trainer(abc.ABC):
     """A base trainer."""
@@ -45,7 +65,9 @@ class Trainer(abc.ABC):
         num_train_examples = kwargs['num_train_examples']
         train_steps = kwargs['train_steps']
         c_opt = config.optimization
-        batch_size = config.train.batch_size
+        self._grad_accum_steps = grad_accum_steps = config.train.get('grad_accum_steps', 1)
+        """learning rate scaling and warmup follow the effective batch size of each optimizer step"""
+        batch_size = config.train.batch_size * grad_accum_steps
         tail_steps = c_opt.get('tail_steps', 0)
         end_lr_factor = c_opt.get('end_lr_factor', 0.)
         warmup_steps = c_opt.warmup_steps or int(
@@ -56,6 +78,13 @@ class Trainer(abc.ABC):
             tail_steps=tail_steps, end_lr_factor=end_lr_factor)
         self._optimizer = optimizer = model_utils.build_optimizer(
             config.optimization, learning_rate)
+        """
+        float16 needs dynamic loss scaling to avoid gradient underflow while bfloat16 has the same 
+        exponent range as float32 and does not
+        """
+        self._loss_scale = tf.keras.mixed_precision.global_policy().name == 'mixed_float16'
+        if self._loss_scale:
+            self._optimizer = optimizer = tf.keras.mixed_precision.LossScaleOptimizer(optimizer)
 
         # Setup model and checkpoints.
         self._model = model = ModelRegistry.lookup(config.model.name)(config)
@@ -80,6 +109,15 @@ class Trainer(abc.ABC):
         self._checkpoint_manager = tf.train.CheckpointManager(
             ckpt, model_dir, config.train.keep_checkpoint_max)
 
+        """
+        async checkpoints copy the variables to host memory and write them in a background thread;
+        a new save waits for the previous one on the same checkpoint to finish so at most one is in flight
+        """
+        self._ckpt_options = None
+        if config.train.get('async_ckpt', 0):
+            self._ckpt_options = tf.train.CheckpointOptions(experimental_enable_async_checkpoint=True)
+        self._ckpt_marker_threads = {}
+
         # Setup metrics.
 
         self._metrics = {
@@ -100,9 +138,15 @@ class Trainer(abc.ABC):
             for t in config.tasks})
 
         self._print_params = False
+        self._grad_accums = None
 
-    def train_step(self, examples, tasks, strategy):
-        """Defines a single training step for model update given examples and tasks.
+        self._jit_compile = config.train.get('jit_compile', 0)
+        if self._jit_compile:
+            """preprocessing stays outside since it works with string tensors and data-dependent shapes"""
+            self._loss_and_gradients = tf.function(self._loss_and_gradients, jit_compile=True)
+
+    def compute_gradients(self, examples, tasks, strategy):
+        """Computes the loss and gradients for a single (micro-)batch.
 
         Args:
           examples: a list of data examples to be fed into the paired task class for
@@ -110,14 +154,24 @@ class Trainer(abc.ABC):
           tasks: a list of tasks that provide preprocessing and postprocessing for
             specific task.
           strategy: tensorflow strategy such as `TPUStrategy` or `MirroredStrategy`.
-        """
-        # logging.info('train_step begins...')
 
+        Returns:
+          loss: weighted sum of task losses.
+          task_loss_metrics: dict of per-task losses.
+          grads: list of gradients, one per trainable variable.
+          trainable_variables: list of trainable variables.
+        """
         preprocessed_outputs = [
             t.preprocess_batched(e, training=True) for e, t in zip(examples, tasks)]
 
         # return
 
+        if self._jit_compile:
+            preprocessed_outputs = model_utils.drop_string_tensors(preprocessed_outputs)
+        loss, task_loss_metrics, grads = self._loss_and_gradients(preprocessed_outputs, tasks, strategy)
+        return loss, task_loss_metrics, grads, self._model.trainable_variables
+
+    def _loss_and_gradients(self, preprocessed_outputs, tasks, strategy):
         task_loss_metrics = {}
         loss = 0
         grads = []
@@ -127,26 +181,96 @@ class Trainer(abc.ABC):
                 task_loss_metrics[f'loss_{task.config.task.name}'] = loss_t
                 loss += loss_t * task.config.task.weight
                 trainable_variables = self._model.trainable_variables
-                grads_t = tape.gradient(  # div by num_replicas_in_sync for mean grad.
-                    loss_t * task.config.task.weight / strategy.num_replicas_in_sync,
-                    trainable_variables)
+                # div by num_replicas_in_sync for mean grad.
+                loss_t_scaled = loss_t * task.config.task.weight / strategy.num_replicas_in_sync
+                if self._loss_scale:
+                    loss_t_scaled = self._optimizer.get_scaled_loss(loss_t_scaled)
+                grads_t = tape.gradient(loss_t_scaled, trainable_variables)
+                if self._loss_scale:
+                    grads_t = self._optimizer.get_unscaled_gradients(grads_t)
                 grads = grads_t if i == 0 else [
                     g + gt for g, gt in zip(grads, grads_t)]
+        return loss, task_loss_metrics, grads
+
+    def train_step(self, examples, tasks, strategy):
+        """Defines a single training step for model update given examples and tasks.
+
+        Args:
+          examples: a list of data examples to be fed into the paired task class for
+            preprocessing.
+          tasks: a list of tasks that provide preprocessing and postprocessing for
+            specific task.
+          strategy: tensorflow strategy such as `TPUStrategy` or `MirroredStrategy`.
+        """
+        # logging.info('train_step begins...')
+
+        loss, task_loss_metrics, grads, trainable_variables = self.compute_gradients(
+            examples, tasks, strategy)
+        self._optimizer.apply_gradients(zip(grads, trainable_variables))
+
+        self._update_loss_metrics(loss, task_loss_metrics)
+        self._update_grad_metrics(grads, trainable_variables, strategy)
+        # logging.info('train_step ends...')
+
+    def accumulate_step(self, examples, tasks, strategy):
+        """Adds the gradients of one micro-batch to the gradient accumulators.
+
+        The accumulators are created on the first call since the model variables
+        only exist after the first forward pass. They are `ON_READ` variables so
+        each replica sums its own gradients locally and the cross-replica
+        reduction happens only once per optimizer step in `apply_accumulated_step`.
+        """
+        loss, task_loss_metrics, grads, trainable_variables = self.compute_gradients(
+            examples, tasks, strategy)
+        if self._grad_accums is None:
+            """init_scope lifts the variable creation out of the training loop like keras does for layer weights"""
+            with tf.init_scope():
+                self._grad_accums = [
+                    tf.Variable(
+                        lambda v=v: tf.zeros(v.shape, v.dtype),
+                        trainable=False,
+                        synchronization=tf.VariableSynchronization.ON_READ,
+                        aggregation=tf.VariableAggregation.SUM,
+                        name='grad_accum')
+                    for v in trainable_variables]
+        for accum, g in zip(self._grad_accums, grads):
+            if g is not None:
+                accum.assign_add(tf.convert_to_tensor(g))
+
+        self._update_loss_metrics(loss, task_loss_metrics)
+
+    def apply_accumulated_step(self, strategy):
+        """Applies the mean of the accumulated gradients and resets the accumulators."""
+        assert self._grad_accums is not None, "accumulate_step must be called before apply_accumulated_step"
+        trainable_variables = self._model.trainable_variables
+        grads = [accum.read_value() / self._grad_accum_steps for accum in self._grad_accums]
         self._optimizer.apply_gradients(zip(grads, trainable_variables))
+        for accum in self._grad_accums:
+            accum.assign(tf.zeros_like(accum))
+
+        self._update_grad_metrics(grads, trainable_variables, strategy)
 
-        # Update metrics.
+    def _update_loss_metrics(self, loss, task_loss_metrics):
         self._metrics['loss'].update_state(loss)
         for k, v in task_loss_metrics.items():
             self._metrics[k].update_state(v)
+
+    def _update_grad_metrics(self, grads, trainable_variables, strategy):
         wmx = [tf.reduce_max(tf.math.abs(m)) for m in trainable_variables]
         self._metrics['weight_linf_norm'].update_state(tf.reduce_max(wmx))
         multiplier = strategy.num_replicas_in_sync
-        self._metrics['grad_global_norm'].update_state(tf.linalg.global_norm(
-            [tf.math.scalar_mul(multiplier, g) for g in grads if g is not None]))
+        grad_global_norm = tf.linalg.global_norm(
+            [tf.math.scalar_mul(multiplier, g) for g in grads if g is not None])
+        if self._loss_scale:
+            """steps with non-finite gradients are skipped by LossScaleOptimizer so leave them out of the mean"""
+            is_finite = tf.math.is_finite(grad_global_norm)
+            self._metrics['grad_global_norm'].update_state(
+                tf.where(is_finite, grad_global_norm, 0.), sample_weight=tf.cast(is_finite, tf.float32))
+        else:
+            self._metrics['grad_global_norm'].update_state(grad_global_norm)
         self._metrics['total_num_params'].update_state(
             utils.count_params(self._model, verbose=self._print_params))
         self._print_params = False
-        # logging.info('train_step ends...')
 
     def val_step(self, examples, tasks):
         preprocessed_outputs = [
@@ -184,11 +308,62 @@ class Trainer(abc.ABC):
         self._verify_restored_p = verify_restored_p
         self._verify_existing_p = verify_existing_p
 
+    def save_checkpoint(self, step, checkpoint_manager=None):
+        """Saves a checkpoint and marks it complete once all of its files are on disk.
+
+        Args:
+          step: `int` step number used in the checkpoint name.
+          checkpoint_manager: `tf.train.CheckpointManager` to save with, defaults
+            to the training checkpoint manager.
+
+        Returns:
+          path prefix of the saved checkpoint.
+        """
+        if checkpoint_manager is None:
+            checkpoint_manager = self._checkpoint_manager
+
+        prev_thread = self._ckpt_marker_threads.pop(id(checkpoint_manager), None)
+        if prev_thread is not None:
+            prev_thread.join()
+
+        prev_ckpts = list(checkpoint_manager.checkpoints)
+        ckpt_path = checkpoint_manager.save(step, options=self._ckpt_options)
+
+        """all workers take part in the save but only the chief marks it complete"""
+        if not utils.is_chief():
+            return ckpt_path
+
+        utils.remove_ckpt_markers([k for k in prev_ckpts if k not in checkpoint_manager.checkpoints])
+
+        if self._ckpt_options is None:
+            utils.write_ckpt_marker(ckpt_path)
+        else:
+            def write_marker():
+                checkpoint_manager.sync()
+                utils.write_ckpt_marker(ckpt_path)
+
+            thread = threading.Thread(target=write_marker, daemon=True)
+            thread.start()
+            self._ckpt_marker_threads[id(checkpoint_manager)] = thread
+        return ckpt_path
+
+    def wait_for_checkpoints(self):
+        """Blocks until all checkpoints being written in the background are complete."""
+        for thread in self._ckpt_marker_threads.values():
+            thread.join()
+        self._ckpt_marker_threads = {}
+        self._checkpoint_manager.sync()
+
     def reset(self):
         """Reseting the metrics and/or other state accumulators."""
         for k, _ in self._metrics.items():
             self._metrics[k].reset_states()
 
+    @property
+    def grad_accum_steps(self):
+        """Returns the number of micro-batches accumulated per optimizer step."""
+        return self._grad_accum_steps
+
     @property
     def model(self):
         """Returns model instance."""
@@ -21,7 +21,7 @@ import os
 import tensorflow as tf
 import tensorflow_addons as tfa
 
-from utils import linux_path
+from utils import linux_path, shape_as_list
 
 
 def check_ckpt_match(model_dir, model, ckpt_vars_p):
@@ -328,6 +328,96 @@ def build_optimizer(config, learning_rate):
         raise ValueError('Unknown optimizer {}'.format(config.optimizer))
 
 
+class FusedEMA(object):
+    """Exponential moving average of source variables kept in destination variables.
+
+    The variables are paired once and split into chunks of at most chunk_size
+    elements. Each chunk is updated by its own XLA-compiled function which fuses
+    the updates of all of its variables into a few kernels instead of a long tail
+    of small ops per variable after each training step.
+    """
+
+    def __init__(self, decay, every_n_steps=1, warmup=False, chunk_size=2 ** 26,
+                 jit_compile=True):
+        """Init function.
+
+        Args:
+          decay: `float` EMA decay.
+          every_n_steps: `int` number of training steps between updates.
+          warmup: `bool` whether to use min(decay, (1 + step) / (10 + step)) as the
+            decay so the average follows the source variables closely early on.
+          chunk_size: `int` max number of elements updated by one function.
+          jit_compile: `bool` whether to compile the update functions with XLA.
+        """
+        self.decay = decay
+        self.every_n_steps = every_n_steps
+        self.warmup = warmup
+        self.chunk_size = chunk_size
+        self.jit_compile = jit_compile
+        self._update_fns = None
+
+    @property
+    def is_paired(self):
+        return self._update_fns is not None
+
+    def pair(self, vars_src, vars_dst, name_exact_match=False):
+        """Pairs each destination variable with its source and builds the update functions of the chunks."""
+        assert len(vars_src) == len(vars_dst), (len(vars_src), len(vars_dst))
+        if name_exact_match:
+            src_vars_dict = dict((var.name, var) for var in vars_src)
+            vars_src = [src_vars_dict[var.name] for var in vars_dst]
+
+        chunks, chunk, chunk_len = [], [], 0
+        for var_src, var_dst in zip(vars_src, vars_dst):
+            assert var_src.shape == var_dst.shape, (var_src.name, var_dst.name)
+            var_len = var_dst.shape.num_elements()
+            if chunk and chunk_len + var_len > self.chunk_size:
+                chunks.append(chunk)
+                chunk, chunk_len = [], 0
+            chunk.append((var_src, var_dst))
+            chunk_len += var_len
+        if chunk:
+            chunks.append(chunk)
+        self._update_fns = [self._get_update_fn(chunk) for chunk in chunks]
+
+    def _get_update_fn(self, chunk):
+        def update_fn(decay):
+            for var_src, var_dst in chunk:
+                decay_ = tf.cast(decay, var_dst.dtype)
+                var_dst.assign(var_dst * decay_ + var_src * (1. - decay_))
+
+        return tf.function(update_fn, jit_compile=self.jit_compile)
+
+    def get_decay(self, step):
+        decay = tf.constant(self.decay, tf.float32)
+        if self.warmup:
+            step = tf.cast(step, tf.float32)
+            decay = tf.minimum(decay, (1. + step) / (10. + step))
+        return decay
+
+    def update(self, step):
+        """Updates the destination variables after training step `step` (starting from 1)."""
+        assert self.is_paired, "pair must be called before update"
+        decay = self.get_decay(step)
+
+        def apply():
+            for update_fn in self._update_fns:
+                update_fn(decay)
+
+        if self.every_n_steps > 1:
+            tf.cond(tf.equal(step % self.every_n_steps, 0), apply, lambda: None)
+        else:
+            apply()
+
+
+def build_ema(config):
+    """FusedEMA for the EMA options in config.optimization."""
+    return FusedEMA(
+        config.get('ema_decay', 0.),
+        every_n_steps=config.get('ema_every_n_steps', 1),
+        warmup=config.get('ema_warmup', False))
+
+
 def get_loss(logits, label_seq, loss_type):
     """Returns loss.
 
@@ -346,6 +436,8 @@ def get_loss(logits, label_seq, loss_type):
             return loss_type.split('@')[1]
         return default
 
+    """softmax and loss are always computed in float32 even if the logits come from a mixed precision model"""
+    logits = tf.cast(logits, tf.float32)
     label_hot = tf.cast(tf.one_hot(label_seq, tf.shape(logits)[-1]), logits.dtype)
     if 'xent' in loss_type:
         label_smoothing = float(_extract_loss_param(loss_type))
@@ -372,17 +464,163 @@ def get_loss(logits, label_seq, loss_type):
     return loss
 
 
-def get_val_metrics(y_true, y_pred_logits, y_mask):
-    y_true_m = tf.boolean_mask(y_true, y_mask)
+def get_seq_lengths(target_seq, padding_token=0):
+    """
+    number of tokens in each sequence up to the last non-padding target and the first padding target after it
+    which is the one that trains the model to end the sequence
+
+    Args:
+      target_seq: `int` tensor of shape (bsz, seqlen).
+
+    Returns:
+      `int32` tensor of shape (bsz,).
+    """
+    seq_len = shape_as_list(target_seq)[1]
+    pos = tf.range(1, seq_len + 1)[tf.newaxis, :]
+    last_nonpad = tf.reduce_max(tf.where(tf.not_equal(target_seq, padding_token), pos, 0), axis=-1)
+    return tf.minimum(last_nonpad + 1, seq_len)
+
+
+def get_packing(lengths, seq_len, n_rows, max_per_row):
+    """Packs variable-length sequences into rows of the same length, first-fit-decreasing.
+
+    The sequences are placed from the longest to the shortest, each into the first row that has room for it
+    and fewer than max_per_row sequences. Sequences that do not fit into the n_rows rows are not packed and
+    fits is False so that the caller can fall back to one sequence per row.
+
+    All shapes are static so that this can be compiled with XLA.
+
+    Args:
+      lengths: `int` tensor of shape (bsz,) with the number of tokens of each sequence to keep.
+      seq_len: `int` length of both the input sequences and the packed rows.
+      n_rows: `int` number of packed rows.
+      max_per_row: `int` max number of sequences in each row.
+
+    Returns:
+      dict with:
+        rows, starts, slots: `int32` tensors of shape (bsz,) with the row, the offset within the row and the
+          index within the row of each sequence.
+        kept: `bool` tensor of shape (bsz,) marking the sequences that fit into the rows.
+        fits: `bool` scalar tensor that is True if all the sequences fit into the rows.
+        segment_ids: `int32` tensor of shape (n_rows, seq_len) with the slot of the sequence each token
+          belongs to and -1 for empty positions.
+        positions: `int32` tensor of shape (n_rows, seq_len) with the position of each token in its sequence.
+    """
+    lengths = tf.minimum(tf.cast(lengths, tf.int32), seq_len)
+    order = tf.argsort(lengths, direction='DESCENDING', stable=True)
+
+    def _assign(prev, length):
+        fill, count = prev[3:]
+        has_room = tf.logical_and(fill + length <= seq_len, count < max_per_row)
+        """first row with room or n_rows if there is none"""
+        row = tf.cast(tf.argmax(tf.concat([has_room, [True]], 0)), tf.int32)
+        in_row = tf.equal(tf.range(n_rows), row)
+        start = tf.reduce_sum(tf.where(in_row, fill, 0))
+        slot = tf.reduce_sum(tf.where(in_row, count, 0))
+        return row, start, slot, tf.where(in_row, fill + length, fill), tf.where(in_row, count + 1, count)
+
+    initializer = (tf.constant(0), tf.constant(0), tf.constant(0),
+                   tf.zeros([n_rows], tf.int32), tf.zeros([n_rows], tf.int32))
+    rows, starts, slots, _, _ = tf.scan(_assign, tf.gather(lengths, order), initializer=initializer)
+    """back to the order of the sequences"""
+    inverse = tf.math.invert_permutation(order)
+    rows, starts, slots = [tf.gather(t, inverse) for t in (rows, starts, slots)]
+    kept = rows < n_rows
+    fits = tf.reduce_all(kept)
+
+    pos = tf.range(seq_len)[tf.newaxis, :]
+    valid = tf.logical_and(pos < lengths[:, tf.newaxis], kept[:, tf.newaxis])
+    """
+    the invalid positions are sent to an extra row that is discarded after scattering so that 
+    the indices of every token are computed without any data-dependent shapes 
+    """
+    dst_rows = tf.where(valid, rows[:, tf.newaxis], n_rows)
+    dst_cols = tf.where(valid, starts[:, tf.newaxis] + pos, pos)
+    dst_indices = tf.stack([dst_rows, dst_cols], axis=-1)
+
+    def _scatter(values):
+        packed = tf.scatter_nd(dst_indices, values, [n_rows + 1, seq_len])
+        return packed[:n_rows]
+
+    segment_ids = _scatter(tf.where(valid, slots[:, tf.newaxis] + 1, 0)) - 1
+    positions = _scatter(tf.where(valid, pos, 0))
+
+    return dict(
+        rows=rows,
+        starts=starts,
+        slots=slots,
+        kept=kept,
+        fits=fits,
+        dst_indices=dst_indices,
+        segment_ids=segment_ids,
+        positions=positions,
+        n_rows=n_rows,
+        max_per_row=max_per_row,
+    )
+
+
+def pack_seqs(seq, packing):
+    """
+    seq: tensor of shape (bsz, seqlen, ...)
+    returns: tensor of shape (n_rows, seqlen, ...) with the positions not covered by any sequence set to zero
+    """
+    shape = shape_as_list(seq)
+    n_rows = packing['n_rows']
+    packed = tf.scatter_nd(packing['dst_indices'], seq, [n_rows + 1, ] + shape[1:])
+    return packed[:n_rows]
+
+
+def unpack_seqs(packed, packing):
+    """
+    packed: tensor of shape (n_rows, seqlen, ...) like the output of pack_seqs
+    returns: tensor of shape (bsz, seqlen, ...) with each sequence back in its own row and the positions
+      past its length or of the sequences that were not packed set to zero
+    """
+    shape = shape_as_list(packed)
+    packed = tf.concat([packed, tf.zeros([1] + shape[1:], packed.dtype)], axis=0)
+    return tf.gather_nd(packed, packing['dst_indices'])
 
+
+def pack_encoded(encoded, packing):
+    """
+    encoded: tensor of shape (bsz, n_enc, dim)
+    returns:
+      tensor of shape (n_rows, max_per_row * n_enc, dim) with the encoded images of the sequences in each
+        row concatenated in the order of their slots
+      `int32` tensor of shape (n_rows, max_per_row * n_enc) with the slot of each encoded token
+    """
+    _, n_enc, dim = shape_as_list(encoded)
+    n_rows, max_per_row = packing['n_rows'], packing['max_per_row']
+    kept = packing['kept']
+    dst_indices = tf.stack([
+        tf.where(kept, packing['rows'], n_rows),
+        tf.where(kept, packing['slots'], 0),
+    ], axis=-1)
+    packed = tf.scatter_nd(dst_indices, encoded, [n_rows + 1, max_per_row, n_enc, dim])
+    packed = tf.reshape(packed[:n_rows], [n_rows, max_per_row * n_enc, dim])
+    enc_segment_ids = tf.tile(
+        tf.repeat(tf.range(max_per_row), n_enc)[tf.newaxis, :], [n_rows, 1])
+    return packed, enc_segment_ids
+
+
+def drop_string_tensors(structure):
+    """replaces string tensors like image IDs, which XLA cannot compile, with None"""
+    return tf.nest.map_structure(
+        lambda t: None if isinstance(t, tf.Tensor) and t.dtype == tf.string else t, structure)
+
+
+def get_val_metrics(y_true, y_pred_logits, y_mask):
     y_pred = tf.cast(tf.argmax(y_pred_logits, axis=2), y_true.dtype)
-    y_pred_m = tf.boolean_mask(y_pred, y_mask)
 
-    """Don't care about output tokens corresponding to GT tokens marked as padding"""
-    y_total_m = tf.cast(tf.size(y_true_m), tf.int64)
+    """
+    Don't care about output tokens corresponding to GT tokens marked as padding
+    counting with the mask instead of boolean_mask keeps the shapes static for XLA
+    """
+    y_mask = tf.cast(y_mask, tf.int64)
+    y_total_m = tf.reduce_sum(y_mask)
 
-    y_correct_m = tf.math.equal(y_true_m, y_pred_m)
-    y_correct_count_m = tf.reduce_sum(tf.cast(y_correct_m, tf.int64))
+    y_correct_m = tf.math.equal(y_true, y_pred)
+    y_correct_count_m = tf.reduce_sum(tf.cast(y_correct_m, tf.int64) * y_mask)
     y_correct_pc_m = (y_correct_count_m / y_total_m) * 100
 
     return y_correct_pc_m
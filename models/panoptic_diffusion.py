@@ -25,6 +25,7 @@ from architectures.transformers import VisionTransformer
 from architectures.transunet import TransUNet
 from models import diffusion_utils
 from models import model as model_lib
+from models import model_utils
 import tensorflow as tf
 
 
@@ -167,26 +168,109 @@ class Model(tf.keras.models.Model):
 
   def get_cond_denoise(self, encoded_cat, encoded, cond_map=None,
                        return_logits=False):
-    def cond_denoise(samples, gamma, training):
+    def cond_denoise(samples, gamma, training, drop_label=False):
+      """
+      drop_label is either a bool or a per-example mask as in diffusion_utils.drop_labels;
+      the image features are zeroed for the unconditional denoising like in encode_images_null
+      """
       gamma = tf.reshape(gamma, [-1])
+      bsz = tf.shape(gamma)[0]
+      encoded_cat_, encoded_, cond_map_ = encoded_cat, encoded, cond_map
+      if encoded_cat_ is not None:
+        encoded_cat_ = diffusion_utils.drop_labels(
+            utils.repeat_to_batch(encoded_cat_, bsz), drop_label)
+      if encoded_ is not None:
+        encoded_ = diffusion_utils.drop_labels(
+            utils.repeat_to_batch(encoded_, bsz), drop_label)
+      if cond_map_ is not None:
+        cond_map_ = utils.repeat_to_batch(cond_map_, bsz)
       if self.config.normalize_noisy_input:
         # rescaling vs normalization
         # gamma_ = tf.reshape(gamma, [tf.shape(gamma)[0], 1, 1, 1])
         # samples /= tf.sqrt((self.config.b_scale**2-1) * gamma_ + 1)
         samples /= tf.math.reduce_std(
             samples, list(range(1, samples.shape.ndims)), keepdims=True)
-      if encoded_cat is not None:
+      if encoded_cat_ is not None:
         if isinstance(samples, tuple) or isinstance(samples, list):
           samples = list(samples)
-          samples[0] = tf.concat([samples[0], encoded_cat], -1)
+          samples[0] = tf.concat([samples[0], encoded_cat_], -1)
         else:
-          samples = tf.concat([samples, encoded_cat], -1)
+          samples = tf.concat([samples, encoded_cat_], -1)
+      if cond_map_ is not None:
+        samples = tf.concat([samples, cond_map_], -1)
+      return self.denoise(samples, encoded_, gamma, training, return_logits)
+    return cond_denoise
+
+  def get_cond_cache(self, images, num_samples=1):
+    """Conditioning tensors for inference that do not depend on samples or gamma.
+
+    The images are encoded once and the results are repeated num_samples times
+    along the batch so that the samples of each image are consecutive. With
+    cache_cond_in, the parts of the denoiser's conv_in on the image features
+    and cond_map channels are computed here instead of in every step.
+    """
+    config = self.config
+    if isinstance(images, tuple):
+      images, cond_map = images
+    else:
+      cond_map = None
+    if config.conditional == 'none':
+      encoded_cat, encoded = self.encode_images_null(images, training=False)
+    else:
+      encoded_cat, encoded = self.encode_images(images, training=False)
+    if num_samples > 1:
+      repeat = lambda x: None if x is None else tf.repeat(x, num_samples, 0)
+      encoded_cat, encoded, cond_map = (
+          repeat(encoded_cat), repeat(encoded), repeat(cond_map))
+    cache = dict(encoded_cat=encoded_cat, encoded=encoded, cond_map=cond_map,
+                 cond_in_cat=None, cond_in_map=None)
+
+    has_cond_in = 'cat' in config.conditional or cond_map is not None
+    if (config.get('cache_cond_in', True) and has_cond_in and
+        self.hidden_shapes is None):
+      x_dim = self.x_channels * (1 if config.self_cond == 'none' else 2)
+      cat_dim = encoded_cat.shape[-1]
+      map_dim = 0 if cond_map is None else cond_map.shape[-1]
+      in_dim = x_dim + cat_dim + map_dim
+      if 'cat' in config.conditional:
+        cache['cond_in_cat'] = self.denoiser_ema(
+            encoded_cat, None, None, False, conv_in_part=(x_dim, in_dim))
       if cond_map is not None:
-        samples = tf.concat([samples, cond_map], -1)
-      return self.denoise(samples, encoded, gamma, training, return_logits)
+        cache['cond_in_map'] = self.denoiser_ema(
+            cond_map, None, None, False,
+            conv_in_part=(x_dim + cat_dim, in_dim))
+      cache['x_dim'] = x_dim
+    return cache
+
+  def get_cached_cond_denoise(self, cache):
+    """Same as get_cond_denoise for the inference with a cond cache."""
+    if cache['cond_in_cat'] is None and cache['cond_in_map'] is None:
+      return self.get_cond_denoise(
+          cache['encoded_cat'], cache['encoded'], cache['cond_map'])
+
+    def cond_denoise(samples, gamma, training, drop_label=False):
+      assert samples.shape[-1] == cache['x_dim'], (
+          samples.shape, cache['x_dim'])
+      gamma = tf.reshape(gamma, [-1])
+      bsz = tf.shape(gamma)[0]
+      encoded_ = cache['encoded']
+      if encoded_ is not None:
+        encoded_ = diffusion_utils.drop_labels(
+            utils.repeat_to_batch(encoded_, bsz), drop_label)
+      if self.config.normalize_noisy_input:
+        samples /= tf.math.reduce_std(
+            samples, list(range(1, samples.shape.ndims)), keepdims=True)
+      cond_in = tf.zeros([], samples.dtype)
+      if cache['cond_in_cat'] is not None:
+        cond_in += diffusion_utils.drop_labels(
+            utils.repeat_to_batch(cache['cond_in_cat'], bsz),
+            drop_label)
+      if cache['cond_in_map'] is not None:
+        cond_in += utils.repeat_to_batch(cache['cond_in_map'], bsz)
+      return self.denoise(samples, encoded_, gamma, training, cond_in=cond_in)
     return cond_denoise
 
-  def denoise(self, x, c, gamma, training, return_logits=False):
+  def denoise(self, x, c, gamma, training, return_logits=False, cond_in=None):
     config = self.config
     if not hasattr(self, 'denoise_x_shape'):
       if isinstance(x, tuple) or isinstance(x, list):
@@ -197,25 +281,30 @@ class Model(tf.keras.models.Model):
         self.denoise_c_shape = tf.shape(c)
       self.denoise_gamma_shape = tf.shape(gamma)
     denoiser = self.denoiser if training else self.denoiser_ema
-    x = denoiser(x, gamma, c, training, return_logits)
+    if cond_in is None:
+      x = denoiser(x, gamma, c, training, return_logits)
+    else:
+      x = denoiser(x, gamma, c, training, return_logits, cond_in=cond_in)
     if config.pred_type == 'x_sigmoid_xent':
       x = x if training else (tf.nn.sigmoid(x) * 2 - 1) * config.b_scale
     return x
 
-  def infer(self, images, iterations=100, method='ddim'):
+  def infer(self, images, iterations=100, method='ddim', num_samples=1):
+    """Masks of shape (bsz, h, w, c) or (bsz, num_samples, h, w, c)."""
+    cache = self.get_cond_cache(images, num_samples)
+    masks = self.infer_cached(cache, iterations, method)
+    if num_samples > 1:
+      masks = tf.reshape(masks, tf.concat(
+          [[-1, num_samples], tf.shape(masks)[1:]], 0))
+    return masks
+
+  def infer_cached(self, cache, iterations=100, method='ddim'):
+    """Masks for a cond cache so it can be reused for several seeds."""
     config = self.config
-    if isinstance(images, tuple):
-      images, cond_map = images
-    else:
-      cond_map = None
-    samples_shape = [tf.shape(images)[0], config.msize[0],
+    samples_shape = [tf.shape(cache['encoded_cat'])[0], config.msize[0],
                      config.msize[1], self.x_channels]
-    if config.conditional == 'none':
-      encoded_cat, encoded = self.encode_images_null(images, training=False)
-    else:
-      encoded_cat, encoded = self.encode_images(images, training=False)
     masks = self.scheduler.generate(
-        self.get_cond_denoise(encoded_cat, encoded, cond_map),
+        self.get_cached_cond_denoise(cache),
         iterations,
         samples_shape,
         hidden_shapes=self.hidden_shapes,
@@ -224,6 +313,7 @@ class Model(tf.keras.models.Model):
         td=config.td,
         x0_clip=self.x0_clip,
         self_cond=config.self_cond,
+        guidance=config.get('guidance', 0.),
         sampler_name=method)
     return masks
 
@@ -320,16 +410,11 @@ class Trainer(model_lib.Trainer):
     super().train_step(examples, tasks, strategy)
 
     # EMA udpate
-    oconfig = self.config.optimization
-    ema_decay = oconfig.get('ema_decay', 0.)
     if self.config.model.conditional == 'none' and not hasattr(
         self.model, 'encoder_initialized'):
       self.model.encoder_initialized = True
       _ = self.model.encode_images(
           tf.zeros(self.model.images_shape), training=True)
-    vars_src = (self.model.denoiser.variables +
-                self.model.encoder.variables +
-                self.model.encoder_fuse.variables)
     if not hasattr(self.model, 'ema_initialized'):
       self.model.ema_initialized = True
       _ = self.model.encode_images(
@@ -344,12 +429,15 @@ class Trainer(model_lib.Trainer):
               self.model, 'denoise_c_shape') else None,
           gamma=tf.zeros(self.model.denoise_gamma_shape),
           training=False)
-    vars_dst = (self.model.denoiser_ema.variables +
-                self.model.encoder_ema.variables +
-                self.model.encoder_fuse_ema.variables)
-    assert len(vars_src) == len(vars_dst), (len(vars_src), len(vars_dst))
-    if oconfig.get('ema_name_exact_match', False):
-      src_vars_dict = dict((var.name, var) for var in vars_src)
-      vars_src = [src_vars_dict[var.name] for var in vars_dst]
-    for var_src, var_dst in zip(vars_src, vars_dst):
-      var_dst.assign(var_dst * ema_decay + var_src * (1. - ema_decay))
+    if not hasattr(self, 'ema'):
+      oconfig = self.config.optimization
+      vars_src = (self.model.denoiser.variables +
+                  self.model.encoder.variables +
+                  self.model.encoder_fuse.variables)
+      vars_dst = (self.model.denoiser_ema.variables +
+                  self.model.encoder_ema.variables +
+                  self.model.encoder_fuse_ema.variables)
+      self.ema = model_utils.build_ema(oconfig)
+      self.ema.pair(vars_src, vars_dst,
+                    oconfig.get('ema_name_exact_match', False))
+    self.ema.update(self._optimizer.iterations)
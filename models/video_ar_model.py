@@ -103,6 +103,7 @@ class Model(tf.keras.models.Model):
                 use_cls_token=self.config.use_cls_token,
                 late_fusion=self.late_fusion,
                 freeze_backbone=self.freeze_backbone,
+                recompute_grad=self.config.recompute_grad,
                 name='rest')
 
 
@@ -151,6 +152,9 @@ class Model(tf.keras.models.Model):
             pos_encoding=self.config.pos_encoding_dec,
             shared_embedding=self.config.shared_decoder_embedding,
             output_bias=self.config.decoder_output_bias,
+            recompute_grad=self.config.recompute_grad,
+            draft_layers=self.config.get('draft_layers', 0),
+            draft_len=self.config.get('draft_len', 4),
             name='ar_decoder')
 
         if self.freeze_decoder or self.freeze_encoder_decoder:
@@ -159,15 +163,30 @@ class Model(tf.keras.models.Model):
         self.is_inited = False
         self.trainable_modules = ['encoder', 'decoder', 'proj', 'proj_mlp']
 
-    def _encode_videos(self, videos, training):
+    @property
+    def supports_frame_tokens(self):
+        """whether the per-frame backbone features can be computed separately from the rest of the encoder"""
+        return hasattr(self.encoder, 'encode_frames')
+
+    def encode_frames(self, frames, training=False):
+        """
+        frames: (n, h, w, c)
+        """
+        assert self.supports_frame_tokens, "per-frame encoding is not supported by the encoder"
+        return self.encoder.encode_frames(frames, training)
+
+    def _encode_videos(self, videos, training, frame_tokens=None):
         config = self.config
-        encoded = self.encoder(videos, training)
+        if frame_tokens is not None:
+            encoded = self.encoder.fuse_frames(frame_tokens, training)
+        else:
+            encoded = self.encoder(videos, training)
         # encoded = utils.flatten_vid(encoded)
 
         encoded = self.proj_ln(self.proj(encoded))
         # Add (optional) positional embedding to encoded visual units.
         if config.dec_proj_mode != 'linear':
-            vis_pos_emb = tf.expand_dims(self.vis_pos_emb, 0)
+            vis_pos_emb = tf.cast(tf.expand_dims(self.vis_pos_emb, 0), encoded.dtype)
             # vis_pos_emb = tf.expand_dims(vis_pos_emb, 0)
             # if self.pos_encoding == 'learned_3d':
             #     encoded = utils.unflatten_vid(encoded, self.vid_len)
@@ -206,9 +225,13 @@ class Model(tf.keras.models.Model):
 
     def infer(self, videos, prompt_seq, encoded=None, max_seq_len=None,
               temperature=1, top_k=1, top_p=1., num_samples=1,
-              sampling_callback=None, training=False):
+              sampling_callback=None, training=False, frame_tokens=None):
+        """
+        frame_tokens: optional (bsz, vid_len, n_feat, dim) output of encode_frames for the frames of each video
+        to use instead of videos which can then be None
+        """
         if encoded is None:
-            encoded = self._encode_videos(videos, training=training)
+            encoded = self._encode_videos(videos, training=training, frame_tokens=frame_tokens)
 
         """only needed if prompt_seq is 3D or above"""
         # encoded, prompt_seq = self._tile_vis_output(encoded, prompt_seq)
@@ -283,6 +306,7 @@ class VideoARTrainer(model_lib.Trainer):
             is_padding, tf.zeros_like(token_weights), token_weights)
 
         logits, pred_encoded = model(videos, input_seq)
+        logits = tf.cast(logits, tf.float32)
         losses = model_utils.get_loss(
             logits, target_seq, self.config.train.loss_type)
         loss = tf.reduce_sum(losses * token_weights) / (
@@ -292,20 +316,20 @@ class VideoARTrainer(model_lib.Trainer):
 
         y_mask = tf.greater(token_weights_notpad, 0)
 
-        y_true = tf.boolean_mask(target_seq, y_mask)
-        y_pred_logits = tf.boolean_mask(logits, y_mask)
+        """sample weights instead of boolean_mask keep the shapes static for XLA"""
+        y_weights = tf.cast(y_mask, tf.float32)
 
         # update metrics
         if validation:
             self._val_metrics['loss_notpad'].update_state(loss_notpad)
-            self._val_metrics['accuracy_notpad'].update_state(y_true, y_pred_logits)
+            self._val_metrics['accuracy_notpad'].update_state(target_seq, logits, sample_weight=y_weights)
             y_mask = tf.greater(token_weights_notpad, 0)
             y_correct = model_utils.get_val_metrics(
                 target_seq, logits, y_mask)
             self._val_metrics['correct_pc'].update_state(y_correct)
         else:
             self._metrics['loss_notpad'].update_state(loss_notpad)
-            self._metrics['accuracy_notpad'].update_state(y_true, y_pred_logits)
+            self._metrics['accuracy_notpad'].update_state(target_seq, logits, sample_weight=y_weights)
 
             # if self.config.debug:
             #     bsz = tf.shape(videos)[0]
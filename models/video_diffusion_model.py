@@ -18,6 +18,7 @@
 import functools
 import ml_collections
 
+import utils
 from architectures.tape import VideoTapeDenoiser
 from models import diffusion_utils
 from models import image_diffusion_model
@@ -92,13 +93,42 @@ class Model(image_diffusion_model.Model):
     def get_cond_denoise(self, labels, cond=None):
         config = self.config
 
-        def cond_denoise(x, gamma, training):
+        def cond_denoise(x, gamma, training, drop_label=False):
+            """
+            drop_label is either a bool or a per-example mask as in diffusion_utils.drop_labels;
+            the conditioning frames are kept for the examples whose labels are dropped
+            """
             gamma = tf.reshape(gamma, [-1])
+            cond_ = cond
+            if cond_ is not None:
+                cond_ = utils.repeat_to_batch(cond_, tf.shape(gamma)[0])
             if config.conditional == 'class':
-                gamma = tf.concat([gamma[..., tf.newaxis], labels], -1)
+                labels_ = diffusion_utils.drop_labels(labels, drop_label)
+                gamma = tf.concat([gamma[..., tf.newaxis], labels_], -1)
             elif config.conditional != 'none' and 'seq@' not in config.conditional:
                 raise ValueError(f'Unknown conditional {config.conditional}')
-            return self.denoise(x, gamma, cond, training)
+            return self.denoise(x, gamma, cond_, training)
+
+        return cond_denoise
+
+    # override for conditional data
+    def get_cached_cond_denoise(self, labels, cond=None):
+        """
+        inference only get_cond_denoise with the step cache of the tape denoiser so that
+        the conditioning frames go through the stem once per generate call instead of in every step
+        """
+        config = self.config
+        step_cache = self.denoiser_ema.get_step_cache(cond)
+
+        def cond_denoise(x, gamma, training, drop_label=False):
+            assert not training, 'the step cache is only for inference'
+            gamma = tf.reshape(gamma, [-1])
+            if config.conditional == 'class':
+                labels_ = diffusion_utils.drop_labels(labels, drop_label)
+                gamma = tf.concat([gamma[..., tf.newaxis], labels_], -1)
+            elif config.conditional != 'none' and 'seq@' not in config.conditional:
+                raise ValueError(f'Unknown conditional {config.conditional}')
+            return self.denoise(x, gamma, None, training, step_cache=step_cache)
 
         return cond_denoise
 
@@ -114,8 +144,12 @@ class Model(image_diffusion_model.Model):
             labels = None
         x_cond = kwargs['images'][:, :-self.sample_shape[0]]
         x_cond = (x_cond * 2. - 1.) * config.b_scale  # convert 0,1 -> -s,s
+        if config.get('cache_step_inputs', True):
+            cond_denoise = self.get_cached_cond_denoise(labels, cond=x_cond)
+        else:
+            cond_denoise = self.get_cond_denoise(labels, cond=x_cond)
         samples = self.scheduler.generate(
-            self.get_cond_denoise(labels, cond=x_cond),
+            cond_denoise,
             iterations,
             samples_shape,
             hidden_shapes=self.hidden_shapes,
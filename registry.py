@@ -15,6 +15,8 @@
 # ==============================================================================
 """General Registry."""
 
+import importlib
+import time
 from typing import Any
 from typing import Callable
 
@@ -24,6 +26,10 @@ class Registry(object):
 
     def __init__(self):
         self._registry = {}
+        # key -> module whose import registers the value for key.
+        self._lazy_registry = {}
+        # module -> seconds taken by its lazy import.
+        self.import_times = {}
 
     def register(self, key: str) -> Callable[[Any], None]:
         """Returns callable to register value for key."""
@@ -36,10 +42,26 @@ class Registry(object):
 
         return r
 
+    def register_lazy(self, key: str, module: str) -> None:
+        """Registers the module to import on the first lookup of key.
+
+        The module is expected to register the value for key when it is imported
+        so that only the modules actually looked up get imported.
+        """
+        if key in self._lazy_registry:
+            raise ValueError("%s already registered!" % key)
+        self._lazy_registry[key] = module
+
     def lookup(self, key: str) -> Any:
         """Looks up value for key."""
+        if key not in self._registry and key in self._lazy_registry:
+            module = self._lazy_registry[key]
+            start_t = time.time()
+            importlib.import_module(module)
+            self.import_times.setdefault(module, time.time() - start_t)
         if key not in self._registry:
-            valid_keys = "\n".join(self._registry.keys())
+            valid_keys = "\n".join(
+                sorted(set(self._registry.keys()) | set(self._lazy_registry.keys())))
             raise ValueError(
                 "%s not registered!\n\n"
                 "Valid keys:%s\n\n" %
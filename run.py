@@ -7,6 +7,8 @@ import os
 import sys
 import time
 
+startup_t = time.time()
+
 dproc_path = os.path.join(os.path.expanduser("~"), "ipsc/ipsc_data_processing")
 sys.path.append(dproc_path)
 
@@ -36,6 +38,8 @@ from tensorflow.python.framework.ops import EagerTensor
 
 EagerTensor.to_numpy = to_numpy
 
+imports_time = time.time() - startup_t
+
 
 # temp1 = tf.random.uniform((5, 5))
 # temp2 = tf.random.uniform((5, 5))
@@ -89,6 +93,17 @@ def get_worker_id(tf_config):
                              f'self_ip_addresses:\n{self_ip_addresses}')
 
 
+def print_startup_times(startup_times, registries):
+    """time spent in each startup stage and in each module imported lazily by the registries"""
+    print('startup times:')
+    for stage, stage_time in startup_times.items():
+        print(f'\t{stage}: {stage_time:.2f} s')
+    for registry_name, registry in registries.items():
+        for module, import_time in registry.import_times.items():
+            print(f'\t{registry_name}: {module}: {import_time:.2f} s')
+    print(f'\ttotal: {time.time() - startup_t:.2f} s')
+
+
 def main(unused_argv):
     # filenames = [
     #     'datasets/ipsc/well3/all_frames_roi/all_frames_roi_12094_17082_16427_20915/image146.jpg'
@@ -110,10 +125,15 @@ def main(unused_argv):
     # paramparse.process(params)
     assert FLAGS.cfg, "cfg must be provided"
 
+    startup_times = dict(imports=imports_time)
+    stage_t = time.time()
+
     import config
 
     cfg = config.load(FLAGS)
 
+    startup_times['config'] = time.time() - stage_t
+
     # if cfg.gpu:
     #     print(f'setting CUDA_VISIBLE_DEVICES to {cfg.gpu}')
     #     os.environ['CUDA_VISIBLE_DEVICES'] = cfg.gpu
@@ -165,7 +185,14 @@ def main(unused_argv):
 
     import utils
 
+    stage_t = time.time()
     strategy = utils.build_strategy(cfg.dist, cfg.use_tpu, cfg.master, cfg.training)
+    startup_times['strategy'] = time.time() - stage_t
+
+    if cfg.mixed_precision:
+        """needs to be set before any model is built"""
+        print(f'using mixed precision policy: {cfg.mixed_precision}')
+        tf.keras.mixed_precision.set_global_policy(cfg.mixed_precision)
 
     # tf.logging.set_verbosity(tf.logging.ERROR)
 
@@ -183,36 +210,17 @@ def main(unused_argv):
     # assert len(logical_devices) == len(gpus) - 1
 
     """
-    all these unused imports needed to register the various modules
+    models, tasks, datasets and metrics are registered lazily so that only the modules named in the config 
+    get imported when they are looked up
     """
+    from data import dataset as dataset_lib
     from data import datasets  # pylint: disable=unused-import
     from data import transforms, video_transforms  # pylint: disable=unused-import
-    from metrics import coco_metrics  # pylint: disable=unused-import
-    from models import ar_model  # pylint: disable=unused-import
-    from models import mhd_ar_model  # pylint: disable=unused-import
-    from models import video_ar_model  # py6lint: disable=unused-import
-    from models import image_ar_model  # pylint: disable=unused-import
-    from models import image_diffusion_model  # pylint: disable=unused-import
-    # from models import latent_diffusion_model  # pylint: disable=unused-import
-    from models import video_diffusion_model  # pylint: disable=unused-import
-    from models import image_discrete_diffusion_model  # pylint: disable=unused-import
+    from metrics import metric_registry
     from models import model as model_lib
-    from models import panoptic_diffusion  # pylint: disable=unused-import
-    # pylint: disable=unused-import
-    from tasks import captioning
-    # from tasks import image_generation
-    from tasks import instance_segmentation
-    # from tasks import keypoint_detection
-    from tasks import object_detection
-    from tasks import video_detection
-    from tasks import static_video_detection
-    from tasks import semantic_segmentation
-    from tasks import mhd_semantic_segmentation
-    from tasks import video_segmentation
-    from tasks import static_video_segmentation
-    # pylint: enable=unused-import
     from tasks import task as task_lib
 
+    stage_t = time.time()
     with strategy.scope():
         # Allow cfg override: for eval, only take one task and one dataset.
         if 'tasks' not in cfg or len(cfg.tasks) == 1 or not cfg.training:
@@ -226,20 +234,32 @@ def main(unused_argv):
         # Calculate steps stuff using last task info (assuming all tasks the same.)
         train_steps = utils.get_train_steps(
             train_dataset, cfg.train.steps, cfg.train.epochs,
-            cfg.train.batch_size)
+            cfg.train.batch_size * cfg.train.grad_accum_steps)
+
+    """imports the model module"""
+    model_lib.ModelRegistry.lookup(cfg.model.name)
+
+    startup_times['tasks_datasets_and_model'] = time.time() - stage_t
+    print_startup_times(startup_times, dict(
+        model=model_lib.ModelRegistry,
+        task=task_lib.TaskRegistry,
+        dataset=dataset_lib.DatasetRegistry,
+        metric=metric_registry.MetricRegistry,
+    ))
 
     is_seg = 'segmentation' in cfg.task.name
 
     if cfg.training:
         checkpoint_steps = utils.get_checkpoint_steps(
             train_dataset, cfg.train.checkpoint_steps,
-            cfg.train.checkpoint_epochs, cfg.train.batch_size)
+            cfg.train.checkpoint_epochs, cfg.train.batch_size * cfg.train.grad_accum_steps)
         checkpoint_steps = min(checkpoint_steps, train_steps)
 
         print()
         print(f'train.steps: {cfg.train.steps}')
         print(f'train.epochs: {cfg.train.epochs}')
         print(f'train.batch_size: {cfg.train.batch_size}')
+        print(f'train.grad_accum_steps: {cfg.train.grad_accum_steps}')
         print(f'train_steps: {train_steps}')
         print(f'checkpoint_steps: {checkpoint_steps}')
 
@@ -261,11 +281,24 @@ def main(unused_argv):
         train.run(cfg, train_datasets, val_datasets, tasks, train_steps, val_steps,
                   checkpoint_steps, train_dataset.num_train_examples, strategy, model_lib, tf)
     else:
-        with strategy.scope():
-            # Restore model checkpoint.
-            model = model_lib.ModelRegistry.lookup(cfg.model.name)(cfg)
-            checkpoint = tf.train.Checkpoint(
-                model=model, global_step=tf.Variable(0, dtype=tf.int64))
+        def build_eval_model():
+            with strategy.scope():
+                # Restore model checkpoint.
+                model = model_lib.ModelRegistry.lookup(cfg.model.name)(cfg)
+                if cfg.eval.jit_compile:
+                    """
+                    only the model inference is compiled with XLA since preprocessing and postprocessing 
+                    work with string tensors and data-dependent shapes
+                    """
+                    model.infer = tf.function(model.infer, jit_compile=True)
+                checkpoint = tf.train.Checkpoint(
+                    model=model, global_step=tf.Variable(0, dtype=tf.int64))
+            return model, checkpoint
+
+        model, checkpoint = build_eval_model()
+        """one model instance per checkpoint evaluated together in a single pass over the dataset"""
+        multi_models = [model, ]
+        multi_checkpoints = [checkpoint, ]
 
         eval_steps = utils.get_eval_steps(
             train_dataset, cfg.eval.steps, cfg.eval.batch_size)
@@ -301,6 +334,14 @@ def main(unused_argv):
 
         checkpoint_dir = os.path.abspath(checkpoint_dir)
 
+        if cfg.eval.stream.video_path:
+            """rolling-window inference on a raw video file instead of the eval dataset"""
+            import video_stream
+            ckpt = utils.get_local_ckpt(checkpoint_dir, [], cfg.eval.ckpt_iter, False)
+            assert ckpt is not None, f'no checkpoint found in {checkpoint_dir}'
+            video_stream.run(cfg, tasks[0], ckpt, strategy, model, checkpoint)
+            return
+
         evaluated_ckpts = []
 
         new_ckpt = None
@@ -331,7 +372,9 @@ def main(unused_argv):
             if cfg.eval.run_existing:
                 create_copy = cfg.eval.ckpt_copy and cfg.eval.ckpt_iter == 0 and not cfg.eval.remote
                 new_ckpt = utils.get_local_ckpt(checkpoint_dir, evaluated_ckpts,
-                                                cfg.eval.ckpt_iter, create_copy)
+                                                cfg.eval.ckpt_iter, create_copy,
+                                                oldest_ckpt_first=cfg.eval.oldest_ckpt_first,
+                                                wait_for_marker=cfg.train.async_ckpt)
                 if new_ckpt is not None:
                     print(f'found local ckpt: {new_ckpt}')
                     is_remote = False
@@ -346,7 +389,8 @@ def main(unused_argv):
                 if cfg.eval.remote:
                     new_ckpt = utils.get_remote_ckpt(
                         checkpoint_dir, cfg.eval.remote, cfg.eval.proxy, cfg.eval.ckpt_iter,
-                        oldest_ckpt_first=cfg.eval.oldest_ckpt_first)
+                        oldest_ckpt_first=cfg.eval.oldest_ckpt_first,
+                        wait_for_marker=cfg.train.async_ckpt)
                     if new_ckpt is not None:
                         print(f'found remote ckpt: {new_ckpt}')
                         is_remote = True
@@ -372,6 +416,37 @@ def main(unused_argv):
                     cfg.eval.proxy_put, tb=True)
             elif cfg.eval.defer:
                 print(f'deferring ckpt eval for later: {new_ckpt}')
+            elif cfg.eval.multi_ckpt > 1 and not cfg.eval.ckpt_iter:
+                """
+                catch up on a backlog of checkpoints by feeding each decoded and preprocessed batch 
+                to all of them
+                """
+                new_ckpts = [new_ckpt_from_tf, ]
+                while len(new_ckpts) < cfg.eval.multi_ckpt:
+                    excluded_ckpts = evaluated_ckpts + [utils.get_name(k) for k in new_ckpts]
+                    if is_remote:
+                        next_ckpt = utils.get_remote_ckpt(
+                            checkpoint_dir, cfg.eval.remote, cfg.eval.proxy,
+                            oldest_ckpt_first=cfg.eval.oldest_ckpt_first,
+                            wait_for_marker=cfg.train.async_ckpt)
+                    else:
+                        next_ckpt = utils.get_local_ckpt(checkpoint_dir, excluded_ckpts, 0, False,
+                                                         oldest_ckpt_first=cfg.eval.oldest_ckpt_first,
+                                                         wait_for_marker=cfg.train.async_ckpt)
+                    if next_ckpt is None:
+                        break
+                    print(f'found ckpt: {next_ckpt}')
+                    new_ckpts.append(next_ckpt)
+
+                while len(multi_models) < len(new_ckpts):
+                    multi_model, multi_checkpoint = build_eval_model()
+                    multi_models.append(multi_model)
+                    multi_checkpoints.append(multi_checkpoint)
+
+                eval.run_multi(cfg, train_datasets[0], tasks[0], eval_steps, new_ckpts, strategy,
+                               multi_models[:len(new_ckpts)], multi_checkpoints[:len(new_ckpts)], tf)
+
+                evaluated_ckpts += [utils.get_name(k) for k in new_ckpts[1:]]
             else:
                 out_dir = eval.run(cfg, train_datasets[0], tasks[0], eval_steps, new_ckpt_from_tf, strategy,
                                    model, checkpoint, tf)
@@ -0,0 +1,126 @@
+"""Columnar accumulator for the per-sequence detection csv files written during evaluation."""
+
+import collections
+import os
+
+import numpy as np
+
+
+def to_csv_strings(values):
+    """
+    converts a column to strings in a single vectorized call;
+    string columns only have a few unique values like image IDs and class names so those are checked for
+    characters that need quoting
+    """
+    values = np.asarray(values)
+    if values.dtype.kind == 'O':
+        """object columns like lists of bytes or str are decoded like the bytes columns"""
+        strings = np.asarray([v.decode() if isinstance(v, bytes) else str(v) for v in values.tolist()],
+                             dtype=str)
+    else:
+        strings = values.astype(str)
+    if values.dtype.kind not in 'USO':
+        return strings
+    unique_strings, inverse = np.unique(strings, return_inverse=True)
+    needs_quotes = [any(c in s for c in ',"\n\r') for s in unique_strings.tolist()]
+    if any(needs_quotes):
+        quoted = [('"' + s.replace('"', '""') + '"') if q else s
+                  for s, q in zip(unique_strings.tolist(), needs_quotes)]
+        strings = np.asarray(quoted, dtype=str)[inverse]
+    return strings
+
+
+class ColumnarCSVWriter:
+    """
+    accumulates the csv rows of each sequence as one array per column that are appended once per image or video
+    and written out with a single vectorized write per sequence on each flush;
+    optionally also saves all the columns of each sequence to a npz file on close
+    """
+
+    def __init__(self, out_dir, columns, save_npz=False):
+        self.out_dir = out_dir
+        self.columns = list(columns)
+        self.save_npz = save_npz
+
+        self._pending = collections.OrderedDict()
+        self._written = set()
+        self._npz_chunks = collections.defaultdict(list)
+
+    def __contains__(self, seq_id):
+        return seq_id in self._pending
+
+    def add_sequence(self, seq_id):
+        """
+        sequences that never get any boxes still get a csv file with only the header
+        to avoid missing csv files causing eval problems later
+        """
+        if seq_id not in self._pending:
+            self._pending[seq_id] = []
+
+    def append(self, seq_id, **columns):
+        """
+        columns: column name to 1-D array with one entry per row or scalar shared by all rows;
+        columns not provided are left empty
+        """
+        self.add_sequence(seq_id)
+
+        n_rows = max((np.size(v) for v in columns.values() if np.ndim(v) > 0), default=1)
+        if n_rows == 0:
+            return
+
+        chunk = {}
+        for name, values in columns.items():
+            assert name in self.columns, f'invalid csv column: {name}'
+            if np.ndim(values) == 0:
+                values = np.full(n_rows, values)
+            values = np.asarray(values)
+            assert values.shape == (n_rows,), f'{name}: expected {n_rows} rows but got {values.shape}'
+            chunk[name] = values
+
+        self._pending[seq_id].append(chunk)
+        if self.save_npz:
+            self._npz_chunks[seq_id].append(chunk)
+
+    def flush(self):
+        """writes the pending rows of every sequence and creates the csv files of new sequences"""
+        os.makedirs(self.out_dir, exist_ok=True)
+        for seq_id, chunks in self._pending.items():
+            out_csv_path = os.path.join(self.out_dir, f"{seq_id}.csv")
+
+            if seq_id not in self._written:
+                mode = 'w'
+                text = ','.join(self.columns) + '\n'
+                self._written.add(seq_id)
+            elif not chunks:
+                continue
+            else:
+                mode = 'a'
+                text = ''
+
+            if chunks:
+                n_rows = [len(next(iter(chunk.values()))) for chunk in chunks]
+                str_columns = []
+                for name in self.columns:
+                    col_chunks = [chunk[name] if name in chunk else np.full(n, '')
+                                  for chunk, n in zip(chunks, n_rows)]
+                    str_columns.append(to_csv_strings(np.concatenate(col_chunks)).tolist())
+                text += '\n'.join(map(','.join, zip(*str_columns))) + '\n'
+
+            with open(out_csv_path, mode) as fid:
+                fid.write(text)
+
+            self._pending[seq_id] = []
+
+    def close(self):
+        self.flush()
+        if not self.save_npz:
+            return
+        for seq_id in self._pending:
+            chunks = self._npz_chunks[seq_id]
+            columns = {}
+            for name in self.columns:
+                col_chunks = [chunk[name] for chunk in chunks if name in chunk]
+                if col_chunks:
+                    columns[name] = np.concatenate(col_chunks)
+            out_npz_path = os.path.join(self.out_dir, f"{seq_id}.npz")
+            np.savez(out_npz_path, **columns)
@@ -36,7 +36,9 @@ class TaskImageGeneration(task_lib.Task):  # pytype: disable=base-class-error
     self._metrics['eval_loss'] = tf.keras.metrics.Mean('eval_loss')
     self._tfgan_evaluator = TFGANMetricEvaluator(
         dataset_name=config.dataset.tfds_name,
-        image_size=config.dataset.image_size)
+        image_size=config.dataset.image_size,
+        split=config.dataset.eval_split,
+        ref_stats_dir=config.eval.get('ref_stats_dir', ''))
 
     self._write_images_to_file = config.eval.get('write_images_to_file', False)
     if self._write_images_to_file:
@@ -115,6 +117,14 @@ class TaskImageGeneration(task_lib.Task):  # pytype: disable=base-class-error
       samples = outputs
     return examples, samples
 
+  def get_real_data(self, examples):
+    """Returns the ground-truth images or None if not in the dataset."""
+    if 'original_image' in examples:
+      return examples['original_image']
+    elif examples['image'].shape[-1] == 3:
+      return examples['image']
+    return None
+
   def postprocess_tpu(self,
                       examples,
                       samples,
@@ -136,19 +146,14 @@ class TaskImageGeneration(task_lib.Task):  # pytype: disable=base-class-error
       results for passing to `postprocess_cpu` which runs in CPU mode.
     """
     logging.info('Start postprocess_tpu.')
-    # Get ground-truth images.
-    if 'original_image' in examples:
-      images = examples['original_image']
-    elif examples['image'].shape[-1] == 3:
-      images = examples['image']
-    else:  # ground-truth images not available in the dataset.
+    images = self.get_real_data(examples)
+    if images is None:  # ground-truth images not available in the dataset.
       images = samples
 
     # FID
-    data_real, data_gen = self._tfgan_evaluator.preprocess_inputs(
-        [images, samples], is_n1p1=False)
     (logits_real, pool3_real), (logits_gen, pool3_gen) = (
-        self._tfgan_evaluator.get_inception_stats([data_real, data_gen]))
+        self._tfgan_evaluator.get_real_and_gen_stats(
+            images, samples, is_n1p1=False))
 
     logging.info('postprocess_tpu done.')
     return (images, samples, logits_real, pool3_real, logits_gen, pool3_gen)
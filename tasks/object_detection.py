@@ -149,6 +149,11 @@ class TaskObjectDetection(task_lib.Task):
             max_seq_len=(config.max_instances_per_image_test * 5 + 1),
             temperature=config.temperature, top_k=config.top_k, top_p=config.top_p)
 
+        if config.get('presliced_logits', 0):
+            # Only the class logits are needed for decoding.
+            logits = task_utils.gather_class_logits(
+                logits, 5, self.config.model.coord_vocab_shift)
+
         # if self.config.validation:
         #     from models import model_utils
         #
@@ -190,7 +195,8 @@ class TaskObjectDetection(task_lib.Task):
           batched_examples: a tuple of features (`dict`) and labels (`dict`),
             containing images and labels.
           pred_seq: `int` sequence of shape (bsz, seqlen').
-          logits: `float` sequence of shape (bsz, seqlen', vocab_size).
+          logits: `float` sequence of shape (bsz, seqlen', vocab_size) or the
+            output of `task_utils.gather_class_logits` if presliced_logits is set.
           training: `bool` indicating training or inference mode.
 
         Returns:
@@ -204,8 +210,12 @@ class TaskObjectDetection(task_lib.Task):
         unpadded_image_size = example['unpadded_image_size']
 
         # Decode sequence output.
+        class_logits = None
+        if config.get('presliced_logits', 0):
+            logits, class_logits = None, logits
         pred_classes, pred_bboxes, scores = task_utils.decode_object_seq_to_bbox(
-            logits, pred_seq, config.quantization_bins, mconfig.coord_vocab_shift)
+            logits, pred_seq, config.quantization_bins, mconfig.coord_vocab_shift,
+            class_logits=class_logits)
 
         # Compute coordinate scaling from [0., 1.] to actual pixels in orig image.
         image_size = images.shape[1:3].as_list()
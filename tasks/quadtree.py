@@ -101,10 +101,12 @@ def depth_sub(previous_map, current_map):
     return current_map - previous_map
 
 
-def dense2quad(raw_map, num_levels=6, return_255=False):
+def dense2quad_loop(raw_map, num_levels=6, return_255=False):
     '''
     raw_map: input is raw segmentation map
     out_map: output is quadtree output representation
+
+    Reference implementation that visits every node in Python, see dense2quad
     '''
     size_x = raw_map.shape[0]
     size_y = raw_map.shape[1]
@@ -125,4 +127,72 @@ def dense2quad(raw_map, num_levels=6, return_255=False):
                     level_map[x, y] = node_val_inter(raw_map, given_level, num_levels, (x, y), out_map[given_level - 1],
                                                      return_255)
         out_map[given_level] = level_map
-    return out_map
\ No newline at end of file
+    return out_map
+
+
+def block_min_max(min_map, max_map):
+    '''
+    Input:
+        min_map, max_map: per-node min and max of one level
+    Output:
+        min_map, max_map: per-node min and max of the next coarser level, where each node covers 2x2 nodes
+    '''
+    res_x = min_map.shape[0] // 2
+    res_y = min_map.shape[1] // 2
+    min_map = min_map.reshape(res_x, 2, res_y, 2).min(axis=(1, 3))
+    max_map = max_map.reshape(res_x, 2, res_y, 2).max(axis=(1, 3))
+    return min_map, max_map
+
+
+def dense2quad(raw_map, num_levels=6, return_255=False):
+    '''
+    raw_map: input is raw segmentation map
+    out_map: output is quadtree output representation
+
+    Same output as dense2quad_loop, but the block min/max of every level are derived from the next finer level
+    so that the whole tree is built in O(pixels) array operations
+    '''
+    raw_map = np.asarray(raw_map)
+    size_x = raw_map.shape[0]
+    size_y = raw_map.shape[1]
+
+    init_res_x = int(size_x / np.power(2, num_levels - 1))
+    init_res_y = int(size_y / np.power(2, num_levels - 1))
+
+    # pixels beyond the last full window are not covered by any node
+    min_map = max_map = raw_map[:init_res_x * np.power(2, num_levels - 1), :init_res_y * np.power(2, num_levels - 1)]
+
+    # values of uniform windows and -1 elsewhere for each level, finest first
+    node_maps = {}
+    for given_level in range(num_levels, 0, -1):
+        if given_level < num_levels:
+            min_map, max_map = block_min_max(min_map, max_map)
+        node_maps[given_level] = np.where(min_map == max_map, min_map, -1).astype(np.float32)
+
+    out_map = {1: node_maps[1]}
+    for given_level in range(2, num_levels + 1):
+        last_map = out_map[given_level - 1].repeat(2, axis=0).repeat(2, axis=1)
+        if return_255:
+            last_val = np.float32(255)
+        else:
+            last_val = last_map
+        out_map[given_level] = np.where(last_map >= 0, last_val, node_maps[given_level])
+    return out_map
+
+
+def quad2dense(out_map):
+    '''
+    Input:
+        out_map: quadtree representation from dense2quad with either value of return_255
+    Output:
+        dense_map: segmentation map at the resolution of the finest level
+
+    Every node takes the value of its coarsest ancestor with a uniform window so that the nodes below it, which
+    may be set to 255, are never read
+    '''
+    num_levels = max(out_map.keys())
+    dense_map = out_map[1]
+    for given_level in range(2, num_levels + 1):
+        dense_map = dense_map.repeat(2, axis=0).repeat(2, axis=1)
+        dense_map = np.where(dense_map >= 0, dense_map, out_map[given_level])
+    return dense_map
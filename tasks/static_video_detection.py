@@ -171,6 +171,15 @@ class TaskStaticVideoDetection(task_lib.Task):
             max_seq_len=config.max_seq_len_test,
             temperature=config.temperature, top_k=config.top_k, top_p=config.top_p)
 
+        if config.get('presliced_logits', 0):
+            """
+            only the class logits of each object are needed for decoding so the full logits are reduced
+            right after inference instead of being carried over to postprocess_tpu
+            """
+            logits = task_utils.gather_class_logits(
+                logits, task_utils.get_bbox_seq_len(self.vid_len, config.coords_1d),
+                self.config.model.coord_vocab_shift)
+
         return examples, pred_seq, logits
 
     def postprocess_tpu(self, batched_examples, pred_seq, logits, training=False):
@@ -188,8 +197,12 @@ class TaskStaticVideoDetection(task_lib.Task):
         unpadded_video_size = example['unpadded_video_size']
 
         # Decode sequence output.
+        class_logits = None
+        if config.get('presliced_logits', 0):
+            logits, class_logits = None, logits
         pred_classes, pred_bboxes, scores = task_utils.decode_video_seq_to_bbox(
-            logits, pred_seq, self.vid_len, config.quantization_bins, config.coords_1d, mconfig.coord_vocab_shift)
+            logits, pred_seq, self.vid_len, config.quantization_bins, config.coords_1d, mconfig.coord_vocab_shift,
+            class_logits=class_logits)
 
         # Compute coordinate scaling from [0., 1.] to actual pixels in orig image.
         image_size = images.shape[1:3].as_list()
@@ -26,6 +26,29 @@ import tensorflow as tf
 
 TaskRegistry = registry.Registry()
 
+"""
+modules that register each task, only imported when the task name is looked up
+"""
+_TASK_MODULES = {
+    'captioning': 'tasks.captioning',
+    'image_generation': 'tasks.image_generation',
+    'instance_segmentation': 'tasks.instance_segmentation',
+    'keypoint_detection': 'tasks.keypoint_detection',
+    'mhd_semantic_segmentation': 'tasks.mhd_semantic_segmentation',
+    'object_detection': 'tasks.object_detection',
+    'object_recognition': 'tasks.recognition',
+    'panoptic_segmentation': 'tasks.panoptic_segmentation',
+    'semantic_segmentation': 'tasks.semantic_segmentation',
+    'static_video_detection': 'tasks.static_video_detection',
+    'static_video_segmentation': 'tasks.static_video_segmentation',
+    'video_detection': 'tasks.video_detection',
+    'video_generation': 'tasks.video_generation',
+    'video_panoptic_segmentation': 'tasks.video_panoptic_segmentation',
+    'video_segmentation': 'tasks.video_segmentation',
+}
+for _name, _module in _TASK_MODULES.items():
+    TaskRegistry.register_lazy(_name, _module)
+
 
 class Task(abc.ABC):
     """Task class.
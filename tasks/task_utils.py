@@ -5235,6 +5235,47 @@ def decode_instance_seq_to_points(seq, quantization_bins, coord_vocab_shift):
     return utils.replace_reserved_tokens(points, seq, vocab.TOKEN_TO_FLOAT)
 
 
+def get_bbox_seq_len(vid_len, coords_1d):
+    """number of tokens per object: the coordinates of the box in each frame followed by the class"""
+    n_bbox_tokens = 2 if coords_1d else 4
+    return vid_len * n_bbox_tokens + 1
+
+
+def gather_class_logits(logits, bbox_seq_len, coord_vocab_shift):
+    """
+    extract logits of all objects - the last of every bbox_seq_len tokens - and reduce them to
+    the logits of the class tokens along with the log of the softmax normalizer over the full vocab
+    so that the softmax is never computed over the coordinate positions or the non-class vocab
+
+    this can be done right after inference so that the full logits do not need to be kept around
+
+    Args:
+      logits: `float` of shape (bsz, seqlen, vocab_size); any incomplete object at the end is ignored
+      bbox_seq_len: `int` number of tokens per object
+      coord_vocab_shift: `int`, class tokens are in [vocab.BASE_VOCAB_SHIFT, coord_vocab_shift)
+
+    Returns:
+      class_logits: `float` of shape (bsz, instances, coord_vocab_shift - vocab.BASE_VOCAB_SHIFT)
+      log_norm: `float` of shape (bsz, instances)
+    """
+    obj_logits = logits[:, bbox_seq_len - 1::bbox_seq_len]  # (bsz, instances, vocab_size)
+    log_norm = tf.reduce_logsumexp(obj_logits, -1)
+    class_logits = obj_logits[..., vocab.BASE_VOCAB_SHIFT:coord_vocab_shift]
+    return class_logits, log_norm
+
+
+def decode_class_logits(class_logits, log_norm):
+    """
+    this is where the claims of automatically learning domain-specific tokens breaks down - we simply select the 
+    class with the max prob even if some non-class token has higher prob than the max-prob class
+
+    the score of each object is the softmax prob of its class over the full vocab
+    """
+    class_ids = tf.argmax(class_logits, -1)
+    scores = tf.exp(tf.reduce_max(class_logits, -1) - log_norm)
+    return class_ids, scores
+
+
 def decode_video_seq_to_bbox(
         logits,
         seq,
@@ -5243,47 +5284,29 @@ def decode_video_seq_to_bbox(
         coords_1d,
         coord_vocab_shift,
         seq_mask=None,
+        class_logits=None,
 ):
-    _, seqlen, vocab_size = logits.shape
+    """
+    class_logits: optional output of gather_class_logits to use instead of logits which can then be None
+    """
+    seqlen = seq.shape[1]
 
     if seq_mask is not None:
         seq = tf.where(seq_mask, seq, tf.cast(-1, seq.dtype))
 
-    n_bbox_tokens = 2 if coords_1d else 4
-    bbox_seq_len = vid_len * n_bbox_tokens + 1
+    bbox_seq_len = get_bbox_seq_len(vid_len, coords_1d)
 
     # truncate out the last few tokens
     if seqlen % bbox_seq_len != 0:
         truncate_len = seqlen % bbox_seq_len
         seq = seq[..., :-truncate_len]
-        logits = logits[..., :-truncate_len, :]
         if seq_mask is not None:
             seq_mask = seq_mask[..., :-truncate_len]
 
-    """
-    extract probs for all classes - starting from 5th element and extracting every fifth element from there
-    """
-    probs = tf.nn.softmax(logits)
-    class_probs = probs[:, bbox_seq_len - 1::bbox_seq_len]  # (bsz, instances, vocab_size)
-    """
-    mask-out non-class portions of the vocab
-    """
-    mask_s1 = [0.] * vocab.BASE_VOCAB_SHIFT  # reserved.
-    mask_s2 = [1.] * (coord_vocab_shift - vocab.BASE_VOCAB_SHIFT)  # labels.
-    mask_s3 = [0] * (vocab_size - coord_vocab_shift)  # coordinates and others.
-    mask = tf.constant(mask_s1 + mask_s2 + mask_s3)
-    """
-    this is where the claims of automatically learning domain-specific tokens breaks down - we simply select the 
-    class with the max prob even if some non-class token has higher prob than the max-prob class
-    """
-    class_tokens = tf.argmax(class_probs * mask[tf.newaxis, tf.newaxis, :], -1)
-    """
-    round-about way of selecting the class prob of each bbox as its score
-    """
-    # scores = tf.reduce_sum(class_probs * tf.one_hot(class_tokens, vocab_size), -1)
-    scores = tf.gather_nd(class_probs, class_tokens[:, :, tf.newaxis], batch_dims=2)
+    if class_logits is None:
+        class_logits = gather_class_logits(logits, bbox_seq_len, coord_vocab_shift)
+    class_ids, scores = decode_class_logits(*class_logits)
 
-    class_ids = tf.maximum(class_tokens - vocab.BASE_VOCAB_SHIFT, 0)
     bboxes, _ = seq_to_video_bbox(seq, quantization_bins, coords_1d, vid_len, coord_vocab_shift)
     return class_ids, bboxes, scores
 
@@ -5384,7 +5407,8 @@ def seq_to_video_bbox(seq, quantization_bins, coords_1d, vid_len, coord_vocab_sh
 def decode_object_seq_to_bbox(logits,
                               pred_seq,
                               quantization_bins,
-                              coord_vocab_shift):
+                              coord_vocab_shift,
+                              class_logits=None):
     """Decode objects (label & bbox) for seq from `build_response_seq_from_bbox`.
 
     Assume yxyxc format with truncation at the end for any uneven extra tokens.
@@ -5395,40 +5419,22 @@ def decode_object_seq_to_bbox(logits,
       pred_seq: `int` pred sequence in shape of (bsz, max_seq_len).
       quantization_bins: `int` for bins.
       coord_vocab_shift: `int`, shifting coordinates by a specified integer.
+      class_logits: optional output of `gather_class_logits` to use instead of
+        logits which can then be None.
 
     Returns:
       pred_class: `int` of shape (bsz, max_instances_per_image).
       pred_bbox: `float` of shape (bsz, max_instances_per_image, 4).
       pred_score: `float` of shape (bsz, max_instances_per_image).
     """
-    _, seqlen, vocab_size = logits.shape
+    seqlen = pred_seq.shape[1]
     if seqlen % 5 != 0:  # truncate out the last few tokens.
         pred_seq = pred_seq[..., :-(seqlen % 5)]
-        logits = logits[..., :-(seqlen % 5), :]
-    """
-    extract probs for all classes - starting from 5th element and extracting every fifth element from there
-    """
-    pred_class_p = tf.nn.softmax(logits)[:, 4::5]  # (bsz, instances, vocab_size)
 
-    """
-    mask-out non-class portions of the vocab
-    """
-    mask_s1 = [0.] * vocab.BASE_VOCAB_SHIFT  # reserved.
-    mask_s2 = [1.] * (coord_vocab_shift - vocab.BASE_VOCAB_SHIFT)  # labels.
-    mask_s3 = [0] * (vocab_size - coord_vocab_shift)  # coordinates and others.
-    mask = tf.constant(mask_s1 + mask_s2 + mask_s3)
-    """
-    this is where the claims of automatically learning domain-specific tokens breaks down - we simply select the 
-    class with the max prob even if some non-class token has higher prob than the max-prob class
-    """
-    pred_class = tf.argmax(pred_class_p * mask[tf.newaxis, tf.newaxis, :], -1)
+    if class_logits is None:
+        class_logits = gather_class_logits(logits, 5, coord_vocab_shift)
+    pred_class, pred_score = decode_class_logits(*class_logits)
 
-    """
-    round-about way of selecting the class prob of each bbox as its score
-    """
-    pred_score = tf.reduce_sum(
-        pred_class_p * tf.one_hot(pred_class, vocab_size), -1)
-    pred_class = tf.maximum(pred_class - vocab.BASE_VOCAB_SHIFT, 0)
     pred_bbox = seq_to_bbox(pred_seq - coord_vocab_shift, quantization_bins)
     return pred_class, pred_bbox, pred_score
 
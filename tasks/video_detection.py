@@ -183,10 +183,25 @@ class TaskVideoDetection(task_lib.Task):
             self.task_vocab_id,
             prompt_shape=(bsz, 1))
 
+        infer_kwargs = {}
+        if 'frame_tokens' in examples:
+            """backbone features of the frames cached by the rolling-window inference in video_stream"""
+            infer_kwargs['frame_tokens'] = examples['frame_tokens']
+
         pred_seq, logits, encoded = model.infer(
             videos, prompt_seq, encoded=None,
             max_seq_len=config.max_seq_len_test,
-            temperature=config.temperature, top_k=config.top_k, top_p=config.top_p)
+            temperature=config.temperature, top_k=config.top_k, top_p=config.top_p,
+            **infer_kwargs)
+
+        if config.get('presliced_logits', 0):
+            """
+            only the class logits of each object are needed for decoding so the full logits are reduced
+            right after inference instead of being carried over to postprocess_tpu
+            """
+            logits = task_utils.gather_class_logits(
+                logits, task_utils.get_bbox_seq_len(self.vid_len, config.coords_1d),
+                self.config.model.coord_vocab_shift)
 
         # if self.config.debug:
         #     bbox_info_gt_infer, bbox_info_pred_infer = vis_utils.debug_loss(
@@ -212,8 +227,12 @@ class TaskVideoDetection(task_lib.Task):
         unpadded_video_size = example['unpadded_video_size']
 
         # Decode sequence output.
+        class_logits = None
+        if config.get('presliced_logits', 0):
+            logits, class_logits = None, logits
         pred_classes, pred_bboxes, scores = task_utils.decode_video_seq_to_bbox(
-            logits, pred_seq, self.vid_len, config.quantization_bins, config.coords_1d, mconfig.coord_vocab_shift)
+            logits, pred_seq, self.vid_len, config.quantization_bins, config.coords_1d, mconfig.coord_vocab_shift,
+            class_logits=class_logits)
 
         # Compute coordinate scaling from [0., 1.] to actual pixels in orig image.
         image_size = videos.shape[2:4].as_list()
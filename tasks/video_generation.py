@@ -32,7 +32,11 @@ class TaskVideoGeneration(task_lib.Task):  # pytype: disable=base-class-error
     self._metrics = {}
     self._tfgan_evaluator = fvd.FVDMetricEvaluator(
         dataset_name=config.dataset.tfds_name,
-        image_size=config.dataset.image_size)
+        image_size=config.dataset.image_size,
+        split=config.dataset.eval_split,
+        ref_stats_dir=config.eval.get('ref_stats_dir', ''),
+        clip_len=config.eval.get('fvd_clip_len', 0),
+        clip_stride=config.eval.get('fvd_clip_stride', 0))
 
   def preprocess_single(self, dataset, batch_duplicates, training):
     """Task-specific preprocessing of individual example in the dataset.
@@ -100,6 +104,11 @@ class TaskVideoGeneration(task_lib.Task):  # pytype: disable=base-class-error
         **kwargs)
     return examples, samples
 
+  def get_real_data(self, batched_examples):
+    """Returns the ground-truth videos."""
+    features, _ = batched_examples
+    return features['video']
+
   def postprocess_tpu(self,
                       batched_examples,
                       samples,
@@ -119,18 +128,21 @@ class TaskVideoGeneration(task_lib.Task):  # pytype: disable=base-class-error
       training: `bool` indicating training or inference mode.
 
     Returns:
-      results for passing to `postprocess_cpu` which runs in CPU mode.
+      results for passing to `postprocess_cpu` which runs in CPU mode; only the
+        real and generated videos if the FVD is computed on clips.
     """
     logging.info('Start postprocess_tpu.')
-    features, labels = batched_examples
-    videos = features['video']
-    labels = tf.argmax(labels['label'], -1)
+    videos = self.get_real_data(batched_examples)
+
+    if self._tfgan_evaluator.clip_len > 0:
+      # The clips are streamed into the FVD stats in postprocess_cpu.
+      logging.info('postprocess_tpu done.')
+      return (videos, samples)
 
     # FID
-    data_real, data_gen = self._tfgan_evaluator.preprocess_inputs(
-        [videos, samples], is_n1p1=False)
     (logits_real, pool3_real), (logits_gen, pool3_gen) = (
-        self._tfgan_evaluator.get_inception_stats([data_real, data_gen]))
+        self._tfgan_evaluator.get_real_and_gen_stats(
+            videos, samples, is_n1p1=False))
 
     logging.info('postprocess_tpu done.')
     return (videos, samples, logits_real, pool3_real, logits_gen, pool3_gen)
@@ -157,11 +169,19 @@ class TaskVideoGeneration(task_lib.Task):  # pytype: disable=base-class-error
       A dict of visualization videos if ret_results, else None.
     """
     logging.info('Start postprocess_cpu')
-    videos, samples, logits_real, pool3_real, logits_gen, pool3_gen = outputs
+    if self._tfgan_evaluator.clip_len > 0:
+      videos, samples = outputs
+      # FVD update with the clips of the real and generated videos.
+      self._tfgan_evaluator.update_stats_from_videos(
+          tf.unstack(videos), is_real=True)
+      self._tfgan_evaluator.update_stats_from_videos(
+          tf.unstack(samples), is_real=False)
+    else:
+      videos, samples, logits_real, pool3_real, logits_gen, pool3_gen = outputs
 
-    # FID update.
-    self._tfgan_evaluator.update_stats(
-        logits_real, pool3_real, logits_gen, pool3_gen)
+      # FID update.
+      self._tfgan_evaluator.update_stats(
+          logits_real, pool3_real, logits_gen, pool3_gen)
 
     # videos summary.
     bsz, t, h, w, c = utils.shape_as_list(samples)
@@ -1531,6 +1531,14 @@ def save_image_in_zip(image, out_path, fmt='PNG'):
         zf.writestr(zipped_filename, image_file.getvalue())
 
 
+def get_class_names(classes, category_index):
+    """class names of all the boxes with a single lookup per unique class"""
+    unique_classes, inverse = np.unique(classes, return_inverse=True)
+    class_names = [category_index[class_id]['name'] if class_id in six.viewkeys(category_index) else 'invalid'
+                   for class_id in unique_classes]
+    return np.asarray(class_names, dtype=str)[inverse]
+
+
 def visualize_boxes_and_labels_on_image_array(
         image_id,
         image,
@@ -1566,38 +1574,33 @@ def visualize_boxes_and_labels_on_image_array(
     if masks is not None:
         assert bboxes is None and bboxes_rescaled is None, \
             "both instance masks and boxes should not be provided"
-        bboxes = []
-        bboxes_rescaled = []
-        valid_masks = []
-        valid_classes = []
-        valid_scores = []
-
-        for obj_id, (mask_, class_, score_) in enumerate(zip(masks, classes, scores, strict=True)):
-            y, x = np.nonzero(mask_)
-            if x.size == 0:
-                continue
-
-            max_y, min_y = np.amax(y), np.amin(y)
-            max_x, min_x = np.amax(x), np.amin(x)
-
-            orig_h, orig_w = orig_size
-            mask_h, mask_w = mask_.shape[:2]
-            norm_h, norm_w = 1. / float(mask_h), 1. / float(mask_w)
-            scale_h, scale_w = float(orig_h) * norm_h, float(orig_w) * norm_w
-
-            bbox = np.asarray([min_y * norm_h, min_x * norm_w, max_y * norm_h, max_x * norm_w])
-            bbox_rescaled = np.asarray([min_y * scale_h, min_x * scale_w, max_y * scale_h, max_x * scale_w])
-            bboxes.append(bbox)
-            bboxes_rescaled.append(bbox_rescaled)
-            valid_masks.append(mask_)
-            valid_classes.append(class_)
-            valid_scores.append(score_)
-
-        bboxes = np.asarray(bboxes)
-        bboxes_rescaled = np.asarray(bboxes_rescaled)
-        masks = np.asarray(valid_masks)
-        classes = np.asarray(valid_classes)
-        scores = np.asarray(valid_scores)
+        assert len(masks) == len(classes) == len(scores), "masks, classes and scores must have the same length"
+        masks = np.asarray(masks)
+        if len(masks) == 0:
+            """images without any predicted instances have masks of shape (0,)"""
+            masks = np.reshape(masks, (0, 1, 1))
+        mask_h, mask_w = masks.shape[1:3]
+
+        """bounding boxes of all the masks from the rows and columns with any mask pixels"""
+        mask_rows = np.any(masks != 0, axis=2)
+        mask_cols = np.any(masks != 0, axis=1)
+        is_valid = np.any(mask_rows, axis=1)
+
+        min_y = np.argmax(mask_rows, axis=1)
+        max_y = mask_h - 1 - np.argmax(mask_rows[:, ::-1], axis=1)
+        min_x = np.argmax(mask_cols, axis=1)
+        max_x = mask_w - 1 - np.argmax(mask_cols[:, ::-1], axis=1)
+        yxyx = np.stack([min_y, min_x, max_y, max_x], axis=1)[is_valid].astype(np.float64)
+
+        orig_h, orig_w = orig_size
+        norm = np.asarray([1. / float(mask_h), 1. / float(mask_w)] * 2)
+        scale = norm * np.asarray([float(orig_h), float(orig_w)] * 2)
+
+        bboxes = yxyx * norm
+        bboxes_rescaled = yxyx * scale
+        masks = masks[is_valid]
+        classes = np.asarray(classes)[is_valid]
+        scores = np.asarray(scores)[is_valid]
     else:
         assert bboxes is not None and bboxes_rescaled is not None, \
             "both instance masks and boxes cannot be None"
@@ -1607,19 +1610,18 @@ def visualize_boxes_and_labels_on_image_array(
     box_id_to_display_str = collections.defaultdict(list)
     box_id_to_color = collections.defaultdict(str)
     box_id_to_orig = {}
-    box_id_to_rescaled = {}
-    box_id_to_class = {}
     box_id_to_masks = {}
-    box_id_to_scores = {}
 
     # box_id_to_instance_masks = {}
     # box_id_to_instance_boundaries = {}
     # box_id_to_keypoints = collections.defaultdict(list)
     # box_id_to_track_ids = {}
     """
-    Collect supplementary information for each bounding box including instance mask, key points, track IDs, colour
+    Collect supplementary information for each bounding box including instance mask, key points, track IDs, colour 
+    that is only needed for drawing
     """
-    for box_id in range(bboxes.shape[0]):
+    n_vis_boxes = bboxes.shape[0] if out_vis_dir is not None else 0
+    for box_id in range(n_vis_boxes):
         class_id = classes[box_id]
 
         if masks is not None:
@@ -1637,9 +1639,7 @@ def visualize_boxes_and_labels_on_image_array(
         else:
             class_name = 'invalid'
 
-        box_id_to_class[box_id] = class_name
         box_id_to_orig[box_id] = tuple(bboxes[box_id].tolist())
-        box_id_to_rescaled[box_id] = tuple(bboxes_rescaled[box_id].tolist())
 
         display_str = ''
 
@@ -1655,10 +1655,7 @@ def visualize_boxes_and_labels_on_image_array(
                     box_id_to_color[box_id] = STANDARD_COLORS[classes[box_id] %
                                                               len(STANDARD_COLORS)]
 
-        if scores is None:
-            box_id_to_scores[box_id] = 1.0
-        else:
-            box_id_to_scores[box_id] = scores[box_id]
+        if scores is not None:
             if not skip_labels:
                 if not agnostic_mode:
                     display_str = str(class_name)
@@ -1681,51 +1678,45 @@ def visualize_boxes_and_labels_on_image_array(
     if '/' in image_id_:
         seq_id, image_id_ = image_id_.split('/')
 
-    """add empty csv data for sequences that don't get any output boxes to 
-    avoid missing csv files causing eval problems later"""
-    if csv_data is not None and seq_id not in csv_data:
-        csv_data[seq_id] = []
-
     if not image_id_.endswith(img_ext):
         image_id_ += img_ext
 
+    if csv_data is not None:
+        if csv_normalized:
+            ymin_, xmin_, ymax_, xmax_ = np.moveaxis(np.reshape(bboxes, (-1, 4)), 1, 0)
+        else:
+            ymin_, xmin_, ymax_, xmax_ = np.moveaxis(np.reshape(bboxes_rescaled, (-1, 4)), 1, 0)
+        csv_columns = dict(
+            ImageID=image_id_,
+            LabelName=get_class_names(classes, category_index),
+            XMin=xmin_,
+            XMax=xmax_,
+            YMin=ymin_,
+            YMax=ymax_,
+            Confidence=1.0 if scores is None else scores,
+        )
+        if masks is not None:
+            # mask_uint8 = mask.astype(np.uint8)
+            # mask_uint8_res = task_utils.resize_mask(mask_uint8, image.shape)
+            # mask_res = mask_uint8_res == 0
+            instance_rles_coco = [mask_img_to_rle_coco(mask) for mask in masks]
+            csv_columns.update(
+                mask_h=np.asarray([rle['size'][0] for rle in instance_rles_coco], dtype=np.int64),
+                mask_w=np.asarray([rle['size'][1] for rle in instance_rles_coco], dtype=np.int64),
+                mask_counts=np.asarray([rle['counts'] for rle in instance_rles_coco], dtype=str),
+            )
+        """
+        sequences that don't get any output boxes still get an empty csv file 
+        to avoid missing csv files causing eval problems later
+        """
+        csv_data.append(seq_id, **csv_columns)
+
     for box_id, color in box_id_to_color.items():
         box_orig = box_id_to_orig[box_id]
         ymin, xmin, ymax, xmax = box_orig
         mask = None
-
-        if csv_data is not None:
-            score = box_id_to_scores[box_id]
-            label = box_id_to_class[box_id]
-
-            box_rescaled = box_id_to_rescaled[box_id]
-
-            if csv_normalized:
-                ymin_, xmin_, ymax_, xmax_ = ymin, xmin, ymax, xmax
-            else:
-                ymin_, xmin_, ymax_, xmax_ = box_rescaled
-            row = {
-                "ImageID": image_id_,
-                "LabelName": label,
-                "XMin": xmin_,
-                "XMax": xmax_,
-                "YMin": ymin_,
-                "YMax": ymax_,
-                "Confidence": score,
-            }
-            if masks is not None:
-                mask = box_id_to_masks[box_id]
-                # mask_uint8 = mask.astype(np.uint8)
-                # mask_uint8_res = task_utils.resize_mask(mask_uint8, image.shape)
-                # mask_res = mask_uint8_res == 0
-                instance_rle_coco = mask_img_to_rle_coco(mask)
-                mask_h, mask_w = instance_rle_coco['size']
-                row["mask_h"] = mask_h
-                row["mask_w"] = mask_w
-                mask_counts = instance_rle_coco['counts']
-                row["mask_counts"] = mask_counts
-
-            csv_data[seq_id].append(row)
+        if csv_data is not None and masks is not None:
+            mask = box_id_to_masks[box_id]
 
         # if instance_masks is not None:
         #     draw_mask_on_image_array(
@@ -2050,10 +2041,31 @@ def visualize_boxes_and_labels_on_video(
     else:
         seq_id = seq_name
 
-    """add empty csv data for sequences that don't get any output boxes to 
-    avoid missing csv files causing eval problems later"""
-    if csv_data is not None and seq_id not in csv_data:
-        csv_data[seq_id] = []
+    if csv_data is not None:
+        """
+        rows are ordered by frame and then by box and only include the boxes present in each frame
+        """
+        n_boxes, n_frames = boxes.shape[0], boxes.shape[1] // 4
+        frame_boxes = np.reshape(boxes, (n_boxes, n_frames, 4))[:, :vid_len, :]
+        frame_boxes_rescaled = np.reshape(bboxes_rescaled, (n_boxes, n_frames, 4))[:, :vid_len, :]
+        is_present = np.all(frame_boxes != vocab.NO_BOX_FLOAT, axis=2)
+        frame_ids, box_ids = np.nonzero(is_present.T)
+        ymin_, xmin_, ymax_, xmax_ = np.moveaxis(frame_boxes_rescaled[box_ids, frame_ids], 1, 0)
+        image_names = np.asarray([os.path.basename(file_name) for file_name in file_names[:vid_len]])
+        csv_data.append(
+            seq_id,
+            ImageID=image_names[frame_ids],
+            VideoID=video_id_,
+            LabelName=get_class_names(classes, category_index)[box_ids],
+            XMin=xmin_,
+            XMax=xmax_,
+            YMin=ymin_,
+            YMax=ymax_,
+            Confidence=1.0 if scores is None else scores[box_ids],
+        )
+
+    if out_vis_dir is None:
+        return None
 
     """
     Collect supplementary information for each bounding box including colour, class
@@ -2061,9 +2073,6 @@ def visualize_boxes_and_labels_on_video(
     box_id_to_display_str = collections.defaultdict(list)
     box_id_to_color = collections.defaultdict(str)
     box_id_to_orig = {}
-    box_id_to_rescaled = {}
-    box_id_to_class = {}
-    box_id_to_scores = {}
 
     for box_id in range(boxes.shape[0]):
         # box = tuple(boxes[box_id].tolist())
@@ -2074,8 +2083,6 @@ def visualize_boxes_and_labels_on_video(
             class_name = 'invalid'
 
         box_id_to_orig[box_id] = tuple(boxes[box_id].tolist())
-        box_id_to_class[box_id] = class_name
-        box_id_to_rescaled[box_id] = tuple(bboxes_rescaled[box_id].tolist())
 
         display_str = f'{video_id_}'
         if not skip_labels:
@@ -2084,10 +2091,7 @@ def visualize_boxes_and_labels_on_video(
 
         if scores is None:
             box_id_to_color[box_id] = groundtruth_box_visualization_color
-            box_id_to_scores[box_id] = 1.0
         else:
-            box_id_to_scores[box_id] = scores[box_id]
-
             if not skip_scores:
                 conf = int(100 * scores[box_id])
                 display_str = f'{display_str}: {conf:d}%'
@@ -2100,13 +2104,12 @@ def visualize_boxes_and_labels_on_video(
                                                       len(STANDARD_COLORS)]
     video_vis = None
 
-    if return_vis and out_vis_dir:
+    if return_vis:
         video_vis = []
 
     for frame_id in range(vid_len):
         start_id = frame_id * 4
-        if out_vis_dir is not None:
-            image_vis = np.copy(video[frame_id, ...])
+        image_vis = np.copy(video[frame_id, ...])
 
         image_path = str(file_names[frame_id])
         image_name = os.path.basename(image_path)
@@ -2117,9 +2120,6 @@ def visualize_boxes_and_labels_on_video(
         assert seg_dir_path_ == seg_dir_path, f"seg_dir_path_ mismatch: {seg_dir_path}, {seg_dir_path_}"
 
         for box_id, color in box_id_to_color.items():
-            box_rescaled = box_id_to_rescaled[box_id]
-            score = box_id_to_scores[box_id]
-            label = box_id_to_class[box_id]
             box_orig = box_id_to_orig[box_id]
 
             ymin, xmin, ymax, xmax = box_orig[start_id:start_id + 4]
@@ -2128,42 +2128,26 @@ def visualize_boxes_and_labels_on_video(
                 continue
             # image_id = f'{seq_name}/{image_name}'
 
-            if csv_data is not None:
-                ymin_, xmin_, ymax_, xmax_ = box_rescaled[start_id:start_id + 4]
-                row = {
-                    "ImageID": image_id,
-                    "VideoID": video_id_,
-                    "LabelName": label,
-                    "XMin": xmin_,
-                    "XMax": xmax_,
-                    "YMin": ymin_,
-                    "YMax": ymax_,
-                    "Confidence": score,
-                }
-                csv_data[seq_id].append(row)
-
-            if out_vis_dir is not None:
-                """box_rescaled not actually used for visualization which is why they seem correct in spite of not 
-                cropping and resizing the 
-                transformed image into the original shape"""
-                image_vis = draw_bounding_box_on_image_array(
-                    image_vis,
-                    ymin,
-                    xmin,
-                    ymax,
-                    xmax,
-                    color=color,
-                    thickness=0 if skip_boxes else line_thickness,
-                    display_str_list=box_id_to_display_str[box_id],
-                    use_normalized_coordinates=use_normalized_coordinates)
+            """box_rescaled not actually used for visualization which is why they seem correct in spite of not 
+            cropping and resizing the 
+            transformed image into the original shape"""
+            image_vis = draw_bounding_box_on_image_array(
+                image_vis,
+                ymin,
+                xmin,
+                ymax,
+                xmax,
+                color=color,
+                thickness=0 if skip_boxes else line_thickness,
+                display_str_list=box_id_to_display_str[box_id],
+                use_normalized_coordinates=use_normalized_coordinates)
 
-        if out_vis_dir is not None:
-            if return_vis:
-                video_vis.append(image_vis)
-            save_image(image_vis, vid_writers, out_vis_dir, seq_id, image_name, video_id_,
-                       unpadded_size=unpadded_size, orig_size=orig_size)
+        if return_vis:
+            video_vis.append(image_vis)
+        save_image(image_vis, vid_writers, out_vis_dir, seq_id, image_name, video_id_,
+                   unpadded_size=unpadded_size, orig_size=orig_size)
 
-    if return_vis and out_vis_dir is not None:
+    if return_vis:
         video_vis = np.stack(video_vis, axis=0)
         return video_vis
 
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+
+"""
+Tests that the streaming FID / IS statistics match the statistics computed on all
+the activations at once, including when accumulators are merged across workers.
+"""
+
+import sys
+import os
+import numpy as np
+
+sys.path.append(os.getcwd())
+
+from metrics import activation_stats
+
+
+def _classifier_score(logits):
+    """same computation as tfgan.eval.classifier_score_from_logits"""
+    logits = np.asarray(logits, dtype=np.float64)
+    log_p = logits - np.max(logits, axis=1, keepdims=True)
+    log_p = log_p - np.log(np.sum(np.exp(log_p), axis=1, keepdims=True))
+    p = np.exp(log_p)
+    q = np.mean(p, axis=0)
+    kl = np.sum(p * (log_p - np.log(q)), axis=1)
+    return np.exp(np.mean(kl))
+
+
+def _get_batches(rng, batch_sizes, dim, num_classes):
+    pool = [rng.normal(3., 2., size=(bsz, dim)).astype(np.float32) for bsz in batch_sizes]
+    logits = [rng.normal(0., 3., size=(bsz, num_classes)).astype(np.float32) for bsz in batch_sizes]
+    return logits, pool
+
+
+def test_streaming_stats_match_full():
+    rng = np.random.default_rng(0)
+    logits, pool = _get_batches(rng, [7, 1, 32, 13, 0, 64], dim=48, num_classes=10)
+
+    stats = activation_stats.ActivationStats(logits_moments=True)
+    for logits_, pool_ in zip(logits, pool):
+        stats.update(logits_, pool_)
+
+    all_pool = np.concatenate(pool, 0).astype(np.float64)
+    all_logits = np.concatenate(logits, 0)
+    assert stats.count == all_pool.shape[0]
+
+    mean, cov = stats.pool.mean_and_cov()
+    np.testing.assert_allclose(mean, np.mean(all_pool, axis=0), rtol=1e-10, atol=1e-12)
+    np.testing.assert_allclose(cov, np.cov(all_pool, rowvar=False), rtol=1e-10, atol=1e-12)
+
+    mean, cov = stats.logits.mean_and_cov()
+    np.testing.assert_allclose(cov, np.cov(all_logits.astype(np.float64), rowvar=False),
+                               rtol=1e-10, atol=1e-12)
+
+    np.testing.assert_allclose(stats.classifier_score.score(), _classifier_score(all_logits), rtol=1e-10)
+
+
+def test_streaming_stats_merge():
+    rng = np.random.default_rng(1)
+    logits, pool = _get_batches(rng, [16, 5, 9, 20, 3], dim=24, num_classes=6)
+
+    full = activation_stats.ActivationStats()
+    for logits_, pool_ in zip(logits, pool):
+        full.update(logits_, pool_)
+
+    """uneven split over 3 workers, one of them without any samples"""
+    workers = [activation_stats.ActivationStats() for _ in range(3)]
+    for i, (logits_, pool_) in enumerate(zip(logits, pool)):
+        workers[0 if i < 3 else 2].update(logits_, pool_)
+
+    merged = activation_stats.ActivationStats()
+    for worker in workers:
+        merged.merge(worker)
+
+    assert merged.count == full.count
+    for x, y in zip(merged.pool.mean_and_cov(), full.pool.mean_and_cov()):
+        np.testing.assert_allclose(x, y, rtol=1e-10, atol=1e-12)
+    np.testing.assert_allclose(merged.classifier_score.score(), full.classifier_score.score(), rtol=1e-12)
+
+
+def test_ref_stats_save_load(tmp_path):
+    rng = np.random.default_rng(2)
+    logits, pool = _get_batches(rng, [10, 12], dim=16, num_classes=5)
+    for logits_moments in [False, True]:
+        stats = activation_stats.ActivationStats(logits_moments=logits_moments)
+        for logits_, pool_ in zip(logits, pool):
+            stats.update(logits_, pool_)
+
+        path = tmp_path / f'stats_{logits_moments}.npz'
+        with open(path, 'wb') as fout:
+            stats.save(fout)
+        with open(path, 'rb') as fin:
+            loaded = activation_stats.ActivationStats.load(fin)
+
+        assert loaded.count == stats.count
+        assert (loaded.logits is not None) == logits_moments
+        for x, y in zip(loaded.pool.mean_and_cov(), stats.pool.mean_and_cov()):
+            np.testing.assert_array_equal(x, y)
+        assert loaded.classifier_score.score() == stats.classifier_score.score()
+
+
+def test_ref_stats_filename():
+    name = activation_stats.get_ref_stats_filename(
+        'fid', 'downsampled_imagenet/64x64', 'validation', 64, 'bilinear', False)
+    assert name == 'fid_downsampled_imagenet-64x64_validation_size_64_bilinear_no_aa.npz'
+
+    names = {activation_stats.get_ref_stats_filename('fvd', 'ucf101', split, 64, method, antialias)
+             for split in ['test', ['train', 'test']]
+             for method in ['bilinear', 'bicubic']
+             for antialias in [False, True]}
+    assert len(names) == 8
@@ -0,0 +1,31 @@
+#!/usr/bin/env python3
+
+"""
+Tests that the completion markers of the checkpoints deleted by CheckpointManager are removed on save without
+scanning the checkpoint directory.
+"""
+
+import sys
+import os
+import types
+import tensorflow as tf
+
+sys.path.append(os.getcwd())
+
+import utils
+from models import model as model_lib
+
+
+def test_markers_follow_kept_checkpoints(tmp_path, monkeypatch):
+    ckpt = tf.train.Checkpoint(v=tf.Variable(1.))
+    manager = tf.train.CheckpointManager(ckpt, str(tmp_path), max_to_keep=2)
+    trainer = types.SimpleNamespace(_ckpt_options=None, _ckpt_marker_threads={}, _checkpoint_manager=manager)
+
+    """the checkpoint directory is never listed during a save"""
+    monkeypatch.setattr(os, 'listdir', None)
+    for step in range(1, 6):
+        model_lib.Trainer.save_checkpoint(trainer, step)
+    monkeypatch.undo()
+
+    markers = sorted(k for k in os.listdir(tmp_path) if k.endswith('.done'))
+    assert markers == sorted(utils.get_ckpt_marker(k) for k in manager.checkpoints) == ['ckpt-4.done', 'ckpt-5.done']
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+
+"""
+Tests that decoding the detection classes and scores from the class logits only gives the same results as the
+masked softmax over the full vocab and that the detection tasks give the same outputs with and without
+presliced_logits.
+"""
+
+import sys
+import os
+import numpy as np
+import ml_collections
+import pytest
+import tensorflow as tf
+
+sys.path.append(os.getcwd())
+
+import vocab
+
+BSZ = 2
+VOCAB_SIZE = 1200
+COORD_VOCAB_SHIFT = 150
+QUANTIZATION_BINS = 1000
+VID_LEN = 2
+MAX_INSTANCES = 4
+
+
+def _random_logits(seqlen, seed):
+    """large logits so that the non-class tokens often have higher probs than all the classes"""
+    return tf.random.stateless_normal([BSZ, seqlen, VOCAB_SIZE], [0, seed], stddev=4.)
+
+
+def _random_seq(seqlen, seed):
+    return tf.random.stateless_uniform(
+        [BSZ, seqlen], [1, seed], minval=COORD_VOCAB_SHIFT, maxval=COORD_VOCAB_SHIFT + QUANTIZATION_BINS,
+        dtype=tf.int64)
+
+
+def _masked_softmax_decode(logits, bbox_seq_len):
+    """class ids and scores from the softmax over the full vocab with the non-class tokens masked out"""
+    seqlen = logits.shape[1]
+    logits = logits[:, :seqlen - seqlen % bbox_seq_len]
+    class_probs = tf.nn.softmax(logits)[:, bbox_seq_len - 1::bbox_seq_len]
+    mask = tf.constant([0.] * vocab.BASE_VOCAB_SHIFT +
+                       [1.] * (COORD_VOCAB_SHIFT - vocab.BASE_VOCAB_SHIFT) +
+                       [0.] * (VOCAB_SIZE - COORD_VOCAB_SHIFT))
+    class_tokens = tf.argmax(class_probs * mask, -1)
+    scores = tf.gather(class_probs, class_tokens, batch_dims=2)
+    return tf.maximum(class_tokens - vocab.BASE_VOCAB_SHIFT, 0), scores
+
+
+def test_class_logits_match_masked_softmax():
+    task_utils = pytest.importorskip('tasks.task_utils')
+    for coords_1d in [False, True]:
+        bbox_seq_len = task_utils.get_bbox_seq_len(VID_LEN, coords_1d)
+        for seqlen in [3 * bbox_seq_len, 3 * bbox_seq_len + 1, 4 * bbox_seq_len - 1]:
+            logits, seq = _random_logits(seqlen, seqlen), _random_seq(seqlen, seqlen)
+            class_ids_ref, scores_ref = _masked_softmax_decode(logits, bbox_seq_len)
+            assert class_ids_ref.shape == [BSZ, 3]
+
+            class_ids, bboxes, scores = task_utils.decode_video_seq_to_bbox(
+                logits, seq, VID_LEN, QUANTIZATION_BINS, coords_1d, COORD_VOCAB_SHIFT)
+            np.testing.assert_array_equal(class_ids, class_ids_ref)
+            np.testing.assert_allclose(scores, scores_ref, rtol=1e-5, atol=1e-7)
+
+            class_logits = task_utils.gather_class_logits(logits, bbox_seq_len, COORD_VOCAB_SHIFT)
+            class_ids_, bboxes_, scores_ = task_utils.decode_video_seq_to_bbox(
+                None, seq, VID_LEN, QUANTIZATION_BINS, coords_1d, COORD_VOCAB_SHIFT, class_logits=class_logits)
+            np.testing.assert_array_equal(class_ids_, class_ids)
+            np.testing.assert_array_equal(scores_, scores)
+            np.testing.assert_array_equal(bboxes_, bboxes)
+
+    for seqlen in [15, 17, 19]:
+        logits, seq = _random_logits(seqlen, seqlen), _random_seq(seqlen, seqlen)
+        class_ids_ref, scores_ref = _masked_softmax_decode(logits, 5)
+        class_ids, _, scores = task_utils.decode_object_seq_to_bbox(
+            logits, seq, QUANTIZATION_BINS, COORD_VOCAB_SHIFT)
+        np.testing.assert_array_equal(class_ids, class_ids_ref)
+        np.testing.assert_allclose(scores, scores_ref, rtol=1e-5, atol=1e-7)
+
+
+class _FixedOutputModel(object):
+    """returns the same predictions for any inputs"""
+
+    def __init__(self, pred_seq, logits):
+        self.pred_seq, self.logits = pred_seq, logits
+
+    def infer(self, *args, **kwargs):
+        return self.pred_seq, self.logits, None
+
+
+def _get_config(presliced_logits):
+    return ml_collections.ConfigDict(dict(
+        task=dict(
+            vocab_id=10, quantization_bins=QUANTIZATION_BINS, coords_1d=False,
+            max_instances_per_image=MAX_INSTANCES, max_instances_per_image_test=MAX_INSTANCES,
+            temperature=1.0, top_k=0, top_p=0.4, presliced_logits=presliced_logits,
+        ),
+        model=dict(coord_vocab_shift=COORD_VOCAB_SHIFT),
+        dataset=dict(length=VID_LEN, category_names_path=dict(categories=[dict(id=1, name='cell')])),
+        debug=0,
+    ))
+
+
+def _get_examples(task_name):
+    bbox = tf.random.stateless_uniform([BSZ, MAX_INSTANCES, 4 * VID_LEN], [2, 0])
+    common = dict(area=tf.ones([BSZ, MAX_INSTANCES]), is_crowd=tf.zeros([BSZ, MAX_INSTANCES]), bbox=bbox)
+    if task_name == 'object_detection':
+        return dict(
+            common, image=tf.zeros([BSZ, 32, 32, 3]), bbox=bbox[..., :4],
+            label=tf.ones([BSZ, MAX_INSTANCES], tf.int64), **{'image/id': tf.range(BSZ)},
+            orig_image_size=tf.constant([[48, 40]] * BSZ), unpadded_image_size=tf.constant([[32, 28]] * BSZ))
+    video_size = dict(orig_video_size=tf.constant([[48, 40]] * BSZ), unpadded_video_size=tf.constant([[32, 28]] * BSZ))
+    files = dict(video_id=tf.range(BSZ), file_names=tf.fill([BSZ, VID_LEN], 'f.jpg'),
+                 file_ids=tf.zeros([BSZ, VID_LEN], tf.int64), class_id=tf.ones([BSZ, MAX_INSTANCES], tf.int64))
+    if task_name == 'video_detection':
+        return dict(common, video=tf.zeros([BSZ, VID_LEN, 32, 32, 3]), **files, **video_size)
+    return dict(common, image=tf.zeros([BSZ, 32, 32, 3]), **files, **video_size)
+
+
+def test_presliced_logits_postprocess_matches():
+    for task_name, class_name in [('object_detection', 'TaskObjectDetection'),
+                                  ('video_detection', 'TaskVideoDetection'),
+                                  ('static_video_detection', 'TaskStaticVideoDetection')]:
+        task_module = pytest.importorskip(f'tasks.{task_name}')
+        bbox_seq_len = 5 if task_name == 'object_detection' else 4 * VID_LEN + 1
+        """one incomplete object at the end"""
+        seqlen = MAX_INSTANCES * bbox_seq_len + 1
+        model = _FixedOutputModel(_random_seq(seqlen, 0), _random_logits(seqlen, 0))
+        examples = _get_examples(task_name)
+
+        outputs = []
+        for presliced_logits in [0, 1]:
+            task = getattr(task_module, class_name)(_get_config(presliced_logits))
+            infer_outputs = task.infer(model, (examples, None, None, None))
+            if presliced_logits:
+                assert infer_outputs[-1][0].shape == [BSZ, MAX_INSTANCES, COORD_VOCAB_SHIFT - vocab.BASE_VOCAB_SHIFT]
+            outputs.append(task.postprocess_tpu(*infer_outputs))
+
+        assert len(outputs[0]) == len(outputs[1])
+        for output, output_presliced in zip(*outputs):
+            if output.dtype.is_floating:
+                np.testing.assert_allclose(output_presliced, output, rtol=1e-5, atol=1e-7)
+            else:
+                np.testing.assert_array_equal(output_presliced, output)
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+
+"""
+Tests that ColumnarCSVWriter writes the same per-sequence csv files as building pandas DataFrames from per-box rows.
+"""
+
+import sys
+import os
+import tempfile
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.append(os.getcwd())
+
+from tasks import csv_writer
+
+CSV_COLUMNS = ["ImageID", "VideoID", "LabelName", "XMin", "XMax", "YMin", "YMax", "Confidence"]
+
+
+def _random_boxes(rng, n_boxes):
+    return dict(
+        ImageID=np.asarray([f'img_{i}.jpg' for i in rng.integers(0, 3, n_boxes)]),
+        LabelName=rng.choice(['car', 'person', 'truck, trailer', 'sign "stop"'], n_boxes),
+        XMin=rng.random(n_boxes).astype(np.float32),
+        XMax=rng.random(n_boxes).astype(np.float32),
+        YMin=rng.random(n_boxes).astype(np.float32),
+        YMax=rng.random(n_boxes).astype(np.float32),
+        Confidence=rng.random(n_boxes).astype(np.float32),
+    )
+
+
+def test_matches_pandas_rows():
+    """Test against DataFrames of per-box rows including periodic flushes, quoting and missing columns."""
+    rng = np.random.default_rng(0)
+    out_dir = tempfile.mkdtemp()
+    writer = csv_writer.ColumnarCSVWriter(out_dir, CSV_COLUMNS, save_npz=True)
+    seq_to_rows = dict(seq_0=[], seq_1=[], seq_empty=[])
+
+    writer.add_sequence('seq_empty')
+    for step in range(6):
+        for seq_id in ['seq_0', 'seq_1']:
+            n_boxes = int(rng.integers(0, 5))
+            columns = _random_boxes(rng, n_boxes)
+            if seq_id == 'seq_0':
+                columns['VideoID'] = f'video_{step}'
+            writer.append(seq_id, **columns)
+            for box_id in range(n_boxes):
+                row = {name: values[box_id] for name, values in columns.items() if np.ndim(values) > 0}
+                if seq_id == 'seq_0':
+                    row['VideoID'] = columns['VideoID']
+                seq_to_rows[seq_id].append(row)
+        if step % 2 == 1:
+            writer.flush()
+    writer.close()
+
+    for seq_id, rows in seq_to_rows.items():
+        expected = pd.DataFrame(rows, columns=CSV_COLUMNS)
+        df = pd.read_csv(os.path.join(out_dir, f'{seq_id}.csv'))
+        assert list(df.columns) == CSV_COLUMNS
+        assert len(df) == len(expected), seq_id
+        for name in CSV_COLUMNS:
+            if expected[name].dtype.kind == 'f':
+                np.testing.assert_allclose(df[name], expected[name], rtol=1e-6, err_msg=name)
+            else:
+                assert df[name].fillna('').astype(str).tolist() == expected[name].fillna('').astype(str).tolist(), name
+
+        npz = np.load(os.path.join(out_dir, f'{seq_id}.npz'))
+        if rows:
+            np.testing.assert_array_equal(npz['Confidence'], expected['Confidence'].to_numpy(np.float32))
+
+
+def test_masks_without_instances():
+    """Test that images with no predicted instances get no rows but still create the csv file of their sequence."""
+    vis_utils = pytest.importorskip('tasks.visualization.vis_utils')
+    columns = ["ImageID", "LabelName", "XMin", "XMax", "YMin", "YMax", "mask_counts", "mask_h", "mask_w",
+               "Confidence"]
+    out_dir = tempfile.mkdtemp()
+    writer = csv_writer.ColumnarCSVWriter(out_dir, columns)
+    category_index = {1: dict(id=1, name='cell')}
+    mask = np.zeros((8, 8), dtype=bool)
+    mask[2:5, 3:7] = True
+    for image_id, masks in [
+        (b'seq_empty/img_0', np.asarray([], dtype=bool)),
+        (b'seq_0/img_0', np.asarray([], dtype=bool)),
+        (b'seq_0/img_1', np.asarray([mask, np.zeros_like(mask)])),
+    ]:
+        vis_utils.visualize_boxes_and_labels_on_image_array(
+            image_id=image_id,
+            image=np.zeros((8, 8, 3), dtype=np.uint8),
+            bboxes_rescaled=None,
+            bboxes=None,
+            classes=np.ones(len(masks), dtype=np.int32),
+            scores=np.full(len(masks), 0.9, dtype=np.float32),
+            category_index=category_index,
+            csv_data=writer,
+            orig_size=(16, 16),
+            masks=masks,
+        )
+    writer.close()
+
+    df = pd.read_csv(os.path.join(out_dir, 'seq_empty.csv'))
+    assert list(df.columns) == columns and len(df) == 0
+
+    df = pd.read_csv(os.path.join(out_dir, 'seq_0.csv'))
+    assert df['ImageID'].tolist() == ['img_1.jpg']
+    assert df['LabelName'].tolist() == ['cell']
+    np.testing.assert_allclose(df[['YMin', 'XMin', 'YMax', 'XMax']].to_numpy()[0], [4, 6, 8, 12])
+
+
+def test_quotes_line_breaks_and_object_columns():
+    out_dir = tempfile.mkdtemp()
+    writer = csv_writer.ColumnarCSVWriter(out_dir, CSV_COLUMNS)
+    label_names = ['car', 'two\nlines', 'carriage\rreturn', 'truck, "trailer"']
+    image_ids = np.asarray([b'img_0.jpg', 'img_1.jpg', b'img, 2.jpg', 'img\n3.jpg'], dtype=object)
+    writer.append('seq_0', ImageID=image_ids, LabelName=np.asarray(label_names, dtype=object),
+                  Confidence=np.arange(4, dtype=np.float32))
+    writer.close()
+
+    df = pd.read_csv(os.path.join(out_dir, 'seq_0.csv'))
+    assert len(df) == 4
+    assert df['ImageID'].tolist() == ['img_0.jpg', 'img_1.jpg', 'img, 2.jpg', 'img\n3.jpg']
+    assert df['LabelName'].tolist() == label_names
+    np.testing.assert_array_equal(df['Confidence'], np.arange(4))
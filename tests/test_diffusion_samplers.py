@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+
+"""
+Tests the diffusion samplers on 1-D Gaussian data for which the probability flow ODE has a closed form solution.
+"""
+
+import sys
+import os
+import numpy as np
+import tensorflow as tf
+
+sys.path.append(os.getcwd())
+
+from models import diffusion_utils
+
+DATA_STD = 0.5
+N_SAMPLES = 64
+
+
+def _get_transition_f(pred_type):
+    """optimal denoiser for N(0, DATA_STD^2) data"""
+
+    def transition_f(x, gamma, training):
+        del training
+        x0 = tf.sqrt(gamma) * DATA_STD ** 2 / (gamma * DATA_STD ** 2 + 1. - gamma) * x
+        if pred_type == 'x':
+            return x0
+        if pred_type == 'eps':
+            return diffusion_utils.get_eps_from_x0(x, gamma, x0)
+        return (tf.sqrt(gamma) * x - x0) / tf.sqrt(1. - gamma)
+
+    return transition_f
+
+
+def _errors(scheduler, sampler_name, pred_type, iterations):
+    noise = tf.random.stateless_normal([N_SAMPLES, 1], [0, 1])
+    scheduler.sample_noise = lambda shape: noise
+    samples = scheduler.generate(
+        _get_transition_f(pred_type), iterations, [N_SAMPLES, 1], pred_type=pred_type,
+        sampler_name=sampler_name)
+
+    """x / sqrt(gamma * DATA_STD^2 + 1 - gamma) is constant along the ODE and data_pred is returned for the last gamma"""
+    gamma = scheduler.time_transform(tf.constant(1. / iterations))
+    x_last = noise * tf.sqrt(gamma * DATA_STD ** 2 + 1. - gamma) / tf.sqrt(
+        scheduler.time_transform(tf.constant(1.)) * DATA_STD ** 2 + 1. - scheduler.time_transform(tf.constant(1.)))
+    expected = tf.sqrt(gamma) * DATA_STD ** 2 / (gamma * DATA_STD ** 2 + 1. - gamma) * x_last
+    return float(tf.reduce_max(tf.abs(samples - expected)))
+
+
+def test_higher_order_samplers():
+    scheduler = diffusion_utils.Scheduler('cosine')
+    for pred_type in ['eps', 'x', 'v']:
+        for nfe in [20, 40]:
+            ddim_error = _errors(scheduler, 'ddim', pred_type, nfe)
+            for sampler_name in ['heun', 'dpm++2m', 'dpm++3m']:
+                """heun evaluates the denoiser twice per iteration"""
+                iterations = nfe // 2 if sampler_name == 'heun' else nfe
+                error = _errors(scheduler, sampler_name, pred_type, iterations)
+                assert error < ddim_error / 2, (pred_type, sampler_name, nfe, error, ddim_error)
+
+
+def test_unknown_sampler():
+    scheduler = diffusion_utils.Scheduler('cosine')
+    try:
+        _errors(scheduler, 'dpm++4m', 'eps', 2)
+    except ValueError:
+        return
+    assert False, 'unknown sampler_name must raise ValueError'
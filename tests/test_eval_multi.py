@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+
+"""
+Tests that evaluating several checkpoints with a single pass over the dataset with eval.run_multi writes the same
+outputs for each checkpoint as evaluating it on its own with eval.run.
+"""
+
+import sys
+import os
+import numpy as np
+import ml_collections
+import pytest
+import tensorflow as tf
+
+sys.path.append(os.getcwd())
+
+BSZ = 2
+EVAL_STEPS = 3
+
+
+class _Model(tf.Module):
+    def __init__(self):
+        super().__init__()
+        self.w = tf.Variable(tf.zeros([4]))
+
+
+class _ScaleTask(object):
+    """scales each input by the model weights and writes the results of each step to the csv files"""
+
+    def preprocess_batched(self, examples, training):
+        return examples
+
+    def infer(self, model, preprocessed_outputs):
+        return preprocessed_outputs['image/id'], preprocessed_outputs['image'] * model.w
+
+    def postprocess_tpu(self, image_ids, outputs):
+        return image_ids, outputs
+
+    def postprocess_cpu(self, outputs, train_step, csv_data, eval_step, **kwargs):
+        image_ids, outputs = outputs
+        for image_id, output in zip(image_ids.numpy(), outputs.numpy()):
+            csv_data.append(f'step_{train_step}', ImageID=f'{eval_step}_{image_id}', Confidence=output.sum())
+
+
+def _get_config(model_dir, eager):
+    return ml_collections.ConfigDict(dict(
+        model_dir=model_dir,
+        eager=eager,
+        task=dict(name='object_detection'),
+        dataset=dict(eval_name='test', img_ext='jpg'),
+        eval=dict(
+            db_prefix=[], save_suffix=[], save_csv=1, save_npz=0, save_vis=0, show_vis=0, write_to_video=0,
+            write_to_zip=0, check_ckpt=0, csv_steps=0, profile=0, tag='eval',
+        ),
+    ))
+
+
+def _save_ckpts(ckpt_dir):
+    ckpts = []
+    for step in [1, 2]:
+        model = _Model()
+        model.w.assign(tf.random.stateless_normal([4], [step, 0]))
+        checkpoint = tf.train.Checkpoint(model=model, global_step=tf.Variable(step, dtype=tf.int64))
+        ckpts.append(checkpoint.write(os.path.join(ckpt_dir, f'ckpt-{step}')))
+    return ckpts
+
+
+def _build_eval_model():
+    model = _Model()
+    checkpoint = tf.train.Checkpoint(model=model, global_step=tf.Variable(0, dtype=tf.int64))
+    return model, checkpoint
+
+
+def _read_csvs(out_dir):
+    csv_dir = os.path.join(out_dir, 'csv')
+    return {k: open(os.path.join(csv_dir, k)).read() for k in sorted(os.listdir(csv_dir)) if k.endswith('.csv')}
+
+
+def test_run_multi_matches_run(tmp_path):
+    eval_lib = pytest.importorskip('eval')
+
+    ckpts = _save_ckpts(str(tmp_path / 'ckpts'))
+    dataset = tf.data.Dataset.from_tensor_slices({
+        'image/id': tf.range(BSZ * EVAL_STEPS),
+        'image': tf.random.stateless_normal([BSZ * EVAL_STEPS, 4], [0, 1]),
+    }).batch(BSZ)
+    strategy = tf.distribute.get_strategy()
+    task = _ScaleTask()
+
+    for eager in [1, 0]:
+        single_dirs = []
+        for ckpt in ckpts:
+            cfg = _get_config(str(tmp_path / f'single_{eager}'), eager)
+            model, checkpoint = _build_eval_model()
+            single_dirs.append(eval_lib.run(cfg, dataset, task, EVAL_STEPS, ckpt, strategy, model, checkpoint, tf))
+
+        cfg = _get_config(str(tmp_path / f'multi_{eager}'), eager)
+        models, checkpoints = zip(*[_build_eval_model() for _ in ckpts])
+        multi_dirs = eval_lib.run_multi(cfg, dataset, task, EVAL_STEPS, ckpts, strategy,
+                                        list(models), list(checkpoints), tf)
+
+        assert len(multi_dirs) == len(single_dirs)
+        for single_dir, multi_dir in zip(single_dirs, multi_dirs):
+            assert os.path.basename(single_dir) == os.path.basename(multi_dir)
+            single_csvs, multi_csvs = _read_csvs(single_dir), _read_csvs(multi_dir)
+            assert single_csvs == multi_csvs
+            """each checkpoint gets its own outputs"""
+            assert len(single_csvs) == 1
+
+        """each csv holds every image of the dataset"""
+        np.testing.assert_equal([csv.count('\n') for csv in _read_csvs(multi_dirs[0]).values()],
+                                [BSZ * EVAL_STEPS + 1])
+        assert _read_csvs(multi_dirs[0]) != _read_csvs(multi_dirs[1])
+
+        """completed checkpoints are skipped"""
+        assert eval_lib.run_multi(cfg, dataset, task, EVAL_STEPS, ckpts, strategy,
+                                  list(models), list(checkpoints), tf) == [None, None]
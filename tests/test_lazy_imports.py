@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+
+"""
+Tests that importing the registries does not import any of the model, task, dataset or metric modules and that
+looking up a name only imports its own module.
+
+Each check runs in a fresh interpreter since other tests may have imported these modules already.
+"""
+
+import sys
+import os
+import subprocess
+import json
+
+sys.path.append(os.getcwd())
+
+"""generous bound on the time taken to import the registries once tensorflow has been imported"""
+MAX_REGISTRY_IMPORT_TIME = 2.0
+
+REGISTERED_MODULES = [
+    'models.ar_model',
+    'models.mhd_ar_model',
+    'models.video_ar_model',
+    'models.image_ar_model',
+    'models.image_diffusion_model',
+    'models.image_discrete_diffusion_model',
+    'models.video_diffusion_model',
+    'models.panoptic_diffusion',
+    'tasks.captioning',
+    'tasks.instance_segmentation',
+    'tasks.object_detection',
+    'tasks.video_detection',
+    'tasks.video_segmentation',
+    'tasks.semantic_segmentation',
+    'data.coco',
+    'data.ipsc',
+    'data.ipsc_video',
+    'data.ipsc_static_video',
+    'metrics.coco_metrics',
+    'metrics.vps_metrics',
+]
+
+SCRIPT = """
+import json, os, sys, time
+sys.path.append(os.getcwd())
+os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
+import tensorflow as tf
+
+start_t = time.time()
+from data import datasets
+from metrics import metric_registry
+from models import model as model_lib
+from tasks import task as task_lib
+import_time = time.time() - start_t
+
+imported = [m for m in json.loads(sys.argv[1]) if m in sys.modules]
+
+model_lib.ModelRegistry.lookup('image_diffusion_model')
+model_lib.TrainerRegistry.lookup('image_diffusion_model')
+imported_after_lookup = [m for m in json.loads(sys.argv[1]) if m in sys.modules]
+
+print(json.dumps(dict(import_time=import_time, imported=imported, imported_after_lookup=imported_after_lookup)))
+"""
+
+
+def _run_script():
+    out = subprocess.run([sys.executable, '-c', SCRIPT, json.dumps(REGISTERED_MODULES)],
+                         capture_output=True, text=True, check=True, cwd=os.getcwd())
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def test_lazy_registry_imports():
+    """Test that the registries import no registered module until it is looked up."""
+    result = _run_script()
+    assert result['imported'] == [], result['imported']
+    assert result['imported_after_lookup'] == ['models.image_diffusion_model'], result['imported_after_lookup']
+    assert result['import_time'] < MAX_REGISTRY_IMPORT_TIME, \
+        f"registries took {result['import_time']:.2f} s to import"
+
+
+def test_unregistered_lookup():
+    """Test that looking up an unknown name lists the lazily registered names too."""
+    from tasks import task as task_lib
+
+    try:
+        task_lib.TaskRegistry.lookup('unknown_task')
+    except ValueError as e:
+        assert 'object_detection' in str(e)
+    else:
+        raise AssertionError('looking up an unknown name should raise ValueError')
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+
+"""
+Tests that sequences packed into shared decoder rows give the same logits as decoding each of them separately
+and that batches whose sequences do not fit into the rows are reported instead of silently dropped.
+"""
+
+import sys
+import os
+import numpy as np
+import tensorflow as tf
+
+sys.path.append(os.getcwd())
+
+from architectures.transformers import AutoregressiveDecoder
+from models import model_utils
+
+SEQ_LEN = 12
+N_ENC = 5
+DIM = 16
+
+
+def _random_seqs(seed, lengths):
+    rng = np.random.default_rng(seed)
+    seqs = np.zeros((len(lengths), SEQ_LEN), dtype=np.int64)
+    for i, length in enumerate(lengths):
+        seqs[i, :length] = rng.integers(1, 50, size=length)
+    return tf.constant(seqs)
+
+
+def test_get_packing():
+    target_seq = _random_seqs(0, [3, 7, 2, 11, 4])
+    lengths = model_utils.get_seq_lengths(target_seq)
+    np.testing.assert_array_equal(lengths, [4, 8, 3, 12, 5])
+
+    """first-fit-decreasing fits all of them where packing them in order would need four rows"""
+    packing = model_utils.get_packing(lengths, SEQ_LEN, n_rows=3, max_per_row=2)
+    np.testing.assert_array_equal(packing['rows'], [1, 1, 2, 0, 2])
+    np.testing.assert_array_equal(packing['starts'], [8, 0, 5, 0, 0])
+    np.testing.assert_array_equal(packing['slots'], [1, 0, 1, 0, 0])
+    assert np.all(packing['kept']) and packing['fits']
+
+    packed = model_utils.pack_seqs(target_seq, packing)
+    np.testing.assert_array_equal(packed[0], target_seq[3])
+    np.testing.assert_array_equal(packed[1, :8], target_seq[1, :8])
+    np.testing.assert_array_equal(packed[1, 8:], target_seq[0, :4])
+    np.testing.assert_array_equal(packed[2, 8:], 0)
+    np.testing.assert_array_equal(packing['segment_ids'][2], [0] * 5 + [1] * 3 + [-1] * 4)
+    np.testing.assert_array_equal(packing['positions'][1], list(range(8)) + list(range(4)))
+
+    unpacked = model_utils.unpack_seqs(packed, packing)
+    np.testing.assert_array_equal(unpacked, target_seq)
+
+
+def test_get_packing_overflow():
+    target_seq = _random_seqs(0, [7, 8, 9, 2])
+    packing = model_utils.get_packing(model_utils.get_seq_lengths(target_seq), SEQ_LEN, n_rows=2, max_per_row=2)
+    np.testing.assert_array_equal(packing['kept'], [False, True, True, True])
+    assert not packing['fits']
+
+    """the sequence that did not fit is zero when unpacked and is not in any row"""
+    unpacked = model_utils.unpack_seqs(model_utils.pack_seqs(target_seq, packing), packing)
+    np.testing.assert_array_equal(unpacked[0], 0)
+    np.testing.assert_array_equal(unpacked[1:], target_seq[1:])
+    assert np.all(packing['segment_ids'] < 2)
+
+
+def test_packed_decoder_matches_unpacked():
+    tf.random.set_seed(0)
+    decoder = AutoregressiveDecoder(
+        defer_vocab=0, defer_seq=0, vocab_size=50, max_seq_len=SEQ_LEN, num_layers=2, dim=DIM,
+        mlp_ratio=2, num_heads=2, drop_path=0., drop_units=0., drop_att=0.)
+
+    lengths = [3, 5, 2, 6, 4]
+    seqs = _random_seqs(1, lengths)
+    encoded = tf.random.normal((len(lengths), N_ENC, DIM))
+
+    logits = decoder(seqs, encoded, training=False)
+
+    packing = model_utils.get_packing(model_utils.get_seq_lengths(seqs), SEQ_LEN, n_rows=3, max_per_row=3)
+    packed_encoded, enc_segment_ids = model_utils.pack_encoded(encoded, packing)
+    packing = dict(packing, enc_segment_ids=enc_segment_ids)
+    packed_logits = decoder(model_utils.pack_seqs(seqs, packing), packed_encoded, training=False, packing=packing)
+
+    assert np.all(packing['kept'])
+    for i, length in enumerate(lengths):
+        row, start = int(packing['rows'][i]), int(packing['starts'][i])
+        np.testing.assert_allclose(
+            packed_logits[row, start:start + length + 1], logits[i, :length + 1], rtol=1e-4, atol=1e-4)
+
+    """packed logits put back into one row per sequence match up to each first padding token"""
+    unpacked_logits = model_utils.unpack_seqs(packed_logits, packing)
+    for i, length in enumerate(lengths):
+        np.testing.assert_allclose(unpacked_logits[i, :length + 1], logits[i, :length + 1], rtol=1e-4, atol=1e-4)
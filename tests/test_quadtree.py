@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+
+"""
+Tests that the vectorized dense2quad gives the same quadtree as the per-node loop and that quad2dense inverts it.
+"""
+
+import sys
+import os
+import numpy as np
+
+sys.path.append(os.getcwd())
+
+from tasks import quadtree
+
+NUM_LEVELS = 4
+
+
+def _random_mask(seed, shape):
+    rng = np.random.default_rng(seed)
+    mask = np.zeros(shape, dtype=np.uint8)
+    for obj_id in range(1, 5):
+        y0, x0 = rng.integers(0, shape[0]), rng.integers(0, shape[1])
+        h, w = rng.integers(1, shape[0] // 2), rng.integers(1, shape[1] // 2)
+        mask[y0:y0 + h, x0:x0 + w] = obj_id
+    """isolated pixels so that the finest levels are not trivially uniform"""
+    mask[rng.random(shape) < 0.01] = 7
+    return mask
+
+
+def test_dense2quad_matches_loop():
+    """Test dense2quad against dense2quad_loop, including sizes that are not multiples of the coarsest window."""
+    for seed, shape in enumerate([(64, 64), (48, 80), (70, 99)]):
+        mask = _random_mask(seed, shape)
+        for return_255 in [False, True]:
+            expected = quadtree.dense2quad_loop(mask, NUM_LEVELS, return_255)
+            out_map = quadtree.dense2quad(mask, NUM_LEVELS, return_255)
+            assert sorted(out_map.keys()) == sorted(expected.keys())
+            for level in expected:
+                assert out_map[level].dtype == expected[level].dtype
+                np.testing.assert_array_equal(out_map[level], expected[level], err_msg=f'{shape} level {level}')
+
+
+def test_quad2dense():
+    """Test that quad2dense recovers the covered part of the mask."""
+    for seed, shape in enumerate([(64, 64), (70, 99)]):
+        mask = _random_mask(seed, shape)
+        for return_255 in [False, True]:
+            dense_map = quadtree.quad2dense(quadtree.dense2quad(mask, NUM_LEVELS, return_255))
+            size_x, size_y = dense_map.shape
+            assert size_x == shape[0] // 8 * 8 and size_y == shape[1] // 8 * 8
+            np.testing.assert_array_equal(dense_map, mask[:size_x, :size_y])
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+
+"""
+Tests that recomputing the decoder and video encoder layer activations in the backward pass gives the same
+gradients as keeping them, with the dropout and drop path masks of the forward pass replayed in the recomputed
+pass, and that layers with dropout that cannot be replayed are rejected.
+"""
+
+import sys
+import os
+import numpy as np
+import pytest
+import tensorflow as tf
+
+sys.path.append(os.getcwd())
+
+from architectures.transformers import (AutoregressiveDecoder, TransformerDecoderLayer, recompute_layer,
+                                        replay_dropout, new_replay_seed)
+from architectures.video_transformers import VideoTransformerEncoder, VideoTransformerEncoderLayer
+
+BSZ = 2
+SEQ_LEN = 6
+VOCAB_SIZE = 11
+DIM = 16
+VID_LEN = 2
+N_FEAT = 5
+
+
+def _build(recompute_grad):
+    encoder = VideoTransformerEncoder(
+        num_layers=2, dim=DIM, mlp_ratio=2, num_heads=2, vid_len=VID_LEN, late_fusion=0,
+        drop_path=0., drop_units=0., recompute_grad=recompute_grad, name='encoder')
+    decoder = AutoregressiveDecoder(
+        defer_vocab=0, defer_seq=0, vocab_size=VOCAB_SIZE, max_seq_len=SEQ_LEN, num_layers=2,
+        dim=DIM, mlp_ratio=2, num_heads=2, drop_path=0., drop_units=0.,
+        recompute_grad=recompute_grad, name='decoder')
+    return encoder, decoder
+
+
+def _get_grads(encoder, decoder, videos, seq):
+    with tf.GradientTape() as tape:
+        encoded = encoder(videos, None, training=True)
+        logits = decoder(seq, encoded, training=True)
+        loss = tf.reduce_mean(tf.nn.sparse_softmax_cross_entropy_with_logits(seq, logits))
+    variables = encoder.trainable_variables + decoder.trainable_variables
+    return tape.gradient(loss, variables)
+
+
+def test_recompute_grad_matches_stored_activations():
+    videos = tf.random.stateless_normal([BSZ, VID_LEN, N_FEAT, DIM], [0, 1])
+    seq = tf.random.stateless_uniform([BSZ, SEQ_LEN], [0, 2], maxval=VOCAB_SIZE, dtype=tf.int64)
+    encoder, decoder = _build(recompute_grad=False)
+    encoder_rc, decoder_rc = _build(recompute_grad=True)
+    """the first call builds the layers"""
+    _get_grads(encoder, decoder, videos, seq)
+    _get_grads(encoder_rc, decoder_rc, videos, seq)
+    for layer, layer_rc in [(encoder, encoder_rc), (decoder, decoder_rc)]:
+        layer_rc.set_weights(layer.get_weights())
+
+    grads = _get_grads(encoder, decoder, videos, seq)
+    grads_rc = _get_grads(encoder_rc, decoder_rc, videos, seq)
+    assert len(grads) == len(grads_rc)
+    for grad, grad_rc in zip(grads, grads_rc):
+        np.testing.assert_allclose(tf.convert_to_tensor(grad), tf.convert_to_tensor(grad_rc),
+                                   rtol=1e-4, atol=1e-5)
+
+
+def _get_layer_grads(layer, args, kwargs, recompute):
+    """args are the tensors that the gradients are taken w.r.t. like in recompute_layer"""
+    tf.random.set_seed(0)
+    with tf.GradientTape() as tape:
+        tape.watch(args)
+        if recompute:
+            outputs = recompute_layer(layer, *args, **kwargs)
+        else:
+            with replay_dropout(new_replay_seed()):
+                outputs = layer(*args, **kwargs)
+        outputs = tf.nest.flatten(outputs)[0]
+        loss = tf.reduce_sum(outputs ** 2)
+    return outputs, tape.gradient(loss, args + layer.trainable_variables)
+
+
+def test_recompute_grad_replays_dropout():
+    drop_kwargs = dict(drop_path=0.2, drop_units=0.2, drop_att=0.2)
+    x = tf.random.stateless_normal([BSZ, SEQ_LEN, DIM], [0, 3])
+    enc = tf.random.stateless_normal([BSZ, N_FEAT, DIM], [0, 4])
+    videos = tf.random.stateless_normal([BSZ, VID_LEN, N_FEAT, DIM], [0, 5])
+    for layer, args, kwargs in [
+        (TransformerDecoderLayer(DIM, 2, 2, **drop_kwargs), [x, enc],
+         dict(cache=None, mask_self=None, mask_cross=None)),
+        (VideoTransformerEncoderLayer(DIM, 2, 2, late_fusion=0, vid_len=VID_LEN, **drop_kwargs), [videos],
+         dict(mask=None)),
+    ]:
+        """the first call builds the layer outside of tf.recompute_grad"""
+        outputs_eval = tf.nest.flatten(recompute_layer(layer, *args, training=False, **kwargs))[0]
+
+        kwargs = dict(kwargs, training=True)
+        outputs, grads = _get_layer_grads(layer, args, kwargs, recompute=False)
+        outputs_rc, grads_rc = _get_layer_grads(layer, args, kwargs, recompute=True)
+        """the masks actually drop something and are the same in both passes"""
+        assert not np.allclose(outputs, outputs_eval, atol=1e-3)
+        np.testing.assert_allclose(outputs_rc, outputs, rtol=1e-5, atol=1e-5)
+        assert len(grads) == len(grads_rc)
+        for grad, grad_rc in zip(grads, grads_rc):
+            np.testing.assert_allclose(tf.convert_to_tensor(grad), tf.convert_to_tensor(grad_rc),
+                                       rtol=1e-4, atol=1e-5)
+
+
+def test_recompute_grad_rejects_unreplayable_dropout():
+    x = tf.random.stateless_normal([BSZ, DIM], [0, 6])
+    layer = tf.keras.Sequential([tf.keras.layers.Dense(DIM), tf.keras.layers.Dropout(0.1)])
+    with pytest.raises(AssertionError):
+        recompute_layer(layer, x, training=True)
+    """keras dropout is fine with a zero rate"""
+    layer = tf.keras.Sequential([tf.keras.layers.Dense(DIM), tf.keras.layers.Dropout(0.)])
+    recompute_layer(layer, x, training=True)
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+
+"""
+Tests that every sample of the rolling sampler follows the same trajectory as Scheduler.generate from the same
+initial noise when requests of different sizes are submitted while the pool is running.
+"""
+
+import sys
+import os
+import numpy as np
+import tensorflow as tf
+
+sys.path.append(os.getcwd())
+
+from models import diffusion_utils
+
+POOL_SIZE = 4
+ITERATIONS = 5
+
+
+def _get_transition_f(labels):
+    """toy denoiser with a hidden state for latent self-cond that counts the iterations"""
+
+    def transition_f(x, gamma, training, drop_label=False):
+        del training
+        x, hidden = x
+        labels_ = diffusion_utils.drop_labels(labels, drop_label)
+        eps = tf.tanh(x) * gamma + 0.1 * labels_ + 0.01 * hidden
+        return eps, hidden + 1.
+
+    return transition_f
+
+
+def test_rolling_matches_generate():
+    labels = tf.range(POOL_SIZE, dtype=tf.float32)[:, tf.newaxis]
+    noise = tf.random.stateless_normal([POOL_SIZE, 1], [0, 1])
+    for sampler_name in ['ddim', 'dpm++2m']:
+        for guidance in [0., 1.]:
+            scheduler = diffusion_utils.Scheduler('cosine')
+            """all the fresh samples of slot i start from noise[i] and have the label i"""
+            scheduler.sample_noise = lambda shape: noise
+            kwargs = dict(hidden_shapes=[[1]], pred_type='eps', self_cond='latent', self_cond_decay=0.5,
+                          guidance=guidance, sampler_name=sampler_name)
+            expected = scheduler.generate(
+                _get_transition_f(labels), ITERATIONS, [POOL_SIZE, 1], **kwargs).numpy()
+
+            sampler = diffusion_utils.RollingSampler(
+                scheduler, _get_transition_f, ITERATIONS, [POOL_SIZE, 1],
+                sample_labels=lambda: labels, **kwargs)
+            outputs = []
+            sampler.submit(3)
+            for _ in range(2):
+                outputs.append(sampler.tick())
+            sampler.submit(6)
+            outputs.append(sampler.tick())
+            outputs += list(sampler.run(2))
+            outputs = [o for o in outputs if o is not None]
+
+            samples = np.concatenate([o[0].numpy() for o in outputs])
+            slot_ids = np.concatenate([o[1].numpy() for o in outputs])[:, 0].astype(int)
+            assert len(samples) == 11, (sampler_name, guidance, len(samples))
+            assert sampler.num_pending == 0 and sampler.num_active == 0
+            np.testing.assert_allclose(samples, expected[slot_ids], rtol=1e-5, atol=1e-5)
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+
+"""
+Tests that speculative decoding with the early layers of the decoder as the draft gives the same tokens as greedy
+decoding with the full decoder.
+"""
+
+import sys
+import os
+import numpy as np
+import tensorflow as tf
+
+sys.path.append(os.getcwd())
+
+from architectures.transformers import AutoregressiveDecoder
+
+SEQ_LEN = 24
+N_ENC = 5
+DIM = 16
+BSZ = 3
+
+
+def _decoder_and_inputs(draft_len, tail_scale=1.):
+    tf.random.set_seed(0)
+    decoder = AutoregressiveDecoder(
+        defer_vocab=0, defer_seq=0, vocab_size=20, max_seq_len=SEQ_LEN, num_layers=3, dim=DIM,
+        mlp_ratio=2, num_heads=2, drop_path=0., drop_units=0., drop_att=0.,
+        draft_layers=1, draft_len=draft_len)
+    prompt = tf.constant([[1, 2]] * BSZ, dtype=tf.int64)
+    encoded = tf.random.normal((BSZ, N_ENC, DIM))
+    decoder(prompt, encoded, training=False)
+    """
+    with random weights the draft almost never agrees with the full decoder so the residual branches of the layers
+    after the draft are scaled down to get a mix of accepted and rejected proposals
+    """
+    for layer in decoder.decoder.dec_layers[decoder.draft_layers:]:
+        for var in layer.variables:
+            var.assign(var * tail_scale)
+    return decoder, prompt, encoded
+
+
+def _greedy(decoder, prompt, encoded, seq_len):
+    draft_layers = decoder.draft_layers
+    decoder.draft_layers = 0
+    tokens, logits = decoder.infer(prompt, encoded, seq_len, top_k=1)
+    decoder.draft_layers = draft_layers
+    return tokens, logits
+
+
+def test_speculative_matches_greedy():
+    for draft_len, tail_scale in [(1, 1.), (4, 1.), (4, 0.2), (5, 0.)]:
+        decoder, prompt, encoded = _decoder_and_inputs(draft_len, tail_scale)
+        tokens, logits = _greedy(decoder, prompt, encoded, SEQ_LEN)
+
+        spec_tokens, spec_logits, stats = decoder.infer_speculative(prompt, encoded, SEQ_LEN)
+        np.testing.assert_array_equal(spec_tokens, tokens)
+        np.testing.assert_allclose(spec_logits, logits, rtol=1e-4, atol=1e-4)
+
+        n_passes, n_accepted = int(stats['n_passes']), int(stats['n_accepted'])
+        """each pass generates one token more than the number of proposals it accepts"""
+        assert n_passes + n_accepted == SEQ_LEN - prompt.shape[1]
+        if tail_scale == 0.:
+            """identical draft and full decoders accept every proposal"""
+            assert n_passes == 1 + int(np.ceil((SEQ_LEN - prompt.shape[1] - 1) / (draft_len + 1)))
+
+        """greedy infer dispatches to speculative decoding"""
+        disp_tokens, _ = decoder.infer(prompt, encoded, SEQ_LEN, top_k=1)
+        np.testing.assert_array_equal(disp_tokens, tokens)
+
+
+def test_speculative_matches_greedy_xla():
+    decoder, prompt, encoded = _decoder_and_inputs(3, 0.2)
+    tokens, _ = _greedy(decoder, prompt, encoded, SEQ_LEN)
+
+    @tf.function(jit_compile=True)
+    def infer_fn(prompt, encoded):
+        return decoder.infer_speculative(prompt, encoded, SEQ_LEN)[0]
+
+    np.testing.assert_array_equal(infer_fn(prompt, encoded), tokens)
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+
+"""
+Tests that the NumPy STQ accumulator and its process-pool driver give the same
+results as the TensorFlow STQuality metric.
+"""
+
+import sys
+import os
+import warnings
+import numpy as np
+import pytest
+
+sys.path.append(os.getcwd())
+
+from metrics import segmentation_and_tracking_quality as stq
+
+NUM_CLASSES = 5
+THINGS_LIST = [2, 3]
+IGNORE_LABEL = 255
+MAX_INSTANCES = 16
+OFFSET = 256 * 256
+
+STQ_KWARGS = dict(
+    num_classes=NUM_CLASSES,
+    things_list=THINGS_LIST,
+    ignore_label=IGNORE_LABEL,
+    max_instances_per_category=MAX_INSTANCES,
+    offset=OFFSET,
+)
+
+
+def _random_panoptic_map(rng, shape):
+    semantic = rng.integers(0, NUM_CLASSES, shape)
+    semantic[rng.random(shape) < 0.05] = IGNORE_LABEL
+    instance = rng.integers(0, 4, shape)
+    return semantic * MAX_INSTANCES + instance
+
+
+def _random_sequences(seed, n_seqs=3, n_frames=4, shape=(24, 32)):
+    rng = np.random.default_rng(seed)
+    sequences = []
+    for seq_id in range(n_seqs):
+        frames = []
+        for _ in range(n_frames):
+            y_true = _random_panoptic_map(rng, shape)
+            y_pred = y_true.copy()
+            """corrupt part of the prediction so that the metrics are not trivially perfect"""
+            noisy = rng.random(shape) < 0.3
+            y_pred[noisy] = _random_panoptic_map(rng, shape)[noisy]
+            weights = np.where(rng.random(shape) < 0.5, 0.5, 1.0)
+            frames.append((y_true, y_pred, weights))
+        sequences.append((f'seq_{seq_id}', frames))
+    return sequences
+
+
+def _update_sequence(metric, seq_id, frames, use_weights):
+    for y_true, y_pred, weights in frames:
+        metric.update_state(y_true, y_pred, seq_id, weights if use_weights else None)
+
+
+def _assert_results_equal(result, expected):
+    assert result['ID_per_seq'] == expected['ID_per_seq']
+    assert result['Length_per_seq'] == expected['Length_per_seq']
+    for name in ['STQ', 'AQ', 'IoU', 'STQ_per_seq', 'AQ_per_seq', 'IoU_per_seq']:
+        np.testing.assert_allclose(result[name], expected[name], rtol=1e-6, err_msg=name)
+
+
+def _tf_result(sequences, use_weights):
+    metric = stq.STQuality(**STQ_KWARGS)
+    for seq_id, frames in sequences:
+        _update_sequence(metric, seq_id, frames, use_weights)
+    return metric.result()
+
+
+def test_numpy_matches_tf():
+    """Test STQualityNumpy against STQuality with and without pixel weights."""
+    sequences = _random_sequences(seed=0)
+    for use_weights in [False, True]:
+        metric = stq.STQualityNumpy(**STQ_KWARGS)
+        for seq_id, frames in sequences:
+            _update_sequence(metric, seq_id, frames, use_weights)
+        _assert_results_equal(metric.result(), _tf_result(sequences, use_weights))
+
+
+def test_merge_state():
+    """Test merging per-sequence STQualityNumpy metrics."""
+    sequences = _random_sequences(seed=1)
+    metrics = []
+    for seq_id, frames in sequences:
+        metric = stq.STQualityNumpy(**STQ_KWARGS)
+        _update_sequence(metric, seq_id, frames, False)
+        metrics.append(metric)
+    merged = stq.STQualityNumpy(**STQ_KWARGS)
+    merged.merge_state(metrics)
+    _assert_results_equal(merged.result(), _tf_result(sequences, False))
+
+    try:
+        merged.merge_state(metrics[:1])
+    except ValueError:
+        pass
+    else:
+        raise AssertionError('merging a duplicate sequence should raise ValueError')
+
+
+def test_evaluate_sequences_in_parallel():
+    """Test the process-pool driver."""
+    sequences = _random_sequences(seed=2)
+    metric = stq.STQualityNumpy(**STQ_KWARGS)
+    stq.evaluate_sequences_in_parallel(
+        metric, _update_sequence,
+        [(seq_id, frames, True) for seq_id, frames in sequences],
+        num_workers=2)
+    _assert_results_equal(metric.result(), _tf_result(sequences, True))
+
+
+def test_numpy_checks_weights_like_tf():
+    """Test that STQualityNumpy warns about unsupported pixel weights wherever STQuality does."""
+    (seq_id, frames), = _random_sequences(3, n_seqs=1, n_frames=1)
+    y_true, y_pred, weights = frames[0]
+    for metric_class in [stq.STQuality, stq.STQualityNumpy]:
+        with warnings.catch_warnings():
+            warnings.simplefilter('error')
+            metric_class(**STQ_KWARGS).update_state(y_true, y_pred, seq_id, weights)
+        with pytest.warns(UserWarning, match='Potential performance degration'):
+            metric_class(**STQ_KWARGS).update_state(y_true, y_pred, seq_id, np.where(weights == 0.5, 0.25, 1.0))
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+
+"""
+Tests that the streaming STQ and DAVIS metrics give the same results and write the same files as the metrics
+that write all the predictions to pngs and evaluate the png directories.
+"""
+
+import sys
+import os
+import numpy as np
+import ml_collections
+import pytest
+import PIL
+
+sys.path.append(os.getcwd())
+
+from metrics import metric_utils
+
+NUM_CLASSES = 4
+THINGS_LIST = [1, 2]
+IGNORE_LABEL = 255
+MAX_INSTANCES = 16
+SHAPE = (12, 16)
+N_FRAMES = 5
+VIDEO_NAMES = ['video_b', 'video_a']
+
+
+def _get_stq_config(annotations_dir, results_dir, streaming):
+    return ml_collections.ConfigDict(dict(
+        task=dict(
+            max_instances_per_image=MAX_INSTANCES,
+            proceeding_frames='-1',
+            metric=dict(results_dir=results_dir, num_workers=0, streaming=streaming),
+        ),
+        dataset=dict(
+            annotations_dir=annotations_dir,
+            num_classes=NUM_CLASSES + 1,
+            class_has_instances_list=THINGS_LIST,
+            ignore_label=IGNORE_LABEL,
+            panoptic_label_divisor=256,
+        ),
+    ))
+
+
+def _random_video(rng):
+    """semantic ids with 0 for ignored pixels and instance ids where instance 1 skips the second frame
+    so that it is remapped to a new id when it comes back"""
+    semantic = rng.integers(0, NUM_CLASSES + 1, (N_FRAMES,) + SHAPE)
+    instance = rng.integers(0, 4, (N_FRAMES,) + SHAPE)
+    instance[1][instance[1] == 1] = 2
+    return np.stack([semantic, instance], -1).astype(np.uint8)
+
+
+def _write_annotations(vps_metrics, annotations_dir, predictions):
+    """ground truth as the predictions with some of the pixels changed"""
+    rng = np.random.default_rng(1)
+    for video_name, video in predictions.items():
+        os.makedirs(os.path.join(annotations_dir, video_name))
+        for frame_id, frame in enumerate(video):
+            semantic = np.where(frame[..., 0] == 0, IGNORE_LABEL, frame[..., 0].astype(np.int32) - 1)
+            instance = frame[..., 1].astype(np.int32)
+            noisy = rng.random(SHAPE) < 0.2
+            semantic[noisy] = rng.integers(0, NUM_CLASSES, SHAPE)[noisy]
+            instance[~np.isin(semantic, THINGS_LIST)] = 0
+            vps_metrics._panoptic_map_to_rgb(
+                semantic, instance, os.path.join(annotations_dir, video_name, f'{frame_id:06}.png'))
+
+
+def _read_files(root_dir):
+    files = {}
+    for dirpath, _, filenames in os.walk(root_dir):
+        for filename in filenames:
+            if filename.endswith('.png'):
+                with open(os.path.join(dirpath, filename), 'rb') as f:
+                    files[os.path.relpath(os.path.join(dirpath, filename), root_dir)] = f.read()
+    return files
+
+
+def _per_seq(result, name):
+    return dict(zip(result['ID_per_seq'], result[name]))
+
+
+def test_streaming_stq_matches_files(tmp_path):
+    vps_metrics = pytest.importorskip('metrics.vps_metrics')
+    rng = np.random.default_rng(0)
+    predictions = {video_name: _random_video(rng) for video_name in VIDEO_NAMES}
+    annotations_dir = str(tmp_path / 'annotations')
+    _write_annotations(vps_metrics, annotations_dir, predictions)
+
+    for with_results_dir in [False, True]:
+        results, metrics = {}, {}
+        for streaming in [0, 1]:
+            results_dir = str(tmp_path / f'results_{with_results_dir}_{streaming}') if with_results_dir else None
+            metric = vps_metrics.STQMetric(_get_stq_config(annotations_dir, results_dir, streaming))
+            for video_name, video in predictions.items():
+                """the frames of a video come in several calls like in the eval loop"""
+                for start in range(0, N_FRAMES, 2):
+                    frame_ids = list(range(start, min(start + 2, N_FRAMES)))
+                    metric.record_prediction(video[frame_ids].copy(), video_name, frame_ids, step=1)
+            results[streaming] = metric.result(step=1)
+            metrics[streaming] = metric
+
+        for name in results[0]:
+            np.testing.assert_allclose(results[1][name], results[0][name], rtol=1e-6, err_msg=name)
+        stq_results = [metrics[streaming].eval.result() for streaming in [0, 1]]
+        assert sorted(stq_results[0]['ID_per_seq']) == sorted(stq_results[1]['ID_per_seq'])
+        for name in ['STQ_per_seq', 'AQ_per_seq', 'IoU_per_seq', 'Length_per_seq']:
+            per_seq = [_per_seq(r, name) for r in stq_results]
+            for seq_id in per_seq[0]:
+                np.testing.assert_allclose(per_seq[1][seq_id], per_seq[0][seq_id], rtol=1e-6, err_msg=name)
+
+        """instance 1 of every video came back after a frame without it and got a new id"""
+        for video_name in VIDEO_NAMES:
+            assert metrics[1].eval._remappers[video_name].id_map[1] not in [0, 1]
+
+        if with_results_dir:
+            """the background writer is flushed by result so all the files are there"""
+            files = [_read_files(str(tmp_path / f'results_{with_results_dir}_{streaming}'))
+                     for streaming in [0, 1]]
+            assert len(files[0]) == len(VIDEO_NAMES) * N_FRAMES * 3
+            assert files[1] == files[0]
+
+
+def test_streaming_davis_matches_files(tmp_path, monkeypatch):
+    vos_metrics = pytest.importorskip('metrics.vos_metrics')
+    evaluated = {}
+
+    class PngDirEvaluation(object):
+        """reads the pngs of the evaluated directory instead of the DAVIS annotations"""
+
+        def __init__(self, **kwargs):
+            del kwargs
+
+        def evaluate(self, result_path):
+            masks = {}
+            for video_name in sorted(os.listdir(result_path)):
+                video_dir = os.path.join(result_path, video_name)
+                if not os.path.isdir(video_dir):
+                    continue
+                masks[video_name] = np.stack([np.array(PIL.Image.open(os.path.join(video_dir, f)))
+                                              for f in sorted(os.listdir(video_dir))])
+            evaluated[result_path] = masks
+            stats = [np.mean(m > 0) for m in masks.values()]
+            measure = dict(M=stats, R=stats, D=stats, M_per_object=dict(zip(masks, stats)))
+            return dict(J=measure, F=measure)
+
+    monkeypatch.setattr(vos_metrics, 'DAVISEvaluation', PngDirEvaluation)
+    rng = np.random.default_rng(0)
+    predictions = {video_name: rng.integers(0, 4, (N_FRAMES,) + SHAPE + (2,)).astype(np.uint8)
+                   for video_name in VIDEO_NAMES}
+
+    for with_results_dir in [False, True]:
+        results, masks = [], []
+        for streaming in [0, 1]:
+            results_dir = str(tmp_path / f'davis_{with_results_dir}_{streaming}') if with_results_dir else None
+            config = ml_collections.ConfigDict(dict(
+                task=dict(metric=dict(results_dir=results_dir, streaming=streaming)),
+                dataset=dict(annotations_dir='', vos_task='semi-supervised', eval_split='val'),
+            ))
+            metric = vos_metrics.DavisVideoObjectSegmentationMetric(config)
+            evaluated.clear()
+            for video_name, video in predictions.items():
+                metric.record_prediction(video.copy(), video_name, list(range(N_FRAMES)), step=1)
+            results.append(metric.result(step=1))
+            masks.append(list(evaluated.values())[0])
+        assert results[1] == results[0]
+        assert masks[1].keys() == masks[0].keys() == set(VIDEO_NAMES)
+        for video_name in VIDEO_NAMES:
+            np.testing.assert_array_equal(masks[1][video_name], masks[0][video_name])
+            np.testing.assert_array_equal(masks[1][video_name], predictions[video_name][..., -1])
+
+
+def test_background_writer_flush(tmp_path):
+    writer = metric_utils.BackgroundWriter()
+    for i in range(8):
+        writer.submit((tmp_path / f'{i}.txt').write_text, str(i))
+    writer.flush()
+    assert sorted(os.listdir(tmp_path)) == [f'{i}.txt' for i in range(8)]
+
+    writer.submit((tmp_path / 'missing' / 'x.txt').write_text, 'x')
+    with pytest.raises(FileNotFoundError):
+        writer.flush()
+    """the failed write is not raised again"""
+    writer.flush()
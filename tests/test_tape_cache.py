@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+
+"""
+Tests that sampling with the step cache of the tape denoiser gives the same samples as recomputing the
+cond projection, the cond frame tape and the position embeddings in every step.
+"""
+
+import sys
+import os
+import numpy as np
+import tensorflow as tf
+
+sys.path.append(os.getcwd())
+
+from architectures.tape import VideoTapeDenoiser
+from configs import config_diffusion_base
+from models import image_diffusion_model
+
+IMAGE_SIZE = 16
+N_CLASSES = 10
+N_SAMPLES = 4
+
+
+def _build_model(cond_on_latent):
+    cfg = config_diffusion_base.get_config('cifar10,tape')
+    cfg.dataset.image_size = IMAGE_SIZE
+    cfg.dataset.num_classes = N_CLASSES
+    cfg.model.conditional = 'class'
+    cfg.model.update(dict(
+        num_layers='1,1', latent_slots=16, latent_dim=32, tape_dim=32, patch_size=4,
+        latent_num_heads=2, rw_num_heads=2, latent_pos_encoding='sin_cos_plus_learned',
+        tape_pos_encoding='sin_cos_plus_learned', cond_on_latent=cond_on_latent,
+        time_on_latent=cond_on_latent))
+    return image_diffusion_model.Model(cfg)
+
+
+def test_cached_sampling_matches_uncached():
+    for cond_on_latent in [False, True]:
+        model = _build_model(cond_on_latent)
+        labels = tf.one_hot(tf.range(N_SAMPLES) % N_CLASSES, N_CLASSES)
+        """a nonzero bias so that the projection of the dropped labels is not zero"""
+        cond_proj = model.denoiser_ema.cond_proj
+        cond_proj(labels)
+        cond_proj.bias.assign(tf.random.normal(cond_proj.bias.shape))
+        for guidance in [0., 2.0]:
+            samples = []
+            for cond_denoise in [model.get_cond_denoise(labels), model.get_cached_cond_denoise(labels)]:
+                tf.random.set_seed(0)
+                samples.append(model.scheduler.generate(
+                    cond_denoise, 4, [N_SAMPLES, IMAGE_SIZE, IMAGE_SIZE, 3],
+                    hidden_shapes=model.hidden_shapes, pred_type='eps',
+                    self_cond=model.config.self_cond, guidance=guidance, sampler_name='ddim'))
+            np.testing.assert_allclose(samples[0], samples[1], rtol=1e-5, atol=1e-5)
+
+
+def test_video_cached_cond_tape_matches_uncached():
+    seq_len, seq_cond, bsz = 5, 2, 2
+    denoiser = VideoTapeDenoiser(
+        num_layers='1', latent_slots=8, latent_dim=32, latent_mlp_ratio=2, latent_num_heads=2,
+        tape_dim=16, tape_mlp_ratio=2, rw_num_heads=1, image_height=8, image_width=8,
+        image_channels=3, patch_size=4, seq_len=seq_len, seq_stride=2, seq_cond=seq_cond,
+        self_cond='latent', name='denoiser')
+    x = tf.random.normal([bsz, seq_len - seq_cond, 8, 8, 3])
+    latent_prev = tf.random.normal([bsz] + denoiser.hidden_shapes[0])
+    tape_prev = tf.random.normal([bsz] + denoiser.hidden_shapes[1])
+    t = tf.random.uniform([bsz])
+    cond = tf.random.normal([bsz, seq_cond, 8, 8, 3])
+
+    outputs = denoiser((x, latent_prev, tape_prev), t, cond, training=False)
+    step_cache = denoiser.get_step_cache(cond)
+    outputs_cached = denoiser((x, latent_prev, tape_prev), t, None, training=False,
+                              step_cache=step_cache)
+    for out, out_cached in zip(outputs, outputs_cached):
+        np.testing.assert_allclose(out, out_cached, rtol=1e-5, atol=1e-5)
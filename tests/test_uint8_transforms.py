@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+
+"""
+Tests that the video preprocessing gives the same frames within the rounding of one resize when the frames are
+kept as uint8 through the geometric transforms and converted to float by the last transform.
+"""
+
+import sys
+import os
+import numpy as np
+import tensorflow as tf
+import ml_collections
+
+sys.path.append(os.getcwd())
+
+from configs import transform_configs
+from data import transforms
+from data import video_transforms  # registers the video transforms
+
+D = lambda **kwargs: ml_collections.ConfigDict(kwargs)
+
+LENGTH = 3
+IMAGE_SIZE = (32, 48)
+"""uint8 rounding of one resize and of the padding value"""
+ATOL = 0.5 / 255 + 1e-6
+
+
+def _get_video():
+    return tf.random.stateless_uniform([LENGTH, 45, 61, 3], [0, 1], maxval=256, dtype=tf.int32)
+
+
+def _run(transform_configs_, video, seed):
+    tf.random.set_seed(seed)
+    example = dict(video=video)
+    for t in transform_configs_:
+        example = transforms.TransformRegistry.lookup(t.name)(t).process_example(example)
+    return example['video']
+
+
+def _get_train_transforms(resize_method, antialias):
+    return [
+        D(name='scale_jitter_video', inputs=['video'], length=LENGTH, target_size=IMAGE_SIZE,
+          min_scale=0.5, max_scale=1.5, resize_method=[resize_method], antialias=[antialias]),
+        D(name='fixed_size_crop_video', inputs=['video'], target_size=IMAGE_SIZE),
+        D(name='random_horizontal_flip_video', inputs=['video'], length=LENGTH),
+        D(name='pad_video_to_max_size', inputs=['video'], length=LENGTH, target_size=IMAGE_SIZE),
+    ]
+
+
+def test_uint8_geometric_transforms_match_float():
+    video = _get_video()
+    for resize_method, antialias in [('bilinear', False), ('bilinear', True), ('bicubic', False)]:
+        for seed in range(4):
+            video_float = _run(
+                _get_train_transforms(resize_method, antialias),
+                tf.image.convert_image_dtype(tf.cast(video, tf.uint8), tf.float32), seed)
+            video_uint8 = _run(
+                _get_train_transforms(resize_method, antialias) + [
+                    D(name='convert_image_dtype_float32', inputs=['video'])],
+                tf.cast(video, tf.uint8), seed)
+            assert video_uint8.dtype == tf.float32
+            assert video_uint8.shape == video_float.shape == [LENGTH, *IMAGE_SIZE, 3]
+            """bicubic overshoots [0, 1] for float frames while uint8 frames are clipped to [0, 255]"""
+            video_float = tf.clip_by_value(video_float, 0., 1.)
+            np.testing.assert_allclose(video_uint8, video_float, rtol=0, atol=ATOL)
+
+
+def test_uint8_video_segmentation_transforms_match_float():
+    video = tf.cast(_get_video(), tf.uint8)
+    for get_transforms in [transform_configs.get_video_segmentation_train_transforms,
+                           transform_configs.get_video_segmentation_eval_transforms]:
+        video_float = _run(
+            get_transforms(IMAGE_SIZE, 100, rle_from_mask=True),
+            tf.image.convert_image_dtype(video, tf.float32), 0)
+        video_uint8 = _run(
+            get_transforms(IMAGE_SIZE, 100, rle_from_mask=True, uint8_images=True), video, 0)
+        assert video_uint8.dtype == tf.float32
+        np.testing.assert_allclose(video_uint8, video_float, rtol=0, atol=ATOL)
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+
+"""
+Tests that the streaming FVD clips of long videos match slicing the whole video, that the stats accumulated
+over them match the stats of all the clips at once and that the video generation eval streams its videos
+through them when eval.fvd_clip_len is set.
+"""
+
+import sys
+import os
+import numpy as np
+import ml_collections
+import pytest
+import tensorflow as tf
+
+sys.path.append(os.getcwd())
+
+from metrics import activation_stats
+from metrics import video_clips
+
+SIZE = 4
+
+
+def _video(n_frames, seed=0):
+    return np.random.default_rng(seed).uniform(size=(n_frames, SIZE, SIZE, 3)).astype(np.float32)
+
+
+def _ref_clips(video, clip_len, stride):
+    return [video[s:s + clip_len] for s in range(0, len(video) - clip_len + 1, stride)]
+
+
+def _uneven_chunks(video):
+    """frames read in chunks of varying sizes, some of them single frames"""
+    sizes = [1, 3, 7, 2, 5]
+    start, i = 0, 0
+    while start < len(video):
+        size = sizes[i % len(sizes)]
+        yield video[start] if size == 1 else video[start:start + size]
+        start += size
+        i += 1
+
+
+def test_clips_match_slicing():
+    video = _video(41)
+    for clip_len, stride in [(8, 8), (8, 3), (8, 1), (4, 10), (16, 4), (50, 1)]:
+        ref_clips = _ref_clips(video, clip_len, stride)
+        for frames in [video, tf.constant(video), list(video), _uneven_chunks(video)]:
+            clips = list(video_clips.iter_clips(frames, clip_len, stride))
+            assert len(clips) == len(ref_clips), (clip_len, stride)
+            for clip, ref_clip in zip(clips, ref_clips):
+                np.testing.assert_array_equal(clip, ref_clip)
+
+    clips = list(video_clips.iter_clips(video, 8, 2, max_clips=3))
+    assert len(clips) == 3
+
+
+def test_frames_preprocessed_once_with_bounded_memory():
+    n_frames, clip_len = 200, 8
+    video = _video(n_frames)
+    n_preprocessed = []
+    n_read = [0]
+
+    def read_frames():
+        for frame in video:
+            n_read[0] += 1
+            yield frame
+
+    def preprocess_fn(frames):
+        n_preprocessed.append(int(frames.shape[0]))
+        return frames * 255.
+
+    for stride, n_needed in [(2, n_frames - n_frames % 2), (12, 17 * clip_len)]:
+        n_preprocessed.clear()
+        n_read[0] = 0
+        for clip_id, clip in enumerate(video_clips.iter_clips(read_frames(), clip_len, stride, preprocess_fn)):
+            np.testing.assert_allclose(clip, video[clip_id * stride:clip_id * stride + clip_len] * 255.)
+            """frames are read lazily: at most one chunk past the end of the current clip"""
+            assert n_read[0] <= clip_id * stride + 2 * clip_len
+        assert sum(n_preprocessed) <= n_needed, (stride, sum(n_preprocessed), n_needed)
+
+
+def test_streaming_clip_stats_match_all_clips():
+    videos = [_video(n, seed=n) for n in [30, 9, 17, 64]]
+    clip_len, stride = 8, 3
+    proj = np.random.default_rng(0).normal(size=(SIZE * SIZE * 3, 6)).astype(np.float32)
+
+    def feature_fn(clips):
+        pool = tf.reduce_mean(tf.reshape(clips, [tf.shape(clips)[0], clip_len, -1]), 1)
+        return tf.matmul(pool, proj), pool
+
+    stats = activation_stats.ActivationStats(logits_moments=True)
+    n_clips = video_clips.accumulate_clip_stats(
+        (_uneven_chunks(v) for v in videos), stats, feature_fn, batch_size=5,
+        clip_len=clip_len, stride=stride)
+
+    all_clips = np.stack([c for v in videos for c in _ref_clips(v, clip_len, stride)])
+    assert n_clips == len(all_clips) == stats.count
+    ref_stats = activation_stats.ActivationStats(logits_moments=True)
+    ref_stats.update(*feature_fn(tf.constant(all_clips)))
+    for x, y in zip(stats.pool.mean_and_cov() + stats.logits.mean_and_cov(),
+                    ref_stats.pool.mean_and_cov() + ref_stats.logits.mean_and_cov()):
+        np.testing.assert_allclose(x, y, rtol=1e-6, atol=1e-7)
+    np.testing.assert_allclose(stats.classifier_score.score(), ref_stats.classifier_score.score(), rtol=1e-6)
+
+
+def test_video_generation_eval_streams_clips(monkeypatch):
+    video_generation = pytest.importorskip('tasks.video_generation')
+    fvd = video_generation.fvd
+    proj = np.random.default_rng(0).normal(size=(3, 6)).astype(np.float32)
+
+    def _post_init(evaluator):
+        """no classifier weights or reference stats in the test"""
+        evaluator.ref_stats = None
+        evaluator.reset()
+        evaluator.dataset_stats_mean = evaluator.dataset_stats_cov = None
+        evaluator.model = lambda clips: dict(
+            features=tf.reduce_mean(clips, [1, 2, 3]), logits=tf.matmul(tf.reduce_mean(clips, [1, 2, 3]), proj))
+
+    monkeypatch.setattr(fvd.FVDMetricEvaluator, '__post_init__', _post_init)
+    clip_len, stride, n_frames = 8, 3, 30
+    config = ml_collections.ConfigDict(dict(
+        task=dict(name='video_generation'),
+        dataset=dict(tfds_name='ucf101', image_size=SIZE, eval_split='test'),
+        eval=dict(ref_stats_dir='fvd_stats', fvd_clip_len=clip_len, fvd_clip_stride=stride),
+    ))
+    task = video_generation.TaskVideoGeneration(config)
+    evaluator = task._tfgan_evaluator
+    assert evaluator.ref_stats_path.endswith(f'_clip_{clip_len}_{stride}.npz')
+
+    videos = tf.constant(np.stack([_video(n_frames, seed) for seed in range(3)]))
+    samples = tf.constant(np.stack([_video(n_frames, seed) for seed in range(3, 6)]))
+    outputs = task.postprocess_tpu(({'video': videos}, {}), samples)
+    assert len(outputs) == 2
+    task.postprocess_cpu(outputs, train_step=0, eval_step=2)
+
+    n_clips = len(_ref_clips(videos[0], clip_len, stride))
+    assert evaluator.stats_real.count == evaluator.stats_gen.count == 3 * n_clips
+    ref_stats = activation_stats.ActivationStats(logits_moments=True)
+    all_clips = tf.constant(np.stack([c for v in samples.numpy() for c in _ref_clips(v, clip_len, stride)]))
+    ref_stats.update(*evaluator.get_inception_stats(all_clips * 255.))
+    for x, y in zip(evaluator.stats_gen.pool.mean_and_cov(), ref_stats.pool.mean_and_cov()):
+        np.testing.assert_allclose(x, y, rtol=1e-5, atol=1e-5)
+    assert np.isfinite(task.compute_scalar_metrics(0)['fvd_pool_batch'])
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+
+"""
+Tests that the video encoder split into encode_frames and fuse_frames gives the same output as the single forward
+pass and that the frame cache of the rolling-window inference holds the right frames for strides shorter and
+longer than the window.
+
+The backbone batch norm uses batch statistics so the features of a frame depend on the other frames encoded with
+it and the split encoder is only compared with the single forward pass for the frames of the same window.
+"""
+
+import sys
+import os
+import numpy as np
+import pytest
+import tensorflow as tf
+
+sys.path.append(os.getcwd())
+
+import utils
+from architectures.video_transformers import VideoResNetTransformer
+
+VID_LEN = 3
+IMAGE_SIZE = 64
+N_FRAMES = 8
+
+
+def _get_frames():
+    return tf.random.stateless_uniform([N_FRAMES, IMAGE_SIZE, IMAGE_SIZE, 3], [0, 1])
+
+
+def _get_windows(stride):
+    """frame ids of all the complete windows of N_FRAMES frames"""
+    return [list(range(start, start + VID_LEN)) for start in range(0, N_FRAMES - VID_LEN + 1, stride)]
+
+
+def test_encoder_frame_tokens_match_full_forward():
+    frames = _get_frames()
+    for late_fusion in [0, 1]:
+        encoder = VideoResNetTransformer(
+            image_height=IMAGE_SIZE, image_width=IMAGE_SIZE, vid_len=VID_LEN, late_fusion=late_fusion,
+            resnet_variant='c4', resnet_depth=18, resnet_width_multiplier=1, resnet_sk_ratio=0.,
+            num_layers=1, dim=32, mlp_ratio=2, num_heads=2, drop_path=0., drop_units=0., use_cls_token=False,
+            name='encoder')
+        for window in _get_windows(stride=2):
+            videos = tf.gather(frames, window)[tf.newaxis]
+            encoded = encoder(videos, training=False)
+            frame_tokens = encoder.encode_frames(utils.flatten_vid(videos), training=False)
+            assert frame_tokens.shape[0] == VID_LEN
+            encoded_split = encoder.fuse_frames(utils.unflatten_vid(frame_tokens, VID_LEN), training=False)
+            np.testing.assert_allclose(encoded_split, encoded, rtol=1e-5, atol=1e-5)
+
+
+def test_model_infer_with_frame_tokens():
+    video_ar_model = pytest.importorskip('models.video_ar_model')
+    from configs import config_video_det
+
+    cfg = config_video_det.get_config()
+    cfg.dataset.length = VID_LEN
+    cfg.model.update(dict(
+        image_size=(IMAGE_SIZE, IMAGE_SIZE), resnet_depth=18, num_encoder_layers=1, num_decoder_layers=1,
+        dim_att=32, dim_mlp=64, dim_att_dec=32, dim_mlp_dec=64, num_heads=2, num_heads_dec=2,
+        drop_path=0., drop_units=0., max_seq_len=12))
+    model = video_ar_model.Model(cfg)
+    assert model.supports_frame_tokens
+
+    videos = _get_frames()[tf.newaxis, :VID_LEN]
+    prompt_seq = tf.fill([1, 1], tf.constant(10, tf.int64))
+    pred_seq, logits, encoded = model.infer(videos, prompt_seq, max_seq_len=8)
+    frame_tokens = utils.unflatten_vid(model.encode_frames(utils.flatten_vid(videos)), VID_LEN)
+    pred_seq_, logits_, encoded_ = model.infer(None, prompt_seq, max_seq_len=8, frame_tokens=frame_tokens)
+    np.testing.assert_allclose(encoded_, encoded, rtol=1e-4, atol=1e-4)
+    np.testing.assert_allclose(logits_, logits, rtol=1e-4, atol=1e-4)
+    np.testing.assert_array_equal(pred_seq_, pred_seq)
+
+
+def test_frame_cache_windows():
+    video_stream = pytest.importorskip('video_stream')
+    """frames and features whose values are their frame ids"""
+    frames = tf.reshape(tf.range(N_FRAMES, dtype=tf.float32), [N_FRAMES, 1, 1])
+    for stride in [1, 2, VID_LEN, VID_LEN + 2]:
+        cache = video_stream.FrameCache(VID_LEN)
+        frame_id = 0
+        windows = []
+        for window_id in range(N_FRAMES):
+            n_skip, n_new = video_stream.get_new_frames(window_id, VID_LEN, stride)
+            assert n_new == (VID_LEN if window_id == 0 else min(stride, VID_LEN))
+            if frame_id + n_skip + n_new > N_FRAMES:
+                break
+            frame_id += n_skip
+            new_ids = list(range(frame_id, frame_id + n_new))
+            cache.add(new_ids, tf.gather(frames, new_ids), 10 * tf.gather(frames, new_ids))
+            frame_id += n_new
+
+            frame_ids, window_frames, frame_tokens = cache.window()
+            assert len(cache) == VID_LEN
+            np.testing.assert_array_equal(window_frames[:, 0, 0], frame_ids)
+            np.testing.assert_array_equal(frame_tokens[:, 0, 0], 10 * np.asarray(frame_ids))
+            windows.append(frame_ids)
+        assert windows == _get_windows(stride), stride
@@ -25,6 +25,11 @@ def run(cfg, train_datasets, val_datasets, tasks, train_steps, val_steps, steps_
         trainer = model_lib.TrainerRegistry.lookup(cfg.model.name)(
             cfg, model_dir=cfg.model_dir,
             num_train_examples=num_train_examples, train_steps=train_steps)
+        grad_accum_steps = trainer.grad_accum_steps
+        if grad_accum_steps > 1:
+            assert type(trainer).train_step is model_lib.Trainer.train_step, \
+                f"grad_accum_steps is not supported by {type(trainer).__name__} with its custom train_step"
+            print(f'accumulating gradients over {grad_accum_steps} micro-batches per optimizer step')
         train_data_iters = [iter(dataset) for dataset in train_datasets]
         summary_writer = tf.summary.create_file_writer(cfg.model_dir)
 
@@ -93,9 +98,13 @@ def run(cfg, train_datasets, val_datasets, tasks, train_steps, val_steps, steps_
             strategy is needed to get the num_replicas_in_sync to divide the gradient and compute its mean
             """
             train_step = lambda xs, ts=tasks: trainer.train_step(xs, ts, strategy)
+            accumulate_step = lambda xs, ts=tasks: trainer.accumulate_step(xs, ts, strategy)
+            apply_accumulated_step = lambda: trainer.apply_accumulated_step(strategy)
 
             """
-            train_steps = num_samples * num_epochs / batch_size
+            train_steps = num_samples * num_epochs / (batch_size * grad_accum_steps)
+            each step is one optimizer update so that optimizer.iterations, WarmUpAndDecay and 
+            checkpointing all count optimizer steps rather than micro-batches
             """
             progbar = None
             if cfg.eager:
@@ -103,7 +112,12 @@ def run(cfg, train_datasets, val_datasets, tasks, train_steps, val_steps, steps_
 
             for step_id in tf.range(steps_per_epoch):  # using tf.range prevents unroll.
                 with tf.name_scope(''):  # prevent `while_` prefix for variable names.
-                    strategy.run(train_step, ([next(it) for it in data_iterators],))
+                    if grad_accum_steps > 1:
+                        for _ in tf.range(grad_accum_steps):
+                            strategy.run(accumulate_step, ([next(it) for it in data_iterators],))
+                        strategy.run(apply_accumulated_step)
+                    else:
+                        strategy.run(train_step, ([next(it) for it in data_iterators],))
 
                 if not cfg.eager:
                     # time_stamp_str = datetime.now().strftime("%y%m%d_%H%M%S_%f")
@@ -195,7 +209,7 @@ def run(cfg, train_datasets, val_datasets, tasks, train_steps, val_steps, steps_
 
                 cur_step = global_step.numpy()
 
-                trainer.checkpoint_manager.save(cur_step)
+                trainer.save_checkpoint(cur_step)
 
                 steps_per_sec = steps_per_epoch / (time.time() - timestamp)
                 timestamp = time.time()
@@ -246,7 +260,7 @@ def run(cfg, train_datasets, val_datasets, tasks, train_steps, val_steps, steps_
                                     import json
                                     print(f'found better validation {metric_name}: {metric_val_np}')
                                     best_val_metrics[metric_name] = metric_val_np
-                                    val_ckpt_managers[metric_name].save(cur_step)
+                                    trainer.save_checkpoint(cur_step, val_ckpt_managers[metric_name])
                                     with open(best_val_metrics_json, 'w') as f:
                                         f.write(json.dumps(best_val_metrics, indent=4))
                         if nan_metric:
@@ -260,6 +274,7 @@ def run(cfg, train_datasets, val_datasets, tasks, train_steps, val_steps, steps_
             # eta = (train_steps - cur_step) / steps_per_sec / 60.
             # logging.info(f'Completed steps {cur_step} / {train_steps} ({progress:.2f}%), ETA {eta:.2f} mins')
             trainer.reset()
+        trainer.wait_for_checkpoints()
         logging.info('###########################################')
         logging.info('Training complete...')
         logging.info('###########################################')
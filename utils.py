@@ -351,6 +351,17 @@ def tile_along_batch(t_in, factor):
     return t_out
 
 
+def repeat_to_batch(x, bsz):
+    """Tiles x along the batch dim to bsz, which must be a multiple of its batch size.
+
+    Unlike tile_along_batch, this stacks whole copies of x rather than repeating each
+    example, to match cached or closed-over conditioning to a batch that stacks several
+    copies of the samples like the conditional and unconditional ones for cf guidance.
+    """
+    n_rep = bsz // tf.shape(x)[0]
+    return tf.tile(x, tf.concat([[n_rep], tf.ones([tf.rank(x) - 1], tf.int32)], 0))
+
+
 def shape_as_list(t):
     # Assumes rank of `t` is statically known.
     shape = t.shape.as_list()
@@ -882,7 +893,37 @@ def is_ckpt(k):
     )
 
 
-def get_local_ckpt(checkpoint_dir, excluded_ckpts, ckpt_iter, create_copy):
+def get_ckpt_marker(ckpt_name):
+    """name of the file written next to a checkpoint once all of its files are on disk"""
+    return f'{get_name(ckpt_name)}.done'
+
+
+def is_chief():
+    """only the chief writes the checkpoint markers under MultiWorkerMirroredStrategy"""
+    cluster_resolver = tf.distribute.get_strategy().cluster_resolver
+    if cluster_resolver is None or not cluster_resolver.task_type:
+        return True
+    return cluster_resolver.task_type == 'chief' or (
+            cluster_resolver.task_type == 'worker' and cluster_resolver.task_id == 0)
+
+
+def write_ckpt_marker(ckpt_path):
+    checkpoint_dir = os.path.dirname(ckpt_path)
+    time_stamp = time.strftime("%y%m%d_%H%M%S")
+    with open(linux_path(checkpoint_dir, get_ckpt_marker(ckpt_path)), 'w') as f:
+        f.write(time_stamp + '\n')
+
+
+def remove_ckpt_markers(ckpt_paths):
+    """markers of the checkpoints removed by CheckpointManager since it only deletes the data and index files"""
+    for ckpt_path in ckpt_paths:
+        marker_path = linux_path(os.path.dirname(ckpt_path), get_ckpt_marker(ckpt_path))
+        if os.path.isfile(marker_path):
+            os.remove(marker_path)
+
+
+def get_local_ckpt(checkpoint_dir, excluded_ckpts, ckpt_iter, create_copy, oldest_ckpt_first=False,
+                   wait_for_marker=False):
     local_ckpts = [k for k in os.listdir(checkpoint_dir)
                    if os.path.isfile(linux_path(checkpoint_dir, k))
                    and is_ckpt(k) and get_name(k) not in excluded_ckpts]
@@ -892,6 +933,11 @@ def get_local_ckpt(checkpoint_dir, excluded_ckpts, ckpt_iter, create_copy):
         linux_path(checkpoint_dir, k.replace('.data-00000-of-00001', '.index'))
     )]
 
+    if wait_for_marker:
+        """exclude checkpoints still being written asynchronously by the training run"""
+        local_ckpts = [k for k in local_ckpts if os.path.isfile(
+            linux_path(checkpoint_dir, get_ckpt_marker(k)))]
+
     # eval_dirs = [k for k in os.listdir(checkpoint_dir)
     #              if k.startswith('ckpt-') and os.path.isdir(linux_path(checkpoint_dir, k))]
     # local_ckpts = [ckpt for ckpt in local_ckpts if
@@ -906,7 +952,7 @@ def get_local_ckpt(checkpoint_dir, excluded_ckpts, ckpt_iter, create_copy):
         local_ckpt_iters = list(map(get_ckpt_iter, local_ckpts))
         ckpt_idx = local_ckpt_iters.index(ckpt_iter)
     else:
-        local_ckpts.sort(reverse=True, key=get_ckpt_iter)
+        local_ckpts.sort(reverse=not oldest_ckpt_first, key=get_ckpt_iter)
         ckpt_idx = 0
 
     ckpt = local_ckpts[ckpt_idx]
@@ -934,7 +980,8 @@ def get_local_ckpt(checkpoint_dir, excluded_ckpts, ckpt_iter, create_copy):
     return ckpt_path
 
 
-def get_remote_ckpt(checkpoint_dir, remote, proxy, ckpt_iter=None, oldest_ckpt_first=False):
+def get_remote_ckpt(checkpoint_dir, remote, proxy, ckpt_iter=None, oldest_ckpt_first=False,
+                    wait_for_marker=False):
     ret = connect_to_remote(remote, proxy)
     if ret is None:
         return None
@@ -952,6 +999,8 @@ def get_remote_ckpt(checkpoint_dir, remote, proxy, ckpt_iter=None, oldest_ckpt_f
 
     remote_files = [k.strip() for k in ssh_stdout_lines]
     remote_ckpts = [k for k in remote_files if is_ckpt(k)]
+    if wait_for_marker:
+        remote_ckpts = [k for k in remote_ckpts if get_ckpt_marker(k) in remote_files]
     local_ckpts = [k for k in os.listdir(checkpoint_dir) if is_ckpt(k)]
     new_remote_ckpts = [ckpt for ckpt in remote_ckpts if ckpt not in local_ckpts]
 
@@ -979,6 +1028,8 @@ def get_remote_ckpt(checkpoint_dir, remote, proxy, ckpt_iter=None, oldest_ckpt_f
 
         ckpt_idx = f'{ckpt_name}.index'
         files_to_transfer = [ckpt, ckpt_idx]
+        if wait_for_marker:
+            files_to_transfer.append(get_ckpt_marker(ckpt_name))
 
         files_to_transfer_str = '\n'.join(files_to_transfer)
         print(f'\nfiles_to_transfer:\n{files_to_transfer_str}\n')
@@ -1066,6 +1117,10 @@ def put_remote_ckpt(ckpt, checkpoint_dir, remote, proxy, tb):
     ckpt_idx = f'{ckpt_name}.index'
     files_to_transfer = ['config.json', ckpt_file, ckpt_idx]
 
+    ckpt_marker = get_ckpt_marker(ckpt_name)
+    if os.path.isfile(linux_path(checkpoint_dir, ckpt_marker)):
+        files_to_transfer.append(ckpt_marker)
+
     if tb:
         tb_files = [k for k in os.listdir(checkpoint_dir)
                        if os.path.isfile(linux_path(checkpoint_dir, k))
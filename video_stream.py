@@ -0,0 +1,246 @@
+"""
+rolling-window inference on a long raw video file for the video detection task
+
+the video is read with OpenCV and a window of dataset.length frames is slid over it with a stride of
+eval.stream.stride frames so that each window after the first one only needs stride new frames;
+the preprocessing and backbone features of every frame are computed once when the frame is read and
+reused by all the windows that contain it while only the temporal part of the encoder and the decoder
+run once per window
+
+the predictions of each window are written by the same postprocess_cpu writers that are used in eval
+"""
+
+import os
+import collections
+import time
+import json
+
+import numpy as np
+import cv2
+
+import tensorflow as tf
+
+import eval as eval_lib
+from eval_utils import print_with_time
+
+
+class FrameCache:
+    """preprocessed frames and their backbone features for the frames in the current window"""
+
+    def __init__(self, vid_len):
+        self.frame_ids = collections.deque(maxlen=vid_len)
+        self.frames = collections.deque(maxlen=vid_len)
+        self.frame_tokens = collections.deque(maxlen=vid_len)
+
+    def __len__(self):
+        return len(self.frame_ids)
+
+    def add(self, frame_ids, frames, frame_tokens):
+        self.frame_ids.extend(frame_ids)
+        self.frames.extend(tf.unstack(frames))
+        if frame_tokens is not None:
+            self.frame_tokens.extend(tf.unstack(frame_tokens))
+
+    def window(self):
+        frames = tf.stack(list(self.frames))
+        frame_tokens = tf.stack(list(self.frame_tokens)) if self.frame_tokens else None
+        return list(self.frame_ids), frames, frame_tokens
+
+
+def get_new_frames(window_id, vid_len, stride):
+    """
+    numbers of frames to skip and to read before a window;
+    the first window needs vid_len frames and each subsequent one stride new frames;
+    frames that are skipped between windows when stride > vid_len are only grabbed and never decoded
+    """
+    if window_id == 0:
+        return 0, vid_len
+    n_new = min(stride, vid_len)
+    return stride - n_new, n_new
+
+
+def read_frames(cap, n_frames):
+    """decoded RGB frames; frames that do not need to be decoded can be skipped with cap.grab()"""
+    frames = []
+    for _ in range(n_frames):
+        ret, frame = cap.read()
+        if not ret:
+            break
+        frames.append(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+    return frames
+
+
+def get_preprocess_fn(cfg):
+    """same frame preprocessing as the video dataset followed by the eval transforms"""
+    image_size = cfg.task.image_size
+    target_size = cfg.dataset.get('target_size', None)
+
+    @tf.function
+    def preprocess(frames):
+        frames = tf.image.convert_image_dtype(frames, tf.float32)
+        if target_size is not None:
+            frames = tf.image.resize(
+                frames, target_size, method='bilinear',
+                antialias=False, preserve_aspect_ratio=False)
+        frames = tf.image.resize(
+            frames, size=image_size, method='bilinear',
+            antialias=True, preserve_aspect_ratio=True)
+        unpadded_size = tf.cast(tf.shape(frames)[1:3], tf.float32)
+        frames = 0.3 + tf.image.pad_to_bounding_box(
+            frames - 0.3, 0, 0, image_size[0], image_size[1])
+        return frames, unpadded_size
+
+    return preprocess
+
+
+def build_window_example(cfg, seq_name, window_id, frame_ids, frames, frame_tokens, orig_size, unpadded_size):
+    """batch of one video with the same features as the eval dataset but no ground truth"""
+    vid_len = cfg.dataset.length
+    max_inst = cfg.task.max_instances_per_image_test
+    n_bbox_coords = vid_len * 4
+
+    file_names = [os.path.join(seq_name, f'image{frame_id + 1:06d}.jpg') for frame_id in frame_ids]
+    example = dict(
+        video=frames[tf.newaxis, ...],
+        video_id=tf.constant([window_id], dtype=tf.int64),
+        file_names=tf.constant([file_names]),
+        file_ids=tf.constant([frame_ids], dtype=tf.int64),
+        orig_video_size=tf.constant([orig_size], dtype=tf.int64),
+        unpadded_video_size=unpadded_size[tf.newaxis, :],
+        class_id=tf.zeros((1, max_inst), dtype=tf.int64),
+        bbox=tf.zeros((1, max_inst, n_bbox_coords), dtype=tf.float32),
+        area=tf.zeros((1, max_inst, vid_len), dtype=tf.float32),
+        is_crowd=tf.zeros((1, max_inst), dtype=tf.bool),
+    )
+    if frame_tokens is not None:
+        example['frame_tokens'] = frame_tokens[tf.newaxis, ...]
+    return example
+
+
+def run(cfg, task, ckpt, strategy, model, checkpoint):
+    """Perform rolling-window inference on cfg.eval.stream.video_path."""
+    assert cfg.task.name == 'video_detection', \
+        f'streaming inference is only supported for video_detection, not {cfg.task.name}'
+
+    scfg = cfg.eval.stream
+    video_path = scfg.video_path
+    vid_len = cfg.dataset.length
+    stride = scfg.stride
+
+    assert os.path.isfile(video_path), f'video file does not exist: {video_path}'
+    assert stride > 0, f'invalid stride: {stride}'
+
+    seq_name = os.path.splitext(os.path.basename(video_path))[0]
+
+    """output dir is named after the video instead of the eval dataset"""
+    cfg.dataset.eval_name = f'stream-{seq_name}-stride-{stride}'
+    cfg.eval.add_stride_info = 0
+
+    ckpt_eval = eval_lib.CheckpointEval(cfg, ckpt, strategy, model, checkpoint, is_video=True, is_seg=False)
+    if ckpt_eval.completed:
+        return ckpt_eval.out_dir
+
+    cap = cv2.VideoCapture(video_path)
+    assert cap.isOpened(), f'video file could not be opened: {video_path}'
+
+    n_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    orig_size = [int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)), int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))]
+    if scfg.max_frames > 0:
+        n_frames = min(n_frames, scfg.max_frames)
+
+    print_with_time(f'streaming inference on {video_path}: {n_frames} frames of size {orig_size} '
+                    f'with vid_len {vid_len} and stride {stride}')
+
+    use_frame_tokens = scfg.reuse_features and model.supports_frame_tokens
+    if scfg.reuse_features and not use_frame_tokens:
+        print('encoder does not support per-frame features so the whole encoder runs on each window')
+
+    preprocess = get_preprocess_fn(cfg)
+    cache = FrameCache(vid_len)
+
+    with strategy.scope():
+        @tf.function
+        def encode_frames(frames):
+            return model.encode_frames(frames, training=False)
+
+        @tf.function
+        def infer_window(example):
+            infer_outputs = task.infer(model, (example, None, None, None))
+            return task.postprocess_tpu(*infer_outputs)
+
+        frame_id = 0
+        window_id = 0
+        unpadded_size = None
+        frame_latencies = []
+        start_t = time.time()
+
+        while True:
+            window_t = time.time()
+
+            n_skip, n_new = get_new_frames(window_id, vid_len, stride)
+            if frame_id + n_skip + n_new > n_frames:
+                break
+
+            for _ in range(n_skip):
+                cap.grab()
+            frame_id += n_skip
+
+            new_frames = read_frames(cap, n_new)
+            if len(new_frames) < n_new:
+                break
+
+            new_frames, unpadded_size = preprocess(np.stack(new_frames))
+            new_frame_tokens = encode_frames(new_frames) if use_frame_tokens else None
+            cache.add(range(frame_id, frame_id + n_new), new_frames, new_frame_tokens)
+            frame_id += n_new
+
+            frame_ids, frames, frame_tokens = cache.window()
+            example = build_window_example(cfg, seq_name, window_id, frame_ids, frames, frame_tokens,
+                                           orig_size, unpadded_size)
+            outputs = infer_window(example)
+
+            window_id += 1
+            ckpt_eval.postprocess(task, outputs, window_id, eval_steps=0)
+
+            frame_latencies.append((time.time() - window_t) / n_new)
+
+        cap.release()
+
+        total_time = time.time() - start_t
+
+    if frame_id < n_frames:
+        print(f'skipped the last {n_frames - frame_id} frames that do not fill a complete window')
+
+    out_dir = ckpt_eval.finish()
+
+    if not frame_latencies:
+        print(f'video is too short for a window of {vid_len} frames')
+        return out_dir
+
+    """
+    the first window includes the tracing of all the functions and the second one their retracing
+    for stride new frames instead of vid_len so both are excluded from the latency stats
+    """
+    n_warmup = 2 if stride < vid_len else 1
+    steady_latencies = np.asarray(frame_latencies[n_warmup:] or frame_latencies) * 1000
+    times = dict(
+        n_frames=frame_id,
+        n_windows=window_id,
+        total_time=total_time,
+        fps=frame_id / total_time,
+        latency_per_frame_ms=dict(
+            mean=float(np.mean(steady_latencies)),
+            median=float(np.median(steady_latencies)),
+            p95=float(np.percentile(steady_latencies, 95)),
+            max=float(np.max(steady_latencies)),
+        ),
+    )
+    print_with_time(f'processed {frame_id} frames in {window_id} windows in {total_time:.2f} s '
+                    f'({times["fps"]:.2f} fps)')
+    print(f'latency per new frame (ms): {times["latency_per_frame_ms"]}')
+
+    times_path = os.path.join(out_dir, 'stream_times.json')
+    with open(times_path, 'w') as fid:
+        json.dump(times, fid, indent=4)
+
+    return out_dir